@@ -9,8 +9,10 @@ $Id: PlotMap.py 1719 2016-08-18 21:44:13Z fsilva $
 from __future__ import division, print_function
 
 # Import Python Modules
+import os
 import sys
 import struct
+import hashlib
 import numpy as np
 import matplotlib as mpl
 if mpl.get_backend() != 'agg':
@@ -130,37 +132,50 @@ def read_coastal(filename, plotregion):
 
     return coast_x, coast_y
 
-def read_topo(filename, plotregion):
+def topo_cache_dir():
+    """
+    Returns the directory where topo tiles are cached, given by the
+    BBP_TOPO_CACHE_DIR environment variable, or None if it is not set
+    """
+    return os.getenv("BBP_TOPO_CACHE_DIR") or None
+
+def read_topo(filename, plotregion, max_points=None, cache_dir=None):
     """
     Reads in topo data that is saved in GMT format:
     bf   GMT native, C-binary format (float)
     Header size is 892 bytes
+    Only the part of the grid inside plotregion is read, keeping
+    every step-th point so that neither dimension is larger than
+    max_points (if given). If cache_dir is set, the resulting tile is
+    saved there and reused by later calls for the same region
     """
-    # Open input file
-    topo_file = open(filename, 'r')
+    # Check if we already have this tile
+    cache_file = None
+    if cache_dir is not None:
+        file_stat = os.stat(filename)
+        key = "%s %d %d %s %s" % (os.path.abspath(filename),
+                                  file_stat.st_size,
+                                  int(file_stat.st_mtime),
+                                  " ".join([repr(float(val))
+                                            for val in plotregion]),
+                                  max_points)
+        cache_file = os.path.join(cache_dir, "topo_%s.npy" %
+                                  (hashlib.sha1(key.encode()).hexdigest()))
+        if os.path.exists(cache_file):
+            return np.ma.masked_invalid(np.load(cache_file))
 
     # Parse header
+    topo_file = open(filename, 'rb')
     buf = topo_file.read(struct.calcsize(GMT_HDR_FORMAT))
+    topo_file.close()
     header = struct.unpack(GMT_HDR_FORMAT, buf)
     topo_dims = [header[0], header[1]]
     topo_region = [header[3], header[4], header[5], header[6]]
 
-    # Read elevation values
-    data = np.arange(topo_dims[0] * topo_dims[1],
-                     dtype=float).reshape(topo_dims[1],
-                                          topo_dims[0])
-
-    buf = topo_file.read(topo_dims[0] * topo_dims[1] *
-                         struct.calcsize(GMT_DATA_FORMAT))
-    topo_file.close()
-
-    # Data is x-fast
-    for y in xrange(0, topo_dims[1]):
-        for x in xrange(0, topo_dims[0]):
-            offset = ((y * topo_dims[0] + x) *
-                      struct.calcsize(GMT_DATA_FORMAT))
-            data[y][x] = struct.unpack(GMT_DATA_FORMAT,
-                                       buf[offset:offset + 4])[0]
+    # Map elevation values, data is x-fast
+    data = np.memmap(filename, dtype=GMT_DATA_FORMAT, mode='r',
+                     offset=struct.calcsize(GMT_HDR_FORMAT),
+                     shape=(topo_dims[1], topo_dims[0]))
 
     # Pull out sub-matrix for plotregion, and invert y-axis
     x0 = int((plotregion[0] - topo_region[0]) / header[9])
@@ -169,14 +184,37 @@ def read_topo(filename, plotregion):
     x1 = int((plotregion[1] - topo_region[0]) / header[9])
     y0 = topo_dims[1] - int((plotregion[3] -
                              topo_region[2]) / header[10])
-    subdata = np.arange((x1 - x0) * (y1 - y0),
-                        dtype=float).reshape(y1 - y0, x1 - x0)
-
-    for y in xrange(y0, y1):
-        for x in xrange(x0, x1):
-            if ((y >= 0) and (y < topo_dims[1]) and
-                (x >= 0) and (x < topo_dims[0])):
-                subdata[y - y0][x - x0] = data[y][x]
+    step = 1
+    if max_points is not None:
+        step = max(1, int(np.ceil(max(x1 - x0, y1 - y0) /
+                                  float(max_points))))
+    rows = np.arange(y0, y1, step)
+    cols = np.arange(x0, x1, step)
+    in_rows = (rows >= 0) & (rows < topo_dims[1])
+    in_cols = (cols >= 0) & (cols < topo_dims[0])
+
+    # Points outside the grid have no data
+    subdata = np.empty((len(rows), len(cols)))
+    subdata.fill(np.nan)
+    if in_rows.any() and in_cols.any():
+        rows = rows[in_rows]
+        cols = cols[in_cols]
+        subdata[np.ix_(in_rows, in_cols)] = data[rows[0]:rows[-1] + 1:step,
+                                                 cols[0]:cols[-1] + 1:step]
+    del data
+
+    # Save tile for next time, the rename makes sure other processes
+    # never see a partial file
+    if cache_file is not None:
+        if not os.path.exists(cache_dir):
+            try:
+                os.makedirs(cache_dir)
+            except OSError:
+                # Created by another process
+                pass
+        tmp_file = "%s.%d.tmp.npy" % (cache_file[:-4], os.getpid())
+        np.save(tmp_file, subdata)
+        os.rename(tmp_file, cache_file)
 
     # Mask array to hide NaNs
     masked = np.ma.masked_invalid(subdata)
@@ -189,13 +227,14 @@ class PlotMap(object):
         return
 
     def plot(self, plottitle, plotregion, topo, coastal, border,
-             fault, sta, map_prefix, hypo_lat=None, hypo_lon=None):
+             fault, sta, map_prefix, hypo_lat=None, hypo_lon=None,
+             topo_cache_dir=None):
         """
         Produce the plot
         """
 
         # Read in topo data
-        topo_points = read_topo(topo, plotregion)
+        topo_points = read_topo(topo, plotregion, cache_dir=topo_cache_dir)
 
         # Read in fault data
         fault_x, fault_y = read_fault(fault)
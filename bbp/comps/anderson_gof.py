@@ -28,6 +28,7 @@ from scipy.signal import butter, filtfilt
 # Import BBP modules
 import bband_utils
 import plot_config
+import seis_cache
 from install_cfg import InstallCfg
 from station_list import StationList
 
@@ -86,14 +87,24 @@ class AndersonGOF(object):
         self.dt = None
         self.log = None
         self.sim_id = sim_id
+        # Bandpass filter coefficients, keyed by band and Nyquist frequency
+        self.filter_bank = {}
 
     @staticmethod
     def eval_func(p1, p2):
-        return 10. * np.exp(-np.power(((p1 - p2) / min(p1, p2)), 2.))
+        return 10. * np.exp(-np.power(((p1 - p2) / np.minimum(p1, p2)), 2.))
 
     @staticmethod
     def eval_func2(p1, p2):
-        return 10. * np.exp(-np.power((np.abs(p1 - p2) / min(p1, p2)), 2.))
+        return 10. * np.exp(-np.power((np.abs(p1 - p2) /
+                                       np.minimum(p1, p2)), 2.))
+
+    @staticmethod
+    def clip_zero(x):
+        """
+        Same as max(0, x) for each element of x, NaNs become zero
+        """
+        return np.where(x > 0, x, 0.)
 
     @staticmethod
     def integral(x, idt):
@@ -109,7 +120,7 @@ class AndersonGOF(object):
 
     @staticmethod
     def shift_bit_length(x):
-        return 1 << (x - 1).bit_length()
+        return 1 << (int(x) - 1).bit_length()
 
     @staticmethod
     def align_seismograms(obs_times, obs_data,
@@ -164,31 +175,19 @@ class AndersonGOF(object):
             xi = xii
 
         # Truncate simulated ground motion according to cross-correlation
-        tq2_integ = np.zeros((1, len(tf)))[0]
-        tq2_integ[0] = 0
-
-        for r in range(1, len(tf)):
-            tq2_integ[r] = tq2_integ[r-1] + (tf[r]**2)
+        tq2_integ = np.zeros(len(tf))
+        tq2_integ[1:] = np.cumsum(np.asarray(tf[1:]) ** 2)
         tq2_integ = tq2_integ * deltat
         cav_tq2_integ_total = tq2_integ[-1]
 
-        oq2_integ = np.zeros((1, len(xi)))[0]
-        oq2_integ[0] = 0
-
-        for r in range(1, len(xi)):
-            oq2_integ[r] = oq2_integ[r-1] + (xi[r]**2)
+        oq2_integ = np.zeros(len(xi))
+        oq2_integ[1:] = np.cumsum(np.asarray(xi[1:]) ** 2)
         oq2_integ = oq2_integ * tdeltat
         cav_oq2_integ_total = oq2_integ[-1]
 
-        for cav_tp in range(0, len(tf)):
-            if tq2_integ[cav_tp] >= (0.05 * cav_tq2_integ_total):
-                cav_tii = cav_tp
-                break
-
-        for cav_p in range(0, len(xi)):
-            if oq2_integ[cav_p] >= (0.05 * cav_oq2_integ_total):
-                cav_ii = cav_p
-                break
+        # First samples reaching 5% of the total
+        cav_tii = np.argmax(tq2_integ >= (0.05 * cav_tq2_integ_total))
+        cav_ii = np.argmax(oq2_integ >= (0.05 * cav_oq2_integ_total))
 
         v_sp = cav_ii - cav_tii
         if v_sp >= 0:
@@ -215,66 +214,67 @@ class AndersonGOF(object):
         """
         ************** Arias duration and intensity ****************
         The time series must have the same duration, the same origin
-         time and must have the same sample rate
+         time and must have the same sample rate. Works along the
+         last axis, so each row of 2D inputs is one record
         """
-        IA1t = (0.5 * np.pi / self.g) * self.dt * np.cumsum(acc1*acc1)
-        IA2t = (0.5 * np.pi / self.g) * self.dt * np.cumsum(acc2*acc2)
-        IA1 = IA1t[(len(IA1t)-1)]
-        IA2 = IA2t[(len(IA2t)-1)]
-        N1 = IA1t / IA1
-        N2 = IA2t / IA2
+        IA1t = (0.5 * np.pi / self.g) * self.dt * np.cumsum(acc1*acc1, axis=-1)
+        IA2t = (0.5 * np.pi / self.g) * self.dt * np.cumsum(acc2*acc2, axis=-1)
+        IA1 = IA1t[..., -1]
+        IA2 = IA2t[..., -1]
+        N1 = IA1t / IA1[..., None]
+        N2 = IA2t / IA2[..., None]
         F = np.absolute(N1 - N2)
-        return max(0, 10. * (1. - np.amax(F))), self.eval_func(IA1, IA2)
+        return self.clip_zero(10. * (1. - np.amax(F, axis=-1))), self.eval_func(IA1, IA2)
 
     def c24_eval(self, vel1, vel2):
         """
         ********************* Energy duration *********************
         """
-        IE1t = self.dt * np.cumsum(vel1*vel1)
-        IE2t = self.dt * np.cumsum(vel2*vel2)
-        IE1 = IE1t[(len(IE1t)-1)]
-        IE2 = IE2t[(len(IE2t)-1)]
-        N1 = IE1t / IE1
-        N2 = IE2t / IE2
+        IE1t = self.dt * np.cumsum(vel1*vel1, axis=-1)
+        IE2t = self.dt * np.cumsum(vel2*vel2, axis=-1)
+        IE1 = IE1t[..., -1]
+        IE2 = IE2t[..., -1]
+        N1 = IE1t / IE1[..., None]
+        N2 = IE2t / IE2[..., None]
         F = np.absolute(N1 - N2)
-        return max(0, 10. * (1. - np.amax(F))), self.eval_func(IE1, IE2)
+        return self.clip_zero(10. * (1. - np.amax(F, axis=-1))), self.eval_func(IE1, IE2)
 
     def c5_eval(self, acc1, acc2):
         """
         ********************* Peak Acceleration *********************
         """
-        pga1 = np.amax(acc1)
-        pga2 = np.amax(acc2)
+        pga1 = np.amax(acc1, axis=-1)
+        pga2 = np.amax(acc2, axis=-1)
         return self.eval_func(pga1, pga2)
 
     def c6_eval(self, vel1, vel2):
         """
         ********************* Peak Velocity *********************
         """
-        pgv1 = np.amax(vel1)
-        pgv2 = np.amax(vel2)
+        pgv1 = np.amax(vel1, axis=-1)
+        pgv2 = np.amax(vel2, axis=-1)
         return self.eval_func(pgv1, pgv2)
 
     def c7_eval(self, dis1, dis2):
         """
         ********************* Peak Displacement *********************
         """
-        pgd1 = np.amax(dis1)
-        pgd2 = np.amax(dis2)
+        pgd1 = np.amax(dis1, axis=-1)
+        pgd2 = np.amax(dis2, axis=-1)
         return self.eval_func(pgd1, pgd2)
 
     def c8_eval(self, rs1, rs2, period):
         """
         ********************* Response Spectra *********************
         """
-        c = [self.eval_func2(rs1[i], rs2[i]) for i in range(len(period))]
+        c = self.eval_func2(rs1[:len(period)], rs2[:len(period)])
         return np.nanmean(c)
 
     def c9_eval(self, fs1, fs2, f):
         """
         ********************* Fourier Spectra *********************
         """
-        c = [self.eval_func2(fs1[i], fs2[i]) for i in range(len(f))]
+        c = self.eval_func2(fs1[:len(f)], fs2[:len(f)])
         return np.nanmean(c)
 
     def c10_eval(self, acc1, acc2):
@@ -284,7 +284,9 @@ class AndersonGOF(object):
         ICC1 = np.sqrt(self.integral2(acc1, self.dt))
         ICC2 = np.sqrt(self.integral2(acc2, self.dt))
         ICC12 = self.integral(acc1 * acc2, self.dt)
-        return 10. * max(ICC12 / (ICC1 * ICC2), 0.)
+        ratio = ICC12 / (ICC1 * ICC2)
+        # Same as max(ratio, 0.), NaNs are kept
+        return 10. * np.where(0. > ratio, 0., ratio)
 
     def cplots(self, irec, station_name, output_file):
         """
@@ -701,10 +703,10 @@ class AndersonGOF(object):
         smidge3 = small * np.abs(peak_mtn3)
         smidge4 = small * np.abs(peak_mtn4)
 
-        zerocross1 = [i for i, x in enumerate(y1) if x <= smidge1]
-        zerocross2 = [i for i, x in enumerate(y2) if x <= smidge2]
-        zerocross3 = [i for i, x in enumerate(y3) if x <= smidge3]
-        zerocross4 = [i for i, x in enumerate(y4) if x <= smidge4]
+        zerocross1 = np.nonzero(np.asarray(y1) <= smidge1)[0]
+        zerocross2 = np.nonzero(np.asarray(y2) <= smidge2)[0]
+        zerocross3 = np.nonzero(np.asarray(y3) <= smidge3)[0]
+        zerocross4 = np.nonzero(np.asarray(y4) <= smidge4)[0]
         # izcl, izct = index in input smc file of zero crossings
         izcl1 = zerocross1[0]
         izct1 = zerocross1[len(zerocross1) - 1]
@@ -788,18 +790,234 @@ class AndersonGOF(object):
         return dist_stat
 
     @staticmethod
-    def butter_bandpass(lowcut, highcut, nyq, y, order):
+    def read_columns(filename):
         """
-        This function implements a butter bandpass filter
+        Reads a whitespace separated text file, skipping the first two
+        lines, blank lines and comments like np.genfromtxt, returns an
+        array for each column
         """
+        return seis_cache.read_columns(filename, skip_lines=2)
 
-        low = lowcut / nyq
-        high = min(highcut / nyq, 0.9999)
-        b, a = signal.butter(order, [low, high], btype='bandpass')
-        # y = signal.lfilter(b, a, y)
-        y = signal.filtfilt(b, a, y)
+    def get_band_filter(self, iband, nyq):
+        """
+        Returns the butterworth bandpass coefficients for band iband,
+        computing them once for each nyq
+        """
+        if (iband, nyq) not in self.filter_bank:
+            lowcut, highcut = self.B[iband]
+            low = lowcut / nyq
+            high = min(highcut / nyq, 0.9999)
+            self.filter_bank[(iband, nyq)] = signal.butter(2, [low, high],
+                                                           btype='bandpass')
+        return self.filter_bank[(iband, nyq)]
+
+    def process_station(self, irec, logfile, site_list, sims_dir,
+                        obs_dir, a_validation_outdir):
+        """
+        Calculates the GoF scores for station irec in site_list,
+        returns the C1-C10 scores for each band, the station score
+        and the dt used
+        """
+        sim_id = self.sim_id
+        site = site_list[irec]
+        station = site.scode
+
+        print("==> Processing station: %s" % (station))
+
+        file_sims_acc = os.path.join(sims_dir, "%d.%s.acc.bbp" %
+                                     (sim_id, station))
+        file_sims_rd50 = os.path.join(sims_dir, "%d.%s.rd50" %
+                                      (sim_id, station))
+        lowcut = site.low_freq_corner
+        highcut = site.high_freq_corner
+        #print(lowcut, highcut)
+
+        (sims_acc_org_time, sims_acc_org_ns,
+         sims_acc_org_ew, sims_acc_org_ver) = self.read_columns(file_sims_acc)
+        (sims_perd, sims_rd50_ns,
+         sims_rd50_ew, sims_rd50_ver) = self.read_columns(file_sims_rd50)
+
+        file_obs_acc = os.path.join(obs_dir, "%s.bbp" %
+                                    (station))
+        file_obs_rd50 = os.path.join(obs_dir, "%s.rd50" %
+                                     (station))
+
+        (obs_acc_org_time, obs_acc_org_ns,
+         obs_acc_org_ew, obs_acc_org_ver) = self.read_columns(file_obs_acc)
+        (obs_perd, obs_rd50_ns,
+         obs_rd50_ew, obs_rd50_ver) = self.read_columns(file_obs_rd50)
+        # Intitialize the rd50 arrays
+        RD50PER = len(obs_perd)
+        rd1 = np.zeros(RD50PER)
+        rd2 = np.zeros(RD50PER)
+        rd3 = np.zeros(RD50PER)
+        rd4 = np.zeros(RD50PER)
+
+        # Resample and align the time series
+        (obs_acc_time,
+         obs_acc_ew,
+         sims_acc_time,
+         sims_acc_ew) = self.align_seismograms(obs_acc_org_time,
+                                               obs_acc_org_ew,
+                                               sims_acc_org_time,
+                                               sims_acc_org_ew)
+
+        (obs_acc_time,
+         obs_acc_ns,
+         sims_acc_time,
+         sims_acc_ns) = self.align_seismograms(obs_acc_org_time,
+                                               obs_acc_org_ns,
+                                               sims_acc_org_time,
+                                               sims_acc_org_ns)
+
+        obs_org_dt = obs_acc_org_time[1] - obs_acc_org_time[0]
+        sims_org_dt = sims_acc_org_time[1] - sims_acc_org_time[0]
+        obs_dt = obs_acc_time[1] - obs_acc_time[0]
+        sims_dt = sims_acc_time[1] - sims_acc_time[0]
+
+        # After the alignment both series are at the coarser dt, set
+        # it for each station instead of keeping the previous one
+        self.dt = max(obs_dt, sims_dt)
+
+        fs = 1. / self.dt
+        fnyq = 0.5 * fs
+
+        # Compute the number of pads for the time series
+        # to have equal number of points for the fft
+        # and for criteria 1 and 2.
+
+        (sims_acc_ns, sims_acc_ew,
+         obs_acc_ns, obs_acc_ew, ndata) = self.smcpadf(sims_acc_ns,
+                                                       sims_acc_ew,
+                                                       obs_acc_ns,
+                                                       obs_acc_ew,
+                                                       self.dt, lowcut,
+                                                       8, highcut, 8,
+                                                       'FALSE')
+        # All four records are processed together, one per row, the
+        # first two are the simulated N/S and E/W components and the
+        # last two the observed ones
+        acc = np.vstack([sims_acc_ns, sims_acc_ew, obs_acc_ns, obs_acc_ew])
+
+        # Compute the FFT frequencies and the spectra only once,
+        # each band just selects its frequencies
+        F_all = np.fft.fftfreq(ndata, self.dt)
+        fft_all = np.fft.fft(acc, axis=-1)
+
+        # Start the loop for the different frequency bands
+        for iband in range(len(self.B)):
+            f1 = self.B[iband][0]
+            f2 = self.B[iband][1]
+            # Do the job only if the frequency band is within
+            # the filtered band and if fnyq is higher than f1
+            if f1 >= lowcut and f2 <= highcut and fnyq >= f2:
+                #print("Working on Period Band :", iband + 1,
+                #      "[", 1. / f2, 1. / f1, "]")
+                T1 = 1. / f1
+                T2 = 1. / f2
+                t_tmp = sims_perd[(sims_perd <= T1) & (T2 <= sims_perd)]
+
+                b, a = self.get_band_filter(iband, fnyq)
+                acc_flt = signal.filtfilt(b, a, acc, axis=-1)
+
+                # Work on the frequency domain
+
+                # Do the response spectra
+                # Save the rsp for the specific frequency band
+                rd1 = sims_rd50_ns[(sims_perd <= T1) & (T2 <= sims_perd)]
+                rd2 = sims_rd50_ew[(sims_perd <= T1) & (T2 <= sims_perd)]
+                rd3 = obs_rd50_ns[(obs_perd <= T1) & (T2 <= obs_perd)]
+                rd4 = obs_rd50_ew[(obs_perd <= T1) & (T2 <= obs_perd)]
+
+                self.C8[irec, iband] = np.nanmean(
+                    [self.c8_eval(rd1, rd3, t_tmp),
+                     self.c8_eval(rd2, rd4, t_tmp)])
+
+                # Slice the FFT for the working frequency band
+                fft_band = fft_all[:, (0. <= F_all) &
+                                   (f1 <= F_all) & (F_all <= f2)]
+                F = F_all[(f1 <= F_all) & (F_all <= f2)]
+
+                fs_band = abs(fft_band) / fft_band.shape[1]
+
+                self.C9[irec, iband] = np.nanmean(
+                    [self.c9_eval(fs_band[0], fs_band[2], F),
+                     self.c9_eval(fs_band[1], fs_band[3], F)])
+
+                # Work on the time domain
+                vel_flt = self.integ(acc_flt, self.dt)
+                dis_flt = self.integ(vel_flt, self.dt)
+
+                c1, c3 = self.c13_eval(acc_flt[:2], acc_flt[2:])
+                c2, c4 = self.c24_eval(vel_flt[:2], vel_flt[2:])
+
+                # Only the N/S component is used for C1-C4, same as
+                # the np.array(c11, c12) expressions used previously
+                self.C1[irec, iband] = c1[0]
+                self.C2[irec, iband] = c2[0]
+                self.C3[irec, iband] = c3[0]
+                self.C4[irec, iband] = c4[0]
+                self.C5[irec, iband] = np.nanmean(
+                    self.c5_eval(acc_flt[:2], acc_flt[2:]))
+                self.C6[irec, iband] = np.nanmean(
+                    self.c6_eval(vel_flt[:2], vel_flt[2:]))
+                self.C7[irec, iband] = np.nanmean(
+                    self.c7_eval(dis_flt[:2], dis_flt[2:]))
+                self.C10[irec, iband] = np.nanmean(
+                    self.c10_eval(acc_flt[:2], acc_flt[2:]))
+
+                #print(self.C1[irec, iband],
+                #      self.C2[irec, iband],
+                #      self.C3[irec, iband],
+                #      self.C4[irec, iband],
+                #      self.C5[irec, iband],
+                #      self.C6[irec, iband],
+                #      self.C7[irec, iband],
+                #      self.C8[irec, iband],
+                #      self.C9[irec, iband],
+                #      self.C10[irec, iband])
+
+        self.S1[irec] = np.nanmean(
+            np.array([np.nanmean(self.C1[irec, :]),
+                      np.nanmean(self.C2[irec, :]),
+                      np.nanmean(self.C3[irec, :]),
+                      np.nanmean(self.C4[irec, :]),
+                      np.nanmean(self.C5[irec, :]),
+                      np.nanmean(self.C6[irec, :]),
+                      np.nanmean(self.C7[irec, :]),
+                      np.nanmean(self.C8[irec, :]),
+                      np.nanmean(self.C9[irec, :]),
+                      np.nanmean(self.C10[irec, :])]))
 
-        return y
+        output_file = os.path.join(a_validation_outdir,
+                                   "gof-%s-%d-anderson-%s.txt" %
+                                   (self.eventname, self.sim_id,
+                                    station))
+        out_file = open(output_file, 'w')
+        line = ('#%s%5s%4s%4s%4s%4s%4s%4s%4s%4s%4s\n' %
+                ('band', 'C1', 'C2', 'C3', 'C4', 'C5',
+                 'C6', 'C7', 'C8', 'C9', 'C10'))
+        out_file.write(line)
+        for i in range(self.BMAX):
+            line = ('%s %3.1f %3.1f %3.1f %3.1f %3.1f %3.1f %3.1f %3.1f %3.1f %3.1f\n' %
+                    (self.BNAMES[i], self.C1[irec, i], self.C2[irec, i],
+                     self.C3[irec, i], self.C4[irec, i], self.C5[irec, i],
+                     self.C6[irec, i], self.C7[irec, i], self.C8[irec, i],
+                     self.C9[irec, i], self.C10[irec, i]))
+            out_file.write(line)
+        out_file.close()
+
+        output_file = os.path.join(a_validation_outdir,
+                                   "gof-%s-%d-anderson-%s.png" %
+                                   (self.eventname, self.sim_id,
+                                    station))
+        self.cplots(irec, station, output_file)
+        print('===> Station score :', "{:3.1f}".format(self.S1[irec]))
+
+        return ([self.C1[irec, :], self.C2[irec, :], self.C3[irec, :],
+                 self.C4[irec, :], self.C5[irec, :], self.C6[irec, :],
+                 self.C7[irec, :], self.C8[irec, :], self.C9[irec, :],
+                 self.C10[irec, :]], self.S1[irec], self.dt)
 
     def run(self):
         """
@@ -831,9 +1049,6 @@ class AndersonGOF(object):
         sims_dir = a_outdir
         obs_dir = os.path.join(a_tmpdir, "obs_seis_%s" % (sta_base))
 
-        # Start with first record
-        irec = 0
-
         # Read station list
         slo = StationList(sta_file)
         site_list = slo.getStationList()
@@ -843,253 +1058,23 @@ class AndersonGOF(object):
         for station in site_list:
             station_names.append(station.scode)
 
-        # Loop over stations
-        for site in site_list:
-            station = site.scode
-
-            print("==> Processing station: %s" % (station))
-
-            file_sims_acc = os.path.join(sims_dir, "%d.%s.acc.bbp" %
-                                         (sim_id, station))
-            file_sims_rd50 = os.path.join(sims_dir, "%d.%s.rd50" %
-                                          (sim_id, station))
-            lowcut = site.low_freq_corner
-            highcut = site.high_freq_corner
-            #print(lowcut, highcut)
-
-            (sims_acc_org_time, sims_acc_org_ns,
-             sims_acc_org_ew, sims_acc_org_ver) = np.genfromtxt(file_sims_acc,
-                                                                skip_header=2,
-                                                                dtype='float64',
-                                                                unpack='TRUE')
-            (sims_perd, sims_rd50_ns,
-             sims_rd50_ew, sims_rd50_ver) = np.genfromtxt(file_sims_rd50,
-                                                          skip_header=2,
-                                                          dtype='float64',
-                                                          unpack='TRUE')
-
-            file_obs_acc = os.path.join(obs_dir, "%s.bbp" %
-                                        (station))
-            file_obs_rd50 = os.path.join(obs_dir, "%s.rd50" %
-                                         (station))
-
-            (obs_acc_org_time, obs_acc_org_ns,
-             obs_acc_org_ew, obs_acc_org_ver) = np.genfromtxt(file_obs_acc,
-                                                              skip_header=2,
-                                                              dtype='float64',
-                                                              unpack='TRUE')
-            (obs_perd, obs_rd50_ns,
-             obs_rd50_ew, obs_rd50_ver) = np.genfromtxt(file_obs_rd50,
-                                                        skip_header=2,
-                                                        dtype='float64',
-                                                        unpack='TRUE')
-            # Intitialize the rd50 arrays
-            RD50PER = len(obs_perd)
-            rd1 = np.zeros(RD50PER)
-            rd2 = np.zeros(RD50PER)
-            rd3 = np.zeros(RD50PER)
-            rd4 = np.zeros(RD50PER)
-
-            # Resample and align the time series
-            (obs_acc_time,
-             obs_acc_ew,
-             sims_acc_time,
-             sims_acc_ew) = self.align_seismograms(obs_acc_org_time,
-                                                   obs_acc_org_ew,
-                                                   sims_acc_org_time,
-                                                   sims_acc_org_ew)
-
-            (obs_acc_time,
-             obs_acc_ns,
-             sims_acc_time,
-             sims_acc_ns) = self.align_seismograms(obs_acc_org_time,
-                                                   obs_acc_org_ns,
-                                                   sims_acc_org_time,
-                                                   sims_acc_org_ns)
-
-            obs_org_dt = obs_acc_org_time[1] - obs_acc_org_time[0]
-            sims_org_dt = sims_acc_org_time[1] - sims_acc_org_time[0]
-            obs_dt = obs_acc_time[1] - obs_acc_time[0]
-            sims_dt = sims_acc_time[1] - sims_acc_time[0]
-
-            if obs_dt == sims_dt:
-                self.dt = obs_dt
-
-            fs = 1. / self.dt
-            fnyq = 0.5 * fs
-
-            # Compute the number of pads for the time series
-            # to have equal number of points for the fft
-            # and for criteria 1 and 2.
-
-            (sims_acc_ns, sims_acc_ew,
-             obs_acc_ns, obs_acc_ew, ndata) = self.smcpadf(sims_acc_ns,
-                                                           sims_acc_ew,
-                                                           obs_acc_ns,
-                                                           obs_acc_ew,
-                                                           self.dt, lowcut,
-                                                           8, highcut, 8,
-                                                           'FALSE')
-            # Start the loop for the different frequency bands
-            for iband in range(len(self.B)):
-                f1 = self.B[iband][0]
-                f2 = self.B[iband][1]
-                # Do the job only if the frequency band is within
-                # the filtered band and if fnyq is higher than f1
-                if f1 >= lowcut and f2 <= highcut and fnyq >= f2:
-                    #print("Working on Period Band :", iband + 1,
-                    #      "[", 1. / f2, 1. / f1, "]")
-                    T1 = 1. / f1
-                    T2 = 1. / f2
-                    t_tmp = sims_perd[(sims_perd <= T1) & (T2 <= sims_perd)]
-
-                    acc_1_flt = self.butter_bandpass(f1, f2, fnyq, sims_acc_ns, 2)
-                    acc_2_flt = self.butter_bandpass(f1, f2, fnyq, sims_acc_ew, 2)
-                    acc_3_flt = self.butter_bandpass(f1, f2, fnyq, obs_acc_ns, 2)
-                    acc_4_flt = self.butter_bandpass(f1, f2, fnyq, obs_acc_ew, 2)
-
-                    # Work on the frequency domain
-
-                    # Do the response spectra
-                    # Save the rsp for the specific frequency band
-                    rd1 = sims_rd50_ns[(sims_perd <= T1) & (T2 <= sims_perd)]
-                    rd2 = sims_rd50_ew[(sims_perd <= T1) & (T2 <= sims_perd)]
-                    rd3 = obs_rd50_ns[(obs_perd <= T1) & (T2 <= obs_perd)]
-                    rd4 = obs_rd50_ew[(obs_perd <= T1) & (T2 <= obs_perd)]
-
-                    self.C8[irec, iband] = np.nanmean(
-                        [self.c8_eval(rd1, rd3, t_tmp),
-                         self.c8_eval(rd2, rd4, t_tmp)])
-
-                    # Now the FFT
-                    # Compute the FFT frequencies
-                    F = np.fft.fftfreq(ndata, self.dt)
-                    # Compute the fft and the amplitudes
-                    fft_1 = np.fft.fft(sims_acc_ns)
-                    fft_1 = fft_1[(0. <= F) & (f1 <= F) & (F <= f2)]
-                    fft_2 = np.fft.fft(sims_acc_ew)
-                    fft_2 = fft_2[(0. <= F) & (f1 <= F) & (F <= f2)]
-                    fft_3 = np.fft.fft(obs_acc_ns)
-                    fft_3 = fft_3[(0. <= F) & (f1 <= F) & (F <= f2)]
-                    fft_4 = np.fft.fft(obs_acc_ew)
-                    fft_4 = fft_4[(0. <= F) & (f1 <= F) & (F <= f2)]
-                    # Slice the FFT frequencies for the working frequency band
-                    F = F[(f1 <= F) & (F <= f2)]
-
-                    fs1 = abs(fft_1) / len(fft_1)
-                    fs2 = abs(fft_2) / len(fft_2)
-                    fs3 = abs(fft_3) / len(fft_3)
-                    fs4 = abs(fft_4) / len(fft_4)
-
-                    self.C9[irec, iband] = np.nanmean(
-                        [self.c9_eval(fs1, fs3, F),
-                        self.c9_eval(fs2, fs4, F)])
-
-                    # Work on the time domain
-                    """
-                    # Compute the site corrected accelerograms
-                    acc_3_scor = np.fft.ifft(fft_3)
-                    acc_4_scor = np.fft.ifft(fft_4)
-
-                    # These do not need filtering because I'm working
-                    # in the sliced frequency domain
-                    acc_3_flt = abs(acc_3_scor)
-                    acc_4_flt = abs(acc_4_scor)
-                    """
-                    vel_1 = self.integ(acc_1_flt, self.dt)
-                    vel_2 = self.integ(acc_2_flt, self.dt)
-                    vel_3 = self.integ(acc_3_flt, self.dt)
-                    vel_4 = self.integ(acc_4_flt, self.dt)
-
-                    dis_1 = self.integ(vel_1, self.dt)
-                    dis_2 = self.integ(vel_2, self.dt)
-                    dis_3 = self.integ(vel_3, self.dt)
-                    dis_4 = self.integ(vel_4, self.dt)
-
-                    c11, c31 = self.c13_eval(acc_1_flt,
-                                             acc_3_flt)
-                    c12, c32 = self.c13_eval(acc_2_flt,
-                                             acc_4_flt)
-
-                    c21, c41 = self.c24_eval(vel_1,
-                                             vel_3)
-                    c22, c42 = self.c24_eval(vel_2,
-                                             vel_4)
-
-                    self.C1[irec, iband] = np.nanmean(
-                                           np.array(c11, c12))
-                    self.C2[irec, iband] = np.nanmean(
-                                           np.array(c21, c22))
-                    self.C3[irec, iband] = np.nanmean(
-                                           np.array(c31, c32))
-                    self.C4[irec, iband] = np.nanmean(
-                                           np.array(c41, c42))
-                    self.C5[irec, iband] = np.nanmean(
-                                           [self.c5_eval(acc_1_flt,
-                                                         acc_3_flt),
-                                            self.c5_eval(acc_2_flt,
-                                                         acc_4_flt)])
-                    self.C6[irec, iband] = np.nanmean(
-                                           [self.c6_eval(vel_1, vel_3),
-                                            self.c6_eval(vel_2, vel_4)])
-                    self.C7[irec, iband] = np.nanmean(
-                                           [self.c7_eval(dis_1, dis_3),
-                                            self.c7_eval(dis_2, dis_4)])
-                    self.C10[irec, iband] = np.nanmean(
-                                            [self.c10_eval(acc_1_flt,
-                                                           acc_3_flt),
-                                             self.c10_eval(acc_2_flt,
-                                                           acc_4_flt)])
-
-                    #print(self.C1[irec, iband],
-                    #      self.C2[irec, iband],
-                    #      self.C3[irec, iband],
-                    #      self.C4[irec, iband],
-                    #      self.C5[irec, iband],
-                    #      self.C6[irec, iband],
-                    #      self.C7[irec, iband],
-                    #      self.C8[irec, iband],
-                    #      self.C9[irec, iband],
-                    #      self.C10[irec, iband])
-
-            self.S1[irec] = np.nanmean(
-                np.array([np.nanmean(self.C1[irec, :]),
-                          np.nanmean(self.C2[irec, :]),
-                          np.nanmean(self.C3[irec, :]),
-                          np.nanmean(self.C4[irec, :]),
-                          np.nanmean(self.C5[irec, :]),
-                          np.nanmean(self.C6[irec, :]),
-                          np.nanmean(self.C7[irec, :]),
-                          np.nanmean(self.C8[irec, :]),
-                          np.nanmean(self.C9[irec, :]),
-                          np.nanmean(self.C10[irec, :])]))
-
-            output_file = os.path.join(a_validation_outdir,
-                                       "gof-%s-%d-anderson-%s.txt" %
-                                       (self.eventname, self.sim_id,
-                                        station))
-            out_file = open(output_file, 'w')
-            line = ('#%s%5s%4s%4s%4s%4s%4s%4s%4s%4s%4s\n' %
-                    ('band', 'C1', 'C2', 'C3', 'C4', 'C5',
-                     'C6', 'C7', 'C8', 'C9', 'C10'))
-            out_file.write(line)
-            for i in range(self.BMAX):
-                line = ('%s %3.1f %3.1f %3.1f %3.1f %3.1f %3.1f %3.1f %3.1f %3.1f %3.1f\n' %
-                        (self.BNAMES[i], self.C1[irec, i], self.C2[irec, i],
-                         self.C3[irec, i], self.C4[irec, i], self.C5[irec, i],
-                         self.C6[irec, i], self.C7[irec, i], self.C8[irec, i],
-                         self.C9[irec, i], self.C10[irec, i]))
-                out_file.write(line)
-            out_file.close()
-
-            output_file = os.path.join(a_validation_outdir,
-                                       "gof-%s-%d-anderson-%s.png" %
-                                       (self.eventname, self.sim_id,
-                                        station))
-            self.cplots(irec, station, output_file)
-            print('===> Station score :', "{:3.1f}".format(self.S1[irec]))
-
-            irec = irec + 1
+        # Process all stations, keeping the scores for each one
+        results = bband_utils.run_stations(self.process_station,
+                                           range(len(site_list)),
+                                           args=(site_list, sims_dir,
+                                                 obs_dir,
+                                                 a_validation_outdir),
+                                           jobs=install.num_jobs,
+                                           logfile=self.log)
+        for irec, (c_values, s1_value, dt) in enumerate(results):
+            for c_array, c_value in zip([self.C1, self.C2, self.C3,
+                                         self.C4, self.C5, self.C6,
+                                         self.C7, self.C8, self.C9,
+                                         self.C10], c_values):
+                c_array[irec, :] = c_value
+            self.S1[irec] = s1_value
+            self.dt = dt
+        irec = len(results)
 
         print('==> Total number of stations processed: %d' % (irec))
         self.C1 = self.C1[0:irec, :]
@@ -13,18 +13,27 @@ from __future__ import division, print_function
 
 # G2CMSS = 980.665 # Convert g to cm/s/s
 import math
-import scipy.integrate
+import numpy as np
 
 # Converting to cm units. Use approximation to g
 G_TO_CMS = 981.0 # %(cm/s)
 
-def ad_from_acc(a_in_peer_file, a_out_ad):
+# Arias intensity thresholds (in %) used for the significant durations
+AI_THRESHOLDS = [5, 75, 95]
+
+def cumtrapz(values):
     """
-    This function reads a PEER formatted acceleration file and outputs
-    the arias duration
+    Cumulative trapezoidal integration (unit spacing) along the last
+    axis, with the same operation order as scipy.integrate.cumtrapz
     """
+    return np.cumsum((values[..., 1:] + values[..., :-1]) / 2.0, axis=-1)
 
-    acc = []
+def read_peer_acc(a_in_peer_file):
+    """
+    Reads a PEER formatted acceleration file, returns the samples and
+    dt, or None if the file cannot be used
+    """
+    sample_lines = []
     start_samples = False
 
     pfx = open(a_in_peer_file, "r")
@@ -39,151 +48,90 @@ def ad_from_acc(a_in_peer_file, a_out_ad):
             #print("Reading Seismogram with NPTS: %d and DT: %f" % (pts, dt))
             continue
         if start_samples:
-            for val in pieces:
-                acc.append(float(val))
+            sample_lines.append(line)
     pfx.close()
 
     if not start_samples:
         print("No samples found in peer file: %s" % (a_in_peer_file))
-        return -1
+        return None
 
     #
     # Full file read. Now count samples found
-    # in_vals contains samples, dt timesetp, pts number of data points
+    # acc contains samples, dt timesetp, pts number of data points
     #
+    acc = np.array(" ".join(sample_lines).split(), dtype=float)
     if len(acc) != pts:
         print("Number of points in header %d does not match number " % (pts) +
               "of pts read from file %d. Exiting file: %s" %
               (len(acc), a_in_peer_file))
-        return -1
-    #
-    # Reduce the sample count to be an even number for fft
-    #
-    if len(acc) % 2 != 0:
-        pts = pts - 1
-        #print("adjusted pts: %d" % (pts))
+        return None
 
-    #
-    # Create a list of dt values
-    #
-    dt_vals = [point * dt for point in range(pts)]
-
-    #
-    # Integrate and calculate vel and disp arrays
-    #
-    acc_cms = [value * G_TO_CMS for value in acc]
-    velo = list(dt * scipy.integrate.cumtrapz(acc_cms))
-    velo.insert(0, 0)
-    disp = list(dt * scipy.integrate.cumtrapz(velo))
-    disp.insert(0, 0)
+    return acc, dt
 
+def calculate_arias(acc, dt):
+    """
+    Computes the Arias intensity for acc, a 2D array with one
+    acceleration record (in g) per row, all sampled at dt. Returns
+    the arias intensity, the normalized arias intensity (in %), the
+    peak arias intensity and its index, and the T5-75 and T5-95
+    significant durations for each record
+    """
+    acc = np.atleast_2d(acc)
+    pts = acc.shape[1]
     #
-    # Find PGA and PGV
+    # Reduce the sample count to be an even number for fft
     #
-    temp1 = max(acc)
-    temp2 = min(acc)
-    if temp1 > abs(temp2):
-        max_acc = temp1
-        max_acc_idx = acc.index(temp1)
-    else:
-        max_acc = abs(temp2)
-        max_acc_idx = acc.index(temp2)
-    #print("Peak Accel (g): %f (secs): %f" % (max_acc, (max_acc_idx * dt)))
-
-    temp1 = max(velo)
-    temp2 = min(velo)
-    if temp1 > abs(temp2):
-        max_vel = temp1
-        max_vel_idx = velo.index(temp1)
-    else:
-        max_vel = abs(temp2)
-        max_vel_idx = velo.index(temp2)
-    #print("Peak Vel (cm/s): %f (secs): %f" % (max_vel, (max_vel_idx * dt)))
-
-    temp1 = max(disp)
-    temp2 = min(disp)
-    if temp1 > abs(temp2):
-        max_disp = temp1
-        max_disp_idx = disp.index(temp1)
-    else:
-        max_disp = abs(temp2)
-        max_disp_idx = disp.index(temp2)
-    #print("Peak Disp (cm): %f (secs): %f" % (max_disp, (max_disp_idx * dt)))
+    if pts % 2 != 0:
+        pts = pts - 1
 
     # Arias Intensities
     # Using the trapezoidal integration
-    arias_intensity = [pow((value * G_TO_CMS), 2) for value in acc]
-    tsum = list(scipy.integrate.cumtrapz(arias_intensity) * dt)
-    tsum.insert(0, 0)
-
-    arias_intensity = [num * math.pi / (2 * G_TO_CMS) for num in tsum]
-
-    #
-    # Find peak arias_intensity
-    #
-    temp1 = max(arias_intensity)
-    temp2 = min(arias_intensity)
-    if temp1 > abs(temp2):
-        arias_intensity_max = temp1
-        arias_intensity_index = arias_intensity.index(temp1)
-    else:
-        arias_intensity_max = abs(temp2)
-        arias_intensity_index = arias_intensity.index(temp2)
-    #print("Peak Arias Intensity (cm/sec): %f (secs): %f" %
-    #      (arias_intensity_max, (arias_intensity_index * dt)))
-
-    if arias_intensity_max:
-        ia_norm = [100 * (i_acc / arias_intensity_max) for i_acc in arias_intensity]
-    else:
-        ia_norm = [0.0 for i_acc in arias_intensity]
-
-    # Define the time for AI=5%, 75%, 95%
-    time_ai5 = 0
-    for i in range(pts):
-        if ia_norm[i] >= 5:
-            break
-        time_ai5 = dt * i
-
-    time_ai75 = 0
-    for i in range(pts):
-        if ia_norm[i] >= 75:
-            break
-        time_ai75 = dt * i
-
-    time_ai95 = 0
-    for i in range(pts):
-        if ia_norm[i] >= 95:
-            break
-        time_ai95 = dt * i
+    arias_intensity = np.zeros(acc.shape)
+    arias_intensity[:, 1:] = cumtrapz((acc * G_TO_CMS) ** 2) * dt
+    arias_intensity = arias_intensity * math.pi / (2 * G_TO_CMS)
+
+    #
+    # Find peak arias_intensity, since the intensity is cumulative and
+    # starts at zero, this is the first occurrence of its maximum
+    #
+    arias_intensity_index = np.argmax(arias_intensity, axis=1)
+    arias_intensity_max = arias_intensity[np.arange(acc.shape[0]),
+                                          arias_intensity_index]
+
+    ia_norm = np.zeros(acc.shape)
+    has_intensity = arias_intensity_max > 0
+    ia_norm[has_intensity] = (100 *
+                              (arias_intensity[has_intensity] /
+                               arias_intensity_max[has_intensity, None]))
+
+    # Define the time for AI=5%, 75%, 95%, ia_norm is non-decreasing so
+    # the number of samples below each threshold is the index of the
+    # first crossing. Times are those of the sample before the
+    # crossing, or the last sample if the threshold is never reached
+    times = []
+    for threshold in AI_THRESHOLDS:
+        crossing = np.sum(ia_norm[:, :pts] < threshold, axis=1)
+        times.append(dt * np.maximum(crossing - 1, 0))
+    time_ai5, time_ai75, time_ai95 = times
 
     # Now, calculate the arias intervals 5% to 75% and 5% to 95%
     time_5_75 = time_ai75 - time_ai5
     time_5_95 = time_ai95 - time_ai5
 
-    #print("Arias Intervals: 5 to 75 % 6f (secs), 5 to 95 % 6f (secs) " %
-    #      (time_5_75, time_5_95))
+    return (arias_intensity, ia_norm, arias_intensity_max,
+            arias_intensity_index, time_5_75, time_5_95)
 
-    #
-    # create single component avd (accel, vel, disp) bbp file
-    #
-    #outfile = open("%s.avd.bbp" % (a_in_peer_file), "w")
-    #outfile.write("# Acc  Vel Disp (avd) from: %s\n" % a_in_peer_file)
-    #outfile.write("# Peak Accel: %f at: %f (s)\n" %
-    #              (max_acc, (max_acc_idx * dt)))
-    #outfile.write("# Peak Vel: %f at: %f (s)\n" %
-    #              (max_vel, (max_vel_idx * dt)))
-    #outfile.write("# Peak Disp: %f at: %f (s)\n" %
-    #              (max_disp, (max_disp_idx * dt)))
-    #outfile.write("# Seconds Accel (g) Vel (cm/s) Disp (cm)\n")
-    #outfile.write("# %d %f  NPTS, DT\n" % (pts, dt))
-    #for i in range(pts):
-    #    outfile.write("% 8f % 8f % 8f % 8f\n" %
-    #                  (dt_vals[i], acc[i], velo[i], disp[i]))
-    #outfile.close()
+def write_arias(a_out_ad, a_in_peer_file, dt, acc, arias_intensity,
+                ia_norm, arias_intensity_max, arias_intensity_index,
+                time_5_75, time_5_95):
+    """
+    Writes a single component Arias Duration bbp file
+    """
+    pts = len(acc)
+    if pts % 2 != 0:
+        pts = pts - 1
+    dt_vals = np.arange(pts) * dt
 
-    #
-    # Create single component Arias Duration bbp file
-    #
     outfile = open(a_out_ad, "w")
     outfile.write("# Arias Intensities from input accel: %s\n" % a_in_peer_file)
     outfile.write("# Peak Arias Intensity (cm/sec): %f (secs): %f\n" %
@@ -194,8 +142,45 @@ def ad_from_acc(a_in_peer_file, a_out_ad):
                   "Arias Intensity (cm/s) "
                   "ADNormalized (%)\n")
     outfile.write("# %d %f  NPTS, DT\n" % (pts, dt))
-    for i in range(pts):
-        outfile.write("% 8f % 8f % 8f % 8f\n" %
-                      (dt_vals[i], acc[i], arias_intensity[i], ia_norm[i]))
+    data = np.column_stack((dt_vals, acc[:pts],
+                            arias_intensity[:pts], ia_norm[:pts]))
+    outfile.write("".join(["% 8f % 8f % 8f % 8f\n" % tuple(row)
+                           for row in data.tolist()]))
     outfile.close()
-    return 0
+
+def ad_from_acc_multi(in_files, out_files):
+    """
+    Computes the arias duration for a list of PEER formatted
+    acceleration files (e.g. the three components of one or more
+    stations), writing one output file for each. Records with the
+    same number of points and dt are processed together as a single
+    2D array. Returns 0 if all files were processed, -1 otherwise
+    """
+    status = 0
+    groups = {}
+    for in_file, out_file in zip(in_files, out_files):
+        record = read_peer_acc(in_file)
+        if record is None:
+            status = -1
+            continue
+        acc, dt = record
+        key = (len(acc), dt)
+        if key not in groups:
+            groups[key] = []
+        groups[key].append((in_file, out_file, acc))
+
+    for (_, dt), records in groups.items():
+        acc = np.vstack([record[2] for record in records])
+        results = calculate_arias(acc, dt)
+        for idx, (in_file, out_file, _) in enumerate(records):
+            write_arias(out_file, in_file, dt, acc[idx],
+                        *[result[idx] for result in results])
+
+    return status
+
+def ad_from_acc(a_in_peer_file, a_out_ad):
+    """
+    This function reads a PEER formatted acceleration file and outputs
+    the arias duration
+    """
+    return ad_from_acc_multi([a_in_peer_file], [a_out_ad])
@@ -424,22 +424,23 @@ class AS16(object):
         out_file.write("#station, rrup, vs30, sd575, sd595, sd2080,"
                        " tau575, tau595, tau2080, phi575, phi595, phi2080\n")
 
+        # Calculate Rrup for all stations
+        site_geoms = [[site.lon, site.lat, 0.0] for site in site_list]
+        (fault_trace1, up_seis_depth,
+         low_seis_depth, ave_dip,
+         dummy1, dummy2) = putils.FaultTraceGen(origin, dims, mech)
+        _, rrups, _ = putils.DistancesToSimpleFaultSurface(site_geoms,
+                                                           fault_trace1,
+                                                           up_seis_depth,
+                                                           low_seis_depth,
+                                                           ave_dip,
+                                                           RxCalc=False)
+
         # Go through each station
-        for site in site_list:
+        for site, rrup in zip(site_list, rrups):
             stat = site.scode
             vs30 = float(site.vs30)
 
-            # Calculate Rrup
-            site_geom = [site.lon, site.lat, 0.0]
-            (fault_trace1, up_seis_depth,
-             low_seis_depth, ave_dip,
-             dummy1, dummy2) = putils.FaultTraceGen(origin, dims, mech)
-            _, rrup, _ = putils.DistanceToSimpleFaultSurface(site_geom,
-                                                             fault_trace1,
-                                                             up_seis_depth,
-                                                             low_seis_depth,
-                                                             ave_dip)
-
             results = calculate_as16(src_keys['magnitude'], rrup,
                                      mechanism, vs30, -999.0, cj)
 
@@ -12,8 +12,16 @@ from __future__ import division, print_function
 import os
 import re
 import sys
+import time
+import random
+import shutil
 import traceback
 import subprocess
+import multiprocessing
+import numpy as np
+
+# Import Broadband modules
+import timeline
 
 # Compile regular expressions
 re_parse_property = re.compile(r'([^:= \t]+)\s*[:=]?\s*(.*)')
@@ -28,6 +36,10 @@ GP_MAX_FILENAME = 256
 # Set to the maximum allowed filename in the SDSU codebase
 SDSU_MAX_FILENAME = 256
 
+# Function, items and log files used by the run_stations worker
+# processes, inherited when the pool forks so they are never pickled
+STATION_TASK = None
+
 class BroadbandExternalError(Exception):
     """
     Exception when an external program invoked by the Broadband
@@ -61,8 +73,9 @@ def runprog(cmd, print_cmd=True, abort_on_error=False):
     try:
         if print_cmd:
             print("Running: %s" % (cmd))
+        start = time.time()
         proc = subprocess.Popen(cmd, shell=True)
-        proc.wait()
+        timeline.wait_process(proc, start, cmd)
     except KeyboardInterrupt:
         print("Interrupted!")
         sys.exit(1)
@@ -92,11 +105,12 @@ def get_command_output(cmd, output_on_stderr=False, abort_on_error=False):
     commandOutput function in Environment.py
     """
     # Execute command using the UNIX shell
-    child = subprocess.Popen(cmd,
-                             shell=True,
-                             stdout=subprocess.PIPE,
-                             stderr=subprocess.PIPE)
-    child_data, child_error = child.communicate()
+    with timeline.Timer("subprocess", timeline.program_name(cmd), cmd=cmd):
+        child = subprocess.Popen(cmd,
+                                 shell=True,
+                                 stdout=subprocess.PIPE,
+                                 stderr=subprocess.PIPE)
+        child_data, child_error = child.communicate()
 
     if child_error and output_on_stderr is False:
         if abort_on_error:
@@ -125,6 +139,106 @@ def get_command_output(cmd, output_on_stderr=False, abort_on_error=False):
 
     return child_data
 
+def run_station(function, item, logfile, args):
+    """
+    Calls function(item, logfile, *args), recording it in the
+    performance timeline
+    """
+    with timeline.Timer("station", str(getattr(item, "scode", item)),
+                        function=getattr(function, "__name__",
+                                         str(function))):
+        return function(item, logfile, *args)
+
+def init_station_worker():
+    """
+    Reseeds the random number generators in each worker, forked
+    workers would otherwise all start from the parent's state
+    """
+    random.seed()
+    np.random.seed()
+
+def run_station_task(index):
+    """
+    Runs the station function from STATION_TASK for the item at
+    index, returns the index, the result and the traceback if the
+    station failed
+    """
+    function, items, logfiles, args = STATION_TASK
+    try:
+        return index, run_station(function, items[index],
+                                  logfiles[index], args), None
+    except BaseException:
+        # Stations calling sys.exit() must not kill the worker, or
+        # the pool would wait for their results forever
+        return index, None, traceback.format_exc()
+
+def run_stations(function, items, args=(), jobs=1, logfile=None):
+    """
+    Calls function(item, logfile, *args) for each item in items (typically
+    the stations from a StationList), using a pool of up to jobs
+    processes. Results are returned in the same order as items. When
+    running in parallel, each station logs to its own file, and these
+    are appended to logfile in station order when all stations are
+    done. In parallel mode, a ProcessingError with the station
+    traceback is raised as soon as any station fails.
+    """
+    global STATION_TASK
+
+    items = list(items)
+    jobs = max(1, min(jobs, len(items)))
+    if jobs == 1:
+        # Nothing to parallelize, run everything here
+        return [run_station(function, item, logfile, args)
+                for item in items]
+
+    if logfile is None:
+        logfiles = [None] * len(items)
+    else:
+        logfiles = ["%s.%d" % (logfile, index)
+                    for index in range(len(items))]
+        for station_log in logfiles:
+            if os.path.exists(station_log):
+                os.remove(station_log)
+
+    # Workers get the station task when the pool forks, so it must
+    # be set first. Stations need the parent's state, so prefer fork
+    STATION_TASK = (function, items, logfiles, args)
+    if hasattr(multiprocessing, "get_context"):
+        pool_class = multiprocessing.get_context("fork").Pool
+    else:
+        pool_class = multiprocessing.Pool
+    pool = pool_class(processes=jobs, initializer=init_station_worker)
+
+    results = [None] * len(items)
+    try:
+        for index, result, error in pool.imap_unordered(run_station_task,
+                                                         range(len(items))):
+            if error is not None:
+                station = getattr(items[index], "scode", index)
+                raise ProcessingError("Station %s failed!\n%s" %
+                                      (station, error))
+            results[index] = result
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+        STATION_TASK = None
+        # Forward station logs in order, even when a station failed
+        if logfile is not None:
+            log_fp = open(logfile, 'a')
+            for station_log in logfiles:
+                if not os.path.exists(station_log):
+                    continue
+                station_fp = open(station_log, 'r')
+                shutil.copyfileobj(station_fp, log_fp)
+                station_fp.close()
+                os.remove(station_log)
+            log_fp.close()
+
+    return results
+
 def mkdirs(list_of_dirs, print_cmd=True):
     """
     Creates all directories specified in the list_of_dirs
@@ -18,391 +18,498 @@ from __future__ import division, print_function
 # Number of header lines in PEER files
 PEER_HEADER_LINES = 6
 
+# Header line used in bbp files written by this module
+BBP_HEADER_LINE = ("#    time(sec)      N-S(cm/s/s)"
+                   "      E-W(cm/s/s)      U-D(cm/s/s)\n")
+
+# Format of each sample line in bbp files written by this module
+BBP_LINE_FORMAT = "%7e   % 8e   % 8e   % 8e\n"
+
+# Format of each value in PEER files, 5 values per line
+PEER_VALUE_FORMAT = "% 12.7E "
+
+# Version of the binary seismogram store layout
+SEIS_STORE_VERSION = 1
+
+# Seismogram store kept with the observed seismograms of a run
+OBS_SEIS_STORE = "seis_store"
+
 # Import Python modules
-import sys
+import os
+import json
+import numpy as np
 
 # Import Broadband modules
 import bband_utils
+import seis_cache
+
+#
+# Bulk seismogram I/O
+#
+# Headers are parsed once, and all samples in a file are converted
+# with a single NumPy call. Output files are formatted with one string
+# operation over the whole record, using the same per-value formats as
+# the original line by line writers, so files are byte-for-byte the
+# same.
+#
+
+def time_axis(npts, dt):
+    """
+    Returns npts sample times starting at zero, accumulating dt the
+    same way as the original per-sample loops did
+    """
+    steps = np.empty(npts)
+    steps[1:] = dt
+    steps[:1] = 0.0
+    return np.cumsum(steps)
 
-def peer2bbp(in_peer_n_file, in_peer_e_file, in_peer_z_file, out_bbp_file):
+def parse_samples(lines, num_columns, filename):
     """
-    This function converts the 3 input peer files (N/E/Z) to a
-    3-component bbp file
+    Returns the values in lines as a (len(lines), num_columns) array,
+    all lines must have num_columns values
     """
-    n_vals = []
-    e_vals = []
-    z_vals = []
-    header_lines = []
-    dt_vals = []
-    start_line = 0
-    start_samples = False
+    try:
+        values = np.array(" ".join(lines).split(), dtype=float)
+    except ValueError:
+        values = None
+    if values is None or values.size != len(lines) * num_columns:
+        raise bband_utils.ProcessingError("Unexpected time series line "
+                                          "format found in %s!" %
+                                          (filename))
+    return values.reshape(len(lines), num_columns)
+
+def format_samples(line_format, data):
+    """
+    Returns the rows of data (one column for each value in
+    line_format) formatted with line_format
+    """
+    data = np.asarray(data, dtype=float)
+    return (line_format * data.shape[0]) % tuple(data.ravel().tolist())
+
+def read_peer_file(in_peer_file):
+    """
+    Reads a PEER file, returns the header lines before the
+    acceleration tag, npts and dt from the header, and the samples
+    """
+    peer_file = open(in_peer_file, "r")
+    lines = peer_file.readlines()
+    peer_file.close()
 
-    # Read input files
-    pfn = open(in_peer_n_file, "r")
-    lines_n = pfn.readlines()
-    pfn.close()
-    pfe = open(in_peer_e_file, "r")
-    lines_e = pfe.readlines()
-    pfe.close()
-    pfz = open(in_peer_z_file, "r")
-    lines_z = pfz.readlines()
-    pfz.close()
-
-    #
     # Test for empty input file and return error if found
-    if len(lines_n) < 1:
+    if len(lines) < 1:
         raise bband_utils.ProcessingError("Input file %s is empty!" %
-                                          (in_peer_n_file))
-    elif len(lines_e) != len(lines_n):
-        raise bband_utils.ProcessingError("N and E peer files do not have "
-                                          "same number of lines!")
-    elif len(lines_z) != len(lines_n):
-        raise bband_utils.ProcessingError("N and Z peer files do not have "
-                                          "same number of lines!")
-    else:
-        pass
-        #print("Input PEER-format seismogram files with len: %d" %
-        #      (len(lines_n)))
-
-    while not start_samples:
-        for line in lines_n:
-            start_line = start_line + 1
-            elems = line.split()
-            if len(elems) > 0:
-                if elems[0] == "ACCELERATION" or elems[0] == 'Acceleration':
-                    start_samples = True
-                    break
-            header_lines.append(line)
+                                          (in_peer_file))
 
-    if not start_samples:
-        raise bband_utils.ProcessingError("No samples found in peer file: %s" %
-                                          (in_peer_n_file))
-    else:
-        #print "starting line: %d"%(start_line)
-        cur_line = 0
-        pts = 0
-        dt = 0.0
-        for line in lines_n:
-            cur_line = cur_line + 1
-            if cur_line == start_line + 1:
-                pts_dt = line.split()
-                pts = float(pts_dt[0])
-                dt = float(pts_dt[1])
-                #print("Reading Seismogram with NPTS: %d and DT: %f" %
-                #      (pts, dt))
-            elif cur_line > start_line + 1:
-                vals = line.split()
-                for x in vals:
-                    n_vals.append(float(x) * bband_utils.G2CMSS)
-            else:
-                # This block will skip the header lines use
-                # ACCELERATION TAG as starting key
-                pass
-
-    cur_line = 0
-    for line in lines_e:
-        cur_line = cur_line + 1
-        if cur_line > start_line + 1:
-            vals = line.split()
-            for y in vals:
-                e_vals.append(float(y) * bband_utils.G2CMSS)
-            else:
-                # Skip header lines
-                pass
-
-    cur_line = 0
-    for line in lines_z:
-        cur_line = cur_line + 1
-        if cur_line > start_line + 1:
-            vals = line.split()
-            for z in vals:
-                z_vals.append(float(z) * bband_utils.G2CMSS)
-        else:
-            # Skip header lines
-            pass
-    #
-    # Populate the dt values for bbp format
-    # Use number of pts in time series as counter
-    #
-    dt_val = float(dt)
-    pts_count = len(n_vals)
-    #
-    # Define the first sample at time dt
-    cur_dt = 0.0
-    for x in range (pts_count):
-        dt_vals.append(cur_dt)
-        cur_dt = cur_dt + dt_val
-    #
-    #
-    if len(dt_vals) == pts_count:
-        pass
-        #print("Read format consistent time series with %d samples." %
-        #      (len(dt_vals)))
+    # Use ACCELERATION tag as starting key
+    for start_line, line in enumerate(lines):
+        elems = line.split()
+        if len(elems) > 0:
+            if elems[0] == "ACCELERATION" or elems[0] == 'Acceleration':
+                break
     else:
-        print("Inconsistent time series: %d %d" % (len(dt_vals), pts_count))
+        raise bband_utils.ProcessingError("No samples found in peer file: %s" %
+                                          (in_peer_file))
+    pts_dt = lines[start_line + 1].split()
+    npts = int(float(pts_dt[0]))
+    dt = float(pts_dt[1])
+    samples = np.array(" ".join(lines[start_line + 2:]).split(), dtype=float)
+
+    return lines[:start_line], npts, dt, samples
 
-    #
-    # Print files in bbp
-    #
-    # Open file
+def read_bbp_file(in_bbp_file):
+    """
+    Reads a bbp file, returns the header lines at the top of the file
+    and a (4, npts) array with the time and the N/S, E/W, U/D
+    components. Comments and blank lines after the header are skipped
+    """
+    header_lines = []
+    bbp_file = open(in_bbp_file, "r")
+    for line in bbp_file:
+        if not line.startswith("#") and not line.startswith("%"):
+            break
+        header_lines.append(line)
+    bbp_file.close()
+
+    data = seis_cache.read_columns(in_bbp_file)
+    if data.shape[0] != 4:
+        raise bband_utils.ProcessingError("Unexpected time series line "
+                                          "format found in %s!" %
+                                          (in_bbp_file))
+
+    return header_lines, data
+
+def write_bbp_file(out_bbp_file, data, header_lines=None,
+                   line_format=BBP_LINE_FORMAT):
+    """
+    Writes a bbp file with the (4, npts) array data (time and the N/S,
+    E/W, U/D components)
+    """
     bbp_file = open(out_bbp_file, "w")
-    # Write header
-    bbp_file.write("#    time(sec)      N-S(cm/s/s)      E-W(cm/s/s)      U-D(cm/s/s)\n")
-    #    for line in header_lines:
-    #        bbp_file.write("# %s" % (line))
-    #    bbp_file.write("# Column 1: Time (s)\n")
-    #    bbp_file.write("# Column 2: North-south acceleration (cm/s/s) (+ is northward)\n")
-    #    bbp_file.write("# Column 3: East-west acceleration (cm/s/s) (+ is eastward)\n")
-    #    bbp_file.write("# Column 4: Up-down acceleration (cm/s/s) (+ is upward)\n#\n")
-    #    bbp_file.write("# NPTS  DT  \n")
-    #    bbp_file.write("# %d %s\n" % (pts_count, dt))
-    # Write the data
-    for x in range(pts_count):
-        bbp_file.write("%7e   % 8e   % 8e   % 8e\n" % (dt_vals[x], n_vals[x],
-                                                       e_vals[x], z_vals[x]))
-    # Lastly, close the file
+    for line in (header_lines or [BBP_HEADER_LINE]):
+        bbp_file.write(line)
+    bbp_file.write(format_samples(line_format, np.transpose(data)))
     bbp_file.close()
 
+def add_bbp_files(in_bbp_files):
+    """
+    Adds the seismograms in in_bbp_files, returns the header lines of
+    the first file and a (4, npts) array with the time and the summed
+    N/S, E/W, U/D components. Files are read one at a time and must
+    all have the same number of samples and time steps
+    """
+    header_lines, total = read_bbp_file(in_bbp_files[0])
+    for in_bbp_file in in_bbp_files[1:]:
+        _, data = read_bbp_file(in_bbp_file)
+        if data.shape != total.shape:
+            raise bband_utils.ProcessingError("File size mismatch: %s has "
+                                              "%d samples, %s has %d!" %
+                                              (in_bbp_file, data.shape[1],
+                                               in_bbp_files[0],
+                                               total.shape[1]))
+        if not np.allclose(data[0], total[0]):
+            raise bband_utils.ProcessingError("Time step mismatch: %s and "
+                                              "%s have different sample "
+                                              "times!" %
+                                              (in_bbp_file, in_bbp_files[0]))
+        total[1:] += data[1:]
+
+    return header_lines, total
+
+def peer2bbp(in_peer_n_file, in_peer_e_file, in_peer_z_file, out_bbp_file):
+    """
+    This function converts the 3 input peer files (N/E/Z) to a
+    3-component bbp file. Returns the (4, npts) array written to the
+    bbp file
+    """
+    _, _, dt, n_vals = read_peer_file(in_peer_n_file)
+    _, _, _, e_vals = read_peer_file(in_peer_e_file)
+    _, _, _, z_vals = read_peer_file(in_peer_z_file)
+    if len(e_vals) != len(n_vals):
+        raise bband_utils.ProcessingError("N and E peer files do not have "
+                                          "same number of samples!")
+    elif len(z_vals) != len(n_vals):
+        raise bband_utils.ProcessingError("N and Z peer files do not have "
+                                          "same number of samples!")
+
+    # Define the first sample at time 0
+    data = np.vstack((time_axis(len(n_vals), dt),
+                      n_vals * bband_utils.G2CMSS,
+                      e_vals * bband_utils.G2CMSS,
+                      z_vals * bband_utils.G2CMSS))
+    write_bbp_file(out_bbp_file, data)
+
+    return data
+
+def write_peer_files(header_lines, npts, dt, n_vals, e_vals, z_vals,
+                     out_peer_n_file, out_peer_e_file, out_peer_z_file):
+    """
+    Writes the N/E/Z acceleration samples (in g) into three PEER
+    files, using header_lines for the free-form part of the header
+    """
+    # Adjust header lines, so we always have enough
+    header_lines = list(header_lines)
+    while len(header_lines) <= (PEER_HEADER_LINES - 2):
+        header_lines.append("\n")
+    header = "%sAcceleration in g\n  %d   %1.6f   NPTS, DT\n" % \
+        ("".join(header_lines[0:(PEER_HEADER_LINES - 2)]), npts, dt)
+
+    for out_peer_file, vals in zip([out_peer_n_file, out_peer_e_file,
+                                    out_peer_z_file],
+                                   [n_vals, e_vals, z_vals]):
+        # Five values per line, add newline at the end of last line
+        # to avoid issue when rotd50.f reads the file (only when
+        # compiled with gfortran 4.3.3 on HPCC)
+        num_lines, num_left = divmod(len(vals), 5)
+        data_format = (PEER_VALUE_FORMAT * 5 + "\n") * num_lines
+        data_format = data_format + PEER_VALUE_FORMAT * num_left + "\n"
+        peer_file = open(out_peer_file, "w")
+        peer_file.write(header)
+        peer_file.write(data_format %
+                        tuple(np.asarray(vals, dtype=float).tolist()))
+        peer_file.close()
+
 def bbp2peer(in_bbp_file, out_peer_n_file, out_peer_e_file, out_peer_z_file):
     """
     Convert bbp file into three peer files for use by RotD50 and
-    other programs that input PEER format seismograms
+    other programs that input PEER format seismograms. Returns npts,
+    dt and a (3, npts) array with the N/E/Z samples (in g)
     """
-    num_header_lines = 0
+    header_lines = []
     bbp = open(in_bbp_file, "r")
-    lines = bbp.readlines()
-    bbp.close()
-    for line in lines:
+    for line in bbp:
         elems = line.split()
-        if elems[0] == "#":
-            num_header_lines = num_header_lines + 1
-        else:
+        if elems[0] != "#":
             break
+        header_lines.append(line)
+    bbp.close()
+    num_header_lines = len(header_lines)
+
+    data = seis_cache.read_columns(in_bbp_file, skip_lines=num_header_lines)
+    if data.shape[0] != 4:
+        raise bband_utils.ProcessingError("Unexpected time series line "
+                                          "format found in %s!" %
+                                          (in_bbp_file))
+    acc = data[1:] / bband_utils.G2CMSS
+
+    # Last line before start gives dt and npts
+    try:
+        elems = []
+        if num_header_lines > 0:
+            elems = header_lines[-1].split()
+        npts = int(elems[1])
+        dt = float(elems[2])
+    except (IndexError, ValueError):
+        # Ok, it doesn't seem we are re-converting to PEER
+        # format a previously PEER-BBP converted file
+        # Let's try to figure things out...
+        npts = data.shape[1]
+        dt = data[0][1] - data[0][0]
+    header_lines = header_lines[:-1]
+
+    write_peer_files(header_lines, npts, dt, acc[0], acc[1], acc[2],
+                     out_peer_n_file, out_peer_e_file, out_peer_z_file)
+
+    return npts, dt, acc
+
+def read_exsim_file(in_exsim_file):
+    """
+    Reads an exsim acc format file, returns the number of lines in the
+    file, npts and dt from the header, and the samples
+    """
+    exsim_file = open(in_exsim_file, "r")
+    lines = exsim_file.readlines()
+    exsim_file.close()
 
-    #print "Counted %d header lines" % (num_header_lines)
+    # Test for empty input file and return error if found
+    if len(lines) < 1:
+        raise bband_utils.ProcessingError("Input file %s is empty!" %
+                                          (in_exsim_file))
 
-    cur_line = 0
-    header_lines = []
-    dt_vals = []
-    n_vals = []
-    e_vals = []
-    z_vals = []
+    pts = 0
+    dt = 0.0
+    start_line = 0
+    start_samples = False
     for line in lines:
-        if cur_line <= (num_header_lines - 2):
-            cur_line = cur_line + 1
-            header_lines.append(line)
-        elif cur_line == (num_header_lines - 1):
-            # Last line before start gives dt and npts
-            cur_line = cur_line + 1
-            # Print line
-            elems = line.split()
-            try:
-                npts = int(elems[1])
-                dt = float(elems[2])
-            except (IndexError, ValueError) as err:
-                # Ok, it doesn't seem we are re-converting to PEER
-                # format a previously PEER-BBP converted file
-                # Let's try to figure things out...
-                npts = len(lines) - num_header_lines
-                try:
-                    time_1 = float(lines[num_header_lines].split()[0])
-                    time_2 = float(lines[num_header_lines+1].split()[0])
-                except ValueError:
-                    print("Cannot figure out npts and dt from this bbp file!")
-                    sys.exit(-1)
-                dt = time_2 - time_1
-            #print("Reformating BBP file with %d header lines." %
-            #      (num_header_lines))
-            #print("Reformating BBP file with dt: %f " % (dt))
-            #print("Reformating BBP file with npts: %d" % (npts))
-        else:
-            elems = line.split()
-            if len(elems) != 4:
-                raise bband_utils.ProcessingError("Unexpected BBP time series "
-                                                  "line format found."
-                                                  "Error in conversion.")
-            else:
-                dt_vals.append(dt)
-                n_vals.append(float(elems[1]) / bband_utils.G2CMSS)
-                e_vals.append(float(elems[2]) / bband_utils.G2CMSS)
-                z_vals.append(float(elems[3]) / bband_utils.G2CMSS)
-
-    # Prepare to write 6 colume format
-    n_file = open(out_peer_n_file, "w")
-    e_file = open(out_peer_e_file, "w")
-    z_file = open(out_peer_z_file, "w")
-
-    #n_file.write("Created by: bbp2peer v12.8.0\n")
-    #e_file.write("Created by: bbp2peer v12.8.0\n")
-    #z_file.write("Created by: bbp2peer v12.8.0\n")
+        start_line = start_line + 1
+        elems = line.split()
+        if len(elems) == 2 and elems[1] == "samples":
+            pts = int(elems[0])
+        elif len(elems) >= 2 and elems[0] == "dt:":
+            dt = float(elems[1])
+        elif len(elems) >= 2 and elems[0] == "time(s)":
+            start_samples = True
+            break
+    if not start_samples:
+        raise bband_utils.ProcessingError("No samples found in exsim file: "
+                                          "%s" % (in_exsim_file))
 
-    # Adjust header lines, so we always have enough
-    while len(header_lines) <= (PEER_HEADER_LINES - 2):
-        header_lines.append("\n")
+    data_lines = lines[start_line:]
+    num_columns = len(data_lines[0].split()) if data_lines else 2
+    samples = parse_samples(data_lines, num_columns, in_exsim_file)[:, 1]
 
-    for line in header_lines[0:(PEER_HEADER_LINES - 2)]:
-        n_file.write(line)
-        e_file.write(line)
-        z_file.write(line)
-
-    n_file.write("Acceleration in g\n")
-    n_file.write("  %d   %1.6f   NPTS, DT\n" % (npts, dt))
-    e_file.write("Acceleration in g\n")
-    e_file.write("  %d   %1.6f   NPTS, DT\n" % (npts, dt))
-    z_file.write("Acceleration in g\n")
-    z_file.write("  %d   %1.6f   NPTS, DT\n" % (npts, dt))
-
-    cur_line = 0
-    for index, elem in enumerate(dt_vals):
-        n_file.write("% 12.7E " % (n_vals[index]))
-        e_file.write("% 12.7E " % (e_vals[index]))
-        z_file.write("% 12.7E " % (z_vals[index]))
-        #print "%f"%(dt_vals[index])
-        #print "%e"%(n_vals[index])
-        #print "%e"%(e_vals[index])
-        #print "%e"%(z_vals[index])
-        if (index % 5) == 4:
-            n_file.write("\n")
-            e_file.write("\n")
-            z_file.write("\n")
-        #else:
-        #    n_file.write("\t")
-        #    e_file.write("\t")
-        #    z_file.write("\t")
-
-    # Add newline at the end of last line to avoid issue when rotd50.f
-    # reads the file (only when compiled with gfortran 4.3.3 on HPCC)
-    n_file.write("\n")
-    e_file.write("\n")
-    z_file.write("\n")
-    # Close all files
-    n_file.close()
-    e_file.close()
-    z_file.close()
+    return len(lines), start_line, pts, dt, samples
 
 def exsim2bbp(in_exsim_n, in_exsim_e, in_exsim_z, out_bbp_file):
     """
     Converts 3 exsim acc format files into 3 component bbp file.
-    Assumes all three files are for the same site.
+    Assumes all three files are for the same site. Returns the (4,
+    npts) array written to the bbp file
     """
-
-    n_vals = []
-    e_vals = []
-    z_vals = []
-    header_lines = []
-    dt_vals = []
-
-    pfn = open(in_exsim_n, "r")
-    lines_n = pfn.readlines()
-    pfn.close()
-    pfe = open(in_exsim_e, "r")
-    lines_e = pfe.readlines()
-    pfe.close()
-    pfz = open(in_exsim_z, "r")
-    lines_z = pfz.readlines()
-    pfz.close()
-
-    #
-    # Test for empty input file and return error if found
-    if len(lines_n) < 1:
-        raise bband_utils.ProcessingError("Input file %s is empty!" %
-                                          (in_exsim_n))
-    elif len(lines_e) != len(lines_n):
+    num_lines, start_line, pts, dt, n_vals = read_exsim_file(in_exsim_n)
+    num_lines_e, _, _, _, e_vals = read_exsim_file(in_exsim_e)
+    num_lines_z, _, _, _, z_vals = read_exsim_file(in_exsim_z)
+    if num_lines_e != num_lines or len(e_vals) != len(n_vals):
         raise bband_utils.ProcessingError("N and E peer files do not have "
                                           "same number of lines!")
-    elif len(lines_z) != len(lines_n):
+    elif num_lines_z != num_lines or len(z_vals) != len(n_vals):
         raise bband_utils.ProcessingError("N and Z peer files do not have "
                                           "same number of lines!")
+    print("Input EXSIM-format seismogram files with len: %d" % (num_lines))
+    print("starting line: %d" % (start_line))
+    print("Reading Seismogram with NPTS: %d and DT: %f" % (pts, dt))
+    print("Read format consistent time series with %d samples." %
+          (len(n_vals)))
+
+    # Define the first sample at time 0
+    data = np.vstack((time_axis(len(n_vals), dt), n_vals, e_vals, z_vals))
+    write_bbp_file(out_bbp_file, data)
+
+    return data
+
+#
+# Binary seismogram store
+#
+# A store is a directory holding one record per seismogram: a .npy
+# file with a (4, npts) float64 array (time, N/S, E/W, U/D rows) that
+# can be memory-mapped, and a small .json file with the record's
+# metadata (dt, npts, units and the original bbp header lines). Each
+# record is written to its own files, so several processes can add
+# stations to the same store at the same time.
+#
+
+def _seis_store_files(store_dir, key):
+    """
+    Returns the data and metadata files for record key
+    """
+    if not key or os.sep in key or key.startswith("."):
+        raise bband_utils.ParameterError("Invalid seismogram store key: %s" %
+                                         (key))
+    return (os.path.join(store_dir, "%s.npy" % (key)),
+            os.path.join(store_dir, "%s.json" % (key)))
+
+def write_seis_record(store_dir, key, data, header_lines=None,
+                      units="cm/s/s"):
+    """
+    Adds record key to the seismogram store in store_dir. data is a
+    (4, npts) array with the time and the N/S, E/W, U/D components
+    """
+    data = np.asarray(data, dtype='float64')
+    if data.ndim != 2 or data.shape[0] != 4 or data.shape[1] < 2:
+        raise bband_utils.ParameterError("Seismogram %s must have 4 rows "
+                                         "and at least 2 samples!" % (key))
+    data_file, meta_file = _seis_store_files(store_dir, key)
+    bband_utils.mkdirs([store_dir], print_cmd=False)
+    metadata = {"version": SEIS_STORE_VERSION,
+                "npts": data.shape[1],
+                "dt": float(data[0][1] - data[0][0]),
+                "units": units,
+                "header": list(header_lines or [])}
+
+    # Write to temporary files first so readers never see partial records
+    tmp_data_file = "%s.%d.tmp" % (data_file, os.getpid())
+    tmp_meta_file = "%s.%d.tmp" % (meta_file, os.getpid())
+    output_file = open(tmp_data_file, 'wb')
+    np.save(output_file, np.ascontiguousarray(data))
+    output_file.close()
+    output_file = open(tmp_meta_file, 'w')
+    json.dump(metadata, output_file)
+    output_file.close()
+    os.rename(tmp_data_file, data_file)
+    os.rename(tmp_meta_file, meta_file)
+
+def read_seis_record(store_dir, key, mmap=True):
+    """
+    Returns the (4, npts) data array and the metadata for record key,
+    the array is memory-mapped read-only unless mmap is False
+    """
+    data_file, meta_file = _seis_store_files(store_dir, key)
+    if not os.path.exists(data_file) or not os.path.exists(meta_file):
+        raise bband_utils.ProcessingError("Seismogram %s not found in %s!" %
+                                          (key, store_dir))
+    input_file = open(meta_file, 'r')
+    metadata = json.load(input_file)
+    input_file.close()
+    if mmap:
+        data = np.load(data_file, mmap_mode='r')
     else:
-        print("Input EXSIM-format seismogram files with len: %d" %
-              (len(lines_n)))
+        data = np.load(data_file)
 
-    pts = 0
-    dt = 0.0
-    start_line = 0
-    start_samples = False
+    return data, metadata
 
-    while not start_samples:
-        for line in lines_n:
-            start_line = start_line + 1
-            elems = line.split()
-            if len(elems) == 2 and elems[1] == "samples":
-                pts = int(elems[0])
-            elif len(elems) >= 2 and elems[0] == "dt:":
-                dt = float(elems[1])
-            elif len(elems) >= 2 and elems[0] == "time(s)":
-                start_samples = True
-                break
-            else:
-                header_lines.append(line)
+def list_seis_records(store_dir):
+    """
+    Returns the sorted list of record keys in the seismogram store
+    """
+    if not os.path.isdir(store_dir):
+        return []
+    keys = []
+    for filename in os.listdir(store_dir):
+        if not filename.endswith(".json"):
+            continue
+        key = filename[:-len(".json")]
+        if os.path.exists(os.path.join(store_dir, "%s.npy" % (key))):
+            keys.append(key)
+
+    return sorted(keys)
+
+def seis_record_key(in_bbp_file):
+    """
+    Returns the default record key for a bbp file, its file name
+    without the .bbp extension
+    """
+    key = os.path.basename(in_bbp_file)
+    if key.endswith(".bbp"):
+        key = key[:-len(".bbp")]
+    return key
 
-    if not start_samples:
-        print("No samples found in peer file: " + in_exsim_n)
-        sys.exit(0)
-    else:
-        print("starting line: %d" % (start_line))
-        print("Reading Seismogram with NPTS: %d and DT: %f" % (pts, dt))
-
-    cur_line = 0
-    for line in lines_n:
-        cur_line = cur_line + 1
-        if cur_line > start_line:
-            vals = line.split()
-            n_vals.append(float(vals[1]))
-
-    cur_line = 0
-    for line in lines_e:
-        cur_line = cur_line + 1
-        if cur_line > start_line:
-            vals = line.split()
-            e_vals.append(float(vals[1]))
-
-    cur_line = 0
-    for line in lines_z:
-        cur_line = cur_line + 1
-        if cur_line > start_line:
-            vals = line.split()
-            z_vals.append(float(vals[1]))
-
-    #
-    # Populate the dt values for bbp format
-    # Use number of pts in time series as counter
-    #
-    dt_val = dt
-    pts_count = len(n_vals)
-    #
-    # Define the first sample at time dt
-    cur_dt = 0.0
-    for x in range (pts_count):
-        dt_vals.append(cur_dt)
-        cur_dt = cur_dt + dt_val
-    #
-    #
-    if len(dt_vals) == pts_count:
-        print("Read format consistent time series with %d samples." %
-              (len(dt_vals)))
-    else:
-        print("Inconsistent time series: %d %d" % (len(dt_vals), pts_count))
+def is_bbp_column_header(line):
+    """
+    Returns True if line is the comment naming the time series
+    columns, the last header line of bbp files
+    """
+    elems = line.split()
+    return (len(elems) > 1 and elems[0] == "#" and
+            (elems[1] == "t" or elems[1].startswith("time")))
 
-    #
-    # Print bbp file
-    #
-    bbp_file = open(out_bbp_file, "w")
-    # Print header
-    bbp_file.write("#    time(sec)      N-S(cm/s/s)      E-W(cm/s/s)      U-D(cm/s/s)\n")
-    #for line in header_lines:
-    #    bbp_file.write("# %s" % (line))
-    # bbp_file.write("# Column 1: Time (s)\n")
-    # bbp_file.write("# Column 2: North-south acceleration (cm/s/s) (+ is northward)\n")
-    # bbp_file.write("# Column 3: East-west acceleration (cm/s/s) (+ is eastward)\n")
-    # bbp_file.write("# Column 4: Up-down acceleration (cm/s/s) (+ is upward)\n#\n")
-    # bbp_file.write("# NPTS  DT  \n")
-    # bbp_file.write("# %d %s\n" % (pts_count, dt))
-    for x in range(pts_count):
-        bbp_file.write("%7e   % 8e   % 8e   % 8e\n" % (dt_vals[x], n_vals[x],
-                                                       e_vals[x], z_vals[x]))
+def bbp2store(in_bbp_file, store_dir, key=None, units="cm/s/s"):
+    """
+    Adds a bbp file to the seismogram store, by default the record key
+    is the file name without the .bbp extension. Returns the key
+    """
+    if key is None:
+        key = seis_record_key(in_bbp_file)
+    header_lines, data = read_bbp_file(in_bbp_file)
+    write_seis_record(store_dir, key, data, header_lines, units)
 
-    bbp_file.close()
+    return key
+
+def store2bbp(store_dir, key, out_bbp_file):
+    """
+    Exports record key from the seismogram store as a bbp file
+    """
+    data, metadata = read_seis_record(store_dir, key)
+    header_lines = metadata["header"] or [BBP_HEADER_LINE]
+
+    write_bbp_file(out_bbp_file, data, header_lines)
+
+def read_seismogram(in_bbp_file, store_dir=None):
+    """
+    Returns a (4, npts) array with the time and the N/S, E/W, U/D
+    components of a bbp file. If store_dir has a record for the file
+    that is not older than it, the record is memory-mapped instead of
+    parsing the text file
+    """
+    if store_dir is not None:
+        key = seis_record_key(in_bbp_file)
+        data_file, meta_file = _seis_store_files(store_dir, key)
+        if (os.path.exists(data_file) and os.path.exists(meta_file) and
+            os.path.getmtime(data_file) >= os.path.getmtime(in_bbp_file)):
+            data, _ = read_seis_record(store_dir, key)
+            return data
+    return seis_cache.read_columns(in_bbp_file)
+
+def store2peer(store_dir, key, out_peer_n_file,
+               out_peer_e_file, out_peer_z_file):
+    """
+    Exports acceleration record key from the seismogram store as three
+    PEER files, producing the same output bbp2peer would create from
+    an original bbp file ending its header with the column names
+    """
+    data, metadata = read_seis_record(store_dir, key)
+    header_lines = metadata["header"]
+
+    # Same rules bbp2peer uses to find npts and dt
+    npts = None
+    if header_lines:
+        elems = header_lines[-1].split()
+        try:
+            npts = int(elems[1])
+            dt = float(elems[2])
+        except (IndexError, ValueError):
+            npts = None
+    if npts is None:
+        npts = data.shape[1]
+        dt = data[0][1] - data[0][0]
+
+    # The column names are not copied to the PEER files
+    if header_lines and is_bbp_column_header(header_lines[-1]):
+        header_lines = header_lines[:-1]
+
+    write_peer_files(header_lines, npts, dt,
+                     data[1] / bband_utils.G2CMSS,
+                     data[2] / bband_utils.G2CMSS,
+                     data[3] / bband_utils.G2CMSS,
+                     out_peer_n_file, out_peer_e_file, out_peer_z_file)
 
 if __name__ == '__main__':
     print("Creating BBP Formatter")
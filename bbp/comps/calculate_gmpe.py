@@ -38,10 +38,11 @@ class CalculateGMPE(object):
         self.gmpe_group_name = i_gmpe_group_name
         self.src_keys = None
 
-    def calculate_gmpe(self, station, output_file):
+    def calculate_gmpe(self, site_list, output_files):
         """
-        This function calculates the gmpe for a station and writes the
-        output in the output_file
+        This function calculates the gmpe for all stations in
+        site_list and writes the output for each station in the
+        corresponding output_files entry
         """
         gmpe_group = gmpe_config.GMPES[self.gmpe_group_name]
         src_keys = self.src_keys
@@ -51,63 +52,64 @@ class CalculateGMPE(object):
                 src_keys['depth_to_top'])
         mech = (src_keys['strike'], src_keys['dip'], src_keys['rake'])
 
-        # Station location
-        site_geom = [float(station.lon), float(station.lat), 0.0]
         (fault_trace1, upper_seis_depth,
          lower_seis_depth, ave_dip,
          dummy1, dummy2) = putils.FaultTraceGen(origin, dims, mech)
-        rjb, rrup, rx = putils.DistanceToSimpleFaultSurface(site_geom,
-                                                            fault_trace1,
-                                                            upper_seis_depth,
-                                                            lower_seis_depth,
-                                                            ave_dip)
-        # If using corrected ground observation data, calcualte GMPEs
-        # with a Vs30 of 863 m/s
-        if self.data_corrected:
-            vs30 = 863
-        else:
-            vs30 = station.vs30
+
+        # Station distances for all stations at once
+        site_geoms = [[float(station.lon), float(station.lat), 0.0]
+                      for station in site_list]
+        (rjbs, rrups,
+         rxs) = putils.DistancesToSimpleFaultSurface(site_geoms, fault_trace1,
+                                                     upper_seis_depth,
+                                                     lower_seis_depth,
+                                                     ave_dip)
+
+        # Site conditions
+        vs30s = []
+        for station in site_list:
+            # If using corrected ground observation data, calcualte GMPEs
+            # with a Vs30 of 863 m/s
+            if self.data_corrected:
+                vs30s.append(863)
+            else:
+                vs30s.append(station.vs30)
         z10 = None # Let PyNGA calculate it
         z25 = None # Let PyNGA calculate it
 
-        # Compute PSA for this station
-        station_median = []
-        for period in gmpe_group["periods"]:
-            period_medians = []
-            for nga_model in gmpe_group["models"]:
-                median = gmpe_config.calculate_gmpe(self.gmpe_group_name,
-                                                    nga_model,
-                                                    src_keys['magnitude'],
-                                                    rjb, vs30,
-                                                    period,
-                                                    rake=src_keys['rake'],
-                                                    dip=src_keys['dip'],
-                                                    W=src_keys['fault_width'],
-                                                    Ztor=src_keys['depth_to_top'],
-                                                    Rrup=rrup, Rx=rx,
-                                                    Z10=z10, Z25=z25)
-                period_medians.append(median)
-            station_median.append((period, period_medians))
+        # Compute PSA for all stations, periods and models at once
+        medians, _ = gmpe_config.calculate_gmpe_batch(self.gmpe_group_name,
+                                                      src_keys['magnitude'],
+                                                      rjbs, vs30s,
+                                                      gmpe_group["periods"],
+                                                      rake=src_keys['rake'],
+                                                      dip=src_keys['dip'],
+                                                      W=src_keys['fault_width'],
+                                                      Ztor=src_keys['depth_to_top'],
+                                                      Rrup=rrups, Rx=rxs,
+                                                      Z10=z10, Z25=z25)
 
         # Create label
         file_label = ""
         for nga_model in gmpe_group["models"]:
             file_label = "%s %s" % (file_label, nga_model)
-        # Output data to file
-        outfile = open(output_file, 'w')
-        outfile.write("#station: %s\n" % (station.scode))
-        outfile.write("#period%s\n" % (file_label))
-        for item in station_median:
-            period = item[0]
-            vals = item[1]
-            out_str = "%.4f" % (period)
-            for method in vals:
-                out_str = out_str + "\t%.6f" % (method)
-            outfile.write("%s\n" % (out_str))
-        outfile.close()
-
-        # Return list
-        return station_median
+
+        # Output data to files
+        for station, output_file, station_medians in zip(site_list,
+                                                         output_files,
+                                                         medians):
+            outfile = open(output_file, 'w')
+            outfile.write("#station: %s\n" % (station.scode))
+            outfile.write("#period%s\n" % (file_label))
+            for period, vals in zip(gmpe_group["periods"], station_medians):
+                out_str = "%.4f" % (period)
+                for method in vals:
+                    out_str = out_str + "\t%.6f" % (method)
+                outfile.write("%s\n" % (out_str))
+            outfile.close()
+
+        # Return array
+        return medians
 
     def run(self):
         """
@@ -148,13 +150,12 @@ class CalculateGMPE(object):
         slo = StationList(a_statfile)
         site_list = slo.getStationList()
 
-        # Go through each station, and print comparison headers for
-        # the first station we process
-        for site in site_list:
-            stat = site.scode
-            print("==> Calculating GMPE for station: %s" % (stat))
-            output_file = os.path.join(a_outdir_gmpe, "%s-gmpe.ri50" % (stat))
-            self.calculate_gmpe(site, output_file)
+        # Calculate GMPEs for all stations at once
+        print("==> Calculating GMPE for %d stations" % (len(site_list)))
+        output_files = [os.path.join(a_outdir_gmpe,
+                                     "%s-gmpe.ri50" % (site.scode))
+                        for site in site_list]
+        self.calculate_gmpe(site_list, output_files)
 
         # All done
         print("Calculate GMPE Completed".center(80, '-'))
@@ -13,6 +13,7 @@ import matplotlib as mpl
 mpl.use('AGG', warn=False)
 import pylab
 import numpy as np
+from scipy import sparse
 
 # Import Broadband modules
 import bband_utils
@@ -314,89 +315,144 @@ def plot_fas(freqs, ns_data, ew_data, eas_smoothed_data, fas_plot, station):
                   transparent=False, dpi=plot_config.dpi)
     pylab.close()
 
-def ko98_smoothing(freqs, data, delta_freq, bexp):
+# Konno-Ohmachi weight matrices, keyed by (nfreq, delta_freq, bexp)
+KO98_WEIGHTS_CACHE = {}
+
+def ko98_weights(freqs, delta_freq, bexp):
     """
+    Returns the sparse Konno-Ohmachi weight matrix for the frequency
+    axis freqs, so that smoothed = weights.dot(data) gives the same
+    results as the original point-by-point smoothing:
+
     # ** smoothing of a function y (equally-spaced, dx) with the "Konno-Ohmachi"
     # ** function sin (alog10(f/fc)^exp) / alog10(f/fc)^exp) ^^4
     # ** where fc is the frequency around which the smoothing is performed
     # ** exp determines the exponent 10^(1/exp) is the half-width of the peak
     # ** cf Konno & Ohmachi, 1998, BSSA 88-1, pp. 228-241
-    """
 
+    Matrices are cached, so each frequency axis is only processed once
+    """
+    freqs = np.asarray(freqs, dtype=float)
     nx = len(freqs)
-    data_smooth = np.zeros(nx)
+    key = (nx, delta_freq, bexp)
+    if key in KO98_WEIGHTS_CACHE:
+        cached_freqs, weights = KO98_WEIGHTS_CACHE[key]
+        if np.array_equal(cached_freqs, freqs):
+            return weights
+
     fratio = np.power(10., (2.5 / bexp))
-    data_smooth[0] = data[0]
+    index = np.arange(nx)
+    index1 = ((freqs / fratio) / delta_freq).astype(int)
+    index2 = ((freqs * fratio) / delta_freq + 1).astype(int)
+    index1[index1 <= 1] = 0
+    index1[index1 >= nx] = nx
+    index2[index2 >= nx] = nx
+    lengths = np.maximum(index2 - index1, 0)
+
+    # Points that are not smoothed: the first point, zero
+    # frequencies (to avoid division by zero), and points whose
+    # smoothing window includes a zero frequency (to avoid NaNs)
+    zeros = np.concatenate(([0], np.cumsum(freqs == 0.0)))
+    no_smooth = ((index == 0) | (freqs == 0.0) |
+                 (zeros[np.maximum(index2, index1)] - zeros[index1] > 0))
+    lengths[no_smooth] = 0
+
+    # Expand all smoothing windows into (row, column) pairs
+    rows = np.repeat(index, lengths)
+    starts = np.cumsum(lengths) - lengths
+    cols = (np.arange(len(rows)) - np.repeat(starts, lengths) +
+            np.repeat(index1, lengths))
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        c1 = bexp * np.log10(freqs[cols] / freqs[rows])
+        values = np.power(np.sin(c1) / c1, 4.0)
+    values[cols == rows] = 1.0
+    values = values / np.bincount(rows, values, minlength=nx)[rows]
+
+    # Add the points that are copied over unchanged
+    rows = np.concatenate((rows, index[no_smooth]))
+    cols = np.concatenate((cols, index[no_smooth]))
+    values = np.concatenate((values, np.ones(np.count_nonzero(no_smooth))))
+
+    weights = sparse.csr_matrix((values, (rows, cols)), shape=(nx, nx))
+    KO98_WEIGHTS_CACHE[key] = (freqs, weights)
+
+    return weights
 
-    for index in range(1, nx):
-        freq = freqs[index]
-        # Added check to avoid division by zero later and NaNs in the output file
-        if freq == 0.0:
-            data_smooth[index] = data[index]
-            continue
-        fc1 = freq / fratio
-        fc2 = freq * fratio
-        index1 = int(fc1 / delta_freq)
-        index2 = int((fc2 / delta_freq) + 1)
-        if index1 <= 1:
-            index1 = 0
-        if index2 >= nx:
-            index2 = nx
-        a1 = 0.0
-        a2 = 0.0
-        for j in range(index1, index2):
-            if j != index:
-                # Extra check to avoid NaNs in output file
-                if freqs[j] == 0.0:
-                    data_smooth[index] = data[index]
-                    break
-                c1 = bexp * np.log10(freqs[j] / freq)
-                c1 = np.power(np.sin(c1) / c1, 4.0)
-                a2 = a2 + c1
-                a1 = a1 + c1 * data[j]
-            else:
-                a2 = a2 + 1.0
-                a1 = a1 + data[index]
-            data_smooth[index] = a1 / a2
-
-    return data_smooth
+def ko98_smoothing(freqs, data, delta_freq, bexp):
+    """
+    Applies Konno-Ohmachi smoothing to data, which can be either a
+    single spectrum or a 2D array with one spectrum per row
+    """
+    weights = ko98_weights(freqs, delta_freq, bexp)
+    data = np.asarray(data, dtype=float)
+    if data.ndim == 1:
+        return weights.dot(data)
+    return weights.dot(data.T).T
 
-def calculate_smoothed_eas(ns_file, ew_file, output_file=None):
+def calculate_smoothed_eas_multi(ns_files, ew_files, output_files=None):
     """
-    Calculates the smoothed EAS at the same frequencies as specified in
-    the input files
+    Calculates the smoothed EAS for a number of stations, all
+    stations sharing the same frequencies are smoothed together in a
+    single call. Returns a list with a (freqs, ns_data, ew_data,
+    eas_data, smoothed_eas) tuple for each station
     """
     b_param = 188.5 # cm/s
 
-    # Read data
-    freqs, ns_data = read_fas_file(ns_file)
-    _, ew_data = read_fas_file(ew_file)
-    eas_data = []
-
-    # Calculate EAS
-    for ns_comp, ew_comp in zip(ns_data, ew_data):
-        eas_data.append(np.sqrt(0.5*(pow(ns_comp, 2) + pow(ew_comp, 2))))
+    # Read data and calculate EAS
+    results = []
+    groups = {}
+    for ns_file, ew_file in zip(ns_files, ew_files):
+        freqs, ns_data = read_fas_file(ns_file)
+        _, ew_data = read_fas_file(ew_file)
+        freqs = np.array(freqs)
+        ns_data = np.array(ns_data)
+        ew_data = np.array(ew_data)
+        eas_data = np.sqrt(0.5 * (ns_data ** 2 + ew_data ** 2))
+        groups.setdefault(freqs.tobytes(), []).append(len(results))
+        results.append([freqs, ns_data, ew_data, eas_data, None])
 
     # Calculate Smoothed EAS
-    smoothed_eas = ko98_smoothing(freqs, eas_data,
-                                  freqs[1]-freqs[0],
-                                  b_param)
-
-    # Write data file if output_file is provided
-    if output_file is not None:
-        out_file = open(output_file, 'w')
-        out_file.write("# Freq(Hz)\t FAS H1 (cm/s)\t FAS H2 (cm/s)\t "
-                       "EAS (cm/s)\t Smoothed EAS, b=%f (cm/s)\n" %
-                       (b_param))
-        for freq, fas_h1, fas_h2, eas, s_eas in zip(freqs, ns_data,
-                                                    ew_data, eas_data,
-                                                    smoothed_eas):
-            out_file.write("%2.7E\t%2.7E\t%2.7E\t%2.7E\t%2.7E\n" %
-                           (freq, fas_h1, fas_h2, eas, s_eas))
-        out_file.close()
+    for members in groups.values():
+        freqs = results[members[0]][0]
+        smoothed_eas = ko98_smoothing(freqs,
+                                      [results[idx][3] for idx in members],
+                                      freqs[1]-freqs[0],
+                                      b_param)
+        for idx, smoothed in zip(members, smoothed_eas):
+            results[idx][4] = smoothed
+
+    # Write data files if output_files are provided
+    if output_files is not None:
+        for output_file, (freqs, ns_data, ew_data,
+                          eas_data, smoothed_eas) in zip(output_files,
+                                                         results):
+            out_file = open(output_file, 'w')
+            out_file.write("# Freq(Hz)\t FAS H1 (cm/s)\t FAS H2 (cm/s)\t "
+                           "EAS (cm/s)\t Smoothed EAS, b=%f (cm/s)\n" %
+                           (b_param))
+            for freq, fas_h1, fas_h2, eas, s_eas in zip(freqs, ns_data,
+                                                        ew_data, eas_data,
+                                                        smoothed_eas):
+                out_file.write("%2.7E\t%2.7E\t%2.7E\t%2.7E\t%2.7E\n" %
+                               (freq, fas_h1, fas_h2, eas, s_eas))
+            out_file.close()
 
     # All done!
-    return freqs, ns_data, ew_data, eas_data, smoothed_eas
+    return [tuple(result) for result in results]
+
+def calculate_smoothed_eas(ns_file, ew_file, output_file=None):
+    """
+    Calculates the smoothed EAS at the same frequencies as specified in
+    the input files
+    """
+    if output_file is None:
+        output_files = None
+    else:
+        output_files = [output_file]
+
+    return calculate_smoothed_eas_multi([ns_file], [ew_file],
+                                        output_files)[0]
 
 class FAS(object):
     """
@@ -409,6 +465,59 @@ class FAS(object):
         self.sim_id = sim_id
         self.r_stations = i_r_stations
 
+    def process_station(self, site, logfile, a_tmpdir, a_outdir):
+        """
+        Runs the USGS FAS tools for the NS and EW components of a
+        single station. Each station uses its own directory, as the
+        tools write their control and summary files to the current
+        working directory. Returns the directory
+        """
+        install = install_cfg.InstallCfg.getInstance()
+        sim_id = self.sim_id
+        a_stadir = os.path.join(a_tmpdir, "fas_%s" % (site.scode))
+        bband_utils.mkdirs([a_stadir], print_cmd=False)
+
+        # Save current directory
+        old_cwd = os.getcwd()
+        os.chdir(a_stadir)
+
+        print("==> Processing station: %s" % (site.scode))
+        # Copy acc file to tmpdata
+        acc_file = "%d.%s.acc.bbp" % (sim_id, site.scode)
+        shutil.copy2(os.path.join(a_outdir, acc_file),
+                     os.path.join(a_stadir, acc_file))
+        asc2smc_control_file = "asc2smc.ctl"
+        smc2fs2_control_file = "smc2fs2.ctl"
+        header_lines = bband_utils.count_header_lines(os.path.join(a_stadir,
+                                                                   acc_file))
+        # Work on both NS and EW components
+        for comp, data_column in zip(["NS", "EW"], [2, 3]):
+            # First we convert from BBP to SMC format
+            create_boore_asc2smc(os.path.join(a_stadir,
+                                              asc2smc_control_file),
+                                 acc_file, data_column, header_lines,
+                                 ".smc8.%s" % (comp))
+            cmd = ("%s << END >> %s 2>&1\n" %
+                   (os.path.join(install.A_USGS_BIN_DIR, "asc2smc"),
+                    logfile) +
+                   "%s\n" % (asc2smc_control_file) +
+                   "END\n")
+            bband_utils.runprog(cmd, False, abort_on_error=True)
+            # Then, we run the smc2fs2 FAS tool
+            smc_file = "%s.smc8.%s" % (acc_file, comp)
+            create_boore_smc2fs2(os.path.join(a_stadir,
+                                              smc2fs2_control_file),
+                                 smc_file, ".no_smooth.fs.col")
+            cmd = ("%s >> %s 2>&1\n" %
+                   (os.path.join(install.A_USGS_BIN_DIR, "smc2fs2"),
+                    logfile))
+            bband_utils.runprog(cmd, False, abort_on_error=True)
+
+        # Restore working directory
+        os.chdir(old_cwd)
+
+        return a_stadir
+
     def run(self):
         """
         Run FAS analysis codes
@@ -439,50 +548,34 @@ class FAS(object):
         old_cwd = os.getcwd()
         os.chdir(a_tmpdir)
 
-        for site in site_list:
-            print("==> Processing station: %s" % (site.scode))
-            # Copy acc file to tmpdata
+        # Compute the unsmoothed FAS for all stations
+        station_dirs = bband_utils.run_stations(self.process_station,
+                                                site_list,
+                                                args=(a_tmpdir, a_outdir),
+                                                jobs=install.num_jobs,
+                                                logfile=self.log)
+
+        ns_files = []
+        ew_files = []
+        output_files = []
+        for site, a_stadir in zip(site_list, station_dirs):
             acc_file = "%d.%s.acc.bbp" % (sim_id, site.scode)
-            shutil.copy2(os.path.join(a_outdir, acc_file),
-                         os.path.join(a_tmpdir, acc_file))
-            asc2smc_control_file = "asc2smc.ctl"
-            smc2fs2_control_file = "smc2fs2.ctl"
-            header_lines = bband_utils.count_header_lines(os.path.join(a_tmpdir,
-                                                                       acc_file))
-            # Work on both NS and EW components
-            for comp, data_column in zip(["NS", "EW"], [2, 3]):
-                # First we convert from BBP to SMC format
-                create_boore_asc2smc(os.path.join(a_tmpdir,
-                                                  asc2smc_control_file),
-                                     acc_file, data_column, header_lines,
-                                     ".smc8.%s" % (comp))
-                cmd = ("%s << END >> %s 2>&1\n" %
-                       (os.path.join(install.A_USGS_BIN_DIR, "asc2smc"),
-                        self.log) +
-                       "%s\n" % (asc2smc_control_file) +
-                       "END\n")
-                bband_utils.runprog(cmd, False, abort_on_error=True)
-                # Then, we run the smc2fs2 FAS tool
-                smc_file = "%s.smc8.%s" % (acc_file, comp)
-                create_boore_smc2fs2(os.path.join(a_tmpdir,
-                                                  smc2fs2_control_file),
-                                     smc_file, ".no_smooth.fs.col")
-                cmd = ("%s >> %s 2>&1\n" %
-                       (os.path.join(install.A_USGS_BIN_DIR, "smc2fs2"),
-                        self.log))
-                bband_utils.runprog(cmd, False, abort_on_error=True)
-
-            # Calculate EAS and smoothed EAS
-            ns_file = os.path.join(a_tmpdir,
-                                   "%s.smc8.NS.no_smooth.fs.col" % (acc_file))
-            ew_file = os.path.join(a_tmpdir,
-                                   "%s.smc8.EW.no_smooth.fs.col" % (acc_file))
-            output_file = os.path.join(a_outdir_fas,
-                                       "%s.smc8.smooth.fs.col" % (acc_file))
-            (freqs, ns_fas,
-             ew_fas, eas, smoothed_eas) = calculate_smoothed_eas(ns_file,
-                                                                 ew_file,
-                                                                 output_file)
+            ns_files.append(os.path.join(a_stadir,
+                                         "%s.smc8.NS.no_smooth.fs.col" %
+                                         (acc_file)))
+            ew_files.append(os.path.join(a_stadir,
+                                         "%s.smc8.EW.no_smooth.fs.col" %
+                                         (acc_file)))
+            output_files.append(os.path.join(a_outdir_fas,
+                                             "%s.smc8.smooth.fs.col" %
+                                             (acc_file)))
+
+        # Calculate EAS and smoothed EAS for all stations at once
+        results = calculate_smoothed_eas_multi(ns_files, ew_files,
+                                               output_files)
+
+        for site, (freqs, ns_fas, ew_fas,
+                   _, smoothed_eas) in zip(site_list, results):
             # Create plot
             fas_plot = os.path.join(a_outdir_fas,
                                     "%d.%s.fas.png" % (sim_id, site.scode))
@@ -143,13 +143,14 @@ class GenPlots(object):
             bbp_formatter.bbp2peer(calc_acc, calc_peer_n,
                                    calc_peer_e, calc_peer_z)
 
-            # Now calculate arias duration for each component
-            for comp in ["N", "E", "Z"]:
-                file_in = os.path.join(a_tmpdir, "%d.%s_%s.acc" %
-                                       (sim_id, stat, comp))
-                file_out = os.path.join(a_tmpdir, "%d.%s_%s.arias" %
-                                        (sim_id, stat, comp))
-                arias_duration.ad_from_acc(file_in, file_out)
+            # Now calculate arias duration for all components
+            files_in = [os.path.join(a_tmpdir, "%d.%s_%s.acc" %
+                                     (sim_id, stat, comp))
+                        for comp in ["N", "E", "Z"]]
+            files_out = [os.path.join(a_tmpdir, "%d.%s_%s.arias" %
+                                      (sim_id, stat, comp))
+                         for comp in ["N", "E", "Z"]]
+            arias_duration.ad_from_acc_multi(files_in, files_out)
 
             # Generate arias duration files for observed data
             obs_acc = os.path.join(a_tmpdir_seis, "%s.bbp" % stat)
@@ -163,13 +164,14 @@ class GenPlots(object):
             bbp_formatter.bbp2peer(obs_acc, obs_peer_n,
                                    obs_peer_e, obs_peer_z)
 
-            # Now calculate arias duration for each component
-            for comp in ["N", "E", "Z"]:
-                file_in = os.path.join(a_tmpdir, "obs.%s_%s.acc" %
-                                       (stat, comp))
-                file_out = os.path.join(a_tmpdir, "obs.%s_%s.arias" %
-                                        (stat, comp))
-                arias_duration.ad_from_acc(file_in, file_out)
+            # Now calculate arias duration for all components
+            files_in = [os.path.join(a_tmpdir, "obs.%s_%s.acc" %
+                                     (stat, comp))
+                        for comp in ["N", "E", "Z"]]
+            files_out = [os.path.join(a_tmpdir, "obs.%s_%s.arias" %
+                                      (stat, comp))
+                         for comp in ["N", "E", "Z"]]
+            arias_duration.ad_from_acc_multi(files_in, files_out)
 
             # Plot seismograms with arias duration
             filename2 = os.path.join(a_outdir, "%d.%s.vel.bbp" %
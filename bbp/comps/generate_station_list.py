@@ -12,7 +12,7 @@ from __future__ import division, print_function
 import optparse
 import numpy as np
 
-from pynga import LonLatToAngleDistance, DistanceToSimpleFaultSurface, \
+from pynga import LonLatToAngleDistance, DistancesToSimpleFaultSurface, \
     EndLocation, SimpleFaultSurface, FaultTraceGen
 #from pynga.utils import *
 
@@ -187,17 +187,11 @@ Nloc = len(Loc2D)
 LocS0 = np.array(Loc2D)
 print('Total station locations: %d' % (Nloc))
 
-Rrups = []
-Rxs = []
-for iloc in xrange(len(Loc2D)):
-    SiteGeom = Loc2D[iloc]
-    Rjb, Rrup, Rx = DistanceToSimpleFaultSurface(SiteGeom,
+Rjbs, Rrups, Rxs = DistancesToSimpleFaultSurface(LocS0,
                                                  FaultTrace1,
                                                  UpperSeisDepth,
                                                  LowerSeisDepth,
                                                  AveDip) # in km
-    Rrups.append(Rrup)
-    Rxs.append(Rx)
 
 if plot_prefix is not None:
     import matplotlib as mpl
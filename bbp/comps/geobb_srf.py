@@ -39,6 +39,7 @@ import pyproj
 
 # Import Broadband modules
 import bband_utils
+import srf_reader
 from station_list import StationList
 
 class GeoBBSRF(object):
@@ -101,20 +102,8 @@ class GeoBBSRF(object):
         return T
 
     def read_srf(self, srffile):
-        if os.path.exists(srffile):
-            srff = open(srffile, 'r')
-        else:
-            raise bband_utils.ParameterError("Missing SRF file (%s)!" %
-                                             (srffile))
-
-        # Check number of planes
-        version = float(srff.readline().strip().split()[0])
-        tokens = srff.readline().strip().split()
-        # Make sure we have a valid SRF file
-        if len(tokens) != 2:
-            raise bband_utils.ProcessingError("Invalid SRF file (%s)!" %
-                                              (srffile))
-        planes = int(tokens[1])
+        srf = srf_reader.read_srf(srffile)
+        planes = srf.planes.shape[0]
         # Make sure we have only 1 plane
         if planes > 1:
             raise bband_utils.ProcessingError("Only one plane is supported!" +
@@ -122,86 +111,23 @@ class GeoBBSRF(object):
                                               (planes))
 
         # Read Fault Data
-        tokens = srff.readline().strip().split()
-        if len(tokens) != 6:
-            raise bband_utils.ProcessingError("Invalid SRF file (%s)!" %
-                                              (srffile))
-        self.f_len = float(tokens[4])
-        self.f_width = float(tokens[5])
-        tokens = srff.readline().strip().split()
-        if len(tokens) != 5:
-            raise bband_utils.ProcessingError("Invalid SRF file (%s)!" %
-                                              (srffile))
-        self.f_strike = float(tokens[0])
-        self.f_dip = float(tokens[1])
-        self.f_depth = float(tokens[2])
-
-        tokens = srff.readline().strip().split()
-        if len(tokens) != 2:
-            raise bband_utils.ProcessingError("Invalid SRF file (%s)!" %
-                                              (srffile))
-        n_cels = int(tokens[1])
-        # print ("F_len: %f, F_width: %f, F_Strike: %f" %
-        #        (self.f_len, self.f_width, self.f_strike))
-        # print ("F_dip: %f, F_depth: %f, n_cells: %d" %
-        #        (self.f_dip, self.f_depth, n_cels))
-        M0 = 0.0
-        lon = []
-        lat = []
-        dep = []
-        tinit = []
-        rake = []
-        for i in range(0, n_cels):
-            tokens = srff.readline().strip().split()
-            if version == 1.0 and len(tokens) != 8:
-                raise bband_utils.ProcessingError("Invalid SRF version 1 "
-                                                  "file (%s)!" %
-                                                  (srffile))
-            if version == 2.0 and len(tokens) != 10:
-                raise bband_utils.ProcessingError("Invalid SRF version 2 "
-                                                  "file (%s)!" %
-                                                  (srffile))
-            lon.append(float(tokens[0]))
-            lat.append(float(tokens[1]))
-            dep.append(float(tokens[2]))
-            area = float(tokens[5])
-            tinit.append(float(tokens[6]))
-            tokens = srff.readline().strip().split()
-            if len(tokens) != 7:
-                raise bband_utils.ProcessingError("Invalid SRF file (%s)!" %
-                                                  (srffile))
-            rake.append(float(tokens[0]))
-            slip1 = float(tokens[1])
-            slip2 = float(tokens[3])
-            slip3 = float(tokens[5])
-            nt1 = float(tokens[2])
-            nt2 = float(tokens[4])
-            nt3 = float(tokens[6])
-            if nt1 > 0:
-                for k in range(0, int(math.ceil(nt1 / 6.0))):
-                    token = srff.readline()
-                    if token == "":
-                        raise bband_utils.ProcessingError("Invalid SRF "
-                                                          "file (%s)!" %
-                                                          (srffile))
-            if nt2 > 0:
-                for k in range(0, int(math.ceil(nt2 / 6.0))):
-                    token = srff.readline()
-                    if token == "":
-                        raise bband_utils.ProcessingError("Invalid SRF "
-                                                          "file (%s)!" %
-                                                          (srffile))
-            if nt3 > 0:
-                for k in range(0, int(math.ceil(nt3 / 6.0))):
-                    token = srff.readline()
-                    if token == "":
-                        raise bband_utils.ProcessingError("Invalid SRF "
-                                                          "file (%s)!" %
-                                                          (srffile))
-
-            M0 = M0 + (area *
-                       (math.sqrt(slip1**2 + slip2**2 + slip3**2))*3)*(10**11)
-        srff.close()
+        self.f_len = float(srf.plane("len")[0])
+        self.f_width = float(srf.plane("wid")[0])
+        self.f_strike = float(srf.plane("stk")[0])
+        self.f_dip = float(srf.plane("dip")[0])
+        self.f_depth = float(srf.plane("dtop")[0])
+
+        lon = srf.column("lon").tolist()
+        lat = srf.column("lat").tolist()
+        dep = srf.column("dep").tolist()
+        tinit = srf.column("tinit")
+        rake = srf.column("rake")
+        # Running sum, adding the points in file order
+        M0 = np.cumsum(srf.column("area") *
+                       (np.sqrt(srf.column("slip1")**2 +
+                                srf.column("slip2")**2 +
+                                srf.column("slip3")**2)) * 3 *
+                       (10**11))[-1]
 
         np_tinit = np.array(tinit)
         tinit_index = []
@@ -287,124 +213,63 @@ class GeoBBSRF(object):
         matrix is used to shift the coordinates to the new reference
         point calculated in the run function.
         """
-        # Open files
-        infile = open(srf_file, 'r')
-        outfile = open(xyz_srf_file, 'w')
-
-        # Pick up version number from SRF file
-        version = float(infile.readline().strip().split()[0])
-        # Now go back to the start
-        infile.seek(0)
-
-        # Copy lines
-        while True:
-            line = infile.readline()
-            # Cannot mix for line in infile with readline...
-            if line is None:
-                break
-            outfile.write(line)
-            # Until we find the plane line
-            if line.find("PLANE") >= 0:
-                break
-
-        tokens = line.strip().split()
-        # Make sure we have a valid SRF file
-        if len(tokens) != 2:
-            raise bband_utils.ProcessingError("Invalid SRF file (%s)!" %
-                                              (srf_file))
-        planes = int(tokens[1])
+        srf = srf_reader.read_srf(srf_file)
+        planes = srf.planes.shape[0]
         # Make sure we have only 1 plane
         if planes > 1:
             raise bband_utils.ProcessingError("Only one plane is " +
                                               "supported!" +
                                               " Found %d " % (planes) +
                                               " in SRF file!")
-        line = infile.readline()
-        tokens = line.strip().split()
-        if len(tokens) != 6:
-            raise bband_utils.ProcessingError("Invalid SRF file (%s)!" %
-                                              (srf_file))
-        # Convert to XYZ
-        lon = float(tokens[0])
-        lat = float(tokens[1])
+
+        # Convert the plane reference point and all points to XYZ
+        lon = np.concatenate((srf.plane("elon"), srf.column("lon")))
+        lat = np.concatenate((srf.plane("elat"), srf.column("lat")))
         [x_cart, y_cart] = self.geo2cart(lon, lat, self.min_lon, self.min_lat)
-        tmp = T3M * np.mat([x_cart, y_cart, 0, 1]).transpose()
-        tokens[0] = str(float(tmp[0]))
-        tokens[1] = str(float(tmp[1]))
+        tmp = T3M * np.mat([x_cart, y_cart,
+                            np.zeros(len(lon)), np.ones(len(lon))])
+        x_xyz = [str(float(value)) for value in tmp[0].A1]
+        y_xyz = [str(float(value)) for value in tmp[1].A1]
+
+        # Number of lines for each point, slip rates have 6 values
+        # per line
+        nts = np.array([srf.column("nt1"), srf.column("nt2"),
+                        srf.column("nt3")])
+        num_lines = (2 + np.ceil(nts / 6.0).sum(axis=0)).astype(int)
+
+        infile = open(srf_file, 'r')
+        lines = infile.readlines()
+        infile.close()
+        outfile = open(xyz_srf_file, 'w')
+
+        # Copy lines until we find the plane line
+        idx = 0
+        while lines[idx].find("PLANE") < 0:
+            idx = idx + 1
+        outfile.writelines(lines[:idx + 1])
+        idx = idx + 1
+        tokens = lines[idx].strip().split()
+        tokens[0] = x_xyz[0]
+        tokens[1] = y_xyz[0]
         outfile.write(" %s\n" % "   ".join(tokens))
 
-        # Continue copying
-        while True:
-            line = infile.readline()
-            # Cannot mix for line in infile with readline...
-            if line is None:
-                break
-            outfile.write(line)
-            if line.find("POINTS") >= 0:
-                break
-        # Figure out how many cells
-        tokens = line.strip().split()
-        if len(tokens) != 2:
-            raise bband_utils.ProcessingError("Invalid SRF file (%s)!" %
-                                              (srf_file))
-        n_cels = int(tokens[1])
+        # Continue copying until the POINTS line
+        start = idx + 1
+        while lines[idx].find("POINTS") < 0:
+            idx = idx + 1
+        outfile.writelines(lines[start:idx + 1])
+        idx = idx + 1
 
         # Go through each cell
-        for i in range(0, n_cels):
-            tokens = infile.readline().strip().split()
-            if version == 1.0 and len(tokens) != 8:
-                raise bband_utils.ProcessingError("Invalid SRF version 1 "
-                                                  "file (%s)!" %
-                                                  (srffile))
-            if version == 2.0 and len(tokens) != 10:
-                raise bband_utils.ProcessingError("Invalid SRF version 2 "
-                                                  "file (%s)!" %
-                                                  (srffile))
-            lon = float(tokens[0])
-            lat = float(tokens[1])
-            [x_cart, y_cart] = self.geo2cart(lon, lat,
-                                             self.min_lon, self.min_lat)
-            tmp = T3M * np.mat([x_cart, y_cart, 0, 1]).transpose()
-            tokens[0] = str(float(tmp[0]))
-            tokens[1] = str(float(tmp[1]))
+        for point in range(srf.num_points()):
+            tokens = lines[idx].strip().split()
+            tokens[0] = x_xyz[point + 1]
+            tokens[1] = y_xyz[point + 1]
             outfile.write(" %s\n" % "   ".join(tokens))
-            line = infile.readline()
-            tokens = line.strip().split()
-            if len(tokens) != 7:
-                raise bband_utils.ProcessingError("Invalid SRF file (%s)!" %
-                                                  (srf_file))
-            nt1 = float(tokens[2])
-            nt2 = float(tokens[4])
-            nt3 = float(tokens[6])
-            # Write line
-            outfile.write(line)
-            if nt1 > 0:
-                for k in range(0, int(math.ceil(nt1 / 6.0))):
-                    token = infile.readline()
-                    if token == "":
-                        raise bband_utils.ProcessingError("Invalid SRF "
-                                                          "file (%s)!" %
-                                                          (srf_file))
-                    outfile.write(token)
-            if nt2 > 0:
-                for k in range(0, int(math.ceil(nt2 / 6.0))):
-                    token = infile.readline()
-                    if token == "":
-                        raise bband_utils.ProcessingError("Invalid SRF "
-                                                          "file (%s)!" %
-                                                          (srf_file))
-                    outfile.write(token)
-            if nt3 > 0:
-                for k in range(0, int(math.ceil(nt3 / 6.0))):
-                    token = infile.readline()
-                    if token == "":
-                        raise bband_utils.ProcessingError("Invalid SRF "
-                                                          "file (%s)!" %
-                                                          (srf_file))
-                    outfile.write(token)
-
-        # All done, close input and output files
-        infile.close()
+            outfile.writelines(lines[idx + 1:idx + num_lines[point]])
+            idx = idx + num_lines[point]
+
+        # All done, close output file
         outfile.close()
 
     def run(self, slo, coord_out_file, fault_out_file, flag,
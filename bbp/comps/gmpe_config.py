@@ -68,6 +68,38 @@ def calculate_gmpe(model_group, model_name, Mw, Rjb, Vs30, period, **kw):
     # Return median
     return median
 
+def calculate_gmpe_batch(model_group, Mw, Rjb, Vs30, periods=None, **kw):
+    """
+    Batch version of calculate_gmpe, evaluating all models in
+    model_group for all stations and periods at once. Rjb, Vs30 and
+    the Rrup and Rx keywords have one value per station. Returns the
+    median and sigma (total standard deviation) arrays, both in g
+    and with shape (stations, periods, models). Sigma is not
+    available for the CENA GROUP 1 models and is set to NaN
+    """
+    gmpe_group = GMPES[model_group]
+    func = gmpe_group['func']
+    if periods is None:
+        periods = gmpe_group['periods']
+    models = gmpe_group['models']
+
+    medians = numpy.empty((len(Rjb), len(periods), len(models)))
+    sigmas = numpy.empty((len(Rjb), len(periods), len(models)))
+    for model_idx, model_name in enumerate(models):
+        # CENA GROUP 1 needs Rrup
+        if model_group == "CENA GROUP 1":
+            medians[:, :, model_idx] = pynga.CENA1_batch(model_name, Mw,
+                                                         Rjb, kw['Rrup'],
+                                                         periods)
+            sigmas[:, :, model_idx] = numpy.nan
+        else:
+            median, sigma, _, _ = pynga.NGA_batch(func, model_name, Mw,
+                                                  Rjb, Vs30, periods, **kw)
+            medians[:, :, model_idx] = median
+            sigmas[:, :, model_idx] = sigma
+
+    return medians, sigmas
+
 def average_gmpe(station, a_src_gmpe_file, a_avg_out_file):
     """
     This function reads the input gmpe file and averages all gmpes
@@ -290,11 +290,21 @@ class InstallCfg(object):
         # Keep track of starting time
         self.start_time = None
 
+        # Number of processes used for per-station processing
+        self.num_jobs = 1
+
     def set_start_time(self):
         """
         This function sets the simulation start time
         """
         self.start_time = time.localtime()
 
+    def set_num_jobs(self, num_jobs):
+        """
+        This function sets the number of processes modules can use
+        for processing stations in parallel
+        """
+        self.num_jobs = max(1, num_jobs)
+
 if __name__ == "__main__":
     print("Test Config Class: %s" % (__file__))
@@ -51,24 +51,30 @@ class LFSeismograms(object):
                 print("Copying for site %s" % (stat.scode))
                 # Need to eliminate negative times
                 fp_in = open("%s/%s-lf.bbp" % (self.seis_dir, stat.scode), 'r')
-                fp_out = open("%s/%d.%s-lf.bbp" %
-                              (a_tmpdir, sim_id, stat.scode), 'w')
-                for line in fp_in:
+                lines = fp_in.readlines()
+                fp_in.close()
+                out_lines = []
+                for idx, line in enumerate(lines):
                     pieces = line.split()
                     try:
                         if pieces[0] == '#' or pieces[0] == '%':
-                            fp_out.write(line)
+                            out_lines.append(line)
                         elif float(pieces[0]) < -0.0001:
                             continue
                         elif float(pieces[0]) < 0.0001:
-                            fp_out.write("0.0\t%s\t%s\t%s\n" % (pieces[1],
-                                                                pieces[2],
-                                                                pieces[3]))
+                            out_lines.append("0.0\t%s\t%s\t%s\n" %
+                                             (pieces[1], pieces[2],
+                                              pieces[3]))
                         else:
-                            fp_out.write(line)
+                            # Times only increase from here on, so
+                            # the rest of the file is copied as is
+                            out_lines.extend(lines[idx:])
+                            break
                     except ValueError:
-                        fp_out.write(line)
-                fp_in.close()
+                        out_lines.append(line)
+                fp_out = open("%s/%d.%s-lf.bbp" %
+                              (a_tmpdir, sim_id, stat.scode), 'w')
+                fp_out.write("".join(out_lines))
                 fp_out.flush()
                 fp_out.close()
             else:
@@ -13,40 +13,60 @@ import os
 import shutil
 
 # Import Broadband modules
-from genslip import Genslip
-from ucrmg import UCrmg
-from jbsim import Jbsim
-from lf_seismograms import LFSeismograms
-from hfsims import Hfsims
-from syn1D import Syn1D
-from uc_stitch import UCStitch
-from bbtoolbox import BBToolbox
-from uc_site import UCSite
-from wcc_siteamp import WccSiteamp
-from rotd50 import RotD50
-from fas import FAS
-from obs_seismograms import ObsSeismograms
-from copy_seismograms import CopySeismograms
-from gen_plots import GenPlots
-from gp_gof import GPGof
-from sdsu_mogof import SDSUMOGoF
-from gmpe_plot import GMPEPlot
-from gmpe_comparison import GMPEComparison
-from calculate_gmpe import CalculateGMPE
-from match import Match
-from plot_seis import PlotSeis
-from plot_map import Plot_Map
-from genhtml import GenHTML
-from exsim import ExSim
-from csm import CSM
-from rmg import RMG
-from as16 import AS16
-from rzz2015 import RZZ2015
-from rzz2015_gmpe import RZZ2015GMPE
-from rotd100 import RotD100
-from anderson_gof import AndersonGOF
-from irikura import Irikura
-from uwsr import uwsr
+import bband_utils
+
+# Maps the class name used in workflows to the Broadband module that
+# implements it. Modules are only imported when a workflow instantiates
+# them, so short runs do not pay for matplotlib, scipy, or pynga unless
+# they need them
+COMPONENTS = {
+    "Genslip": "genslip",
+    "UCrmg": "ucrmg",
+    "Jbsim": "jbsim",
+    "LFSeismograms": "lf_seismograms",
+    "Hfsims": "hfsims",
+    "Syn1D": "syn1D",
+    "UCStitch": "uc_stitch",
+    "BBToolbox": "bbtoolbox",
+    "UCSite": "uc_site",
+    "WccSiteamp": "wcc_siteamp",
+    "RotD50": "rotd50",
+    "FAS": "fas",
+    "ObsSeismograms": "obs_seismograms",
+    "CopySeismograms": "copy_seismograms",
+    "GenPlots": "gen_plots",
+    "GPGof": "gp_gof",
+    "SDSUMOGoF": "sdsu_mogof",
+    "GMPEPlot": "gmpe_plot",
+    "GMPEComparison": "gmpe_comparison",
+    "CalculateGMPE": "calculate_gmpe",
+    "Match": "match",
+    "PlotSeis": "plot_seis",
+    "Plot_Map": "plot_map",
+    "GenHTML": "genhtml",
+    "ExSim": "exsim",
+    "CSM": "csm",
+    "RMG": "rmg",
+    "AS16": "as16",
+    "RZZ2015": "rzz2015",
+    "RZZ2015GMPE": "rzz2015_gmpe",
+    "RotD100": "rotd100",
+    "AndersonGOF": "anderson_gof",
+    "Irikura": "irikura",
+    "uwsr": "uwsr",
+}
+
+def get_component_class(name):
+    """
+    Returns the class implementing Broadband module name, importing
+    its Python module on first use
+    """
+    if name not in COMPONENTS:
+        raise bband_utils.ParameterError("Unknown Broadband module: %s" %
+                                         (name))
+    # __import__ caches the module in sys.modules after the first call
+    component = __import__(COMPONENTS[name])
+    return getattr(component, name)
 
 class Module(object):
     def __init__(self):
@@ -117,4 +137,5 @@ class Module(object):
         self.kw_args['sim_id'] = sim_id
         #kwargs = {"simID" : sim_id}
         #return globals()[self.module_name](*self.module_args, simID=my_simID)
-        return globals()[self.module_name](*self.module_args, **self.kw_args)
+        component_class = get_component_class(self.module_name)
+        return component_class(*self.module_args, **self.kw_args)
@@ -211,6 +211,12 @@ class ObsSeismograms(object):
                                                  "observed seismograms "
                                                  "not supported")
 
+            # Keep a binary copy of the seismogram for the
+            # validation modules
+            bbp_formatter.bbp2store(os.path.join(a_tmpdir_seis, r_bbp_file),
+                                    os.path.join(a_tmpdir_seis,
+                                                 bbp_formatter.OBS_SEIS_STORE))
+
             # Run RotD50 on this file
             if corr_psa is not None:
                 # First calculate rd50 and psa5 files
@@ -16,6 +16,7 @@ import math
 # Import Broadband modules
 import bband_utils
 import fault_utils
+import srf_reader
 from station_list import StationList
 from install_cfg import InstallCfg
 import simplekml
@@ -41,23 +42,14 @@ def write_fault_trace(srf_file, out_file):
     """
     This function reads the srf file and outputs a trace file
     """
-    points = []
-    shallowest = 100.0
-
-    # Read srf_file
-    srf_data = open(srf_file, 'r')
-    for line in srf_data:
-        pieces = line.split()
-        if len(pieces) == 8:
-            depth = float(pieces[2])
-            if depth == shallowest:
-                points.append([float(pieces[0]), float(pieces[1])])
-            elif depth < shallowest:
-                shallowest = depth
-                del points[:]
-                points.append([float(pieces[0]), float(pieces[1])])
-    # Done reading, close file
-    srf_data.close()
+    srf = srf_reader.read_srf(srf_file)
+    depths = srf.column("dep").tolist()
+    # Trace is given by the shallowest points, in file order
+    shallowest = min([100.0] + depths)
+    points = [[lon, lat] for lon, lat, depth
+              in zip(srf.column("lon").tolist(),
+                     srf.column("lat").tolist(), depths)
+              if depth == shallowest]
 
     # Now, open output file, and write the data
     trace_file = open(out_file, 'w')
@@ -283,7 +275,8 @@ class Plot_Map(object):
         plotter.plot(plottitle, plotregion, topo,
                      coastal, border, trace_file,
                      simple_station_file, map_prefix,
-                     hypo_lat=hypo_lat, hypo_lon=hypo_lon)
+                     hypo_lat=hypo_lat, hypo_lon=hypo_lon,
+                     topo_cache_dir=PlotMap.topo_cache_dir())
 
         print("Plot MAP Completed".center(80, '-'))
 
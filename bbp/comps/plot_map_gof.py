@@ -179,7 +179,8 @@ def create_map_gof(all_sta_x_data, all_sta_y_data, all_sta_resid_data,
                  (comp_label, sim_id))
 
     # Read in topo data
-    topo_points = PlotMap.read_topo(topo, plotregion)
+    topo_points = PlotMap.read_topo(topo, plotregion,
+                                    cache_dir=PlotMap.topo_cache_dir())
 
     # Read in fault data
     fault_x, fault_y = PlotMap.read_fault(fault)
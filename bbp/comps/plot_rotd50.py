@@ -15,8 +15,9 @@ import matplotlib as mpl
 mpl.use('AGG', warn=False)
 import pylab
 
-# Import plot config file
+# Import Broadband modules
 import plot_config
+import seis_cache
 
 def plot_rd50(stat, rotd50_file1, rotd50_file2, label1, label2,
               outfile, lfreq=None, hfreq=None, quiet=False):
@@ -37,16 +38,11 @@ def plot_rd50(stat, rotd50_file1, rotd50_file2, label1, label2,
     pseudo_aa_ew2 = []
     rd50_aa2 = []
 
-    rd50file1 = open(rotd50_file1, 'r')
-    for line in rd50file1:
-        if line.startswith("#") or line.startswith("%"):
-            continue
-        pieces = line.split()
-        periods1.append(float(pieces[0]))
-        pseudo_aa_ns1.append(float(pieces[1]))
-        pseudo_aa_ew1.append(float(pieces[2]))
-        rd50_aa1.append(float(pieces[3]))
-    rd50file1.close()
+    rd50_data = seis_cache.read_columns(rotd50_file1)
+    if rd50_data.size:
+        (periods1, pseudo_aa_ns1,
+         pseudo_aa_ew1, rd50_aa1) = [column.tolist() for column
+                                      in rd50_data[:4]]
 
     if periods1 == []:
         print("Input file %s is missing data! Aborting..." %
@@ -54,16 +50,11 @@ def plot_rd50(stat, rotd50_file1, rotd50_file2, label1, label2,
         sys.exit(1)
 
     if rotd50_file2 != "-":
-        rd50file2 = open(rotd50_file2, 'r')
-        for line in rd50file2:
-            if line.startswith("#") or line.startswith("%"):
-                continue
-            pieces = line.split()
-            periods2.append(float(pieces[0]))
-            pseudo_aa_ns2.append(float(pieces[1]))
-            pseudo_aa_ew2.append(float(pieces[2]))
-            rd50_aa2.append(float(pieces[3]))
-        rd50file2.close()
+        rd50_data = seis_cache.read_columns(rotd50_file2)
+        if rd50_data.size:
+            (periods2, pseudo_aa_ns2,
+             pseudo_aa_ew2, rd50_aa2) = [column.tolist() for column
+                                          in rd50_data[:4]]
 
         if periods2 == []:
             print("Input file %s is missing data! Aborting..." %
@@ -14,8 +14,9 @@ import matplotlib as mpl
 mpl.use("AGG", warn=False)
 import pylab
 
-# Import plot config file
+# Import Broadband modules
 import plot_config
+import seis_cache
 
 # S-wave velocity in km/s
 S_VELOCITY = 4
@@ -122,32 +123,13 @@ def read_seismogram_file(filename):
     This function reads a seismogram and returns 4 lists with the
     horizontal components (ns and ew), vertical, and the timestamps
     """
-    # Start empty
-    ts = []
-    ns = []
-    ew = []
-    ver = []
-
-    # Read file
-    seis_file = open(filename, 'r')
-    for line in seis_file:
-        # Remove leading spaces
-        line = line.strip()
-        # Skip comments
-        if line.startswith('#') or line.startswith('%'):
-            continue
-        tmp = line.split()
-        if len(tmp) < 4:
-            print("Error reading seismogram in file %s" % (filename))
-            sys.exit(1)
-        ts.append(float(tmp[0]))
-        ns.append(float(tmp[1]))
-        ew.append(float(tmp[2]))
-        ver.append(float(tmp[3]))
-    # Close file
-    seis_file.close()
+    data = seis_cache.read_columns(filename)
+    if data.shape[0] < 4:
+        print("Error reading seismogram in file %s" % (filename))
+        sys.exit(1)
     # All done
-    return (ts, ns, ew, ver)
+    return (data[0].tolist(), data[1].tolist(),
+            data[2].tolist(), data[3].tolist())
 
 def plot_overlay(stat, obs_filename, comp_filename, obs_label, comp_label,
                  outfile, y_label="Velocity (cm/s)",
@@ -24,6 +24,7 @@ with warnings.catch_warnings():
 
 # Import Broadband modules
 import bband_utils
+import srf_reader
 from install_cfg import InstallCfg
 
 # Import plot config file
@@ -55,37 +56,23 @@ def get_srf_params(srf_file):
     """
     Reads fault_len, width, dlen, and dwid from the srd file
     """
-    srf_params1 = None
-    srf_params2 = None
-    srf = open(srf_file, 'r')
-    for line in srf:
-        if line.startswith("PLANE"):
-            # Found the plane line, the next one should have what we need
-            srf_params1 = srf.next()
-            srf_params2 = srf.next()
-            break
-    srf.close()
-    if srf_params1 is None or srf_params2 is None:
+    try:
+        _, planes = srf_reader.read_srf_header(srf_file)
+    except bband_utils.ProcessingError:
+        planes = []
+    if len(planes) < 1:
         print("Cannot determine parameters from SRF file %s" %
               (srf_file))
         sys.exit(1)
-    srf_params1 = srf_params1.strip()
-    srf_params1 = srf_params1.split()
-    srf_params2 = srf_params2.strip()
-    srf_params2 = srf_params2.split()
-    # Make sure we have the correct number of pieces
-    if len(srf_params1) != 6 or len(srf_params2) != 5:
-        print("Cannot parse params from SRF file %s" %
-              (srf_file))
-        sys.exit(1)
+    plane = dict(zip(srf_reader.PLANE_COLUMNS, planes[0]))
 
     # Pick the parameters that we need
     params = {}
-    params["dim_len"] = int(srf_params1[2])
-    params["dim_wid"] = int(srf_params1[3])
-    params["fault_len"] = float(srf_params1[4])
-    params["fault_width"] = float(srf_params1[5])
-    params["azimuth"] = int(float(srf_params2[0]))
+    params["dim_len"] = int(plane["nstk"])
+    params["dim_wid"] = int(plane["ndip"])
+    params["fault_len"] = float(plane["len"])
+    params["fault_width"] = float(plane["wid"])
+    params["azimuth"] = int(plane["stk"])
 
     return params
 
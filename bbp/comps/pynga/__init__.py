@@ -38,6 +38,21 @@ TsDict = {
 	      0.30, 0.40, 0.50, 0.75, 1.0, 1.5, 2.0, 3.0, 4.0, 5.0, 7.5, 10.0,-1,-2],    
 	}
 
+# Model instances, shared between calls so the coefficient tables
+# are only read once
+MODELS = {}
+
+def get_model(model_class, shared=True):
+    """
+    Returns the shared instance of model_class, or a new one if
+    shared is False
+    """
+    if not shared:
+        return model_class()
+    if model_class not in MODELS:
+        MODELS[model_class] = model_class()
+    return MODELS[model_class]
+
 # ============================================
 # Integrated function for CENA GROUP 1 models 
 # ============================================
@@ -46,13 +61,13 @@ def CENA1(model_name, Mw, Rjb, Rrup, period):
     Combined function to calculate CENA1 models
     """
     if model_name == "PZT11":
-        model = PZT11.PZT11()
+        model = get_model(PZT11.PZT11)
         dist = Rrup
     elif model_name == "A0811E":
-        model = A0811E.A0811E()
+        model = get_model(A0811E.A0811E)
         dist = Rjb
     elif model_name == "S03SCVS":
-        model = S03SCVS.S03SCVS()
+        model = get_model(S03SCVS.S03SCVS)
         dist = Rjb
     else:
         print "Invalid CENA1 model_name"
@@ -171,6 +186,9 @@ def NGA08(model_name, Mw, Rjb, Vs30, period, epislon=0, NGAs=None, \
 
     """
     
+    # Model instances can only be shared when using the default
+    # coefficients, as NewCoefs updates them in place
+    shared = NGAs == None
     if NGAs == None:
 	NGAs={'CB':{'NewCoefs':None,'terms':(1,1,1,1,1,1)},\
 	      'BA':{'NewCoefs':None,'terms':(1,1,1)},\
@@ -189,16 +207,16 @@ def NGA08(model_name, Mw, Rjb, Vs30, period, epislon=0, NGAs=None, \
 	raise ValueError
 
     if model_name == 'BA':
-	ngaM = BA08.BA08_nga()
+	ngaM = get_model(BA08.BA08_nga, shared)
 	kwds = {'Mech':Mech,'Ftype':Ftype,'AB11':AB11, 'CoefTerms':dict1[model_name]}   # OpenSHA doesn't have this
     if model_name == 'CB':
-	ngaM = CB08.CB08_nga()
+	ngaM = get_model(CB08.CB08_nga, shared)
 	kwds = {'Ftype':Ftype,'Rrup':Rrup,'Ztor':Ztor,'dip':dip,'Z25':Z25,'W':W,'Zhypo':Zhypo,'azimuth':azimuth,'Fhw':Fhw,'Z10':Z10,'Z15':Z15,'Arb':ArbCB,'CoefTerms':dict1[model_name]}
     if model_name == 'CY':
-	ngaM = CY08.CY08_nga()
+	ngaM = get_model(CY08.CY08_nga, shared)
 	kwds = {'Ftype':Ftype,'Rrup':Rrup,'Rx':Rx,'Ztor':Ztor,'dip':dip,'W':W,'Zhypo':Zhypo,'azimuth':azimuth,'Fhw':Fhw,'Z10':Z10,'AS':Fas,'VsFlag':VsFlag,'CoefTerms':dict1[model_name]}
     if model_name == 'AS':                                                                                                                
-	ngaM = AS08.AS08_nga()
+	ngaM = get_model(AS08.AS08_nga, shared)
 	kwds = {'Ftype':Ftype,'Rrup':Rrup,'Rx':Rx,'Ztor':Ztor,'dip':dip,'W':W,'Zhypo':Zhypo,'azimuth':azimuth,'Fhw':Fhw,'Z10':Z10,'Fas':Fas,'VsFlag':VsFlag, 'CoefTerms':dict1[model_name]}
 	
     # Common interpolation and calculation for all models
@@ -335,6 +353,9 @@ def NGA14(model_name, Mw, Rjb, Vs30, period, epislon=0, NGAs=None, \
           CRjb=15, Ry0=None, \
           D_DPP=0 ):
 
+    # Model instances can only be shared when using the default
+    # coefficients, as NewCoefs updates them in place
+    shared = NGAs == None
     if NGAs == None:
 	NGAs={'CB':{'NewCoefs':None,'terms':(1,1,1,1,1,1,1,1,1)},\
 	      'BSSA':{'NewCoefs':None,'terms':(1,1,1)},\
@@ -354,22 +375,22 @@ def NGA14(model_name, Mw, Rjb, Vs30, period, epislon=0, NGAs=None, \
 	raise ValueError
 
     if model_name == 'BSSA':
-	ngaM = BSSA14.BSSA14_nga()
+	ngaM = get_model(BSSA14.BSSA14_nga, shared)
         kwds = {'Mech':Mech,'Ftype':Ftype,'Z10':Z10,'Dregion':Dregion,'country':country,'CoefTerms':dict1[model_name]}
 
     if model_name == 'CB':
-	ngaM = CB14.CB14_nga()
+	ngaM = get_model(CB14.CB14_nga, shared)
         kwds = {'Ftype':Ftype,'Rrup':Rrup,'Ztor':Ztor,'dip':dip,'Z25':Z25,'W':W,'Zhypo':Zhypo,'azimuth':azimuth,'Fhw':Fhw,'Z10':Z10,'Z15':Z15,'Arb':ArbCB,'SJ':SJ,'region':region,'CoefTerms':dict1[model_name]}
 
     if model_name == 'CY':
-	ngaM = CY14.CY14_nga()
+	ngaM = get_model(CY14.CY14_nga, shared)
         kwds = {'Ftype':Ftype,'Rrup':Rrup,'Rx':Rx,'Ztor':Ztor,'dip':dip,'W':W,'Zhypo':Zhypo,'azimuth':azimuth,'Fhw':Fhw,'Z10':Z10,'AS':Fas,'VsFlag':VsFlag,'country':country,'D_DPP':D_DPP,'CoefTerms':dict1[model_name]}
 	# the new CY model treat PGA = SA(0.01)
 	if period == -1: 
 	    period = 0.01 
 
     if model_name == 'ASK':                                                                                                                
-	ngaM = ASK14.ASK14_nga()
+	ngaM = get_model(ASK14.ASK14_nga, shared)
         kwds = {'Ftype':Ftype,'Rrup':Rrup,'Rx':Rx,'Ztor':Ztor,'dip':dip,'W':W,'Zhypo':Zhypo,'azimuth':azimuth,'Fhw':Fhw,'Z10':Z10,'Fas':Fas,'CRjb':CRjb,'Ry0':Ry0,'region':region,'country':country,'VsFlag':VsFlag, 'CoefTerms':dict1[model_name]}
 
     # common interpolate for all models
@@ -419,6 +440,68 @@ def NGA14(model_name, Mw, Rjb, Vs30, period, epislon=0, NGAs=None, \
     return NGAmedian, np.exp( NGAsigmaT ), np.exp( NGAtau ), np.exp( NGAsigma )      # all in g, include the standard deviation
 
 
+# ============================================
+# Batch evaluation of the NGA models
+# ============================================
+NGA_MODELS = {NGA08: {'BA': BA08.BA08_nga, 'CB': CB08.CB08_nga,
+                      'CY': CY08.CY08_nga, 'AS': AS08.AS08_nga},
+              NGA14: {'BSSA': BSSA14.BSSA14_nga, 'CB': CB14.CB14_nga,
+                      'CY': CY14.CY14_nga, 'ASK': ASK14.ASK14_nga}}
+
+def NGA_batch(nga_func, model_name, Mw, Rjb, Vs30, periods, **kwds):
+    """
+    Evaluates NGA08 or NGA14 (nga_func) for all sites and periods at
+    once. Rjb, Vs30 and any site dependent keyword (Rrup, Rx, ...)
+    are lists with one value per site. Each model period needed is
+    evaluated once for all sites, periods outside the model period
+    list are then interpolated with arrays, same as nga_func does.
+
+    Returns the median, sigmaT, tau and sigma arrays (in g), all with
+    shape (sites, periods)
+    """
+    model_periods = np.array(get_model(NGA_MODELS[nga_func][model_name]).periods)
+    # Values at the model periods, computed once for all sites
+    model_values = {}
+
+    def values_at(period):
+        if period not in model_values:
+            model_values[period] = np.array(nga_func(model_name, Mw, Rjb,
+                                                     Vs30, period, **kwds))
+        return model_values[period]
+
+    NS = len(Rjb)
+    NT = len(periods)
+    values = np.zeros((4, NS, NT))
+    for ip in xrange( NT ):
+        period = periods[ip]
+        if (abs(model_periods - period) < 0.0001).any():
+            values[:, :, ip] = values_at(period)
+            continue
+        # Interpolate ln values between the closest model periods
+        period_low = max(model_periods[model_periods < period])
+        period_high = min(model_periods[model_periods > period])
+        values[:, :, ip] = np.exp(logline(np.log(period_low),
+                                          np.log(period_high),
+                                          np.log(values_at(period_low)),
+                                          np.log(values_at(period_high)),
+                                          np.log(period)))
+
+    return values[0], values[1], values[2], values[3]
+
+def CENA1_batch(model_name, Mw, Rjb, Rrup, periods):
+    """
+    Evaluates the CENA1 model for all sites (Rjb and Rrup lists) and
+    periods, returns the median array with shape (sites, periods)
+    """
+    NS = len(Rjb)
+    NT = len(periods)
+    medians = np.zeros((NS, NT))
+    for isite in xrange( NS ):
+        for ip in xrange( NT ):
+            medians[isite, ip] = CENA1(model_name, Mw, Rjb[isite],
+                                       Rrup[isite], periods[ip])
+    return medians
+
 def BSSA14_validation(infile, outfile, iset):
     # read in files (mainly parameters for run using pynga) 
     hdrs = open(infile,'r').readlines()[3].strip().split()
@@ -1474,51 +1474,27 @@ def srfFaultSurfaceExtract(SRFfile):
     Following the Graves' SRF convention used in BBP and CyberShake
     """ 
 
-    lines = open( SRFfile, 'r' ).readlines()
-    Nseg = int(lines[1].strip().split()[1]) 
+    # SRF parsing is shared with the other Broadband modules
+    import srf_reader
+    srf = srf_reader.read_srf( SRFfile )
+    Nseg = srf.planes.shape[0]
     
-    # loop over segments to get (Nrow,Ncol) of each segments
-    # fault surface for each segment will be read latter
+    # (Nrow,Ncol) of each segments
     srfFaultSurface = {}
     srfFaultSurface['segments'] = {}
     
-    dims = []
-    dips = []
-    ztors = [] 
-    for iseg in xrange( Nseg ):
-	il0 = 2*iseg + 2  # fault geometry info
-	spl = lines[il0].strip().split()
-	lon0, lat0, L, W, Ncol, Nrow = np.array( spl, 'f' )
-	Ncol, Nrow = int(Ncol), int(Nrow) 
-	dims.append( [Ncol,Nrow] ) 
-
-	il1 = il0 + 1     # focal mechanism and hypocenter info 
-	spl = lines[il1].strip().split()
-	strike, dip, ztor, hypoAS, hypoDD = np.array(spl,'f')
-	dips.append(dip)    # will be used to get the average dip angle (over segments)
-	ztors.append(ztor) 
+    Ncols = srf.plane('nstk').astype('i')
+    Nrows = srf.plane('ndip').astype('i')
+    dims = [[Ncol, Nrow] for Ncol, Nrow in zip( Ncols.tolist(), Nrows.tolist() )]
+    dips = list( srf.plane('dip').astype('f') )    # will be used to get the average dip angle (over segments)
+    ztors = list( srf.plane('dtop').astype('f') )
     
     srfFaultSurface['segments']['dims'] = dims
     srfFaultSurface['segments']['dips'] = dips
     srfFaultSurface['segments']['ztors'] = ztors
 
-    il0 = 2*(Nseg+1) 
-    Npoints = int(lines[il0].strip().split()[1])
-
-    il0 = il0 + 1   # jump to the data block (for each segments, there are a data block)
-    
-    locs = []; rakes = []
-    while il0 < len(lines):
-	spl = lines[il0].strip().split()
-	lon, lat, dep, strike, dip, Area, Tinit, dt = np.array( spl, 'f' )
-	locs.append(  [lon,lat,dep] ) 
-
-	il0 = il0 + 1
-	spl = lines[il0].strip().split()
-	rake, slipA_AlongRake, Nt = np.array( spl[:3], 'f' )
-	rakes.append( rake ) # will be used to get average rake (over points)
-	dl = int(Nt/6) + (Nt%6!=0)*1
-	il0 = il0 + dl + 1   # import (similar to the segments jump) ...
+    locs = np.array( [srf.column('lon'), srf.column('lat'), srf.column('dep')], 'f' ).T
+    rakes = list( srf.column('rake').astype('f') )   # will be used to get average rake (over points)
     
     Nrow1 = 0; Ncol1 = 0 
     for iseg in xrange( Nseg ): 
@@ -1823,6 +1799,261 @@ def DistanceToEvenlyGriddedSurface(SiteGeo, FaultGeo, Fast = True, RrupCalc=True
     return Rjb, Rrup, Rx 
 
 
+# ==========================================
+# Vectorized distances for lists of sites
+# ==========================================
+# The functions below compute the same quantities as the single-site
+# functions above (flat-earth approximation, Fast=True) for N sites at
+# once. SiteGeoms is an (N,2) or (N,3) array-like of lon/lat[/dep], all
+# fault geometry is computed only once.
+def CheckPointsInPolygon(points, verts):
+    """
+    Vectorized version of CheckPointInPolygon
+    inputs:
+	points: test points, (N,2) or (N,3) array, only x and y are used
+	verts: points that define the polygon shape
+    return: boolean array with N elements
+    """
+    points = np.asarray( points, dtype=float )
+    verts = np.array( verts, dtype=float )
+    testx = points[:,0]
+    testy = points[:,1]
+    vertx = verts[:,0]
+    verty = verts[:,1]
+    nvert = len(vertx)
+    check = np.zeros( len(testx), dtype=bool )
+    j = nvert - 1
+    for i in xrange( nvert ):
+	c1 = verty[i]>testy
+	c2 = verty[j]>testy
+	with np.errstate(divide='ignore', invalid='ignore'):
+	    factor = (vertx[j]-vertx[i])*(testy-verty[i])/(verty[j]-verty[i]) + vertx[i]
+	check ^= (c1 != c2) & (testx < factor)
+	j = i    # edge is defined from j to i
+
+    return check
+
+
+def minDistsToLine2D( locs, segs ):
+    """
+    Vectorized version of minDistToLine2D (Fast=True): signed distance
+    between each site in locs and the line (extending infinitely)
+    of the closest segment in segs
+    """
+    locs = np.asarray( locs, dtype=float )
+    lon3 = locs[:,0] * np.pi/180.
+    lat3 = locs[:,1] * np.pi/180.
+    minDist0 = np.ones( len(locs) ) * 1000.
+    minDist = np.zeros( len(locs) ) * np.nan
+    for iseg in range(1,len(segs)):
+	lon1, lat1 = np.array( segs[iseg-1] )[:2] * np.pi/180.
+	lon2, lat2 = np.array( segs[iseg] )[:2] * np.pi/180.
+	lonScale = np.cos( 0.5*lat3 + 0.25*lat1 + 0.25*lat2 )
+	x2 = (lon2-lon1)*lonScale
+	y2 = lat2-lat1
+	x3 = (lon3-lon1)*lonScale
+	y3 = lat3 - lat1
+	dist = (x2*(-y3)-(-x3)*y2)/np.sqrt(x2**2+y2**2) * R
+	update = np.abs( dist ) <= minDist0
+	minDist0 = np.where( update, np.abs(dist), minDist0 )
+	minDist = np.where( update, dist, minDist )
+    return minDist
+
+
+def minDistsToLineSeg2D( locs, segs ):
+    """
+    Vectorized version of minDistToLineSeg2D (Fast=True)
+    """
+    locs = np.asarray( locs, dtype=float )
+    lon3 = locs[:,0] * np.pi/180.
+    lat3 = locs[:,1] * np.pi/180.
+    minDist = np.ones( len(locs) ) * 1000.
+    for iseg in range(1,len(segs)):
+	lon1, lat1 = np.array( segs[iseg-1] )[:2] * np.pi/180.
+	lon2, lat2 = np.array( segs[iseg] )[:2] * np.pi/180.
+	lonScale = np.cos( 0.5*lat3 + 0.25*lat1 + 0.25*lat2 )
+	x2 = (lon2-lon1)*lonScale
+	y2 = lat2-lat1
+	px = (lon3-lon1)*lonScale
+	py = lat3 - lat1
+
+	# same three cases as in ptToLineSeg2D
+	dotprod = px*x2 + py*y2
+	beyond1 = dotprod <= 0.0
+	px = np.where( beyond1, px, x2-px )
+	py = np.where( beyond1, py, y2-py )
+	dotprod = px*x2 + py*y2
+	with np.errstate(divide='ignore', invalid='ignore'):
+	    projLenSq = np.where( beyond1 | (dotprod <= 0.0), 0.0,
+				  dotprod * dotprod / (x2*x2 + y2*y2) )
+	lenSq = np.maximum( px*px + py*py - projLenSq, 0.0 )
+	dist = np.sqrt( lenSq ) * R
+	minDist = np.minimum( dist, minDist )
+    return minDist
+
+
+def sumXYZ( values ):
+    """
+    Sum of the x, y, z components (last axis) of single precision
+    values, accumulated in double precision as the builtin sum does
+    """
+    values = np.asarray( values, dtype=float )
+    return values[...,0] + values[...,1] + values[...,2]
+
+
+def minDistsToLineSeg3D( locs, segs ):
+    """
+    Vectorized version of minDistToLineSeg3D (Rscale=DegToKm), the
+    closest points are computed in single precision as in ptToLineSeg3D
+    """
+    locs = np.asarray( locs, dtype=float )
+    p0 = locs.astype( 'f' )
+    minDist = np.ones( len(locs) ) * 1000.
+    for iseg in range(1,len(segs)):
+	p1 = np.array( segs[iseg-1], 'f' )
+	p2 = np.array( segs[iseg], 'f' )
+	v = p2 - p1
+	w0 = p0 - p1
+	w1 = p0 - p2
+	beyond1 = sumXYZ( w0*v ) <= 0
+	beyond2 = ~beyond1 & (sumXYZ( w1*v ) >= 0)
+
+	# get the projected point on the 3D line
+	n = v/np.float32( np.sqrt( sumXYZ( v*v ) ) )
+	w10 = p1 - p0
+	w10n = sumXYZ( w10*n ).astype( 'f' )[:,None] * n
+	Ploc = w10 - w10n + p0
+	Ploc[beyond1] = p1
+	Ploc[beyond2] = p2
+
+	dist = FlatDistances( locs, Ploc )
+	minDist = np.minimum( dist, minDist )
+    return minDist
+
+
+def FlatDistances( locs1, locs2 ):
+    """
+    Vectorized version of the total distance sqrt(hD**2+vD**2) given by
+    LonLatToAngleDistance (Fast=True) between locs1 and locs2, both are
+    (N,3) arrays
+    """
+    lon1 = locs1[:,0] * np.pi/180.
+    lat1 = locs1[:,1] * np.pi/180.
+    lon2 = locs2[:,0] * np.pi/180.
+    lat2 = locs2[:,1] * np.pi/180.
+    dlat = lat1 - lat2
+    dlon = (lon1 - lon2) * np.cos( (lat1+lat2)/2.0 )
+    hD = R * np.sqrt( dlat**2 + dlon**2 )
+    vD = locs1[:,2] - locs2[:,2]
+    return np.sqrt( hD**2 + vD**2 )
+
+
+def minDistsToSurfSeg( locs, segs ):
+    """
+    Vectorized version of minDistToSurfSeg (Rscale=DegToKm)
+    """
+    locs = np.asarray( locs, dtype=float )
+    u = locs[:,0]; v = locs[:,1]; w = locs[:,2]
+    minDist = np.ones( len(locs) ) * 1000.
+    for points in segs:
+	# projection of the sites on the segment plane (see ptToSurf3D)
+	corners = np.array( points )
+	vn = np.cross(corners[1,:]-corners[0,:], corners[2,:]-corners[0,:])
+	vn = vn / np.sqrt( np.dot(vn,vn) )
+	a = vn[0]; b = vn[1]; c = vn[2]
+	d = -a*corners[0,0]-b*corners[0,1]-c*corners[0,2]
+	L1 = a*u+b*v+c*w+d
+	L2 = a**2+b**2+c**2
+	Ppoints = np.column_stack( (u-a*L1/L2, v-b*L1/L2, w-c*L1/L2) )
+
+	# inside the segment use the projected point, otherwise the
+	# closest point on the segment edges
+	check = CheckPointsInPolygon( Ppoints, corners )
+	dist = FlatDistances( locs, Ppoints )
+	outside = ~check
+	if outside.any():
+	    pointsClosed = list(points) + [points[0]]
+	    dist[outside] = minDistsToLineSeg3D( locs[outside], pointsClosed )
+	minDist = np.minimum( dist, minDist )
+    return minDist
+
+
+def DistancesX( SiteGeoms, FaultTrace1 ):
+    """
+    Vectorized version of DistanceX (AveStrike=None, Fast=True,
+    DealRx='Extension')
+    """
+    SiteGeoms = np.asarray( SiteGeoms, dtype=float )
+    Npoints = len( FaultTrace1 )
+    ps = FaultTrace1[0]
+    pe = FaultTrace1[-1]
+    Radius, hD, vD, dir = LonLatToAngleDistance(ps, pe, CalcRadius=False, CalcDist=True, Fast=True, CalcAzimuth=True, Azimuth0to2PI=True )
+
+    # surface projection of the fault (down-dip extension)
+    vector = [dir+np.pi/2.,1000,0.0]
+    Loc3 = EndLocation( ps, vector )
+    Loc4 = EndLocation( pe, vector )
+    verts = list( FaultTrace1 ) + [Loc4, Loc3]
+    check = CheckPointsInPolygon( SiteGeoms, np.array(verts)[:,:2] )
+
+    # extended fault trace and surface projection
+    vector = [dir, 1000.0, 0.0]
+    Loc2 = EndLocation( pe, vector )
+    vector[0] = dir + np.pi
+    Loc1 = EndLocation( ps, vector )
+    vector[0] = dir + np.pi/2.
+    Loc3 = EndLocation( Loc1, vector )
+    Loc4 = EndLocation( Loc2, vector )
+    segs = [Loc1] + list( FaultTrace1 ) + [Loc2]
+    verts = segs + [Loc4, Loc3]
+    checkExt = CheckPointsInPolygon( SiteGeoms, np.array(verts)[:,:2] )
+
+    distToExtendedTrace = minDistsToLineSeg2D( SiteGeoms, segs )
+    Rx = np.where( checkExt | (distToExtendedTrace == 0.0),
+		   distToExtendedTrace, -distToExtendedTrace )
+    if check.any():
+	# sites within the surface projection of the source (hanging wall)
+	Rx[check] = minDistsToLine2D( SiteGeoms[check], FaultTrace1 )
+    return Rx
+
+
+def DistancesToSimpleFaultSurface(SiteGeoms, FaultTrace1, UpperSeisDepth, LowerSeisDepth, AveDip, RrupCalc=True, RxCalc=True):
+    """
+    Compute Rjb,Rrup,Rx for simple fault plane for a list of sites,
+    same as calling DistanceToSimpleFaultSurface (no grid, Fast=True)
+    for each site
+    SiteGeoms: (N,2) or (N,3) lon/lat[/dep] of the sites
+    FaultTrace1 is just the top fault trace (two or more points)
+    return: Rjb, Rrup, Rx arrays with N elements (None if not computed)
+    """
+    SiteGeoms = np.array( SiteGeoms, dtype=float, ndmin=2 )
+    if SiteGeoms.size == 0:
+	# No sites, ndmin=2 would leave a (1,0) array
+	Rjb = np.zeros(0)
+	Rrup = np.zeros(0) if RrupCalc else None
+	Rx = np.zeros(0) if RxCalc else None
+	return Rjb, Rrup, Rx
+    if SiteGeoms.shape[1] == 2:
+	SiteGeoms = np.column_stack( (SiteGeoms, np.zeros(len(SiteGeoms))) )
+    FaultTrace, FaultSeg, AveStrike = SimpleFaultSurface(FaultTrace1, UpperSeisDepth, LowerSeisDepth, AveDip)
+
+    # Rjb: points to line (or seg)
+    vertsClosed = FaultTrace + [FaultTrace[0]]
+    Rjb = minDistsToLineSeg2D( SiteGeoms, vertsClosed )
+    Rjb[CheckPointsInPolygon( SiteGeoms, FaultTrace )] = 0.0
+
+    if RrupCalc:
+	Rrup = minDistsToSurfSeg( SiteGeoms, FaultSeg )
+    else:
+	Rrup = None
+
+    if RxCalc:
+	Rx = DistancesX( SiteGeoms, FaultTrace1 )
+    else:
+	Rx = None
+
+    return Rjb, Rrup, Rx
+
 
 
 # ==========================
@@ -0,0 +1,449 @@
+#!/usr/bin/env python
+"""
+Southern California Earthquake Center Broadband Platform
+Copyright 2010-2017 Southern California Earthquake Center
+
+Columnar store for the RotD50 results of a multi-realization run. Each
+realization's rd50 files are parsed once and appended to a single
+array (realization x station x period x component), so combining a
+growing ensemble only reads the realizations added or changed since
+the last time. The combined residuals and their bias, sigma and 90%
+confidence limits are computed from the store with array reductions,
+producing the same tables and statistics files as the
+gen_resid_tbl_3comp and resid2uncer_varN programs
+"""
+from __future__ import division, print_function
+
+# Import Python modules
+import os
+import glob
+import json
+import numpy
+
+# Import Broadband modules
+import bband_utils
+
+# Change this when the layout of the store changes
+RD50_STORE_VERSION = 2
+# Data is kept as raw float64 values, one block per realization
+RD50_DTYPE = numpy.float64
+
+# Component labels used in the residual tables
+RESID_COMPS = ["psa5n", "psa5e", "rotd50"]
+# Columns before the residuals in the residual tables
+RESID_HEADER = ["EQ", "Mag", "stat", "lon", "lat", "stat_seq_no", "Vs30",
+                "close_dist", "Xcos", "Ycos", "T_min", "T_max", "comp"]
+# Residual used when the simulated value is zero
+RESID_NO_SIM = -99.0
+
+# One-sided 95% t values for 1 to 55 degrees of freedom, as used by
+# resid2uncer_varN for the 90% confidence limits
+T95 = [6.3138, 2.9200, 2.3534, 2.1318, 2.0150, 1.9432, 1.8946,
+       1.8595, 1.8331, 1.8125, 1.7959, 1.7823, 1.7709, 1.7613,
+       1.7531, 1.7459, 1.7396, 1.7341, 1.7291, 1.7247, 1.7207,
+       1.7171, 1.7139, 1.7109, 1.7081, 1.7056, 1.7033, 1.7011,
+       1.6991, 1.6973, 1.6955, 1.6939, 1.6924, 1.6909, 1.6896,
+       1.6883, 1.6871, 1.6860, 1.6849, 1.6839, 1.6829, 1.6820,
+       1.6811, 1.6802, 1.6794, 1.6787, 1.6779, 1.6772, 1.6766,
+       1.6759, 1.6753, 1.6747, 1.6741, 1.6736, 1.6730]
+
+class RD50Store(object):
+    """
+    Keeps the rd50 data of all realizations of a simulation in
+    store_dir. The index file lists stations, periods and ingested
+    realizations with the size and modification time of their files,
+    the data file has one block of shape (stations, periods,
+    components) per realization, in index order
+    """
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        self.index_file = os.path.join(store_dir, "index.json")
+        self.data_file = os.path.join(store_dir, "rd50.f8")
+        self.stations = []
+        self.periods = []
+        self.num_comps = 0
+        self.realizations = []
+        self.stamps = []
+        self.event_label = None
+        if not os.path.exists(self.store_dir):
+            os.makedirs(self.store_dir)
+        if os.path.exists(self.index_file):
+            in_file = open(self.index_file, 'r')
+            index = json.load(in_file)
+            in_file.close()
+            if index["version"] == RD50_STORE_VERSION:
+                self.stations = index["stations"]
+                self.periods = index["periods"]
+                self.num_comps = index["num_comps"]
+                self.realizations = index["realizations"]
+                self.stamps = index["stamps"]
+                self.event_label = index["event_label"]
+
+    def block_size(self):
+        """
+        Returns the number of values stored for each realization
+        """
+        return len(self.stations) * len(self.periods) * self.num_comps
+
+    def write_index(self):
+        """
+        Saves the index, replacing the old one in a single step so
+        readers never see a partial index
+        """
+        tmp_file = "%s.tmp" % (self.index_file)
+        out_file = open(tmp_file, 'w')
+        json.dump({"version": RD50_STORE_VERSION,
+                   "stations": self.stations,
+                   "periods": self.periods,
+                   "num_comps": self.num_comps,
+                   "realizations": self.realizations,
+                   "stamps": self.stamps,
+                   "event_label": self.event_label}, out_file, indent=1)
+        out_file.close()
+        os.rename(tmp_file, self.index_file)
+
+    def realization_stamp(self, input_dir, realization):
+        """
+        Returns the size and modification time of the rd50 file of
+        each station in realization, None if any file is missing
+        """
+        basedir = os.path.join(input_dir, realization)
+        stamp = []
+        for station in self.stations:
+            data_file = os.path.join(basedir, "%s.%s.rd50" %
+                                     (realization, station))
+            if not os.path.isfile(data_file):
+                return None
+            stat = os.stat(data_file)
+            stamp.append([stat.st_size, stat.st_mtime])
+        return stamp
+
+    def read_realization(self, input_dir, realization):
+        """
+        Returns an array with the rd50 data for all stations in
+        realization, sorted by period
+        """
+        basedir = os.path.join(input_dir, realization)
+        block = numpy.empty((len(self.stations), len(self.periods),
+                             self.num_comps), dtype=RD50_DTYPE)
+        for idx, station in enumerate(self.stations):
+            data_file = os.path.join(basedir, "%s.%s.rd50" %
+                                     (realization, station))
+            if not os.path.isfile(data_file):
+                raise bband_utils.ProcessingError("Data for station %s " %
+                                                  (station) +
+                                                  "not found for "
+                                                  "realization %s!" %
+                                                  (realization))
+            data = numpy.loadtxt(data_file, comments="#", ndmin=2)
+            data = data[numpy.argsort(data[:, 0], kind="mergesort")]
+            if (data.shape != (len(self.periods), self.num_comps + 1) or
+                not numpy.array_equal(data[:, 0], self.periods)):
+                raise bband_utils.ProcessingError("Periods in %s do not "
+                                                  "match the other "
+                                                  "realizations!" %
+                                                  (data_file))
+            block[idx] = data[:, 1:]
+        return block
+
+    def setup(self, input_dir, realization):
+        """
+        Sets stations, periods, components and event label using the
+        files in realization
+        """
+        basedir = os.path.join(input_dir, realization)
+        # Figure out what our stations are
+        rd50_files = glob.glob("%s%s%s.*.rd50" % (basedir,
+                                                  os.sep,
+                                                  realization))
+        rd50_files = [os.path.basename(each_file) for each_file in rd50_files]
+        if len(rd50_files) < 1:
+            raise bband_utils.ProcessingError("No rd50 files found "
+                                              "for realization %s!" %
+                                              (realization))
+        self.stations = sorted([station.split(".")[1]
+                                for station in rd50_files])
+        # Capture event_label
+        bias_file = glob.glob("%s%s*.bias" % (basedir, os.sep))
+        if len(bias_file) < 1:
+            raise bband_utils.ProcessingError("Cannot find event label!")
+        bias_file = bias_file[0]
+        self.event_label = os.path.basename(bias_file).split("-")[0]
+        # Periods and components come from the first station
+        data = numpy.loadtxt(os.path.join(basedir, rd50_files[0]),
+                             comments="#", ndmin=2)
+        self.periods = sorted(data[:, 0].tolist())
+        self.num_comps = data.shape[1] - 1
+        self.realizations = []
+        self.stamps = []
+        # Start with an empty data file
+        open(self.data_file, 'wb').close()
+
+    def update(self, input_dir):
+        """
+        Ingests all realizations in input_dir that are not in the store
+        yet, and ingests again the ones whose files changed since they
+        were stored. Returns the number of realizations added and the
+        number of realizations updated
+        """
+        realizations = sorted(os.listdir(input_dir))
+        if len(realizations) < 1:
+            raise bband_utils.ProcessingError("No realizations found "
+                                              "in %s!" % (input_dir))
+        if not self.realizations:
+            self.setup(input_dir, realizations[0])
+        positions = dict([(realization, idx) for idx, realization
+                          in enumerate(self.realizations)])
+        new_realizations = []
+        changed_realizations = []
+        for realization in realizations:
+            stamp = self.realization_stamp(input_dir, realization)
+            if realization not in positions:
+                new_realizations.append((realization, stamp))
+            elif stamp != self.stamps[positions[realization]]:
+                changed_realizations.append((realization, stamp))
+        if not new_realizations and not changed_realizations:
+            return 0, 0
+
+        block_bytes = self.block_size() * numpy.dtype(RD50_DTYPE).itemsize
+        # Drop anything left behind by an interrupted update
+        out_file = open(self.data_file, 'r+b')
+        out_file.truncate(len(self.realizations) * block_bytes)
+        # Replace the blocks of realizations that were run again,
+        # their old stamps stay in the index until it is saved
+        for realization, stamp in changed_realizations:
+            print("updating realization: %s" % (realization))
+            block = self.read_realization(input_dir, realization)
+            out_file.seek(positions[realization] * block_bytes)
+            out_file.write(block.tobytes())
+            self.stamps[positions[realization]] = stamp
+        out_file.seek(0, os.SEEK_END)
+        for realization, stamp in new_realizations:
+            print("ingesting realization: %s" % (realization))
+            block = self.read_realization(input_dir, realization)
+            out_file.write(block.tobytes())
+        out_file.flush()
+        os.fsync(out_file.fileno())
+        out_file.close()
+        for realization, stamp in new_realizations:
+            self.realizations.append(realization)
+            self.stamps.append(stamp)
+        self.write_index()
+
+        return len(new_realizations), len(changed_realizations)
+
+    def get_data(self, realizations=None):
+        """
+        Returns a read-only array (realization x station x period x
+        component) for realizations (all of them if None), which must
+        have been ingested already
+        """
+        data = numpy.memmap(self.data_file, dtype=RD50_DTYPE, mode='r',
+                            shape=(len(self.realizations),
+                                   len(self.stations),
+                                   len(self.periods),
+                                   self.num_comps))
+        if realizations is None:
+            return data
+        positions = dict([(realization, idx) for idx, realization
+                          in enumerate(self.realizations)])
+        return data[[positions[realization] for realization in realizations]]
+
+    def station_means(self, realizations=None):
+        """
+        Returns the mean across realizations for each station, period
+        and component
+        """
+        data = self.get_data(realizations)
+        # Average over a contiguous last axis, so sums are done in the
+        # same order as numpy.mean over each list of values
+        data = numpy.ascontiguousarray(numpy.rollaxis(data, 0, 4))
+        return data.mean(axis=-1)
+
+class ResidTable(object):
+    """
+    Residuals ln(observed / simulated) of the three rd50 components
+    for a list of stations. Values are single precision and periods
+    and period limits are rounded as in the gen_resid_tbl_3comp text
+    tables, so the statistics match the ones resid2uncer_varN computes
+    from them
+    """
+
+    def __init__(self, eq_label, site_list, rrups, periods, resid):
+        self.eq_label = eq_label
+        self.site_list = site_list
+        self.rrups = rrups
+        # Periods go through the simulated rd50 files and the
+        # residual table header
+        periods = numpy.array(["%10.4f" % (period) for period in periods],
+                              dtype=numpy.float32)
+        self.periods = numpy.array(["%.5e" % (period) for period in periods],
+                                   dtype=numpy.float32)
+        self.resid = resid
+        self.tmin = []
+        self.tmax = []
+        for site in site_list:
+            self.tmin.append(self.period_limit(site.high_freq_corner,
+                                               "-99999.999"))
+            self.tmax.append(self.period_limit(site.low_freq_corner,
+                                               "99999.999"))
+
+    @staticmethod
+    def period_limit(freq, default):
+        """
+        Returns the period limit for corner frequency freq as written
+        in the residual tables
+        """
+        freq = numpy.array("%f" % (freq), dtype=numpy.float32)
+        if freq > 0.0:
+            return "%.3f" % (1.0 / float(freq))
+        return default
+
+    def write(self, resid_file, print_header=True):
+        """
+        Appends the table to resid_file, starting with the header
+        line if print_header is set
+        """
+        lines = []
+        if print_header:
+            lines.append("\t".join(RESID_HEADER +
+                                   ["%.5e" % (period)
+                                    for period in self.periods]))
+        for idx, site in enumerate(self.site_list):
+            statinfo = "\t".join([self.eq_label, "0.0", site.scode,
+                                  "%.4f" % (float(site.lon)),
+                                  "%.4f" % (float(site.lat)), "-999",
+                                  "%d" % (site.vs30),
+                                  "%.2f" % (self.rrups[idx]), "-999", "-999",
+                                  self.tmin[idx], self.tmax[idx]])
+            for comp, values in zip(RESID_COMPS, self.resid[idx]):
+                lines.append("\t".join([statinfo, comp] +
+                                       ["%.5e" % (value)
+                                        for value in values]))
+        out_file = open(resid_file, 'a')
+        out_file.write("".join(["%s\n" % (line) for line in lines]))
+        out_file.close()
+
+    def stats(self):
+        """
+        Returns the bias, sigma, sigma0, m90 and p90 arrays (component
+        x period), using for each period the stations whose period
+        limits include it
+        """
+        resid = numpy.asarray(self.resid, dtype=numpy.float64)
+        periods = self.periods[numpy.newaxis, :]
+        tmin = numpy.array(self.tmin, dtype=numpy.float32)
+        tmax = numpy.array(self.tmax, dtype=numpy.float32)
+        in_range = ((periods >= tmin[:, numpy.newaxis]) &
+                    (periods <= tmax[:, numpy.newaxis]))
+        in_range = in_range[:, numpy.newaxis, :]
+        nval = numpy.sum(in_range, axis=0) * numpy.ones(resid.shape[1:])
+        valid = nval > 1
+        nval[~valid] = 2
+
+        bias = numpy.sum(numpy.where(in_range, resid, 0.0), axis=0) / nval
+        sigma = numpy.sqrt(numpy.sum(numpy.where(in_range, resid - bias,
+                                                 0.0) ** 2, axis=0) /
+                           (nval - 1))
+        sigma0 = numpy.sqrt(numpy.sum(numpy.where(in_range, resid,
+                                                  0.0) ** 2, axis=0) / nval)
+        t95 = numpy.array(T95)[numpy.minimum(nval, 56).astype(int) - 2]
+        t95[nval > 56] = 1.64
+        ttfac = t95 * numpy.sqrt(1.0 / nval)
+
+        stats = {"bias": bias,
+                 "sigma": sigma,
+                 "sigma0": sigma0,
+                 "m90": bias - sigma * ttfac,
+                 "p90": bias + sigma * ttfac}
+        for values in stats.values():
+            values[~valid] = 0.0
+        return stats
+
+    def write_stats(self, fileroot):
+        """
+        Writes the fileroot-<comp>.<stat> files with the statistics of
+        each component, in the format plotted by PlotGoF
+        """
+        stats = self.stats()
+        for stat, values in stats.items():
+            for comp, comp_values in zip(RESID_COMPS, values):
+                out_file = open("%s-%s.%s" % (fileroot, comp, stat), 'w')
+                out_file.write("".join(["%13.5e %13.5e\n" % (period, value)
+                                        for period, value
+                                        in zip(self.periods, comp_values)]))
+                out_file.close()
+
+def read_obs_data(obs_dir, stations, num_periods, num_comps):
+    """
+    Returns an array (station x period x component) with the observed
+    rd50 data for stations, in the order of the files
+    """
+    obs_data = numpy.empty((len(stations), num_periods, num_comps))
+    for idx, station in enumerate(stations):
+        data_file = os.path.join(obs_dir, "%s.rd50" % (station))
+        if not os.path.isfile(data_file):
+            raise bband_utils.ProcessingError("Observed data for station "
+                                              "%s not found!" % (station))
+        data = numpy.loadtxt(data_file, comments="#", ndmin=2)
+        if data.shape != (num_periods, num_comps + 1):
+            raise bband_utils.ProcessingError("Periods in %s do not match "
+                                              "the simulated data!" %
+                                              (data_file))
+        obs_data[idx] = data[:, 1:]
+    return obs_data
+
+def station_residuals(obs_data, sim_data):
+    """
+    Returns the residuals ln(obs_data / sim_data) as an array (station
+    x component x period), computed in single precision. Residuals are
+    RESID_NO_SIM where the simulated value is zero
+    """
+    obs_data = numpy.float32(numpy.rollaxis(obs_data, 2, 1))
+    sim_data = numpy.float32(numpy.rollaxis(sim_data, 2, 1))
+    no_sim = sim_data == 0.0
+    sim_data[no_sim] = 1.0
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        resid = numpy.float32(numpy.log(numpy.float64(obs_data / sim_data)))
+    resid[no_sim] = RESID_NO_SIM
+    return resid
+
+def combine_residuals(store, realizations, obs_dir, site_list, rrups):
+    """
+    Returns the ResidTable for the stations in site_list, comparing
+    the observed data in obs_dir with the mean of realizations in the
+    store
+    """
+    if store.num_comps != len(RESID_COMPS):
+        raise bband_utils.ProcessingError("Expected %d components in the "
+                                          "rd50 store!" % (len(RESID_COMPS)))
+    positions = dict([(station, idx) for idx, station
+                      in enumerate(store.stations)])
+    for site in site_list:
+        if site.scode not in positions:
+            raise bband_utils.ProcessingError("Data for station %s not "
+                                              "found in the rd50 store!" %
+                                              (site.scode))
+    sim_data = store.station_means(realizations)
+    sim_data = sim_data[[positions[site.scode] for site in site_list]]
+    obs_data = read_obs_data(obs_dir, [site.scode for site in site_list],
+                             len(store.periods), store.num_comps)
+
+    return ResidTable(store.event_label, site_list, rrups, store.periods,
+                      station_residuals(obs_data, sim_data))
+
+def update_store(input_dir, store_dir):
+    """
+    Updates the rd50 store in store_dir with any new or changed
+    realizations in input_dir. Returns the store and the realizations
+    in input_dir
+    """
+    store = RD50Store(store_dir)
+    num_new, num_changed = store.update(input_dir)
+    print("%d new realizations, %d updated, %d in store" %
+          (num_new, num_changed, len(store.realizations)))
+    # Only use realizations that are still in input_dir
+    realizations = sorted(os.listdir(input_dir))
+
+    return store, realizations
@@ -13,11 +13,11 @@ import os
 import sys
 import math
 import time
-import cmath
+import heapq
 import random
+import hashlib
 import numpy as np
 from scipy.interpolate import griddata
-import warnings
 
 # Import BBP modules
 import plot_srf
@@ -106,6 +106,12 @@ C = [[1.0000, 0.0351, 0.6673, 0.9803, 0.2617, 0.6657, -0.1094,
 # Constant from gen_rup
 par_t_acc = 0.2
 
+# Number of Cholesky factors kept in the cache directory
+RMG_CACHE_SIZE = 8
+# Change this when the Cholesky factors change, so factors cached by
+# older versions of the code are not used
+RMG_CACHE_VERSION = 1
+
 def get_nodes(points, dx, dy):
     """
     """
@@ -129,7 +135,7 @@ def get_points(nodes, dx, dy):
     return points
 
 def sub2ind(i, j, m, n):
-    return int(np.ravel_multi_index([[i-1], [j-1]], [m, n], order='F'))
+    return int(np.ravel_multi_index((i-1, j-1), (m, n), order='F'))
 
 def ind2sub(ind, m, n):
     return np.unravel_index(ind, (m, n), order='F')
@@ -149,31 +155,32 @@ def reckon(lat0, lon0, rng, az):
     Computes the latitude and longitude positions for selected ranges
     and azimuths from a starting point along a great circle path. The
     range is input as degrees of arc length on a sphere The input
-    azimuth is measured clockwise from due north
+    azimuth is measured clockwise from due north. Ranges and
+    azimuths can be arrays
     """
     # epsilon = 1.7453e-07
     lat = lat0 * math.pi / 180.0
     lon = lon0 * math.pi / 180.0
-    az = az * math.pi / 180.0
-    rng = rng * math.pi / 180.0
+    az = np.asarray(az) * math.pi / 180.0
+    rng = np.asarray(rng) * math.pi / 180.0
 
     # Compute latitude
-    temp1 = math.sin(lat) * math.cos(rng)
-    temp2 = math.cos(lat) * math.sin(rng) * math.cos(az)
-    tmplat = math.asin(temp1 + temp2)
+    temp1 = math.sin(lat) * np.cos(rng)
+    temp2 = math.cos(lat) * np.sin(rng) * np.cos(az)
+    tmplat = np.arcsin(temp1 + temp2)
 
     # Compute longitude
-    temp1 = math.sin(rng) * math.sin(az)
-    temp2 = math.cos(lat) * math.cos(rng)
-    temp3 = math.sin(lat) * math.sin(rng) * math.cos(az)
-    tmplon = lon + math.atan2(temp1, temp2-temp3)
+    temp1 = np.sin(rng) * np.sin(az)
+    temp2 = math.cos(lat) * np.cos(rng)
+    temp3 = math.sin(lat) * np.sin(rng) * np.cos(az)
+    tmplon = lon + np.arctan2(temp1, temp2-temp3)
 
     # Convert back to degrees
     newlat = tmplat * 180.0 / math.pi
     newlon = (math.pi *
-              ((abs(tmplon) / math.pi) -
-               2 * math.ceil(((abs(tmplon) / math.pi) - 1) / 2.0)) *
-              math.copysign(1, tmplon))
+              ((np.abs(tmplon) / math.pi) -
+               2 * np.ceil(((np.abs(tmplon) / math.pi) - 1) / 2.0)) *
+              np.copysign(1, tmplon))
     newlon = newlon * 180.0 / math.pi
 
     return newlat, newlon
@@ -193,6 +200,13 @@ def calc_time(i, j, Fij, T, frozen, m, n, dy, dx, order):
                 (frozen[i-3+pi][j-3+pj])):
                 patch[pi][pj] = T[i-3+pi][j-3+pj]
 
+    return calc_time_patch(patch, Fij, dy, dx, order)
+
+def calc_time_patch(patch, Fij, dy, dx, order):
+    """
+    Solves the time-distance equation for the pixel at the center of
+    the 5x5 patch of Frozen time-distances (np.inf everywhere else)
+    """
     # If all the surrounding cross values are inf, set the time to
     # Inf, otherwise it would results in b^2 - 4 * a(=0) *
     # c(=1/Fij=Inf)= NaN
@@ -276,7 +290,7 @@ def calc_time(i, j, Fij, T, frozen, m, n, dy, dx, order):
     if d < 0 and order == 2:
         # Revert to order 1
         order = 1
-        (time, tmp_flag) = calc_time(i, j, Fij, T, frozen, m, n, dy, dx, order)
+        (time, tmp_flag) = calc_time_patch(patch, Fij, dy, dx, order)
         e_flag = max(1, tmp_flag)
     elif d < 0 and order == 1:
         # Add 1/Fij to smallest neighbour
@@ -296,7 +310,10 @@ def calc_time(i, j, Fij, T, frozen, m, n, dy, dx, order):
 
 class RMG(object):
     """
-    This class implements the RMG rupture generator
+    This class implements the RMG rupture generator. When the
+    BBP_RMG_CACHE_DIR environment variable is set, the Cholesky
+    factors of the covariance matrix are kept in that directory and
+    reused by later runs with the same fault geometry
     """
     # Number of stats points
     n_stats = 1000
@@ -305,7 +322,180 @@ class RMG(object):
     def fm(F, source_points, dxyz):
         """
         Implements the Fast-marching method to solve the Eikonal eqn
-        in 2 dimensions
+        in 2 dimensions. The narrow band is kept in a binary heap with
+        lazy deletion, and all grids are stored as flat (Fortran
+        order) arrays so no reshaping happens inside the main loop
+        """
+
+        # Initialize parameters
+        # ndims = 2
+        m, n = F.shape
+        dx = dxyz[0]
+        dy = dxyz[1]
+
+        # Check error conditions
+        if not np.all(F >= 0):
+            raise ValueError("F must be >= 0")
+
+        if ((n < 1) or (m < 1)):
+            raise ValueError("m and n must by > 0")
+
+        if (dx <= 0) or (dy <= 0):
+            raise ValueError("dxyz must be > 0")
+
+        # Flip source points
+        source_points = source_points[::-1]
+
+        # Flat views of the speed map, time-distance and frozen
+        # matrices, all in Fortran order (index = i + j * m)
+        f_F = F.flatten(order='F').tolist()
+        T = np.zeros(m * n) - 1
+        frozen = np.zeros(m * n, dtype=bool)
+
+        # Frozen time-distances padded with 2 pixels of np.inf on
+        # each side, so the 5x5 stencil around pixel (i, j) is just
+        # the view t_frozen[i:i+5, j:j+5]. The stencil is passed to
+        # calc_time_patch as nested lists, scalar access to Python
+        # floats is much cheaper than to numpy array elements
+        t_frozen = np.empty((m + 4, n + 4))
+        t_frozen[:] = np.inf
+
+        # Narrow band: heap entries are (time, seq, ind). The current
+        # time of each narrow band pixel is kept in nb_time, entries
+        # that no longer match it are stale and discarded when
+        # popped. The sequence number is assigned when the pixel
+        # first enters the narrow band, so ties are broken in
+        # insertion order
+        narrow_band = []
+        nb_time = np.empty(m * n)
+        nb_seq = np.zeros(m * n, dtype=int) - 1
+        seq = 0
+
+        # Relative indices of the 4 neighbors to a given point
+        i_offsets = [-1, 1, 0, 0]
+        j_offsets = [0, 0, -1, 1]
+
+        # Relative indices of the 8 neighbors to a given point
+        i_offsets_full = [-1, -1, -1, 0, 0, 1, 1, 1]
+        j_offsets_full = [-1, 0, 1, -1, 1, -1, 0, 1]
+
+        # Initialize error flag
+        e_flag = 0
+
+        # First we calculate the time-distances to all 8 neighboring
+        # pixels of the source point. This calculation is done simply
+        # by taking the distance and dividing by the speed. We also
+        # freeze this
+
+        # Get node and its indice
+        cp = source_points
+        cp_node = get_nodes(cp, dx, dy)
+        cp_ind = sub2ind(cp_node[0], cp_node[1], m, n)
+
+        # Calculate travel time and freeze
+        cp_points = get_points(cp_node, dx, dy)
+        T[cp_ind] = (np.sqrt(np.dot(cp - cp_points, cp - cp_points)) /
+                     f_F[cp_ind])
+        frozen[cp_ind] = True
+
+        # For all 8 neighbors of the source point
+        for neigh in range(0, 8):
+            # Get index of neighbor, store as i and j
+            ni = cp_node[0] + i_offsets_full[neigh]
+            nj = cp_node[1] + j_offsets_full[neigh]
+
+            # Only check if is_in_domain
+            if is_in_domain(ni - 1, nj - 1, m, n) and is_in_domain(ni, nj,
+                                                                   m, n):
+                n_ind = sub2ind(ni, nj, m, n)
+                val = cp - get_points([ni, nj], dx, dy)
+                time = np.sqrt(np.dot(val, val)) / f_F[n_ind]
+                if T[n_ind] >= 0:
+                    T[n_ind] = min(time, T[n_ind])
+                else:
+                    T[n_ind] = time
+                frozen[n_ind] = True
+
+        for ind in np.flatnonzero(frozen):
+            i, j = ind % m, ind // m
+            t_frozen[i + 2, j + 2] = T[ind]
+
+        # Calculate the initial narrow band as all neighboring pixels
+        # to the ones that have been frozen. Note that this time,
+        # unlike the source-point loop, the henceforth in the
+        # algorithm, the neighbors of a pixel only include its 4
+        # non-diagonal neighbors.
+        for ind in np.flatnonzero(frozen):
+            i, j = ind % m, ind // m
+            # For all 4 neighbors of the frozen points
+            for neigh in range(0, 4):
+                # Get index of neighbor, store as i and j
+                ni = i + i_offsets[neigh]
+                nj = j + j_offsets[neigh]
+                if not is_in_domain(ni, nj, m, n):
+                    continue
+                n_ind = ni + nj * m
+
+                # If (i,j) valid for consideration
+                if not frozen[n_ind] and nb_seq[n_ind] < 0:
+                    (time,
+                     flag) = calc_time_patch(t_frozen[ni:ni+5,
+                                                      nj:nj+5].tolist(),
+                                             f_F[n_ind], dy, dx, 2)
+                    nb_time[n_ind] = time
+                    nb_seq[n_ind] = seq
+                    heapq.heappush(narrow_band, (time, seq, n_ind))
+                    seq = seq + 1
+                    e_flag = max(flag, e_flag)
+
+        # Main Loop
+        # Now start the main loop.
+        # Loop until there are no more narrow band
+        # neighbours, meaning the algorithm has finished
+        while narrow_band:
+            # Get min heap element.
+            # This will be the new "center pixel" (CP)
+            time, _, cp = heapq.heappop(narrow_band)
+            if frozen[cp] or time != nb_time[cp]:
+                # Stale entry
+                continue
+
+            i, j = cp % m, cp // m
+            # Freeze and set time
+            frozen[cp] = True
+            T[cp] = time
+            t_frozen[i + 2, j + 2] = time
+
+            # For all neighbours of CP
+            for neigh in range(0, 4):
+                # Get index of neighbor, store as i and j
+                ni = i + i_offsets[neigh]
+                nj = j + j_offsets[neigh]
+                if not is_in_domain(ni, nj, m, n):
+                    continue
+                n_ind = ni + nj * m
+
+                # If (i,j) valid for consideration
+                if not frozen[n_ind]:
+                    (time,
+                     flag) = calc_time_patch(t_frozen[ni:ni+5,
+                                                      nj:nj+5].tolist(),
+                                             f_F[n_ind], dy, dx, 2)
+                    if nb_seq[n_ind] < 0:
+                        nb_seq[n_ind] = seq
+                        seq = seq + 1
+                    nb_time[n_ind] = time
+                    heapq.heappush(narrow_band, (time, nb_seq[n_ind], n_ind))
+
+                    e_flag = max(flag, e_flag)
+
+        return T.reshape((m, n), order='F'), e_flag
+
+    @staticmethod
+    def fm_reference(F, source_points, dxyz):
+        """
+        Original Fast-marching implementation using a dictionary as
+        the narrow band, kept to validate and benchmark RMG.fm
         """
 
         # Initialize parameters
@@ -521,6 +711,9 @@ class RMG(object):
         self.r_srcfile = r_srcfile
         self.rup = {}
         self.use_interpolation = True
+        self.cache_dir = None
+        # SVFs for the clipped rise times, indexed by (tau_s, tau_r, nt)
+        self.svf_cache = {}
 
     def gen_stats_inp(self):
         """
@@ -716,56 +909,49 @@ class RMG(object):
 
         return rho
 
-    def gen_dist(self):
+    def get_cov_factor(self, X, Z):
         """
-        Generate 2D distributions of source parameters using the
-        Cholesky factorization based on 1-point and 2-point statistics
+        Returns the Cholesky factor of the covariance matrix for the
+        subfault coordinates X, Z. The factor only depends on the
+        geometry and the 2-point statistics, so it is kept in
+        self.cache_dir (when set) under a hash of those inputs and
+        the cache version
         """
         rup = self.rup
 
-        t1 = time.time()
+        cache_file = None
+        if self.cache_dir is not None:
+            key = hashlib.sha1()
+            key.update(("rmg_cache_v%d" % (RMG_CACHE_VERSION)).encode())
+            key.update(np.ascontiguousarray(X).tobytes())
+            key.update(np.ascontiguousarray(Z).tobytes())
+            for param in ["p2_ax", "p2_az", "p2_cc", "p2_RDx", "p2_RDz"]:
+                key.update(np.array(rup[param], dtype='float64').tobytes())
+            cache_file = os.path.join(self.cache_dir,
+                                      "cm_%s.npy" % (key.hexdigest()))
+            if os.path.exists(cache_file):
+                t1 = time.time()
+                L = np.load(cache_file)
+                # Mark it as recently used
+                os.utime(cache_file, None)
+                t2 = time.time()
+                print("=> Elapsed time for loading cached Cholesky factor: "
+                      "%10.2f" % (t2 - t1))
+                return L
 
-        N = int(rup["nx"] * rup["nz"])
-        print()
-        print("=> Number of subfaults (fine grid): %d" % (N))
-        if self.use_interpolation:
-            # Also print information about the coarse grid
-            N1 = int(rup["nx1"] * rup["nz1"])
-            print("=> Number of subfaults (coarse grid): %d" % (N1))
-        print()
-
-        if not self.use_interpolation:
-            # Does not use interpolation
-            XX, ZZ = np.meshgrid(rup["lx"], rup["lz"])
-            X = XX.flatten(1).astype('float32')
-            Z = ZZ.flatten(1).astype('float32')
-
-            Z1 = np.tile(Z, (N, 1)).T
-            del Z
-            r_z = (Z1.T - Z1)
-            del Z1
-
-            X1 = np.tile(X, (N, 1)).T
-            del X
-            r_x = (X1.T - X1)
-            del X1
-        else:
-            # Uses the interpolation code
-            XX, ZZ = np.meshgrid(rup["lx1"], rup["lz1"])
-            X = XX.flatten(1).astype('float32')
-            Z = ZZ.flatten(1).astype('float32')
+        t1 = time.time()
 
-            Z1 = np.tile(Z, (N1, 1)).T
-            del Z
-            r_z = (Z1.T - Z1)
-            del Z1
+        N = len(X)
+        Z1 = np.tile(Z, (N, 1)).T
+        r_z = (Z1.T - Z1)
+        del Z1
 
-            X1 = np.tile(X, (N1, 1)).T
-            del X
-            r_x = (X1.T - X1)
-            del X1
+        X1 = np.tile(X, (N, 1)).T
+        r_x = (X1.T - X1)
+        del X1
 
         rho = self.gen_rho(r_x, r_z)
+        del r_x, r_z
 
         cm = np.vstack([np.hstack([rho[0][0], rho[0][1], rho[0][2]]),
                         np.hstack([rho[0][1].T, rho[1][1], rho[1][2]]),
@@ -793,170 +979,255 @@ class RMG(object):
         t2 = time.time()
         print("=> Elapsed time for Cholesky Factorization: %10.2f" % (t2 - t1))
 
-        t1 = time.time()
+        if cache_file is not None:
+            bband_utils.mkdirs([self.cache_dir], print_cmd=False)
+            # Write to a temporary file so readers never see partial factors
+            tmp_file = "%s.%d.tmp" % (cache_file, os.getpid())
+            output_file = open(tmp_file, 'wb')
+            np.save(output_file, L)
+            output_file.close()
+            os.rename(tmp_file, cache_file)
+            # Only keep the most recently used factors, other runs
+            # sharing the directory may be removing them too
+            try:
+                cached = [os.path.join(self.cache_dir, filename)
+                          for filename in os.listdir(self.cache_dir)
+                          if filename.endswith(".npy")]
+                cached.sort(key=os.path.getmtime, reverse=True)
+                for old_file in cached[RMG_CACHE_SIZE:]:
+                    os.remove(old_file)
+            except OSError:
+                pass
+
+        return L
+
+    def gen_dist(self, num_realizations=1):
+        """
+        Generate 2D distributions of source parameters using the
+        Cholesky factorization based on 1-point and 2-point statistics.
+        Draws num_realizations distributions from the same factor,
+        sets rup to the first one, and returns them all
+        """
+        rup = self.rup
+
+        N = int(rup["nx"] * rup["nz"])
+        print()
+        print("=> Number of subfaults (fine grid): %d" % (N))
+        if self.use_interpolation:
+            # Also print information about the coarse grid, which is
+            # the one used for the covariance matrix
+            N = int(rup["nx1"] * rup["nz1"])
+            print("=> Number of subfaults (coarse grid): %d" % (N))
+        print()
 
         if not self.use_interpolation:
-            s0 = np.random.randn(3 * N)
-            s = np.dot(L, s0)
-            slip = s[:N]
-            vr = s[N:2*N]
-            psv = s[2*N:]
-
-            rup["slip_dist"] = np.reshape(slip, (rup["nz"], rup["nx"]), order='F')
-            rup["vr_dist"] = np.reshape(vr, (rup["nz"], rup["nx"]), order='F')
-            rup["psv_dist"] = np.reshape(psv, (rup["nz"], rup["nx"]), order='F')
+            # Does not use interpolation
+            XX, ZZ = np.meshgrid(rup["lx"], rup["lz"])
         else:
-            s0 = np.random.randn(3 * N1)
-            s = np.dot(L, s0)
-            slip1 = s[:N1]
-            vr1 = s[N1:2*N1]
-            psv1 = s[2*N1:]
-
-            rup["slip1_dist"] = np.reshape(slip1,
-                                           (rup["nz1"], rup["nx1"]), order='F')
-            rup["vr1_dist"] = np.reshape(vr1,
-                                         (rup["nz1"], rup["nx1"]), order='F')
-            rup["psv1_dist"] = np.reshape(psv1,
-                                          (rup["nz1"], rup["nx1"]), order='F')
+            # Uses the interpolation code
+            XX, ZZ = np.meshgrid(rup["lx1"], rup["lz1"])
+        X = XX.flatten(1).astype('float32')
+        Z = ZZ.flatten(1).astype('float32')
+
+        L = self.get_cov_factor(X, Z)
+
+        t1 = time.time()
+
+        # One factorization serves all realizations, the first one
+        # uses the same random numbers as a single draw would
+        s0 = np.random.randn(num_realizations, 3 * N)
+        realizations = []
+        for idx in range(num_realizations):
+            s = np.dot(L, s0[idx])
+            if not self.use_interpolation:
+                keys = ["slip_dist", "vr_dist", "psv_dist"]
+                shape = (rup["nz"], rup["nx"])
+            else:
+                keys = ["slip1_dist", "vr1_dist", "psv1_dist"]
+                shape = (rup["nz1"], rup["nx1"])
+            realization = {}
+            for comp, key in enumerate(keys):
+                realization[key] = np.reshape(s[comp*N:(comp+1)*N],
+                                              shape, order='F')
+            realizations.append(realization)
+        rup.update(realizations[0])
 
         # Step 4 done, look how long it took
         t2 = time.time()
         print("=> Elapsed time for random sampling: %10.2f" % (t2 - t1))
 
-    def svf_etinti(self, tau_s, tau_r, dt, nt):
+        return realizations
+
+    @staticmethod
+    def svf_etinti_grid(tau_s, tau_r, dt, nt):
         """
         Generating the shape of slip velocity function (SVF)
-        based on Tinti et al. (BSSA, 2005)
+        based on Tinti et al. (BSSA, 2005) for each pair of tau_s
+        and tau_r (arrays or scalars) at once, all with nt samples.
+        Returns a (pairs x nt) array and the time vector
         """
-        t = np.linspace(0, (nt-1)*dt, nt)
+        t = np.linspace(0, (nt-1)*dt, int(nt))
 
-        if tau_r < tau_s:
+        tau_s, tau_r = np.broadcast_arrays(np.atleast_1d(tau_s),
+                                           np.atleast_1d(tau_r))
+        if np.any(tau_r < tau_s):
             raise ValueError("Tau_r should be larger than Tau_s")
+        # One row for each SVF
+        tau_s = np.asarray(tau_s, dtype=float)[:, np.newaxis]
+        tau_r = np.asarray(tau_r, dtype=float)[:, np.newaxis]
 
         # U_tot (final slip) is one here
         K = 2.0 / (math.pi * tau_r * tau_s**2)
 
-        # Ignore the divide by zero error
-        with np.errstate(divide='ignore'):
+        # Ignore the divide by zero and invalid value errors, these
+        # samples are outside the time windows that use them
+        with np.errstate(divide='ignore', invalid='ignore'):
             C1 = ((t / 2.0 + 1.0 / 4 * tau_r) *
                   np.sqrt(np.array((t * (tau_r - t)), dtype=complex)) +
                   (t * tau_r - tau_r ** 2) *
                   np.arcsin(np.sqrt(np.array((t / tau_r)), dtype=complex)) -
-                  [3.0 / 4 * tau_r ** 2 * y for y in
-                   [cmath.atan(x) for x in np.sqrt(np.array(((tau_r - t) / t),
-                                                            dtype=complex))]])
-
-        C2 = 3.0 / 8 * math.pi * tau_r ** 2
-
-        C3 = ((tau_s - t - 1.0 / 2 * tau_r) *
-              np.sqrt(np.array(((t - tau_s) * (tau_r - t + tau_s)),
-                               dtype=complex)) +
-              tau_r * (2.0 * tau_r - 2 * t + 2 * tau_s) *
-              np.arcsin(np.sqrt(np.array(((t - tau_s) / tau_r),
-                                         dtype=complex))) +
-              [3.0 / 2 * tau_r ** 2 * y for y in
-               [cmath.atan(x) for x in np.sqrt(np.array((tau_r - t + tau_s) /
-                                                        (t - tau_s),
-                                                        dtype=complex))]])
-
-        C4 = ((-tau_s + 1.0 / 2.0 * t + 1.0 / 4.0 * tau_r) *
-              np.sqrt(np.array(((t - 2 * tau_s) * (tau_r - t + 2 * tau_s)),
-                               dtype=complex)) +
-              tau_r * (-tau_r + t - 2 * tau_s) *
-              np.arcsin(np.sqrt(np.array(((t - 2 * tau_s) / tau_r),
-                                         dtype=complex))) -
-              [3.0 / 4.0 * tau_r ** 2 * y for y in
-               [cmath.atan(x) for x in np.sqrt(np.array((tau_r - t + 2*tau_s) /
-                                                        (t - 2 * tau_s),
-                                                        dtype=complex))]])
-
-        C5 = math.pi / 2.0 * tau_r * (t - tau_r)
-
-        C6 = math.pi / 2.0 * tau_r * (2.0 * tau_s - t + tau_r)
-
-        # Filters ComplexWarning when typecasting array to float
-        with warnings.catch_warnings():
-            warnings.simplefilter("ignore")
-            if tau_r > 2 * tau_s:
-                svf = (np.array(((C1 + C2) *
-                                 [x1 and x2 for x1, x2 in zip(t >= 0,
-                                                              t < tau_s)]),
-                                dtype=float) +
-                       (np.array(((C1 - C2 + C3) *
-                                  [x1 and x2 for x1, x2 in zip(t >= tau_s,
-                                                               t < 2*tau_s)]),
-                                 dtype=float)) +
-                       (np.array(((C1 + C3 + C4) *
-                                  [x1 and x2 for x1, x2 in zip(t >= 2*tau_s,
-                                                               t < tau_r)]),
-                                 dtype=float)) +
-                       (np.array(((C5 + C3 + C4) *
-                                  [x1 and x2 for x1, x2 in zip(t >= tau_r,
-                                                               t < tau_r +
-                                                               tau_s)]),
-                                 dtype=float)) +
-                       (np.array(((C4 + C6) *
-                                  [x1 and x2 for x1, x2 in zip(t >= (tau_r +
-                                                                     tau_s),
-                                                               t < (tau_r+2 *
-                                                                    tau_s))]),
-                                 dtype=float)))# +
-#                   (np.array(((0) *
-#                              [x1 for x1 in t>=(tau_r+2*tau_s)]),
-#                             dtype=float)))
-            else:
-                svf = (np.array(((C1 + C2) *
-                                 [x1 and x2 for x1, x2 in zip(t >= 0,
-                                                              t < tau_s)]),
-                                dtype=float) +
-                       (np.array(((C1 - C2 + C3) *
-                                  [x1 and x2 for x1, x2 in zip(t >= tau_s,
-                                                               t < tau_r)]),
-                                 dtype=float)) +
-                       (np.array(((C5 + C3 - C2) *
-                                  [x1 and x2 for x1, x2 in zip(t >= tau_r,
-                                                               t < 2*tau_s)]),
-                                 dtype=float)) +
-                       (np.array(((C5 + C3 + C4) *
-                                  [x1 and x2 for x1, x2 in zip(t >= 2*tau_s,
-                                                               t < tau_r +
-                                                               tau_s)]),
-                                 dtype=float)) +
-                       (np.array(((C4 + C6) *
-                                  [x1 and x2 for x1, x2 in zip(t >= (tau_r +
-                                                                     tau_s),
-                                                               t < (tau_r+2 *
-                                                                    tau_s))]),
-                                 dtype=float)))# +
-#                   (np.array(((0) *
-#                              [x1 for x1 in t>=(tau_r+2*tau_s)]),
-#                             dtype=float)))
-
-        svf = np.dot(K, svf)
+                  3.0 / 4 * tau_r ** 2 *
+                  np.arctan(np.sqrt(np.array(((tau_r - t) / t),
+                                             dtype=complex))))
+
+            C2 = 3.0 / 8 * math.pi * tau_r ** 2
+
+            C3 = ((tau_s - t - 1.0 / 2 * tau_r) *
+                  np.sqrt(np.array(((t - tau_s) * (tau_r - t + tau_s)),
+                                   dtype=complex)) +
+                  tau_r * (2.0 * tau_r - 2 * t + 2 * tau_s) *
+                  np.arcsin(np.sqrt(np.array(((t - tau_s) / tau_r),
+                                             dtype=complex))) +
+                  3.0 / 2 * tau_r ** 2 *
+                  np.arctan(np.sqrt(np.array((tau_r - t + tau_s) /
+                                             (t - tau_s), dtype=complex))))
+
+            C4 = ((-tau_s + 1.0 / 2.0 * t + 1.0 / 4.0 * tau_r) *
+                  np.sqrt(np.array(((t - 2 * tau_s) * (tau_r - t + 2 * tau_s)),
+                                   dtype=complex)) +
+                  tau_r * (-tau_r + t - 2 * tau_s) *
+                  np.arcsin(np.sqrt(np.array(((t - 2 * tau_s) / tau_r),
+                                             dtype=complex))) -
+                  3.0 / 4.0 * tau_r ** 2 *
+                  np.arctan(np.sqrt(np.array((tau_r - t + 2*tau_s) /
+                                             (t - 2 * tau_s), dtype=complex))))
+
+            C5 = math.pi / 2.0 * tau_r * (t - tau_r)
+
+            C6 = math.pi / 2.0 * tau_r * (2.0 * tau_s - t + tau_r)
+
+            # Both shapes, each SVF picks the one for its rise times
+            svf_long = (((C1 + C2) * ((t >= 0) & (t < tau_s))).real +
+                        ((C1 - C2 + C3) *
+                         ((t >= tau_s) & (t < 2*tau_s))).real +
+                        ((C1 + C3 + C4) *
+                         ((t >= 2*tau_s) & (t < tau_r))).real +
+                        ((C5 + C3 + C4) *
+                         ((t >= tau_r) & (t < tau_r + tau_s))).real +
+                        ((C4 + C6) *
+                         ((t >= (tau_r + tau_s)) &
+                          (t < (tau_r+2 * tau_s)))).real)
+            svf_short = (((C1 + C2) * ((t >= 0) & (t < tau_s))).real +
+                         ((C1 - C2 + C3) *
+                          ((t >= tau_s) & (t < tau_r))).real +
+                         ((C5 + C3 - C2) *
+                          ((t >= tau_r) & (t < 2*tau_s))).real +
+                         ((C5 + C3 + C4) *
+                          ((t >= 2*tau_s) & (t < tau_r + tau_s))).real +
+                         ((C4 + C6) *
+                          ((t >= (tau_r + tau_s)) &
+                           (t < (tau_r+2 * tau_s)))).real)
+
+        svf = K * np.where(tau_r > 2 * tau_s, svf_long, svf_short)
 
         return svf, t
 
-    def gen_svf(self, tw, dt, nt, svf_type):
+    def svf_etinti(self, tau_s, tau_r, dt, nt):
         """
-        Generating triangular or rectangular shape Slip Velocity
-        Function
+        Generating the shape of slip velocity function (SVF)
+        based on Tinti et al. (BSSA, 2005)
         """
-        # Implements the 'etinti' svf_type only
+        svf, t = self.svf_etinti_grid(tau_s, tau_r, dt, nt)
 
+        return svf[0], t
+
+    @staticmethod
+    def get_svf_taus(tw):
+        """
+        Returns tau_s and tau_r for the SVF of rise time tw (a scalar
+        or an array)
+        """
         # 10% of total risetime
         #t_acc = tw * 0.1
         # Fixed T_acc
         t_acc = par_t_acc
 
         tau_s = t_acc / 1.3
-        tau_r = tw - 2.0 * tau_s
-        if tau_r <= tau_s:
-            tau_r = tau_s * 1.01
-        svf, time_vec = self.svf_etinti(tau_s, tau_r, dt, nt)
+        tau_r = np.asarray(tw - 2.0 * tau_s, dtype=float)
+        tau_r[tau_r <= tau_s] = tau_s * 1.01
+
+        return tau_s, tau_r
+
+    def gen_svf(self, tw, dt, nt, svf_type):
+        """
+        Generating triangular or rectangular shape Slip Velocity
+        Function
+        """
+        # Implements the 'etinti' svf_type only
+        tau_s, tau_r = self.get_svf_taus(tw)
+        svf, time_vec = self.svf_etinti(tau_s, float(tau_r), dt, nt)
 
         # All done
         return svf, time_vec
 
+    def gen_svfs(self, rist_dist, dt, svf_type, rist_limits=()):
+        """
+        Generates the SVFs for all subfaults in rist_dist at once,
+        padded with zeros to the longest one. SVFs for the rise times
+        in rist_limits (the clipping values) are kept for the next
+        calls. Returns the number of samples of each SVF, the SVFs
+        (subfault grid x time) and the time vector of the longest one
+        """
+        # Implements the 'etinti' svf_type only
+        rist = np.asarray(rist_dist, dtype=float)
+        svf_nt = np.ceil((rist + 0.5) / dt)
+        tau_s, tau_r = self.get_svf_taus(rist)
+        max_nt = int(svf_nt.max())
+
+        # Many subfaults have the same rise time (e.g. the ones
+        # clipped to the min/max values), each SVF is computed only
+        # once. Only the clipped ones repeat across realizations, so
+        # only these are kept in svf_cache
+        keys = [(tau_s, cur_tau_r, cur_nt) for cur_tau_r, cur_nt
+                in zip(tau_r.ravel().tolist(), svf_nt.ravel().tolist())]
+        limit_keys = set([key for key, cur_rist
+                          in zip(keys, rist.ravel().tolist())
+                          if cur_rist in rist_limits])
+        svfs_found = dict([(key, self.svf_cache[key]) for key in limit_keys
+                           if key in self.svf_cache])
+        missing = sorted(set([key for key in keys
+                              if key not in svfs_found]),
+                         key=lambda key: key[2])
+        for cur_nt in sorted(set([key[2] for key in missing])):
+            group = [key for key in missing if key[2] == cur_nt]
+            svfs, _ = self.svf_etinti_grid([key[0] for key in group],
+                                           [key[1] for key in group],
+                                           dt, cur_nt)
+            for key, svf in zip(group, svfs):
+                svfs_found[key] = svf
+                if key in limit_keys:
+                    self.svf_cache[key] = svf
+
+        index = {}
+        rows = [index.setdefault(key, len(index)) for key in keys]
+        table = np.zeros((len(index), max_nt))
+        for key, row in index.items():
+            table[row, :int(key[2])] = svfs_found[key]
+        svf = table[rows].reshape(rist.shape + (max_nt,))
+        time_vec = np.linspace(0, (max_nt-1)*dt, max_nt)
+
+        return svf_nt, svf, time_vec
+
     # def calculate_interp(self, X, Z, func):
     #    """
     #    Calls function 'func' as many times as needed to calculate
@@ -976,10 +1247,11 @@ class RMG(object):
     #    # Return results
     #    return out_data
 
-    def gen_rup(self):
+    def gen_rup(self, realization=None):
         """
         This function implements the rupture model generator based on
-        1-point and 2-point statistics
+        1-point and 2-point statistics. Uses the 2D distributions in
+        realization (as returned by gen_dist) when provided
         """
         rup = self.rup
         config = self.config
@@ -991,7 +1263,10 @@ class RMG(object):
         print("### auto- and cross-correlation")
         print()
 
-        self.gen_dist()
+        if realization is None:
+            self.gen_dist()
+        else:
+            rup.update(realization)
 
         if self.use_interpolation:
             # Added code for the interpolation
@@ -1103,21 +1378,12 @@ class RMG(object):
         t1 = time.time()
 
         # b) generating slip velocity functions (SVF)
-        rup["svf_nt"] = np.zeros((rup["nz"], rup["nx"]))
-        rup["psv1_dist"] = np.zeros((rup["nz"], rup["nx"]))
-        rup["svf_svf"] = np.empty((rup["nz"], rup["nx"]), dtype=object)
-        rup["svf_time"] = np.empty((rup["nz"], rup["nx"]), dtype=object)
-        for k in range(0, int(rup["nz"])):
-            for i in range(0, int(rup["nx"])):
-                rup["svf_nt"][k][i] = math.ceil((rup["rist_dist"][k][i]+0.5) /
-                                                config.svf_dt)
-                (rup["svf_svf"][k][i],
-                 rup["svf_time"][k][i]) = self.gen_svf(rup["rist_dist"][k][i],
-                                                       config.svf_dt,
-                                                       rup["svf_nt"][k][i],
-                                                       config.svf_type)
-                rup["psv1_dist"][k][i] = (max(rup["svf_svf"][k][i]) *
-                                          rup["slip_dist"][k][i])
+        (rup["svf_nt"], rup["svf_svf"],
+         rup["svf_time"]) = self.gen_svfs(rup["rist_dist"], config.svf_dt,
+                                          config.svf_type,
+                                          (rup["p1_min"][3],
+                                           rup["p1_max"][3]))
+        rup["psv1_dist"] = rup["svf_svf"].max(axis=2) * rup["slip_dist"]
 
         # Done, check how long it took
         t2 = time.time()
@@ -1138,69 +1404,40 @@ class RMG(object):
         print("### Step IV: Generating SRF files...")
         print("###")
 
-        # Data structures
-        subf = {}
-        subf["lat"] = np.zeros((rup["nz"], rup["nx"]))
-        subf["lon"] = np.zeros((rup["nz"], rup["nx"]))
-        subf["dep"] = np.zeros((rup["nz"], rup["nx"]))
-        subf["stk"] = np.zeros((rup["nz"], rup["nx"]))
-        subf["dip"] = np.zeros((rup["nz"], rup["nx"]))
-        subf["area"] = np.zeros((rup["nz"], rup["nx"]))
-        subf["tinit"] = np.zeros((rup["nz"], rup["nx"]))
-        subf["dt"] = np.zeros((rup["nz"], rup["nx"]))
-        subf["rak"] = np.zeros((rup["nz"], rup["nx"]))
-        subf["slip1"] = np.zeros((rup["nz"], rup["nx"]))
-        subf["nt1"] = np.zeros((rup["nz"], rup["nx"]))
-        subf["slip2"] = np.zeros((rup["nz"], rup["nx"]))
-        subf["nt2"] = np.zeros((rup["nz"], rup["nx"]))
-        subf["slip3"] = np.zeros((rup["nz"], rup["nx"]))
-        subf["nt3"] = np.zeros((rup["nz"], rup["nx"]))
-
-        # SRF Data Block Input
-        for i in range(0, int(rup["nx"])):
-            for k in range(0, int(rup["nz"])):
-                z_km = (config.CFGDICT["depth_to_top"] + ((k+1)-0.5) *
-                        config.CFGDICT["dwid"] *
-                        math.sin(deg2rad * config.CFGDICT['dip']))
-
-                azi = config.CFGDICT['strike'] + 90 # Fault normal direction
-                length = ((i+1) - 0.5 - rup["nx"] / 2.0) * config.CFGDICT["dlen"]
-
-                x_km = (length * math.sin(deg2rad * config.CFGDICT['strike']) +
-                        ((k+1) - 0.5) * config.CFGDICT["dwid"] *
-                        math.cos(deg2rad * config.CFGDICT['dip']) *
-                        math.sin(deg2rad * azi))
-                y_km = (length * math.cos(deg2rad * config.CFGDICT['strike']) +
-                        ((k+1) - 0.5) * config.CFGDICT["dwid"] *
-                        math.cos(deg2rad * config.CFGDICT['dip']) *
-                        math.cos(deg2rad * azi))
-
-                rng = math.sqrt(x_km**2 + y_km**2) * 180.0 / 6371.0 / math.pi
-                azi = math.atan2(y_km, x_km)
-                azi = ((azi >= 0 and azi <= math.pi/2) * (math.pi/2 - azi) +
-                       (azi > math.pi/2) * (2 * math.pi + math.pi / 2 - azi) +
-                       (azi < 0) * (abs(azi) + math.pi/2))
-                azi = azi * 180.0 / math.pi
-
-                (subf["lat"][k][i],
-                 subf["lon"][k][i]) = reckon(config.CFGDICT["lat_top_center"],
-                                             config.CFGDICT["lon_top_center"],
-                                             rng, azi)
-                subf["dep"][k][i] = z_km
-                subf["stk"][k][i] = config.CFGDICT['strike']
-                subf["dip"][k][i] = config.CFGDICT['dip']
-                # cm * cm
-                subf["area"][k][i] = (config.CFGDICT["dlen"] * 1E5 *
-                                      config.CFGDICT["dwid"] * 1E5)
-                subf["tinit"][k][i] = rup["rupT_dist"][k][i]
-                subf["dt"][k][i] = config.svf_dt
-                subf["rak"][k][i] = config.CFGDICT['rake']
-                subf["slip1"][k][i] = rup["slip_dist"][k][i]
-                subf["nt1"][k][i] = rup["svf_nt"][k][i]
-                subf["slip2"][k][i] = 0.0
-                subf["nt2"][k][i] = 0
-                subf["slip3"][k][i] = 0.0
-                subf["nt3"][k][i] = 0
+        # Subfault coordinates, one row for each k (down dip) and one
+        # column for each i (along strike)
+        (k, i) = np.mgrid[0:int(rup["nz"]), 0:int(rup["nx"])]
+        z_km = (config.CFGDICT["depth_to_top"] + ((k+1)-0.5) *
+                config.CFGDICT["dwid"] *
+                math.sin(deg2rad * config.CFGDICT['dip']))
+
+        azi = config.CFGDICT['strike'] + 90 # Fault normal direction
+        length = ((i+1) - 0.5 - rup["nx"] / 2.0) * config.CFGDICT["dlen"]
+
+        x_km = (length * math.sin(deg2rad * config.CFGDICT['strike']) +
+                ((k+1) - 0.5) * config.CFGDICT["dwid"] *
+                math.cos(deg2rad * config.CFGDICT['dip']) *
+                math.sin(deg2rad * azi))
+        y_km = (length * math.cos(deg2rad * config.CFGDICT['strike']) +
+                ((k+1) - 0.5) * config.CFGDICT["dwid"] *
+                math.cos(deg2rad * config.CFGDICT['dip']) *
+                math.cos(deg2rad * azi))
+
+        rng = np.sqrt(x_km**2 + y_km**2) * 180.0 / 6371.0 / math.pi
+        azi = np.arctan2(y_km, x_km)
+        azi = (((azi >= 0) & (azi <= math.pi/2)) * (math.pi/2 - azi) +
+               (azi > math.pi/2) * (2 * math.pi + math.pi / 2 - azi) +
+               (azi < 0) * (np.abs(azi) + math.pi/2))
+        azi = azi * 180.0 / math.pi
+
+        (lat, lon) = reckon(config.CFGDICT["lat_top_center"],
+                            config.CFGDICT["lon_top_center"],
+                            rng, azi)
+        # cm * cm
+        area = (config.CFGDICT["dlen"] * 1E5 *
+                config.CFGDICT["dwid"] * 1E5)
+        slip1 = rup["slip_dist"]
+        nt1 = rup["svf_nt"]
 
         print()
         print("=> Writing SRF file : %s" % (outfl))
@@ -1226,28 +1463,52 @@ class RMG(object):
         # Write Data Block
         outf.write('POINTS %7d\n' % (rup["nx"] * rup["nz"]))
 
-        for k in range(0, int(rup["nz"])):
-            for i in range(0, int(rup["nx"])):
-                outf.write(' %10.4f %10.4f %7.2f %10.2f '
-                           '%10.2f %e %7.2f %7.4f\n' %
-                           (subf["lon"][k][i], subf["lat"][k][i],
-                            subf["dep"][k][i], subf["stk"][k][i],
-                            subf["dip"][k][i], subf["area"][k][i],
-                            subf["tinit"][k][i], subf["dt"][k][i]))
-                outf.write(' %10.2f %10.2f %6d %10.2f %6d %10.2f %6d' %
-                           (subf["rak"][k][i], subf["slip1"][k][i],
-                            subf["nt1"][k][i], subf["slip2"][k][i],
-                            subf["nt2"][k][i], subf["slip3"][k][i],
-                            subf["nt3"][k][i]))
-                for j in range(0, int(rup["svf_nt"][k][i])):
-                    if j % 6 == 0:
-                        outf.write('\n  ')
-                    outf.write('%e' % (rup["svf_svf"][k][i][j] *
-                                       subf["slip1"][k][i]))
-                    outf.write('   ')
-                outf.write('\n')
+        num_points = int(rup["nx"] * rup["nz"])
+        ones = np.ones(num_points)
+        zeros = np.zeros(num_points)
+        # Point lines, ordered by k and then i
+        points = np.column_stack((lon.ravel(), lat.ravel(), z_km.ravel(),
+                                  config.CFGDICT['strike'] * ones,
+                                  config.CFGDICT['dip'] * ones,
+                                  area * ones,
+                                  rup["rupT_dist"].ravel(),
+                                  config.svf_dt * ones,
+                                  config.CFGDICT['rake'] * ones,
+                                  slip1.ravel(), nt1.ravel(),
+                                  zeros, zeros, zeros, zeros)).tolist()
+        # Slip rates, scaled by the slip of each subfault
+        slip_rates = (rup["svf_svf"] *
+                      slip1[:, :, np.newaxis]).reshape(num_points, -1)
+        point_format = (' %10.4f %10.4f %7.2f %10.2f '
+                        '%10.2f %e %7.2f %7.4f\n'
+                        ' %10.2f %10.2f %6d %10.2f %6d %10.2f %6d')
+        # Slip rate formats for each number of samples, six per line
+        sr_formats = {}
+        blocks = []
+        for point, nt_value, slip_rate in zip(points,
+                                              nt1.ravel().astype(int).tolist(),
+                                              slip_rates):
+            if nt_value not in sr_formats:
+                sr_formats[nt_value] = "".join([('\n  ' if j % 6 == 0
+                                                 else '') + '%e   '
+                                                for j in range(nt_value)])
+            blocks.append(point_format % tuple(point))
+            blocks.append(sr_formats[nt_value] %
+                          tuple(slip_rate[:nt_value].tolist()))
+            blocks.append('\n')
+        outf.write("".join(blocks))
         outf.close()
 
+    def gen_srfs(self, srf_files):
+        """
+        Generates one rupture realization for each file in srf_files,
+        all drawn from a single factorization of the covariance matrix
+        """
+        realizations = self.gen_dist(len(srf_files))
+        for realization, srf_file in zip(realizations, srf_files):
+            self.gen_rup(realization)
+            self.gen_srf(srf_file)
+
     def run(self):
         """
         This function runs the RMG method
@@ -1277,6 +1538,10 @@ class RMG(object):
         # Read SRC file
         self.config = RMGCfg(a_srcname=a_srcfile)
 
+        # Covariance factors are only shared between runs when the
+        # BBP_RMG_CACHE_DIR environment variable is set
+        self.cache_dir = os.getenv("BBP_RMG_CACHE_DIR") or None
+
         # Run the Song RMG
         self.gen_stats_inp()
         self.gen_src()
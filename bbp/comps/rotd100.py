@@ -18,6 +18,8 @@ import shutil
 import bband_utils
 import install_cfg
 import bbp_formatter
+import rotd_calc
+from rotd50 import RotD50
 from correct_psa import CorrectPSA
 from station_list import StationList
 from PlotGOF import PlotGoF
@@ -37,50 +39,51 @@ class RotD100(object):
                   peer_input_z_file, output_rotd100_file,
                   logfile):
         """
-        This function runs the rotd100 command inside workdir, using
-        the inputs and outputs specified
+        This function calculates RotD100 inside workdir, using the
+        inputs and outputs specified
         """
-        install = install_cfg.InstallCfg.getInstance()
-
-        # Make sure we don't have absolute path names
-        peer_input_e_file = os.path.basename(peer_input_e_file)
-        peer_input_n_file = os.path.basename(peer_input_n_file)
-        peer_input_z_file = os.path.basename(peer_input_z_file)
-        output_rotd100_file = os.path.basename(output_rotd100_file)
+        rotd_calc.do_rotd(workdir, os.path.basename(peer_input_e_file),
+                          os.path.basename(peer_input_n_file),
+                          os.path.basename(output_rotd100_file),
+                          with_rotd100=True)
 
-        # Save cwd, change back to it at the end
-        old_cwd = os.getcwd()
-        os.chdir(workdir)
+        if rotd_calc.validation_mode():
+            RotD100.validate_rotd100(workdir, peer_input_e_file,
+                                     peer_input_n_file, peer_input_z_file,
+                                     output_rotd100_file, logfile)
 
-        # Make sure we remove the output files first or Fortran will
-        # complain if they already exist
-        try:
-            os.unlink(output_rotd100_file)
-        except OSError:
-            pass
+    @staticmethod
+    def validate_rotd100(workdir, peer_input_e_file, peer_input_n_file,
+                         peer_input_z_file, output_rotd100_file,
+                         logfile):
+        """
+        Runs the Fortran rotd100 code on the same inputs and checks
+        that its output matches output_rotd100_file
+        """
+        output_rotd100_file = os.path.join(workdir,
+                                           os.path.basename(output_rotd100_file))
+        fortran_rotd100_file = "%s.fortran" % (output_rotd100_file)
+        RotD100.do_rotd100_fortran(workdir, peer_input_e_file,
+                                   peer_input_n_file, peer_input_z_file,
+                                   fortran_rotd100_file, logfile)
+        diff = rotd_calc.compare_rotd_files(fortran_rotd100_file,
+                                            output_rotd100_file)
+        if diff > rotd_calc.VALIDATION_TOLERANCE:
+            raise bband_utils.ProcessingError("RotD100 output %s differs "
+                                              "from Fortran output by %f!" %
+                                              (output_rotd100_file, diff))
 
-        #
-        # write config file for rotd100 program
-        rd100_conf = open("rotd100_inp.cfg", 'w')
-        # This flag indicates inputs acceleration
-        rd100_conf.write("2 interp flag\n")
-        # This flag indicate we are processing two input files (horizontals)
-        rd100_conf.write("1 Npairs\n")
-        # Number of headers in the file
-        rd100_conf.write("6 Nhead\n")
-        rd100_conf.write("%s\n" % peer_input_e_file)
-        rd100_conf.write("%s\n" % peer_input_n_file)
-        rd100_conf.write("%s\n" % output_rotd100_file)
-        # Close file
-        rd100_conf.close()
-
-        progstring = ("%s >> %s 2>&1" %
-                      (os.path.join(install.A_UCB_BIN_DIR,
-                                    "rotd100"), logfile))
-        bband_utils.runprog(progstring, abort_on_error=True, print_cmd=False)
-
-        # Restore working directory
-        os.chdir(old_cwd)
+    @staticmethod
+    def do_rotd100_fortran(workdir, peer_input_e_file, peer_input_n_file,
+                           peer_input_z_file, output_rotd100_file,
+                           logfile):
+        """
+        This function runs the rotd100 command inside workdir, using
+        the inputs and outputs specified
+        """
+        rotd_calc.run_rotd_fortran("rotd100", workdir, peer_input_e_file,
+                                   peer_input_n_file, output_rotd100_file,
+                                   logfile)
 
     def __init__(self, i_r_srcfile, i_r_stations,
                  i_a_obsdir, i_obs_format, i_obs_corr,
@@ -112,101 +115,51 @@ class RotD100(object):
         computed seismograms
         """
         install = install_cfg.InstallCfg.getInstance()
-        sim_id = self.sim_id
         slo = StationList(a_statfile)
         site_list = slo.getStationList()
 
-        for site in site_list:
-            stat = site.scode
-            print("==> Calculating simulation RotD100 for station: %s" %
-                  (stat))
-            # Since we have velocity files, we need to differentiate
-            # to get to acceleration
-
-            # Create path names and check if their sizes are within bounds
-            nsfile = os.path.join(a_tmpdir,
-                                  "%d.%s.000" % (sim_id, stat))
-            ewfile = os.path.join(a_tmpdir,
-                                  "%d.%s.090" % (sim_id, stat))
-            udfile = os.path.join(a_tmpdir,
-                                  "%d.%s.ver" % (sim_id, stat))
-            bbpfile = os.path.join(a_outdir,
-                                   "%d.%s.vel.bbp" % (sim_id, stat))
-
-            bband_utils.check_path_lengths([nsfile, ewfile, udfile],
-                                           bband_utils.GP_MAX_FILENAME)
-
-            cmd = ("%s " % (os.path.join(install.A_GP_BIN_DIR, "wcc2bbp")) +
-                   "wcc2bbp=0 nsfile=%s ewfile=%s udfile=%s < %s >> %s 2>&1" %
-                   (nsfile, ewfile, udfile, bbpfile, self.log))
-            bband_utils.runprog(cmd, abort_on_error=True, print_cmd=False)
-
-            for c in ["090", "000", "ver"]:
-                # Differentiate to get from velocity to accl needed by rotd100
-                # Create path names and check if their sizes are within bounds
-                filein = os.path.join(a_tmpdir,
-                                      "%d.%s.%s" %
-                                      (sim_id, stat, c))
-                fileout = os.path.join(a_tmpdir,
-                                       "%d.%s.acc.%s" %
-                                       (sim_id, stat, c))
-
-                bband_utils.check_path_lengths([filein, fileout],
-                                               bband_utils.GP_MAX_FILENAME)
-
-                cmd = ("%s diff=1 " %
-                       (os.path.join(install.A_GP_BIN_DIR, "integ_diff")) +
-                       "filein=%s fileout=%s >> %s 2>&1" %
-                       (filein, fileout, self.log))
-                bband_utils.runprog(cmd, abort_on_error=True, print_cmd=False)
-
-                # Check file length
-                bband_utils.check_path_lengths(["%s/%d.%s.acc.%s" %
-                                                (a_tmpdir, sim_id, stat, c)],
-                                               bband_utils.GP_MAX_FILENAME)
-
-            # Now we need to convert them back to bbp
-            # Create path names and check if their sizes are
-            # within bounds
-            nsfile = os.path.join(a_tmpdir,
-                                  "%d.%s.acc.000" % (sim_id, stat))
-            ewfile = os.path.join(a_tmpdir,
-                                  "%d.%s.acc.090" % (sim_id, stat))
-            udfile = os.path.join(a_tmpdir,
-                                  "%d.%s.acc.ver" % (sim_id, stat))
-            bbpfile = os.path.join(a_tmpdir,
-                                   "%d.%s.acc.bbp" % (sim_id, stat))
-
-            bband_utils.check_path_lengths([nsfile, ewfile, udfile],
-                                           bband_utils.GP_MAX_FILENAME)
+        bband_utils.run_stations(self.calculate_simulated_station, site_list,
+                                 args=(a_tmpdir, a_outdir, a_dstdir),
+                                 jobs=install.num_jobs, logfile=self.log)
 
-            cmd = ("%s " % (os.path.join(install.A_GP_BIN_DIR, "wcc2bbp")) +
-                   "nsfile=%s ewfile=%s udfile=%s " %
-                   (nsfile, ewfile, udfile) +
-                   "units=cm/s/s wcc2bbp=1 > %s 2>> %s" %
-                   (bbpfile, self.log))
-            bband_utils.runprog(cmd, abort_on_error=True, print_cmd=False)
-
-            # Now we need to convert to peer format
-            out_n_acc = os.path.join(a_tmpdir,
-                                     "%d.%s.peer_n.acc" % (sim_id, stat))
-            out_e_acc = os.path.join(a_tmpdir,
-                                     "%d.%s.peer_e.acc" % (sim_id, stat))
-            out_z_acc = os.path.join(a_tmpdir,
-                                     "%d.%s.peer_z.acc" % (sim_id, stat))
-            bbp_formatter.bbp2peer(bbpfile, out_n_acc, out_e_acc, out_z_acc)
-
-            # Let's have rotD100 create these output files
-            out_rotd100_base = "%d.%s.rd100" % (sim_id, stat)
-            tmp_rotd100 = os.path.join(a_tmpdir, out_rotd100_base)
-            out_rotd100 = os.path.join(a_dstdir, out_rotd100_base)
-
-            # Run the rotD100 program
-            self.do_rotd100(a_tmpdir, out_e_acc, out_n_acc, out_z_acc,
-                            out_rotd100, self.log)
-
-            cmd = "cp %s %s" % (tmp_rotd100, out_rotd100)
-            bband_utils.runprog(cmd, abort_on_error=True, print_cmd=False)
+    def calculate_simulated_station(self, site, logfile, a_tmpdir,
+                                    a_outdir, a_dstdir):
+        """
+        This function calculates the RotD100/RotD50 values for the
+        computed seismogram at a single station
+        """
+        sim_id = self.sim_id
+        stat = site.scode
+        print("==> Calculating simulation RotD100 for station: %s" %
+              (stat))
+        # Since we have velocity files, we need to differentiate
+        # to get to acceleration
+        bbpfile = os.path.join(a_outdir,
+                               "%d.%s.vel.bbp" % (sim_id, stat))
+        dt, acc_n, acc_e, _ = rotd_calc.read_bbp_vel2acc(bbpfile)
+
+        # Let's have rotD100 create these output files
+        out_rotd100_base = "%d.%s.rd100" % (sim_id, stat)
+        tmp_rotd100 = os.path.join(a_tmpdir, out_rotd100_base)
+        out_rotd100 = os.path.join(a_dstdir, out_rotd100_base)
+
+        # Calculate RotD100
+        results = rotd_calc.calc_rotd(acc_e, acc_n, dt)
+        rotd_calc.write_rotd_file(tmp_rotd100,
+                                  "%d.%s.peer_e.acc" % (sim_id, stat),
+                                  "%d.%s.peer_n.acc" % (sim_id, stat),
+                                  results, with_rotd100=True)
+
+        if rotd_calc.validation_mode():
+            # Create the PEER files and compare with the Fortran code
+            (out_e_acc, out_n_acc,
+             out_z_acc) = RotD50.create_peer_files(a_tmpdir, a_outdir,
+                                                   sim_id, stat,
+                                                   logfile)
+            self.validate_rotd100(a_tmpdir, out_e_acc, out_n_acc,
+                                  out_z_acc, tmp_rotd100, logfile)
+
+        shutil.copy2(tmp_rotd100, out_rotd100)
 
     def calculate_observations(self, a_indir, a_statfile, a_tmpdir_seis, a_dstdir):
         """
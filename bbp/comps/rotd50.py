@@ -12,11 +12,13 @@ from __future__ import division, print_function
 # Import Python modules
 import os
 import sys
+import shutil
 
 # Import Broadband modules
 import bband_utils
 import install_cfg
 import bbp_formatter
+import rotd_calc
 from station_list import StationList
 
 class RotD50(object):
@@ -29,48 +31,50 @@ class RotD50(object):
                   peer_input_z_file, output_rotd50_file,
                   logfile):
         """
-        This function runs the rotd50 command inside workdir, using
-        the inputs and outputs specified
+        This function calculates RotD50 inside workdir, using the
+        inputs and outputs specified
         """
-        install = install_cfg.InstallCfg.getInstance()
+        rotd_calc.do_rotd(workdir, os.path.basename(peer_input_e_file),
+                          os.path.basename(peer_input_n_file),
+                          os.path.basename(output_rotd50_file))
 
-        # Make sure we don't have absolute path names
-        peer_input_e_file = os.path.basename(peer_input_e_file)
-        peer_input_n_file = os.path.basename(peer_input_n_file)
-        peer_input_z_file = os.path.basename(peer_input_z_file)
-        output_rotd50_file = os.path.basename(output_rotd50_file)
+        if rotd_calc.validation_mode():
+            RotD50.validate_rotd50(workdir, peer_input_e_file,
+                                   peer_input_n_file, peer_input_z_file,
+                                   output_rotd50_file, logfile)
 
-        # Save cwd, change back to it at the end
-        old_cwd = os.getcwd()
-        os.chdir(workdir)
-
-        # Make sure we remove the output files first or Fortran will
-        # complain if they already exist
-        try:
-            os.unlink(output_rotd50_file)
-        except OSError:
-            pass
+    @staticmethod
+    def validate_rotd50(workdir, peer_input_e_file, peer_input_n_file,
+                        peer_input_z_file, output_rotd50_file,
+                        logfile):
+        """
+        Runs the Fortran rotd50 code on the same inputs and checks
+        that its output matches output_rotd50_file
+        """
+        output_rotd50_file = os.path.join(workdir,
+                                          os.path.basename(output_rotd50_file))
+        fortran_rotd50_file = "%s.fortran" % (output_rotd50_file)
+        RotD50.do_rotd50_fortran(workdir, peer_input_e_file,
+                                 peer_input_n_file, peer_input_z_file,
+                                 fortran_rotd50_file, logfile)
+        diff = rotd_calc.compare_rotd_files(fortran_rotd50_file,
+                                            output_rotd50_file)
+        if diff > rotd_calc.VALIDATION_TOLERANCE:
+            raise bband_utils.ProcessingError("RotD50 output %s differs "
+                                              "from Fortran output by %f!" %
+                                              (output_rotd50_file, diff))
 
-        #
-        # write config file for rotd50 program
-        rd50_conf = open("rotd50_inp.cfg", 'w')
-        # This flag indicates inputs acceleration
-        rd50_conf.write("2 interp flag\n")
-        # This flag indicate we are processing two input files (horizontals)
-        rd50_conf.write("1 Npairs\n")
-        # Number of headers in the file
-        rd50_conf.write("6 Nhead\n")
-        rd50_conf.write("%s\n" % peer_input_e_file)
-        rd50_conf.write("%s\n" % peer_input_n_file)
-        rd50_conf.write("%s\n" % output_rotd50_file)
-        # Close file
-        rd50_conf.close()
-
-        progstring = ("%s/rotd50 >> %s 2>&1" % (install.A_UCB_BIN_DIR, logfile))
-        bband_utils.runprog(progstring, abort_on_error=True, print_cmd=False)
-
-        # Restore working directory
-        os.chdir(old_cwd)
+    @staticmethod
+    def do_rotd50_fortran(workdir, peer_input_e_file, peer_input_n_file,
+                          peer_input_z_file, output_rotd50_file,
+                          logfile):
+        """
+        This function runs the rotd50 command inside workdir, using
+        the inputs and outputs specified
+        """
+        rotd_calc.run_rotd_fortran("rotd50", workdir, peer_input_e_file,
+                                   peer_input_n_file, output_rotd50_file,
+                                   logfile)
 
     def __init__(self, i_r_stations, sim_id=0):
         """
@@ -78,6 +82,121 @@ class RotD50(object):
         """
         self.sim_id = sim_id
         self.r_stations = i_r_stations
+        self.log = None
+
+    @staticmethod
+    def create_peer_files(a_tmpdir, a_outdir, sim_id, stat, logfile):
+        """
+        Converts the velocity bbp file for station stat into
+        acceleration PEER files, returns the E, N and Z filenames
+        """
+        install = install_cfg.InstallCfg.getInstance()
+
+        # Create path names and check if their sizes are within bounds
+        nsfile = os.path.join(a_tmpdir,
+                              "%d.%s.000" % (sim_id, stat))
+        ewfile = os.path.join(a_tmpdir,
+                              "%d.%s.090" % (sim_id, stat))
+        udfile = os.path.join(a_tmpdir,
+                              "%d.%s.ver" % (sim_id, stat))
+        bbpfile = os.path.join(a_outdir,
+                               "%d.%s.vel.bbp" % (sim_id, stat))
+
+        bband_utils.check_path_lengths([nsfile, ewfile, udfile],
+                                       bband_utils.GP_MAX_FILENAME)
+
+        cmd = ("%s/wcc2bbp " % (install.A_GP_BIN_DIR) +
+               "wcc2bbp=0 nsfile=%s ewfile=%s udfile=%s < %s >> %s 2>&1" %
+               (nsfile, ewfile, udfile, bbpfile, logfile))
+        bband_utils.runprog(cmd, abort_on_error=True, print_cmd=False)
+
+        for c in ["090", "000", "ver"]:
+            # Differentiate to get from velocity to accl needed by rotd50
+            # Create path names and check if their sizes are within bounds
+            filein = os.path.join(a_tmpdir,
+                                  "%d.%s.%s" %
+                                  (sim_id, stat, c))
+            fileout = os.path.join(a_tmpdir,
+                                   "%d.%s.acc.%s" %
+                                   (sim_id, stat, c))
+
+            bband_utils.check_path_lengths([filein, fileout],
+                                           bband_utils.GP_MAX_FILENAME)
+
+            cmd = ("%s/integ_diff diff=1 " % (install.A_GP_BIN_DIR) +
+                   "filein=%s fileout=%s >> %s 2>&1" %
+                   (filein, fileout, logfile))
+            bband_utils.runprog(cmd, abort_on_error=True, print_cmd=False)
+
+        # Now we need to convert them back to bbp
+        # Create path names and check if their sizes are
+        # within bounds
+        nsfile = os.path.join(a_tmpdir,
+                              "%d.%s.acc.000" % (sim_id, stat))
+        ewfile = os.path.join(a_tmpdir,
+                              "%d.%s.acc.090" % (sim_id, stat))
+        udfile = os.path.join(a_tmpdir,
+                              "%d.%s.acc.ver" % (sim_id, stat))
+        bbpfile = os.path.join(a_tmpdir,
+                               "%d.%s.acc.bbp" % (sim_id, stat))
+
+        bband_utils.check_path_lengths([nsfile, ewfile, udfile],
+                                       bband_utils.GP_MAX_FILENAME)
+
+        cmd = ("%s/wcc2bbp " % (install.A_GP_BIN_DIR) +
+               "nsfile=%s ewfile=%s udfile=%s " %
+               (nsfile, ewfile, udfile) +
+               "units=cm/s/s wcc2bbp=1 > %s 2>> %s" %
+               (bbpfile, logfile))
+        bband_utils.runprog(cmd, abort_on_error=True, print_cmd=False)
+
+        # Now we need to convert to peer format
+        out_n_acc = os.path.join(a_tmpdir,
+                                 "%d.%s.peer_n.acc" % (sim_id, stat))
+        out_e_acc = os.path.join(a_tmpdir,
+                                 "%d.%s.peer_e.acc" % (sim_id, stat))
+        out_z_acc = os.path.join(a_tmpdir,
+                                 "%d.%s.peer_z.acc" % (sim_id, stat))
+        bbp_formatter.bbp2peer(bbpfile, out_n_acc, out_e_acc, out_z_acc)
+
+        return out_e_acc, out_n_acc, out_z_acc
+
+    def process_station(self, site, logfile, a_tmpdir, a_outdir):
+        """
+        Calculates RotD50 for a single station
+        """
+        sim_id = self.sim_id
+
+        stat = site.scode
+        print("==> Processing station: %s" % (stat))
+
+        # Since we have velocity files, we need to differentiate
+        # to get to acceleration
+        bbpfile = os.path.join(a_outdir,
+                               "%d.%s.vel.bbp" % (sim_id, stat))
+        dt, acc_n, acc_e, _ = rotd_calc.read_bbp_vel2acc(bbpfile)
+
+        # Let's have rotD50 create these output files
+        out_rotd50_base = "%d.%s.rd50" % (sim_id, stat)
+        tmp_rotd50 = os.path.join(a_tmpdir, out_rotd50_base)
+        out_rotd50 = os.path.join(a_outdir, out_rotd50_base)
+
+        # Calculate RotD50
+        results = rotd_calc.calc_rotd(acc_e, acc_n, dt)
+        rotd_calc.write_rotd_file(tmp_rotd50,
+                                  "%d.%s.peer_e.acc" % (sim_id, stat),
+                                  "%d.%s.peer_n.acc" % (sim_id, stat),
+                                  results)
+
+        if rotd_calc.validation_mode():
+            # Create the PEER files and compare with the Fortran code
+            (out_e_acc, out_n_acc,
+             out_z_acc) = self.create_peer_files(a_tmpdir, a_outdir,
+                                                 sim_id, stat, logfile)
+            self.validate_rotd50(a_tmpdir, out_e_acc, out_n_acc,
+                                 out_z_acc, tmp_rotd50, logfile)
+
+        shutil.copy2(tmp_rotd50, out_rotd50)
 
     def run(self):
         print("RotD50".center(80, '-'))
@@ -104,96 +223,10 @@ class RotD50(object):
         slo = StationList(a_statfile)
         site_list = slo.getStationList()
 
-        for site in site_list:
-            stat = site.scode
-            print("==> Processing station: %s" % (stat))
-
-            # Since we have velocity files, we need to differentiate
-            # to get to acceleration
-
-            # Create path names and check if their sizes are within bounds
-            nsfile = os.path.join(a_tmpdir,
-                                  "%d.%s.000" % (sim_id, stat))
-            ewfile = os.path.join(a_tmpdir,
-                                  "%d.%s.090" % (sim_id, stat))
-            udfile = os.path.join(a_tmpdir,
-                                  "%d.%s.ver" % (sim_id, stat))
-            bbpfile = os.path.join(a_outdir,
-                                   "%d.%s.vel.bbp" % (sim_id, stat))
-
-            bband_utils.check_path_lengths([nsfile, ewfile, udfile],
-                                           bband_utils.GP_MAX_FILENAME)
-
-            cmd = ("%s/wcc2bbp " % (install.A_GP_BIN_DIR) +
-                   "wcc2bbp=0 nsfile=%s ewfile=%s udfile=%s < %s >> %s 2>&1" %
-                   (nsfile, ewfile, udfile, bbpfile, self.log))
-            bband_utils.runprog(cmd, abort_on_error=True, print_cmd=False)
-
-            for c in ["090", "000", "ver"]:
-                # Differentiate to get from velocity to accl needed by rotd50
-                # Create path names and check if their sizes are within bounds
-                filein = os.path.join(a_tmpdir,
-                                      "%d.%s.%s" %
-                                      (sim_id, stat, c))
-                fileout = os.path.join(a_tmpdir,
-                                       "%d.%s.acc.%s" %
-                                       (sim_id, stat, c))
-
-                bband_utils.check_path_lengths([filein, fileout],
-                                               bband_utils.GP_MAX_FILENAME)
-
-                cmd = ("%s/integ_diff diff=1 " % (install.A_GP_BIN_DIR) +
-                       "filein=%s fileout=%s >> %s 2>&1" %
-                       (filein, fileout, self.log))
-                bband_utils.runprog(cmd, abort_on_error=True, print_cmd=False)
-
-                # Check file length
-                bband_utils.check_path_lengths(["%s/%d.%s.acc.%s" %
-                                                (a_tmpdir, sim_id, stat, c)],
-                                               bband_utils.GP_MAX_FILENAME)
-
-            # Now we need to convert them back to bbp
-            # Create path names and check if their sizes are
-            # within bounds
-            nsfile = os.path.join(a_tmpdir,
-                                  "%d.%s.acc.000" % (sim_id, stat))
-            ewfile = os.path.join(a_tmpdir,
-                                  "%d.%s.acc.090" % (sim_id, stat))
-            udfile = os.path.join(a_tmpdir,
-                                  "%d.%s.acc.ver" % (sim_id, stat))
-            bbpfile = os.path.join(a_tmpdir,
-                                   "%d.%s.acc.bbp" % (sim_id, stat))
-
-            bband_utils.check_path_lengths([nsfile, ewfile, udfile],
-                                           bband_utils.GP_MAX_FILENAME)
-
-            cmd = ("%s/wcc2bbp " % (install.A_GP_BIN_DIR) +
-                   "nsfile=%s ewfile=%s udfile=%s " %
-                   (nsfile, ewfile, udfile) +
-                   "units=cm/s/s wcc2bbp=1 > %s 2>> %s" %
-                   (bbpfile, self.log))
-            bband_utils.runprog(cmd, abort_on_error=True, print_cmd=False)
-
-            # Now we need to convert to peer format
-            out_n_acc = os.path.join(a_tmpdir,
-                                     "%d.%s.peer_n.acc" % (sim_id, stat))
-            out_e_acc = os.path.join(a_tmpdir,
-                                     "%d.%s.peer_e.acc" % (sim_id, stat))
-            out_z_acc = os.path.join(a_tmpdir,
-                                     "%d.%s.peer_z.acc" % (sim_id, stat))
-            bbp_formatter.bbp2peer(bbpfile, out_n_acc, out_e_acc, out_z_acc)
-
-            # Let's have rotD50 create these output files
-            out_rotd50_base = "%d.%s.rd50" % (sim_id, stat)
-            tmp_rotd50 = os.path.join(a_tmpdir, out_rotd50_base)
-            out_rotd50 = os.path.join(a_outdir, out_rotd50_base)
-
-            # Run the rotD50 program
-            self.do_rotd50(a_tmpdir, out_e_acc, out_n_acc, out_z_acc,
-                           out_rotd50, self.log)
-
-            cmd = "cp %s %s" % (tmp_rotd50, out_rotd50)
-            bband_utils.runprog(cmd, abort_on_error=True, print_cmd=False)
+        # Process all stations
+        bband_utils.run_stations(self.process_station, site_list,
+                                 args=(a_tmpdir, a_outdir),
+                                 jobs=install.num_jobs, logfile=self.log)
 
         # All done!
         print("RotD50 Completed".center(80, '-'))
@@ -0,0 +1,328 @@
+#!/usr/bin/env python
+"""
+Southern California Earthquake Center Broadband Platform
+Copyright 2010-2016 Southern California Earthquake Center
+
+In-process implementation of the UCB rotd50/rotd100 codes. Computes
+the oscillator responses for all periods and rotation angles using
+NumPy arrays, and returns RotD50, RotD100 and RotI50 directly. Output
+files use the same layout as the Fortran codes.
+
+When the BBP_ROTD_VALIDATE environment variable is set, the RotD50
+and RotD100 modules also run the Fortran codes and compare both
+outputs using compare_rotd_files.
+"""
+from __future__ import division, print_function
+
+# Import Python modules
+import os
+import shutil
+import tempfile
+import numpy as np
+from scipy.signal import lfilter
+
+# Import Broadband modules
+import bband_utils
+import install_cfg
+
+# Periods used by the rotd50/rotd100 codes
+RSP_PERIODS = [0.010, 0.011, 0.012, 0.013, 0.015, 0.017, 0.020, 0.022,
+               0.025, 0.029, 0.032, 0.035, 0.040, 0.045, 0.050, 0.055,
+               0.060, 0.065, 0.075, 0.085, 0.100, 0.110, 0.120, 0.130,
+               0.150, 0.170, 0.200, 0.220, 0.240, 0.260, 0.280, 0.300,
+               0.350, 0.400, 0.450, 0.500, 0.550, 0.600, 0.650, 0.750,
+               0.850, 1.000, 1.100, 1.200, 1.300, 1.500, 1.700, 2.000,
+               2.200, 2.400, 2.600, 2.800, 3.000, 3.500, 4.000, 4.400,
+               5.000, 5.500, 6.000, 6.500, 7.500, 8.500, 10.000]
+DAMPING = 0.05
+# Records are interpolated in the frequency domain to dt <= DT_MAX
+DT_MAX = 0.001
+# Number of rotation angles, each angle also gives the response at +90
+NUM_ANGLES = 90
+# Number of points rotated at a time, limits memory usage
+ROTATION_BLOCK = 16384
+# Maximum relative difference accepted in validation mode
+VALIDATION_TOLERANCE = 0.01
+
+def validation_mode():
+    """
+    Returns True if we should validate the results against the
+    Fortran rotd codes
+    """
+    return os.getenv("BBP_ROTD_VALIDATE", "0") not in ["", "0"]
+
+def interp_freq(acc, dt):
+    """
+    Interpolates the records in acc (one per row) to a time step
+    smaller than DT_MAX by padding in the frequency domain, same as
+    the InterpFreq subroutine in the Fortran code. Returns the
+    interpolated records and the new dt
+    """
+    dt32 = np.float32(dt)
+    factor = 2 ** (int(np.log(dt32 / np.float32(DT_MAX)) /
+                       np.log(np.float32(2.0))) + 1)
+    npts = acc.shape[1]
+    npts2 = 2 ** int(np.log(np.float32(npts)) /
+                     np.log(np.float32(2.0)) + np.float32(0.9999))
+
+    # Pad with zeros to a power of 2, move to the frequency domain,
+    # halve the Nyquist value and pad with zeros up to the new Nyquist
+    spectra = np.fft.rfft(acc, n=npts2, axis=1)
+    spectra[:, -1] = spectra[:, -1] / 2.0
+    interp = np.fft.irfft(spectra, n=factor * npts2, axis=1) * factor
+
+    return interp.astype(np.float32), dt32 / factor
+
+def calc_rsp_th(acc, dt, w, damping):
+    """
+    Computes the pseudo-acceleration time histories of an oscillator
+    with frequency w (rad/s) and damping for all records in acc (one
+    per row). The oscillator recurrence from the brs subroutine is
+    applied as an equivalent 2nd order IIR filter
+    """
+    beta = np.float64(np.float32(damping))
+    dt = np.float64(dt)
+    w = np.float64(w)
+
+    # Same coefficients as the coeff subroutine
+    t1 = np.sqrt(1.0 - beta ** 2)
+    t2 = np.sin(w * t1 * dt)
+    t3 = np.cos(w * t1 * dt)
+    t4 = np.exp(-beta * w * dt)
+    s1 = (2.0 * beta ** 2 - 1.0) / (w ** 2 * dt)
+    s2 = 2.0 * beta / (w ** 3 * dt)
+
+    a11 = t4 * (beta * t2 / t1 + t3)
+    a12 = t4 * t2 / (w * t1)
+    a21 = -t4 * w * t2 / t1
+    a22 = t4 * (t3 - beta * t2 / t1)
+
+    b11 = t4 * ((s1 + beta / w) * t2 / (w * t1) +
+                (s2 + 1.0 / w ** 2) * t3) - s2
+    b12 = -t4 * (s1 * t2 / (w * t1) + s2 * t3) - 1.0 / w ** 2 + s2
+    b21 = (s1 + beta / w) * (t3 - beta * t2 / t1)
+    b21 = (t4 * (b21 - (s2 + 1.0 / w ** 2) * (w * t1 * t2 + beta * w * t3)) +
+           1.0 / (w ** 2 * dt))
+
+    b22 = s1 * (t3 - beta * t2 / t1)
+    b22 = (-t4 * (b22 - s2 * (w * t1 * t2 + beta * w * t3)) -
+           1.0 / (w ** 2 * dt))
+
+    # Relative displacement d[i] = a11 d[i-1] + a12 v[i-1] +
+    # b11 x[i-1] + b12 x[i], written as a transfer function
+    num = [b12, b11 - a22 * b12 + a12 * b22, a12 * b21 - a22 * b11]
+    den = [1.0, -(a11 + a22), a11 * a22 - a12 * a21]
+    disp = lfilter(num, den, acc, axis=1)
+
+    return (disp.astype(np.float32) *
+            np.float64(np.float32(w) ** 2)).astype(np.float32)
+
+def calc_rotd(acc_e, acc_n, dt, periods=None, damping=DAMPING):
+    """
+    Calculates the response spectra of the two horizontal components
+    acc_e and acc_n (in g) rotated through 180 degrees. Returns a
+    dictionary with the as-recorded PSa (psa5_e and psa5_n), rotd50,
+    rotd100 and roti50 arrays, and the roti50 angle (degrees)
+    """
+    if periods is None:
+        periods = RSP_PERIODS
+    npts = min(len(acc_e), len(acc_n))
+    acc = np.vstack((np.asarray(acc_e[:npts], dtype=np.float32),
+                     np.asarray(acc_n[:npts], dtype=np.float32)))
+    acc, dt = interp_freq(acc, dt)
+
+    angles = (np.arange(NUM_ANGLES, dtype=np.float32) *
+              np.float32(3.14159) / np.float32(180.0))
+    cos1 = np.cos(angles)[:, np.newaxis]
+    sin1 = np.sin(angles)[:, np.newaxis]
+
+    # Response for each period for angles 0-179 degrees, as the
+    # response of the second rotated component at angle a is the
+    # response of the first at a + 90
+    rot_sa = np.empty((len(periods), 2 * NUM_ANGLES))
+    for idx, period in enumerate(periods):
+        w = np.float32(2.0) * np.float32(3.14159) / np.float32(period)
+        rsp = calc_rsp_th(acc, dt, w, damping)
+
+        # Only points with amplitude on one component at least
+        # SaMin/1.5 can define the peak of the rotated responses
+        amps = np.abs(rsp)
+        test = amps.max(axis=1).min() / np.float32(1.5)
+        keep = np.maximum(amps[0], amps[1]) > test
+        rsp1 = rsp[0, keep]
+        rsp2 = rsp[1, keep]
+
+        sa_x = np.zeros(NUM_ANGLES, dtype=np.float32) - np.float32(1.0e30)
+        sa_y = np.zeros(NUM_ANGLES, dtype=np.float32) - np.float32(1.0e30)
+        for start in range(0, len(rsp1), ROTATION_BLOCK):
+            blk1 = rsp1[start:start + ROTATION_BLOCK]
+            blk2 = rsp2[start:start + ROTATION_BLOCK]
+            sa_x = np.maximum(sa_x,
+                              np.abs(cos1 * blk1 - sin1 * blk2).max(axis=1))
+            sa_y = np.maximum(sa_y,
+                              np.abs(sin1 * blk1 + cos1 * blk2).max(axis=1))
+        rot_sa[idx, :NUM_ANGLES] = sa_x
+        rot_sa[idx, NUM_ANGLES:] = sa_y
+
+    sorted_sa = np.sort(rot_sa, axis=1)
+    rotd50 = (sorted_sa[:, NUM_ANGLES - 1] + sorted_sa[:, NUM_ANGLES]) / 2.0
+    rotd100 = sorted_sa[:, -1]
+
+    # RotI50 uses the single angle that minimizes the spread of the
+    # rotated responses around RotD50 across all periods
+    penalty = np.sum((rot_sa / rotd50[:, np.newaxis] - 1.0) ** 2, axis=0)
+    roti50_angle = int(np.argmin(penalty))
+
+    return {"periods": np.array(periods),
+            "psa5_e": rot_sa[:, 0],
+            "psa5_n": rot_sa[:, NUM_ANGLES],
+            "rotd50": rotd50,
+            "rotd100": rotd100,
+            "roti50": rot_sa[:, roti50_angle],
+            "roti50_angle": roti50_angle}
+
+def read_peer_acc(peer_file):
+    """
+    Reads a 6 header line PEER acceleration file, returns the samples
+    (in g) and dt
+    """
+    input_file = open(peer_file, 'r')
+    lines = input_file.readlines()
+    input_file.close()
+
+    pieces = lines[5].split()
+    npts = int(pieces[0])
+    dt = float(pieces[1])
+    samples = np.array(" ".join(lines[6:]).split(), dtype=float)
+
+    return samples[:npts], dt
+
+def read_bbp_vel2acc(bbp_file):
+    """
+    Reads a velocity bbp file (cm/s) and returns the dt and the
+    differentiated N, E and Z acceleration records (in g). Uses the
+    same backward difference as integ_diff
+    """
+    data = np.loadtxt(bbp_file, comments='#')
+    # Same rounding used when writing dt to a PEER file
+    dt = float("%1.6f" % (data[1, 0] - data[0, 0]))
+    vel = data[:, 1:4].T
+    acc = np.empty_like(vel)
+    acc[:, 0] = vel[:, 0]
+    acc[:, 1:] = np.diff(vel, axis=1)
+    acc = acc / dt / bband_utils.G2CMSS
+
+    return dt, acc[0], acc[1], acc[2]
+
+def fortran_e10_5(value):
+    """
+    Formats value the same way as the Fortran e10.5 edit descriptor
+    """
+    mantissa, exponent = ("%.4E" % (value)).split("E")
+    sign = ""
+    if mantissa.startswith("-"):
+        sign = "-"
+        mantissa = mantissa[1:]
+    if float(mantissa) == 0.0:
+        return "%s.00000E+00" % (sign)
+    return "%s.%s%sE%+03d" % (sign, mantissa[0], mantissa[2:],
+                              int(exponent) + 1)
+
+def write_rotd_file(output_file, label_e, label_n, results,
+                    with_rotd100=False):
+    """
+    Writes the RotD50 (or RotD100, if with_rotd100 is set) output
+    file using the Fortran file layout
+    """
+    columns = ["psa5_n", "psa5_e", "rotd50"]
+    header = "#  Psa5_N Psa5_E RotD50"
+    if with_rotd100:
+        columns.append("rotd100")
+        header = "%s RotD100" % (header)
+
+    out_file = open(output_file, 'w')
+    out_file.write("%s\n" % (header))
+    out_file.write("#  %-80s\n" % (label_e[:80]))
+    out_file.write("#  %-80s\n" % (label_n[:80]))
+    out_file.write("#  %5d%10.4f\n" % (len(results["periods"]), DAMPING))
+    for idx, period in enumerate(results["periods"]):
+        out_file.write("%10.4f %s\n" %
+                       (period, " ".join([fortran_e10_5(results[col][idx])
+                                          for col in columns])))
+    out_file.close()
+
+def compare_rotd_files(ref_file, new_file):
+    """
+    Returns the maximum relative difference between two rotd output
+    files
+    """
+    ref_data = np.loadtxt(ref_file, comments='#')
+    new_data = np.loadtxt(new_file, comments='#')
+    if ref_data.shape != new_data.shape:
+        raise bband_utils.ProcessingError("Files %s and %s have different "
+                                          "sizes!" % (ref_file, new_file))
+    return np.max(np.abs(new_data[:, 1:] - ref_data[:, 1:]) /
+                  np.abs(ref_data[:, 1:]))
+
+def run_rotd_fortran(program, workdir, peer_input_e_file, peer_input_n_file,
+                     output_file, logfile):
+    """
+    Runs the Fortran program (rotd50 or rotd100) on a pair of PEER
+    files inside workdir, writing output_file there. The codes read
+    their configuration from a fixed file name in the current
+    directory, so each call gets its own directory under workdir
+    """
+    install = install_cfg.InstallCfg.getInstance()
+    rundir = tempfile.mkdtemp(prefix="%s-" % (program), dir=workdir)
+
+    try:
+        # File names are relative to rundir, the Fortran codes only
+        # take names up to 80 characters
+        peer_input_e_file = os.path.join(os.pardir,
+                                         os.path.basename(peer_input_e_file))
+        peer_input_n_file = os.path.join(os.pardir,
+                                         os.path.basename(peer_input_n_file))
+        output_file = os.path.basename(output_file)
+
+        # Make sure we remove the output files first or Fortran will
+        # complain if they already exist
+        try:
+            os.unlink(os.path.join(workdir, output_file))
+        except OSError:
+            pass
+
+        # Write config file for the Fortran program
+        conf_file = open(os.path.join(rundir, "%s_inp.cfg" % (program)), 'w')
+        # This flag indicates inputs acceleration
+        conf_file.write("2 interp flag\n")
+        # This flag indicate we are processing two input files (horizontals)
+        conf_file.write("1 Npairs\n")
+        # Number of headers in the file
+        conf_file.write("6 Nhead\n")
+        conf_file.write("%s\n" % (peer_input_e_file))
+        conf_file.write("%s\n" % (peer_input_n_file))
+        conf_file.write("%s\n" % (os.path.join(os.pardir, output_file)))
+        conf_file.close()
+
+        progstring = ("cd %s && %s >> %s 2>&1" %
+                      (rundir, os.path.join(install.A_UCB_BIN_DIR, program),
+                       os.path.abspath(logfile)))
+        bband_utils.runprog(progstring, abort_on_error=True, print_cmd=False)
+    finally:
+        shutil.rmtree(rundir, ignore_errors=True)
+
+def do_rotd(workdir, peer_input_e_file, peer_input_n_file,
+            output_file, with_rotd100=False):
+    """
+    Calculates RotD50 (and RotD100 when with_rotd100 is set) for a
+    pair of PEER files inside workdir, writing output_file
+    """
+    acc_e, dt = read_peer_acc(os.path.join(workdir, peer_input_e_file))
+    acc_n, _ = read_peer_acc(os.path.join(workdir, peer_input_n_file))
+    results = calc_rotd(acc_e, acc_n, dt)
+    write_rotd_file(os.path.join(workdir, output_file),
+                    os.path.basename(peer_input_e_file),
+                    os.path.basename(peer_input_n_file),
+                    results, with_rotd100=with_rotd100)
+
+    return results
@@ -35,7 +35,11 @@ import seqnum
 import bbp_status
 import xml_handler
 import build_workflow
+import timeline
+import seis_cache
+import srf_reader
 from optfile import OptFile
+from stage_cache import StageCache
 
 # Here some global variables
 install = InstallCfg.getInstance()
@@ -91,8 +95,15 @@ parser.add_option("-r", "--resume", dest="resume_module",
                   help="Resume workflow from a certain module")
 parser.add_option("-e", "--end", dest="end_module",
                   help="End workflow after a certain module")
+parser.add_option("-j", "--jobs", dest="jobs", type="int", default=1,
+                  help=("Number of processes used to process stations "
+                        "in parallel"), metavar="JOBS")
 parser.add_option("--expert", action="store_true", dest="expert",
                   help="Turn on expert mode")
+parser.add_option("--stage-cache", dest="stage_cache",
+                  help=("Reuse the outputs of modules whose inputs have not "
+                        "changed, keeping them in CACHE_DIR"),
+                  metavar="CACHE_DIR")
 
 (options, args) = parser.parse_args()
 
@@ -111,6 +122,10 @@ if options.resume_module is not None:
     if options.xmlFile is None or options.inputSimID is None:
         parser.error("Resume option requires both -x and -s options.")
 
+if options.jobs < 1:
+    parser.error("Number of jobs must be a positive integer.")
+install.set_num_jobs(options.jobs)
+
 # Check if user specified sim_id
 if options.inputSimID:
     try:
@@ -258,9 +273,33 @@ if options.noxml is None:
     out_xml = os.path.join(a_outdir, "%s.xml" % (sim_id))
     shutil.copy2(run_xml, out_xml)
 
+# Record module, station and external program timings
+timeline_file = os.path.join(a_logdir, "%d.timeline.jsonl" % (sim_id))
+timeline.enable(timeline_file)
+
+# Parse each seismogram, spectrum and SRF file only once in this run
+seis_cache_dir = os.path.join(a_tmpdir, "seis_cache")
+seis_cache.enable(seis_cache_dir)
+srf_cache_dir = os.path.join(a_tmpdir, "srf_cache")
+srf_reader.enable(srf_cache_dir)
+
+# Initialize the stage cache, if requested
+stage_cache = None
+if options.stage_cache is not None:
+    stage_cache = StageCache(os.path.abspath(options.stage_cache), sim_id,
+                             {"indata": a_indir, "tmpdata": a_tmpdir,
+                              "outdata": a_outdir, "logs": a_logdir},
+                             install.VERSION,
+                             ignore_files=[timeline_file],
+                             ignore_dirs=[seis_cache_dir, srf_cache_dir])
+cache_key = None
+
 # Run xml Broadband workflow
 last_module = None
 for item in workflow:
+    if stage_cache is not None:
+        # Key depends on this module and all modules before it
+        cache_key = stage_cache.get_key(item, cache_key)
     # Check if we need to stop at a certain module
     if options.end_module is not None:
         if last_module == options.end_module.lower():
@@ -279,9 +318,20 @@ for item in workflow:
         options.resume_module = None
     try:
         # print("Running %s" % (item.getName()))
-        item.stage(a_indir)
-        obj = item.instantiate(sim_id)
-        obj.run()
+        with timeline.Timer("module", item.getName()) as module_timer:
+            item.stage(a_indir)
+            if stage_cache is not None and stage_cache.lookup(cache_key):
+                num_files = stage_cache.restore(cache_key)
+                print("==> Restored: %s (%d files from stage cache)" %
+                      (item.getName(), num_files))
+                module_timer.extra["restored"] = True
+                continue
+            if stage_cache is not None:
+                before = stage_cache.snapshot()
+            obj = item.instantiate(sim_id)
+            obj.run()
+            if stage_cache is not None:
+                stage_cache.store(cache_key, item.getName(), before)
     except Exception as err:
         fp = open("%s/fatal_error.log" % a_logdir, 'w')
         fp.write("%s\n" % err)
@@ -291,6 +341,20 @@ for item in workflow:
         traceback.print_exc()
         sys.exit(-3)
 
+# Performance summary
+seis_cache.disable()
+srf_reader.disable()
+timeline.disable()
+# Nothing is recorded when all modules were skipped
+if os.path.exists(timeline_file):
+    timeline_events = timeline.read_timeline(timeline_file)
+    timeline.write_chrome_trace(timeline_events,
+                                os.path.join(a_logdir,
+                                             "%d.trace.json" % (sim_id)))
+    print()
+    print("Performance summary".center(80, '-'))
+    print(timeline.summarize(timeline_events))
+
 # All done!
 print()
 print("SCEC Broadband Platform run completed.")
@@ -11,6 +11,7 @@ from __future__ import division, print_function
 import os
 import sys
 import math
+import zlib
 from scipy import integrate
 # from scipy.signal import butter, filtfilt
 from scipy import interpolate
@@ -23,54 +24,46 @@ import pylab
 # Import BBP modules
 import bband_utils
 import plot_config
+import bbp_formatter
 from install_cfg import InstallCfg
 from station_list import StationList
 
 CM2G = 980.664999
 RZZ_DT = 0.02
+# Number of simulations averaged for each damping value
+RZZ_NUM_SIMS = 20
+# Number of filter columns built at a time in the simulations
+RZZ_FILTER_COLUMNS = 256
 
 class RZZ2015(object):
     """
     This class implements the Rezaeian-Zhong-Zareian 2015 validation metrics
     """
 
-    def __init__(self, r_stations, eventname, sim_id=0):
+    def __init__(self, r_stations, eventname, sim_id=0, seed=None):
         """
-        Initilize class variables
+        Initilize class variables, seed makes the damping simulations
+        reproducible
         """
         self.eventname = eventname
         self.stations = r_stations
         self.log = None
         self.sim_id = sim_id
+        self.seed = seed
 
-    def read_bbp(self, bbp_file):
+    def read_bbp(self, bbp_file, store_dir=None):
         """
         This function reads the input bbp_file and returns 4 arrays
         containing the timestamps and 3 time series. This function
-        converts all BBP files from cm/2^2 to g
+        converts all BBP files from cm/2^2 to g. The seismogram is
+        read from the seismogram store in store_dir when it has it
 
         """
-        times = []
-        comp1 = []
-        comp2 = []
-        comp3 = []
-
-        ifile = open(bbp_file, 'r')
-        for line in ifile:
-            line = line.strip()
-            # Skip comments
-            if line.startswith('%') or line.startswith('#'):
-                continue
-            pieces = [float(x) for x in line.split()]
-            times.append(pieces[0])
-            comp1.append(pieces[1] / CM2G)
-            comp2.append(pieces[2] / CM2G)
-            comp3.append(pieces[3] / CM2G)
-        # Close input file
-        ifile.close()
+        data = bbp_formatter.read_seismogram(bbp_file, store_dir)
 
         # All done, return arrays
-        return times, comp1, comp2, comp3
+        return (data[0].tolist(), (data[1] / CM2G).tolist(),
+                (data[2] / CM2G).tolist(), (data[3] / CM2G).tolist())
 
     def arias(self, F, dt, percent):
         """
@@ -221,7 +214,33 @@ class RZZ2015(object):
 
         return new_times, new_data, RZZ_DT
 
-    def sim_f(self, w0, wn, zeta, n, deltat):
+    def sim_filter(self, w0, wn, zeta, t, j0, j1):
+        """
+        Builds columns j0 to j1 of the time-varying filter used for the
+        unmodulated simulations. Returns the block H of the response
+        matrix, where H[i - j0, j - j0] is the response at t[i] to a
+        unit impulse at t[j], for rows i >= j0 (the response is zero
+        before the impulse)
+        w0: frequency at the begining (rad/sec = 2pi*Hz)
+        wn: frequency at the end
+        zeta: constant damping ratio
+        t: time vector
+        """
+        # Filter frequency for each impulse time tj (columns)
+        omega = w0 - (w0 - wn) * t[j0:j1] / t[-1]
+        omegaD = omega * math.sqrt(1 - zeta**2)
+
+        # Time elapsed since each impulse, where sin(0) gives zero
+        # before the impulse
+        lag = t[j0:, None] - t[None, j0:j1]
+        np.maximum(lag, 0.0, out=lag)
+        H = np.exp((-zeta * omega)[None, :] * lag)
+        H *= np.sin(omegaD[None, :] * lag)
+        H *= (omega / math.sqrt(1 - zeta**2))[None, :]
+
+        return H
+
+    def sim_f(self, w0, wn, zeta, n, deltat, num_sims=1, prng=np.random):
         """
         Generates the unmodulated simulations that are "not" post-processed yet
         w0: frequency at the begining (rad/sec = 2pi*Hz)
@@ -229,65 +248,54 @@ class RZZ2015(object):
         zeta: constant damping ratio
         n: length of acceleration vector
         deltat: time steps
+        num_sims: number of simulations, returned one per row when
+                  larger than 1
+        prng: random number generator used for the white noise
         """
         t = np.linspace(0, deltat * (n-1), n)
-        f = np.zeros(n)
-        C = np.zeros(n)
+
+        # White noise, one row for each simulation
+        u = prng.normal(0, size=(num_sims, n))
 
         # Find the scale parameter, C vector (see eqn 3 in the qual. report,
-        # C is the denominator). And construct the Sj vectors to evaluate f
-        # vector (see equations 2 and 3 in the report)
-        for j in range(0, n):
-            tj = t[j]
-            uj = np.random.normal(0)
-            omega = w0 - (w0 - wn) * tj / t[n-1]
-            omegaD = omega * math.sqrt(1 - zeta**2)
-            Cj = np.zeros(n)
-            Sj = np.zeros(n)
-            for i in range(0, n):
-                ti = t[i]
-                if ti >= tj:
-                    hf = (omega / math.sqrt(1 - zeta**2) *
-                          math.exp(-zeta * omega * (ti-tj)) *
-                          math.sin(omegaD * (ti-tj)))
-                    Cj[i] = hf ** 2
-                    Sj[i] = hf
-                else:
-                    Cj[i] = 0.0
-                    Sj[i] = 0.0
-            C = C + Cj
-            f = f + Sj * uj
-        C = C ** 0.5
+        # C is the denominator). The Sj vectors used to evaluate f
+        # (see equations 2 and 3 in the report) are the columns of the
+        # filter, built RZZ_FILTER_COLUMNS at a time to bound the memory
+        C = np.zeros(n)
+        f = np.zeros((num_sims, n))
+        for j0 in range(0, n, RZZ_FILTER_COLUMNS):
+            j1 = min(j0 + RZZ_FILTER_COLUMNS, n)
+            H = self.sim_filter(w0, wn, zeta, t, j0, j1)
+            C[j0:] += np.sum(H * H, axis=1)
+            f[:, j0:] += np.dot(u[:, j0:j1], H.T)
+        C = np.sqrt(C)
         C[0] = 0.1
 
         # Scale f to normalize its standard deviation
         f = f / C
 
+        if num_sims == 1:
+            return f[0], t
         return f, t
 
     def nmax_pmin(self, F, n):
         """
         Gives the cumulative count of negative-maximums and
-        positive-minimums of F, a vector of size n, as a function of time
+        positive-minimums of F, a vector of size n, as a function of time.
+        F can also be a 2D array with one vector per row
         """
-        I = np.zeros(n-2)
-        count_min = 0
-        count_max = 0
+        F = np.asarray(F)[..., :n]
+        prev_val = F[..., :-2]
+        cur_val = F[..., 1:-1]
+        next_val = F[..., 2:]
 
-        for r in range(1, n-1):
-            if F[r] > 0:
-                if F[r-1] > F[r]:
-                    if F[r+1] > F[r]:
-                        count_min = count_min + 1
-            else:
-                if F[r-1] < F[r]:
-                    if F[r+1] < F[r]:
-                        count_max = count_max + 1
-            I[r-1] = count_min + count_max
+        positive = cur_val > 0
+        pos_min = positive & (prev_val > cur_val) & (next_val > cur_val)
+        neg_max = ~positive & (prev_val < cur_val) & (next_val < cur_val)
+        I = np.cumsum(pos_min | neg_max, axis=-1).astype('float64')
 
-        I = np.insert(I, 0, I[0], axis=0)
-        I = np.insert(I, len(I), I[-1], axis=0)
-        return I
+        # Repeat the first and last counts at both ends
+        return np.concatenate([I[..., :1], I, I[..., -1:]], axis=-1)
 
     def zhatcalc(self, error, target_lp):
         """
@@ -319,9 +327,10 @@ class RZZ2015(object):
 
         return zhat
 
-    def damping_z(self, tf, deltat, wmid, wslope):
+    def damping_z(self, tf, deltat, wmid, wslope, prng=np.random):
         """
-        Calculate the bandwidth parameter zeta
+        Calculate the bandwidth parameter zeta, prng is the random
+        number generator used for the simulations
         """
 
         # Cut the target at 5% and 9% arias intensity
@@ -343,24 +352,17 @@ class RZZ2015(object):
         # freq (Hz) at the end of the motion to be simulated
         wn = wmid + wslope * (t95 - t45)
 
-        sim_lp = {}
-        for k in range(0, 9):
-            sim_lp[k] = None
-            for j in range(0, 20):
-                # Unmodulated simulation for the cut (5-95) motion
-                sim_f = self.sim_f(w0*2*np.pi, wn*2*np.pi, (k+1)*0.1,
-                                  len(tf_cut), deltat)[0]
-                # Cumulative nmax+pmin: (Local Peaks)
-                new_row = self.nmax_pmin(sim_f, len(sim_f))
-                if sim_lp[k] is None:
-                    sim_lp[k] = new_row
-                else:
-                    sim_lp[k] = np.vstack((sim_lp[k], new_row))
-
-        # Take average of every 20 set of simulations
         avg_lp = {}
         for k in range(0, 9):
-            avg_lp[k] = sum(sim_lp[k]) / 20.0
+            # Unmodulated simulations for the cut (5-95) motion, all
+            # realizations share the same filter
+            sim_f = self.sim_f(w0*2*np.pi, wn*2*np.pi, (k+1)*0.1,
+                               len(tf_cut), deltat,
+                               num_sims=RZZ_NUM_SIMS, prng=prng)[0]
+            # Cumulative nmax+pmin: (Local Peaks)
+            sim_lp = self.nmax_pmin(sim_f, len(tf_cut))
+            # Take average of every set of simulations
+            avg_lp[k] = np.sum(sim_lp, axis=0) / float(RZZ_NUM_SIMS)
 
         # Calculate errors (to see which column of avg_LP is
         # closer to the target nmax+pmin)
@@ -381,12 +383,9 @@ class RZZ2015(object):
                 obs_times, obs_data, sym_times, sym_data):
         """
         This function computes the validation metrics of RZZ2015 for a
-        given pair of timeseries
+        given pair of timeseries, returns the line for the output file
         """
-        # Create path for our plot and output file
-        out_file = os.path.join(output_dir,
-                                '%d.rzz2015.%s.txt' %
-                                (self.sim_id, self.eventname))
+        # Create path for our plot
         out_plot = os.path.join(output_dir,
                                 '%d.rzz2015.%s.%03d.png' %
                                 (self.sim_id, stat, comp))
@@ -704,36 +703,12 @@ class RZZ2015(object):
         # motion), and 2 scalar error terms for metric 3
 
         # Recorded motion
-        tcountmin = 0
-        tcountmax = 0
-        ttot = np.zeros((1, len(tf)-2))[0]
-        for r in range(1, len(tf) - 1):
-            if tf[r] > 0:
-                if tf[r-1] > tf[r]:
-                    if tf[r+1] > tf[r]:
-                        tcountmin = tcountmin + 1
-            else:
-                if tf[r-1] < tf[r]:
-                    if tf[r+1] < tf[r]:
-                        tcountmax = tcountmax + 1
-            ttot[r-1] = tcountmin + tcountmax
+        ttot = self.nmax_pmin(tf, len(tf))[1:-1]
 
         tt3 = np.linspace(0, (len(ttot)-1) * deltat, len(ttot))
 
         # Simulated motion
-        tcountmin = 0
-        tcountmax = 0
-        tot = np.zeros((1, len(x)-2))[0]
-        for r in range(1, len(x) - 1):
-            if x[r] > 0:
-                if x[r-1] > x[r]:
-                    if x[r+1] > x[r]:
-                        tcountmin = tcountmin + 1
-            else:
-                if x[r-1] < x[r]:
-                    if x[r+1] < x[r]:
-                        tcountmax = tcountmax + 1
-            tot[r-1] = tcountmin + tcountmax
+        tot = self.nmax_pmin(x, len(x))[1:-1]
 
         tot = tot[0:len(ttot)]
 
@@ -743,8 +718,17 @@ class RZZ2015(object):
         metric_error_shape_3 = metric_error_6 / metric_error_3
 
         # Calculate the bandwidth parameter zeta
-        result_6 = self.damping_z(tf, deltat, result_4, result_5)
-        result_12 = self.damping_z(x, deltat, result_10, result_11)
+        if self.seed is None:
+            # run_stations reseeds this in each worker
+            prng = np.random
+        else:
+            # Same random numbers for a station and component no
+            # matter the order in which stations are processed
+            prng = np.random.RandomState([self.seed,
+                                          zlib.crc32(stat.encode()) &
+                                          0xffffffff, int(comp)])
+        result_6 = self.damping_z(tf, deltat, result_4, result_5, prng)
+        result_12 = self.damping_z(x, deltat, result_10, result_11, prng)
 
         # Plot validation metric 3
         subfig = axs[1][2]
@@ -802,19 +786,52 @@ class RZZ2015(object):
         r6_record = result_6
         r6_siml = result_12
 
-        # Write data to file
-        ofile = open(out_file, 'a')
-        ofile.write("%s, %03d, " % (stat, comp) +
-                    "%7.4f, %7.4f, " % (epsilon_a, nu_a) +
-                    "%7.4f, %7.4f, " % (epsilon_b, nu_b) +
-                    "%7.4f, %7.4f, " % (epsilon_c, nu_c) +
-                    "%7.4f, %7.4f, " % (r1_record, r1_siml) +
-                    "%7.4f, %7.4f, " % (r2_record, r2_siml) +
-                    "%7.4f, %7.4f, " % (r3_record, r3_siml) +
-                    "%7.4f, %7.4f, " % (r4_record, r4_siml) +
-                    "%7.4f, %7.4f, " % (r5_record, r5_siml) +
-                    "%7.2f, %7.2f\n" % (r6_record, r6_siml))
-        ofile.close()
+        # Data for the output file
+        return ("%s, %03d, " % (stat, comp) +
+                "%7.4f, %7.4f, " % (epsilon_a, nu_a) +
+                "%7.4f, %7.4f, " % (epsilon_b, nu_b) +
+                "%7.4f, %7.4f, " % (epsilon_c, nu_c) +
+                "%7.4f, %7.4f, " % (r1_record, r1_siml) +
+                "%7.4f, %7.4f, " % (r2_record, r2_siml) +
+                "%7.4f, %7.4f, " % (r3_record, r3_siml) +
+                "%7.4f, %7.4f, " % (r4_record, r4_siml) +
+                "%7.4f, %7.4f, " % (r5_record, r5_siml) +
+                "%7.2f, %7.2f\n" % (r6_record, r6_siml))
+
+    def process_station(self, site, logfile, obs_dir, a_outdir,
+                        a_validation_outdir):
+        """
+        Computes the RZZ2015 metrics for both horizontal components of
+        a station, returns the lines for the output file
+        """
+        sim_id = self.sim_id
+        stat = site.scode
+        r_obs_bbp = "%s.bbp" % (stat)
+        a_obs_bbp = os.path.join(obs_dir, r_obs_bbp)
+        r_sym_bbp = "%d.%s.acc.bbp" % (sim_id, stat)
+        a_sym_bbp = os.path.join(a_outdir, r_sym_bbp)
+
+        if not (os.path.exists(a_obs_bbp) and
+                os.path.exists(a_sym_bbp)):
+            # Just skip it
+            print("===> Couldn't find files "
+                  "%s and %s, skipping station %s" %
+                  (a_obs_bbp, a_sym_bbp, stat))
+            return []
+
+        obs_data = self.read_bbp(a_obs_bbp,
+                                 os.path.join(obs_dir,
+                                              bbp_formatter.OBS_SEIS_STORE))
+        sym_data = self.read_bbp(a_sym_bbp)
+
+        # Process each component separately
+        lines = []
+        for comp in range(1, 3):
+            lines.append(self.process(stat, comp, a_validation_outdir,
+                                      obs_data[0], obs_data[comp],
+                                      sym_data[0], sym_data[comp]))
+
+        return lines
 
     def run(self):
         """
@@ -847,6 +864,13 @@ class RZZ2015(object):
         slo = StationList(sta_file)
         site_list = slo.getStationList()
 
+        # Process all stations
+        results = bband_utils.run_stations(self.process_station, site_list,
+                                           args=(obs_dir, a_outdir,
+                                                 a_validation_outdir),
+                                           jobs=install.num_jobs,
+                                           logfile=self.log)
+
         # Create output file, add header
         out_file = open(os.path.join(a_validation_outdir,
                                      '%d.rzz2015.%s.txt' %
@@ -856,33 +880,12 @@ class RZZ2015(object):
                        " r1_record, r1_siml, r2_record, r2_siml,"
                        " r3_record, r3_siml, r4_record, r4_siml,"
                        " r5_record, r5_siml, r6_record, r6_siml\n")
+        # Write results in station order
+        for lines in results:
+            for line in lines:
+                out_file.write(line)
         out_file.close()
 
-        # Go through each station
-        for site in site_list:
-            stat = site.scode
-            r_obs_bbp = "%s.bbp" % (stat)
-            a_obs_bbp = os.path.join(obs_dir, r_obs_bbp)
-            r_sym_bbp = "%d.%s.acc.bbp" % (sim_id, stat)
-            a_sym_bbp = os.path.join(a_outdir, r_sym_bbp)
-
-            if not (os.path.exists(a_obs_bbp) and
-                    os.path.exists(a_sym_bbp)):
-                # Just skip it
-                print("===> Couldn't find files "
-                      "%s and %s, skipping station %s" %
-                      (a_obs_bbp, a_sym_bbp, stat))
-                continue
-
-            obs_data = self.read_bbp(a_obs_bbp)
-            sym_data = self.read_bbp(a_sym_bbp)
-
-            # Process each component separately
-            for comp in range(1, 3):
-                self.process(stat, comp, a_validation_outdir,
-                             obs_data[0], obs_data[comp],
-                             sym_data[0], sym_data[comp])
-
         print("RZZ2015 Completed".center(80, '-'))
 
 if __name__ == "__main__":
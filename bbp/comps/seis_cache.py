@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+"""
+Southern California Earthquake Center Broadband Platform
+Copyright 2010-2016 Southern California Earthquake Center
+
+Per-run cache of the parsed columns of text seismograms (bbp) and
+response spectra (rd50) files. While enabled, each file is parsed once
+and kept in memory and in a binary sidecar in the cache directory, so
+all validation metrics of a run (and their station worker processes)
+share the parsed data instead of reading the text files again
+"""
+from __future__ import division, print_function
+
+# Import Python modules
+import os
+import hashlib
+from collections import OrderedDict
+import numpy as np
+
+# Import Broadband modules
+import bband_utils
+
+# Directory with the sidecar files, None when the cache is disabled
+CACHE_DIR = None
+# Maximum number of bytes of parsed data kept in memory
+MEMORY_LIMIT = 256 * 1024 * 1024
+
+# Parsed files in memory, oldest first, indexed by absolute path
+_entries = OrderedDict()
+_entries_bytes = [0]
+
+def enable(cache_dir):
+    """
+    Starts caching parsed files, using cache_dir for the sidecars
+    """
+    global CACHE_DIR
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    CACHE_DIR = cache_dir
+
+def disable():
+    """
+    Stops caching parsed files and empties the in-memory cache
+    """
+    global CACHE_DIR
+    CACHE_DIR = None
+    _entries.clear()
+    _entries_bytes[0] = 0
+
+def parse_columns(filename):
+    """
+    Parses a whitespace separated text file, skipping blank lines,
+    '%' lines and '#' comments. Returns a (columns, rows) array and
+    the line number of each row in the file
+    """
+    input_file = open(filename, 'r')
+    lines = input_file.readlines()
+    input_file.close()
+
+    rows = []
+    line_numbers = []
+    for line_number, line in enumerate(lines):
+        row = line.split('#', 1)[0]
+        if not row.strip() or row.lstrip().startswith('%'):
+            continue
+        rows.append(row)
+        line_numbers.append(line_number)
+    if not rows:
+        return np.empty((0, 0)), np.array(line_numbers, dtype=np.int64)
+
+    num_cols = len(rows[0].split())
+    try:
+        values = np.array(" ".join(rows).split(), dtype='float64')
+    except ValueError:
+        values = None
+    if values is None or values.size != len(rows) * num_cols:
+        raise bband_utils.ProcessingError("Unexpected line format "
+                                          "found in %s!" % (filename))
+
+    return (values.reshape(len(rows), num_cols).T,
+            np.array(line_numbers, dtype=np.int64))
+
+def sidecar_file(filename):
+    """
+    Returns the path of the sidecar for filename in the cache directory
+    """
+    digest = hashlib.sha1(filename.encode()).hexdigest()
+    return os.path.join(CACHE_DIR, "%s.npz" % (digest))
+
+def load_sidecar(filename, stamp):
+    """
+    Returns the data and line numbers saved for filename, or None if
+    there is no sidecar or it was made from a different version of
+    the file
+    """
+    cache_file = sidecar_file(filename)
+    if not os.path.exists(cache_file):
+        return None
+    try:
+        sidecar = np.load(cache_file)
+        try:
+            if not np.array_equal(sidecar["stamp"], stamp):
+                return None
+            return sidecar["data"], sidecar["line_numbers"]
+        finally:
+            sidecar.close()
+    except (IOError, ValueError, KeyError):
+        # Unreadable sidecar, parse the file again
+        return None
+
+def save_sidecar(filename, stamp, data, line_numbers):
+    """
+    Saves the parsed data of filename. The sidecar is written to a
+    temporary file and renamed, so other processes never read a
+    partial sidecar
+    """
+    cache_file = sidecar_file(filename)
+    tmp_file = "%s.%d.tmp" % (cache_file, os.getpid())
+    out_file = open(tmp_file, 'wb')
+    np.savez(out_file, stamp=stamp, data=data, line_numbers=line_numbers)
+    out_file.close()
+    os.rename(tmp_file, cache_file)
+
+def remember(filename, stamp, data, line_numbers):
+    """
+    Keeps the parsed data of filename in memory, dropping the oldest
+    entries when going over MEMORY_LIMIT
+    """
+    if filename in _entries:
+        _entries_bytes[0] = _entries_bytes[0] - _entries.pop(filename)[1].nbytes
+    _entries[filename] = (stamp, data, line_numbers)
+    _entries_bytes[0] = _entries_bytes[0] + data.nbytes
+    while _entries_bytes[0] > MEMORY_LIMIT and len(_entries) > 1:
+        _, (_, old_data, _) = _entries.popitem(last=False)
+        _entries_bytes[0] = _entries_bytes[0] - old_data.nbytes
+
+def read_columns(filename, skip_lines=0):
+    """
+    Reads a whitespace separated text file like parse_columns, but
+    ignoring data in the first skip_lines lines, and returns an array
+    for each column. When the cache is enabled, files already parsed
+    in this run are not read again
+    """
+    if CACHE_DIR is None:
+        data, line_numbers = parse_columns(filename)
+    else:
+        filename = os.path.abspath(filename)
+        stat = os.stat(filename)
+        stamp = np.array([stat.st_size, stat.st_mtime], dtype='float64')
+        entry = _entries.get(filename)
+        if entry is not None and np.array_equal(entry[0], stamp):
+            _, data, line_numbers = entry
+        else:
+            saved = load_sidecar(filename, stamp)
+            if saved is None:
+                data, line_numbers = parse_columns(filename)
+                save_sidecar(filename, stamp, data, line_numbers)
+            else:
+                data, line_numbers = saved
+            remember(filename, stamp, data, line_numbers)
+
+    if skip_lines > 0:
+        # Copy, callers may change the arrays
+        return data[:, line_numbers >= skip_lines]
+    return data.copy()
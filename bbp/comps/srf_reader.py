@@ -0,0 +1,297 @@
+#!/usr/bin/env python
+"""
+Southern California Earthquake Center Broadband Platform
+Copyright 2010-2016 Southern California Earthquake Center
+
+Reader for SRF (Standard Rupture Format) files. An SRF file is parsed
+once into columnar arrays: the plane headers, one row per point with
+its geometry and slip, and all slip-rate functions concatenated with
+the offsets of each point's series. While the cache is enabled the
+arrays are also saved as memory-mappable .npy files keyed by the hash
+of the SRF file, so other modules and processes do not parse it again
+"""
+from __future__ import division, print_function
+
+# Import Python modules
+import os
+import re
+import json
+import shutil
+import hashlib
+import tempfile
+import numpy as np
+
+# Import Broadband modules
+import bband_utils
+
+# Change this when the layout of the cache entries changes
+SRF_CACHE_VERSION = 1
+# Directory with the cached SRF arrays, None when the cache is disabled
+CACHE_DIR = None
+# Block size used when hashing SRF files
+HASH_BLOCK_SIZE = 1024 * 1024
+
+# Columns of the plane headers (two lines for each plane)
+PLANE_COLUMNS = ["elon", "elat", "nstk", "ndip", "len", "wid",
+                 "stk", "dip", "dtop", "shyp", "dhyp"]
+# Columns of the points, vs and den are only in version 2 files
+POINT_COLUMNS = ["lon", "lat", "dep", "stk", "dip", "area", "tinit", "dt",
+                 "vs", "den", "rake", "slip1", "nt1", "slip2", "nt2",
+                 "slip3", "nt3"]
+
+# SRF files already read in this process, indexed by absolute path
+_srfs = {}
+
+def enable(cache_dir):
+    """
+    Starts caching parsed SRF files in cache_dir
+    """
+    global CACHE_DIR
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    CACHE_DIR = cache_dir
+
+def disable():
+    """
+    Stops caching parsed SRF files
+    """
+    global CACHE_DIR
+    CACHE_DIR = None
+    _srfs.clear()
+
+class SRFData(object):
+    """
+    Contents of an SRF file. planes has one row per plane and points
+    one row per point, with the columns in PLANE_COLUMNS and
+    POINT_COLUMNS. sr has all slip-rate functions, the ones for point
+    i and component c (0-2) are in sr[sr_offsets[3 * i + c]:
+    sr_offsets[3 * i + c + 1]]
+    """
+
+    def __init__(self, version, planes, points, sr_offsets, sr):
+        self.version = version
+        self.planes = planes
+        self.points = points
+        self.sr_offsets = sr_offsets
+        self.sr = sr
+
+    def num_points(self):
+        """
+        Returns the number of points in the SRF
+        """
+        return self.points.shape[0]
+
+    def plane(self, name):
+        """
+        Returns column name of the plane headers
+        """
+        return np.array(self.planes[:, PLANE_COLUMNS.index(name)])
+
+    def column(self, name):
+        """
+        Returns column name of the points
+        """
+        return np.array(self.points[:, POINT_COLUMNS.index(name)])
+
+    def slip_rate(self, point, comp=0):
+        """
+        Returns the slip-rate function of component comp (0-2) of
+        point, reading only that series from the cached arrays
+        """
+        idx = 3 * point + comp
+        return self.sr[self.sr_offsets[idx]:self.sr_offsets[idx + 1]]
+
+def hash_srf(srf_file):
+    """
+    Returns the sha1 hash of the contents of srf_file
+    """
+    digest = hashlib.sha1()
+    in_file = open(srf_file, 'rb')
+    while True:
+        block = in_file.read(HASH_BLOCK_SIZE)
+        if not block:
+            break
+        digest.update(block)
+    in_file.close()
+    return digest.hexdigest()
+
+def parse_header(lines, srf_file):
+    """
+    Parses the header lines of an SRF file (everything before the
+    first POINTS line), returns the version and the planes array
+    """
+    lines = [line for line in lines
+             if line.strip() and not line.lstrip().startswith('#')]
+    try:
+        version = float(lines[0].split()[0])
+        tokens = lines[1].split()
+        if len(tokens) != 2 or tokens[0] != "PLANE":
+            raise ValueError
+        num_planes = int(tokens[1])
+        if len(lines) != 2 + 2 * num_planes:
+            raise ValueError
+        planes = []
+        for plane in range(num_planes):
+            tokens = (lines[2 + 2 * plane].split() +
+                      lines[3 + 2 * plane].split())
+            if len(tokens) != len(PLANE_COLUMNS):
+                raise ValueError
+            planes.append([float(token) for token in tokens])
+    except (IndexError, ValueError):
+        raise bband_utils.ProcessingError("Invalid SRF file (%s)!" %
+                                          (srf_file))
+
+    return version, np.array(planes, dtype=float).reshape(-1,
+                                                          len(PLANE_COLUMNS))
+
+def read_srf_header(srf_file):
+    """
+    Reads only the header of srf_file, returns the version and the
+    planes array
+    """
+    if not os.path.exists(srf_file):
+        raise bband_utils.ParameterError("Missing SRF file (%s)!" %
+                                         (srf_file))
+    lines = []
+    in_file = open(srf_file, 'r')
+    for line in in_file:
+        if line.startswith("POINTS"):
+            break
+        lines.append(line)
+    in_file.close()
+
+    return parse_header(lines, srf_file)
+
+def parse_points(values, num_points, version, srf_file):
+    """
+    Splits the values of a POINTS block into the points array and the
+    slip-rate payload
+    """
+    num_head = 8 if version < 2.0 else 10
+    row_size = num_head + 7
+    # Find where each point starts
+    starts = np.empty(num_points, dtype=np.int64)
+    pos = 0
+    try:
+        for point in range(num_points):
+            starts[point] = pos
+            nts = values[pos + num_head + 2:pos + row_size:2]
+            pos = pos + row_size + int(nts[0] + nts[1] + nts[2])
+    except IndexError:
+        pos = -1
+    if pos != values.size:
+        raise bband_utils.ProcessingError("Invalid SRF version %d "
+                                          "file (%s)!" %
+                                          (int(version), srf_file))
+
+    rows = starts[:, np.newaxis] + np.arange(row_size)
+    points = values[rows]
+    if num_head == 8:
+        # No vs and den in version 1 files
+        points = np.insert(points, [num_head, num_head], np.nan, axis=1)
+    payload = np.ones(values.size, dtype=bool)
+    payload[rows] = False
+
+    return points, values[payload]
+
+def parse_srf(srf_file):
+    """
+    Parses srf_file, returns an SRFData object
+    """
+    if not os.path.exists(srf_file):
+        raise bband_utils.ParameterError("Missing SRF file (%s)!" %
+                                         (srf_file))
+    in_file = open(srf_file, 'r')
+    text = in_file.read()
+    in_file.close()
+
+    # Split the header and the POINTS blocks
+    blocks = re.split(r'^[ \t]*POINTS[ \t]+(\S+)[ \t]*$', text, flags=re.M)
+    version, planes = parse_header(blocks[0].splitlines(), srf_file)
+    if len(blocks) < 3:
+        raise bband_utils.ProcessingError("Invalid SRF file (%s)!" %
+                                          (srf_file))
+    all_points = []
+    all_sr = []
+    for count, block in zip(blocks[1::2], blocks[2::2]):
+        try:
+            num_points = int(count)
+            values = np.array(block.split(), dtype=float)
+        except ValueError:
+            raise bband_utils.ProcessingError("Invalid SRF file (%s)!" %
+                                              (srf_file))
+        points, sr = parse_points(values, num_points, version, srf_file)
+        all_points.append(points)
+        all_sr.append(sr)
+    points = np.concatenate(all_points)
+    nts = points[:, [POINT_COLUMNS.index("nt1"),
+                     POINT_COLUMNS.index("nt2"),
+                     POINT_COLUMNS.index("nt3")]]
+    sr_offsets = np.zeros(nts.size + 1, dtype=np.int64)
+    sr_offsets[1:] = np.cumsum(nts.ravel().astype(np.int64))
+
+    return SRFData(version, planes, points, sr_offsets,
+                   np.concatenate(all_sr))
+
+def load_cached_srf(entry_dir):
+    """
+    Returns the SRFData saved in entry_dir, with memory-mapped
+    arrays, or None if there is no valid entry
+    """
+    index_file = os.path.join(entry_dir, "index.json")
+    if not os.path.exists(index_file):
+        return None
+    in_file = open(index_file, 'r')
+    index = json.load(in_file)
+    in_file.close()
+    if index["version"] != SRF_CACHE_VERSION:
+        return None
+    arrays = [np.load(os.path.join(entry_dir, "%s.npy" % (name)),
+                      mmap_mode='r')
+              for name in ["planes", "points", "sr_offsets", "sr"]]
+    return SRFData(index["srf_version"], *arrays)
+
+def save_cached_srf(entry_dir, srf):
+    """
+    Saves srf in entry_dir. The entry is written to a temporary
+    directory and renamed, so partial entries are never used
+    """
+    parent_dir = os.path.dirname(entry_dir)
+    tmp_dir = tempfile.mkdtemp(dir=parent_dir, prefix=".tmp_")
+    for name in ["planes", "points", "sr_offsets", "sr"]:
+        np.save(os.path.join(tmp_dir, "%s.npy" % (name)), getattr(srf, name))
+    out_file = open(os.path.join(tmp_dir, "index.json"), 'w')
+    json.dump({"version": SRF_CACHE_VERSION,
+               "srf_version": srf.version}, out_file)
+    out_file.close()
+    try:
+        os.rename(tmp_dir, entry_dir)
+    except OSError:
+        # Another process saved the same file first
+        shutil.rmtree(tmp_dir)
+
+def read_srf(srf_file):
+    """
+    Returns an SRFData object with the contents of srf_file. When the
+    cache is enabled, files already parsed are loaded from the cache
+    """
+    if CACHE_DIR is None:
+        return parse_srf(srf_file)
+    if not os.path.exists(srf_file):
+        raise bband_utils.ParameterError("Missing SRF file (%s)!" %
+                                         (srf_file))
+
+    srf_file = os.path.abspath(srf_file)
+    stat = os.stat(srf_file)
+    stamp = (stat.st_size, stat.st_mtime)
+    if srf_file in _srfs and _srfs[srf_file][0] == stamp:
+        return _srfs[srf_file][1]
+
+    entry_dir = os.path.join(CACHE_DIR, hash_srf(srf_file))
+    srf = load_cached_srf(entry_dir)
+    if srf is None:
+        srf = parse_srf(srf_file)
+        save_cached_srf(entry_dir, srf)
+    _srfs[srf_file] = (stamp, srf)
+
+    return srf
@@ -0,0 +1,277 @@
+#!/usr/bin/env python
+"""
+Southern California Earthquake Center Broadband Platform
+Copyright 2010-2016 Southern California Earthquake Center
+
+Content-addressed cache of the files produced by each module of a
+Broadband workflow, used by run_bbp.py to skip modules whose inputs
+have not changed since a previous run
+"""
+from __future__ import division, print_function
+
+# Import Python modules
+import os
+import re
+import json
+import shutil
+import hashlib
+import tempfile
+
+# Import Broadband modules
+import validation_cfg
+
+# Change this when the layout of the cache entries changes
+STAGE_CACHE_VERSION = 2
+# Placeholder for the simulation id in the file names and contents of
+# cache entries
+SIM_ID_TOKEN = "{sim_id}"
+# Shorter simulation ids cannot be told apart from other numbers in
+# the outputs, their entries are only reused by the same simulation id
+SIM_ID_MIN_DIGITS = 4
+# Block size used when hashing files
+HASH_BLOCK_SIZE = 1024 * 1024
+
+def hash_file(filename, digest=None):
+    """
+    Adds the contents of filename to digest (a new sha1 object if
+    None) and returns it
+    """
+    if digest is None:
+        digest = hashlib.sha1()
+    in_file = open(filename, 'rb')
+    while True:
+        block = in_file.read(HASH_BLOCK_SIZE)
+        if not block:
+            break
+        digest.update(block)
+    in_file.close()
+    return digest
+
+def arg_token(arg):
+    """
+    Returns a string that uniquely describes a module argument, using
+    the same representation as the workflow XML files. Arguments that
+    point to existing files also include the file contents
+    """
+    if isinstance(arg, validation_cfg.ValidationEvent):
+        return "validation_cfg.VE_EVENTS:%s" % (arg.get_validation_name())
+    if isinstance(arg, dict):
+        items = ["%s=%s" % (key, arg_token(arg[key]))
+                 for key in sorted(arg.keys())]
+        return "dict:{%s}" % (",".join(items))
+    token = "%s:%s" % (arg.__class__.__name__, str(arg))
+    if (isinstance(arg, str) and os.path.isabs(arg) and
+        os.path.isfile(arg)):
+        token = "%s:%s" % (token, hash_file(arg).hexdigest())
+    return token
+
+class StageCache(object):
+    """
+    Stores the files each module writes to the run directories (indata,
+    tmpdata, outdata and logs for the simulation), keyed by a hash of
+    the module name, its arguments, its staged files and the key of the
+    module before it in the workflow
+    """
+
+    def __init__(self, cache_dir, sim_id, run_dirs, version="",
+                 ignore_files=(), ignore_dirs=()):
+        """
+        run_dirs maps a short area name to each run directory, version
+        is the Broadband version, included in all keys. Files in
+        ignore_files and anything under ignore_dirs are never stored
+        """
+        self.cache_dir = cache_dir
+        self.sim_id = sim_id
+        self.run_dirs = run_dirs
+        self.version = version
+        self.ignore_files = set([os.path.abspath(filename)
+                                 for filename in ignore_files])
+        self.ignore_dirs = set([os.path.abspath(dirname)
+                                for dirname in ignore_dirs])
+        # Simulation id as a whole token, not part of a word or of a
+        # decimal number
+        self.sim_id_re = re.compile(r'(?<![0-9A-Za-z])(?<![0-9]\.)%d'
+                                    r'(?![0-9A-Za-z])(?!\.[0-9])' % (sim_id))
+        self.sim_id_bytes_re = re.compile(self.sim_id_re.pattern.encode())
+        self.portable = len(str(sim_id)) >= SIM_ID_MIN_DIGITS
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+    def get_key(self, module, upstream_key=None):
+        """
+        Returns the cache key for module (a module.Module object), the
+        workflow up to this module is described by upstream_key
+        """
+        digest = hashlib.sha1()
+        digest.update(("stage cache %d %s\n" %
+                       (STAGE_CACHE_VERSION, self.version)).encode())
+        digest.update(("upstream %s\n" % (upstream_key)).encode())
+        digest.update(("module %s\n" % (module.getName())).encode())
+        for arg in module.getArgs():
+            digest.update(("arg %s\n" % (arg_token(arg))).encode())
+        kw_args = module.getKeywordArgs()
+        for keyword in sorted(kw_args.keys()):
+            if keyword == "sim_id":
+                continue
+            digest.update(("kwarg %s %s\n" %
+                           (keyword, arg_token(kw_args[keyword]))).encode())
+        for stage_file in module.getStageFiles():
+            digest.update(("stage %s\n" %
+                           (os.path.basename(stage_file))).encode())
+            digest = hash_file(stage_file, digest)
+        return digest.hexdigest()
+
+    def entry_dir(self, key, sim_id=None):
+        """
+        Returns the directory holding the cache entry for key, or the
+        one only used by sim_id if not None
+        """
+        if sim_id is not None:
+            key = "%s-%d" % (key, sim_id)
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def find_entry(self, key):
+        """
+        Returns the directory of the entry for key that can be used
+        by this simulation, None if there is no complete entry
+        """
+        for entry_dir in [self.entry_dir(key, self.sim_id),
+                          self.entry_dir(key)]:
+            if os.path.exists(os.path.join(entry_dir, "manifest.json")):
+                return entry_dir
+        return None
+
+    def snapshot(self):
+        """
+        Returns the size and modification time of all files in the
+        run directories, indexed by (area, relative path)
+        """
+        files = {}
+        for area, run_dir in self.run_dirs.items():
+            for root, dirnames, filenames in os.walk(run_dir):
+                dirnames[:] = [dirname for dirname in dirnames
+                               if os.path.abspath(os.path.join(root, dirname))
+                               not in self.ignore_dirs]
+                for filename in filenames:
+                    path = os.path.join(root, filename)
+                    if os.path.abspath(path) in self.ignore_files:
+                        continue
+                    stat = os.stat(path)
+                    files[(area, os.path.relpath(path, run_dir))] = (
+                        stat.st_size, stat.st_mtime)
+        return files
+
+    def lookup(self, key):
+        """
+        Returns True if there is a complete cache entry for key
+        """
+        return self.find_entry(key) is not None
+
+    def store(self, key, module_name, before):
+        """
+        Saves the files that were added or changed in the run
+        directories since the before snapshot as the entry for key.
+        The simulation id is replaced with SIM_ID_TOKEN in file names
+        and text files, if any binary file contains it the entry is
+        only used by this simulation id
+        """
+        after = self.snapshot()
+        outputs = sorted([item for item in after
+                          if before.get(item) != after[item]])
+
+        # Text outputs that contain the simulation id
+        text_outputs = set()
+        portable = self.portable
+        for area, rel_path in outputs:
+            if not portable:
+                break
+            in_file = open(os.path.join(self.run_dirs[area], rel_path), 'rb')
+            data = in_file.read()
+            in_file.close()
+            if self.sim_id_bytes_re.search(data) is None:
+                continue
+            if b"\0" in data:
+                portable = False
+            else:
+                text_outputs.add((area, rel_path))
+        if portable:
+            entry_dir = self.entry_dir(key)
+        else:
+            entry_dir = self.entry_dir(key, self.sim_id)
+
+        # Build the entry in a temporary directory and move it into
+        # place, so partial entries are never used
+        parent_dir = os.path.dirname(entry_dir)
+        if not os.path.exists(parent_dir):
+            os.makedirs(parent_dir)
+        tmp_dir = tempfile.mkdtemp(dir=parent_dir, prefix=".tmp_%s" % (key))
+        files = []
+        for area, rel_path in outputs:
+            src_file = os.path.join(self.run_dirs[area], rel_path)
+            if portable:
+                cache_path = self.sim_id_re.sub(SIM_ID_TOKEN, rel_path)
+            else:
+                cache_path = rel_path
+            dst_file = os.path.join(tmp_dir, area, cache_path)
+            if not os.path.exists(os.path.dirname(dst_file)):
+                os.makedirs(os.path.dirname(dst_file))
+            is_text = portable and (area, rel_path) in text_outputs
+            if is_text:
+                in_file = open(src_file, 'rb')
+                data = self.sim_id_bytes_re.sub(SIM_ID_TOKEN.encode(),
+                                                in_file.read())
+                in_file.close()
+                out_file = open(dst_file, 'wb')
+                out_file.write(data)
+                out_file.close()
+                shutil.copystat(src_file, dst_file)
+            else:
+                shutil.copy2(src_file, dst_file)
+            files.append([area, cache_path, is_text])
+        manifest = open(os.path.join(tmp_dir, "manifest.json"), 'w')
+        json.dump({"version": STAGE_CACHE_VERSION,
+                   "module": module_name,
+                   "sim_id": self.sim_id,
+                   "portable": portable,
+                   "files": files}, manifest, indent=1)
+        manifest.close()
+        try:
+            os.rename(tmp_dir, entry_dir)
+        except OSError:
+            # Another run stored the same entry first
+            shutil.rmtree(tmp_dir)
+
+        return len(files)
+
+    def restore(self, key):
+        """
+        Copies the files in the entry for key to the run directories,
+        replacing SIM_ID_TOKEN with the current simulation id in their
+        names and text contents. Returns the number of files restored
+        """
+        entry_dir = self.find_entry(key)
+        manifest = open(os.path.join(entry_dir, "manifest.json"), 'r')
+        entry = json.load(manifest)
+        manifest.close()
+        for area, cache_path, is_text in entry["files"]:
+            src_file = os.path.join(entry_dir, area, cache_path)
+            if entry["portable"]:
+                rel_path = cache_path.replace(SIM_ID_TOKEN, str(self.sim_id))
+            else:
+                rel_path = cache_path
+            dst_file = os.path.join(self.run_dirs[area], rel_path)
+            if not os.path.exists(os.path.dirname(dst_file)):
+                os.makedirs(os.path.dirname(dst_file))
+            if is_text:
+                in_file = open(src_file, 'rb')
+                data = in_file.read().replace(SIM_ID_TOKEN.encode(),
+                                              str(self.sim_id).encode())
+                in_file.close()
+                out_file = open(dst_file, 'wb')
+                out_file.write(data)
+                out_file.close()
+                shutil.copystat(src_file, dst_file)
+            else:
+                shutil.copy2(src_file, dst_file)
+
+        return len(entry["files"])
@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+"""
+Southern California Earthquake Center Broadband Platform
+Copyright 2010-2016 Southern California Earthquake Center
+
+Performance timeline for Broadband runs. Records wall time, CPU time
+and peak memory of workflow modules, external programs and station
+tasks as JSON lines, and summarizes them at the end of a run
+"""
+from __future__ import division, print_function
+
+# Import Python modules
+import os
+import sys
+import json
+import time
+import errno
+import resource
+
+# File where events are appended, None when the timeline is disabled
+TIMELINE_FILE = None
+
+# Event categories, in the order used by the summary
+CATEGORIES = ["module", "station", "subprocess"]
+
+def enable(filename):
+    """
+    Starts recording events to filename
+    """
+    global TIMELINE_FILE
+    TIMELINE_FILE = filename
+
+def disable():
+    """
+    Stops recording events
+    """
+    global TIMELINE_FILE
+    TIMELINE_FILE = None
+
+def maxrss_kb(usage):
+    """
+    Returns the peak resident set size in usage in kilobytes
+    """
+    if sys.platform == 'darwin':
+        # Reported in bytes on Mac OS X
+        return usage.ru_maxrss // 1024
+    return usage.ru_maxrss
+
+def record(category, name, start, wall, cpu, rss_kb, **extra):
+    """
+    Appends one event to the timeline. Each event is written with a
+    single call to an append-only file, so events from station
+    worker processes do not get mixed up
+    """
+    if TIMELINE_FILE is None:
+        return
+    event = {"category": category, "name": name, "start": start,
+             "wall": wall, "cpu": cpu, "maxrss_kb": rss_kb,
+             "pid": os.getpid()}
+    event.update(extra)
+    line = "%s\n" % (json.dumps(event, sort_keys=True))
+    out_fd = os.open(TIMELINE_FILE, os.O_WRONLY | os.O_APPEND | os.O_CREAT,
+                     0o644)
+    try:
+        os.write(out_fd, line.encode())
+    finally:
+        os.close(out_fd)
+
+class Timer(object):
+    """
+    Context manager that records an event for the code it wraps. CPU
+    time includes the child processes that finished in the meantime,
+    the peak memory is the highest mark of this process or any of its
+    children so far
+    """
+
+    def __init__(self, category, name, **extra):
+        self.category = category
+        self.name = name
+        self.extra = extra
+        self.start = None
+        self.self_usage = None
+        self.children_usage = None
+
+    def __enter__(self):
+        if TIMELINE_FILE is not None:
+            self.self_usage = resource.getrusage(resource.RUSAGE_SELF)
+            self.children_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+            self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_tb):
+        if TIMELINE_FILE is None or self.start is None:
+            return False
+        wall = time.time() - self.start
+        self_usage = resource.getrusage(resource.RUSAGE_SELF)
+        children_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        cpu = (self_usage.ru_utime - self.self_usage.ru_utime +
+               self_usage.ru_stime - self.self_usage.ru_stime +
+               children_usage.ru_utime - self.children_usage.ru_utime +
+               children_usage.ru_stime - self.children_usage.ru_stime)
+        if exc_type is not None:
+            self.extra["failed"] = True
+        record(self.category, self.name, self.start, wall, cpu,
+               max(maxrss_kb(self_usage), maxrss_kb(children_usage)),
+               **self.extra)
+        return False
+
+def program_name(cmd):
+    """
+    Returns the name of the program run by shell command cmd, used to
+    label its events
+    """
+    elems = cmd.split()
+    if not elems:
+        return ""
+    return os.path.basename(elems[0])
+
+def wait_process(proc, start, cmd):
+    """
+    Waits for proc (a subprocess.Popen object started at time start)
+    and records its resource usage, returns its exit code
+    """
+    if TIMELINE_FILE is None:
+        return proc.wait()
+    while True:
+        try:
+            _, status, usage = os.wait4(proc.pid, 0)
+            break
+        except OSError as err:
+            if err.errno != errno.EINTR:
+                raise
+    wall = time.time() - start
+    if os.WIFSIGNALED(status):
+        proc.returncode = -os.WTERMSIG(status)
+    else:
+        proc.returncode = os.WEXITSTATUS(status)
+    record("subprocess", program_name(cmd), start, wall,
+           usage.ru_utime + usage.ru_stime, maxrss_kb(usage),
+           cmd=cmd, returncode=proc.returncode)
+    return proc.returncode
+
+def read_timeline(filename):
+    """
+    Returns the list of events in timeline file filename
+    """
+    events = []
+    in_file = open(filename, 'r')
+    for line in in_file:
+        line = line.strip()
+        if not line:
+            continue
+        events.append(json.loads(line))
+    in_file.close()
+    return events
+
+def summarize(events):
+    """
+    Returns a text table with the number of events, total wall and CPU
+    times and peak memory for each module, station function and
+    external program
+    """
+    totals = {}
+    order = []
+    for event in events:
+        key = (event["category"], event.get("function", event["name"]))
+        if key not in totals:
+            totals[key] = [0, 0.0, 0.0, 0]
+            order.append(key)
+        total = totals[key]
+        total[0] += 1
+        total[1] += event["wall"]
+        total[2] += event["cpu"]
+        total[3] = max(total[3], event["maxrss_kb"] or 0)
+
+    lines = ["%-10s %-30s %6s %11s %11s %11s" %
+             ("category", "name", "count", "wall (s)", "cpu (s)",
+              "peak (MB)")]
+    for category in CATEGORIES:
+        for key in order:
+            if key[0] != category:
+                continue
+            count, wall, cpu, rss = totals[key]
+            lines.append("%-10s %-30s %6d %11.2f %11.2f %11.1f" %
+                         (category, key[1][:30], count, wall, cpu,
+                          rss / 1024.0))
+    return "\n".join(lines)
+
+def write_chrome_trace(events, filename):
+    """
+    Writes events in the Chrome trace event format, which can be
+    loaded in chrome://tracing or Perfetto
+    """
+    trace_events = []
+    for event in events:
+        args = dict([(key, val) for key, val in event.items()
+                     if key not in ["category", "name", "start",
+                                    "wall", "pid"]])
+        trace_events.append({"name": event["name"],
+                             "cat": event["category"],
+                             "ph": "X",
+                             "ts": int(event["start"] * 1e6),
+                             "dur": int(event["wall"] * 1e6),
+                             "pid": 0,
+                             "tid": event["pid"],
+                             "args": args})
+    out_file = open(filename, 'w')
+    json.dump({"traceEvents": trace_events}, out_file)
+    out_file.close()
@@ -174,6 +174,93 @@ class UCSite(object):
 
         return stations_to_stitch
 
+    def process_station(self, result_file, logfile, a_tmpdir_mod,
+                        a_tmpdir, a_outdir):
+        """
+        Copies the 3comp result file for a station to the output
+        directory as a velocity bbp file, and creates the
+        corresponding acceleration bbp file
+        """
+        install = InstallCfg.getInstance()
+        sim_id = self.sim_id
+        cfg = self.cfg
+
+        basename = result_file[0:result_file.rfind('.3comp')]
+        result_file = os.path.join(a_tmpdir_mod, result_file)
+        shutil.copy2(result_file, "%s/%d.%s.vel.bbp" % (a_outdir,
+                                                        sim_id,
+                                                        basename))
+        shutil.copy2(result_file, "%s/%d.%s.vel.bbp" % (a_tmpdir,
+                                                        sim_id,
+                                                        basename))
+        shutil.copy2(result_file, "%s/%s.3comp" % (a_tmpdir, basename))
+
+        # Create acceleration seismogram
+
+        # Create path names and check if their sizes are
+        # within bounds
+        nsfile = os.path.join(a_tmpdir,
+                              "%d.%s.000" % (sim_id, basename))
+        ewfile = os.path.join(a_tmpdir,
+                              "%d.%s.090" % (sim_id, basename))
+        udfile = os.path.join(a_tmpdir,
+                              "%d.%s.ver" % (sim_id, basename))
+        bbpfile = os.path.join(a_tmpdir,
+                               "%d.%s.vel.bbp" % (sim_id, basename))
+
+        bband_utils.check_path_lengths([nsfile, ewfile, udfile],
+                                       bband_utils.GP_MAX_FILENAME)
+
+        cmd = ("%s/wcc2bbp " % (install.A_GP_BIN_DIR) +
+               "nsfile=%s ewfile=%s udfile=%s " %
+               (nsfile, ewfile, udfile) +
+               "wcc2bbp=0 < %s >> %s 2>&1" %
+               (bbpfile, logfile))
+        bband_utils.runprog(cmd, abort_on_error=True)
+
+        for comp in cfg.COMPS:
+            # Differentiate each component
+            filein = os.path.join(a_tmpdir,
+                                  "%d.%s.%s" %
+                                  (sim_id, basename, comp))
+            fileout = os.path.join(a_tmpdir,
+                                   "%d.%s.acc.%s" %
+                                   (sim_id, basename, comp))
+
+            bband_utils.check_path_lengths([filein, fileout],
+                                           bband_utils.GP_MAX_FILENAME)
+
+            cmd = ("%s/integ_diff diff=1 filein=%s fileout=%s" %
+                   (install.A_GP_BIN_DIR, filein, fileout))
+            bband_utils.runprog(cmd, abort_on_error=True)
+
+        # Create path names and check if their sizes are
+        # within bounds
+        nsfile = os.path.join(a_tmpdir,
+                              "%d.%s.acc.000" % (sim_id, basename))
+        ewfile = os.path.join(a_tmpdir,
+                              "%d.%s.acc.090" % (sim_id, basename))
+        udfile = os.path.join(a_tmpdir,
+                              "%d.%s.acc.ver" % (sim_id, basename))
+        bbpfile = os.path.join(a_tmpdir,
+                               "%d.%s.acc.bbp" % (sim_id, basename))
+
+        bband_utils.check_path_lengths([nsfile, ewfile, udfile],
+                                       bband_utils.GP_MAX_FILENAME)
+
+        cmd = ("%s/wcc2bbp " % (install.A_GP_BIN_DIR) +
+               "nsfile=%s ewfile=%s udfile=%s " %
+               (nsfile, ewfile, udfile) +
+               "units=cm/s/s wcc2bbp=1 > %s 2>> %s" %
+               (bbpfile, logfile))
+        bband_utils.runprog(cmd, abort_on_error=True)
+
+        # Copy acceleration bbp file to outdir
+        shutil.copy2(os.path.join(a_tmpdir, "%d.%s.acc.bbp" %
+                                  (sim_id, basename)),
+                     os.path.join(a_outdir, "%d.%s.acc.bbp" %
+                                  (sim_id, basename)))
+
     def run(self):
         """
         Runs the UCSB site response program
@@ -392,83 +479,11 @@ class UCSite(object):
         shutil.copy2("stations.ll.orig", "station.ll")
 
         # Move the results to the output directory, as bbp format
-        for result_file in os.listdir(a_tmpdir_mod):
-            dot_index = result_file.rfind('.3comp')
-            if dot_index > -1:
-                basename = result_file[0:dot_index]
-                shutil.copy2(result_file, "%s/%d.%s.vel.bbp" % (a_outdir,
-                                                                sim_id,
-                                                                basename))
-                shutil.copy2(result_file, "%s/%d.%s.vel.bbp" % (a_tmpdir,
-                                                                sim_id,
-                                                                basename))
-                shutil.copy2(result_file, "%s/%s.3comp" % (a_tmpdir, basename))
-
-                # Create acceleration seismogram
-
-                # Create path names and check if their sizes are
-                # within bounds
-                nsfile = os.path.join(a_tmpdir,
-                                      "%d.%s.000" % (sim_id, basename))
-                ewfile = os.path.join(a_tmpdir,
-                                      "%d.%s.090" % (sim_id, basename))
-                udfile = os.path.join(a_tmpdir,
-                                      "%d.%s.ver" % (sim_id, basename))
-                bbpfile = os.path.join(a_tmpdir,
-                                       "%d.%s.vel.bbp" % (sim_id, basename))
-
-                bband_utils.check_path_lengths([nsfile, ewfile, udfile],
-                                               bband_utils.GP_MAX_FILENAME)
-
-                cmd = ("%s/wcc2bbp " % (install.A_GP_BIN_DIR) +
-                       "nsfile=%s ewfile=%s udfile=%s " %
-                       (nsfile, ewfile, udfile) +
-                       "wcc2bbp=0 < %s >> %s 2>&1" %
-                       (bbpfile, self.log))
-                bband_utils.runprog(cmd, abort_on_error=True)
-
-                for comp in cfg.COMPS:
-                    # Differentiate each component
-                    filein = os.path.join(a_tmpdir,
-                                          "%d.%s.%s" %
-                                          (sim_id, basename, comp))
-                    fileout = os.path.join(a_tmpdir,
-                                           "%d.%s.acc.%s" %
-                                           (sim_id, basename, comp))
-
-                    bband_utils.check_path_lengths([filein, fileout],
-                                                   bband_utils.GP_MAX_FILENAME)
-
-                    cmd = ("%s/integ_diff diff=1 filein=%s fileout=%s" %
-                           (install.A_GP_BIN_DIR, filein, fileout))
-                    bband_utils.runprog(cmd, abort_on_error=True)
-
-                # Create path names and check if their sizes are
-                # within bounds
-                nsfile = os.path.join(a_tmpdir,
-                                      "%d.%s.acc.000" % (sim_id, basename))
-                ewfile = os.path.join(a_tmpdir,
-                                      "%d.%s.acc.090" % (sim_id, basename))
-                udfile = os.path.join(a_tmpdir,
-                                      "%d.%s.acc.ver" % (sim_id, basename))
-                bbpfile = os.path.join(a_tmpdir,
-                                       "%d.%s.acc.bbp" % (sim_id, basename))
-
-                bband_utils.check_path_lengths([nsfile, ewfile, udfile],
-                                               bband_utils.GP_MAX_FILENAME)
-
-                cmd = ("%s/wcc2bbp " % (install.A_GP_BIN_DIR) +
-                       "nsfile=%s ewfile=%s udfile=%s " %
-                       (nsfile, ewfile, udfile) +
-                       "units=cm/s/s wcc2bbp=1 > %s 2>> %s" %
-                       (bbpfile, self.log))
-                bband_utils.runprog(cmd, abort_on_error=True)
-
-                # Copy acceleration bbp file to outdir
-                shutil.copy2(os.path.join(a_tmpdir, "%d.%s.acc.bbp" %
-                                          (sim_id, basename)),
-                             os.path.join(a_outdir, "%d.%s.acc.bbp" %
-                                          (sim_id, basename)))
+        result_files = [result_file for result_file in os.listdir(a_tmpdir_mod)
+                        if result_file.rfind('.3comp') > -1]
+        bband_utils.run_stations(self.process_station, result_files,
+                                 args=(a_tmpdir_mod, a_tmpdir, a_outdir),
+                                 jobs=install.num_jobs, logfile=self.log)
 
         os.chdir(old_cwd)
 
@@ -11,9 +11,11 @@ from __future__ import division, print_function
 import os
 import sys
 import shutil
+import numpy as np
 
 # Import Broadband modules
 import bband_utils
+import bbp_formatter
 import fault_utils
 import stas2files
 from install_cfg import InstallCfg
@@ -36,9 +38,6 @@ class UCStitch(object):
 
     def make_bbp(self, a_tmpdir, site):
         print("Making bbp for %s." % (site))
-        bbp_fp = open(os.path.join(a_tmpdir,
-                                   "%d.%s-stitch.bbp" % (self.sim_id, site)),
-                      'w')
 
         gm_filenames = []
         gm_filenames.append("%s/%s.000.gmBB.001" % (a_tmpdir, site))
@@ -48,28 +47,29 @@ class UCStitch(object):
         for gm_filename in gm_filenames:
             print(gm_filename)
             tmp_fp = open(gm_filename, 'r')
-            tmp_data = []
             header = tmp_fp.readline()
-            for line in tmp_fp.readlines():
-                pieces = line.split()
-                for piece in pieces:
-                    tmp_data.append(piece.strip())
-            gm_data.append(tmp_data)
+            gm_data.append(np.array(tmp_fp.read().split(), dtype=float))
             tmp_fp.close()
 
         nt = int(header.split()[0])
         dt = float(header.split()[1])
-        ts = 0.0
         print(nt, dt)
 
+        npts = len(gm_data[0])
+        if len(gm_data[1]) < npts or len(gm_data[2]) < npts:
+            raise bband_utils.ProcessingError("Components for station %s "
+                                              "have different lengths!" %
+                                              (site))
+        data = np.vstack((bbp_formatter.time_axis(npts, dt),
+                          gm_data[0], gm_data[1][:npts], gm_data[2][:npts]))
+
+        bbp_fp = open(os.path.join(a_tmpdir,
+                                   "%d.%s-stitch.bbp" % (self.sim_id, site)),
+                      'w')
         bbp_fp.write("# nt = %d   dt = %f\n" % (nt, dt))
         bbp_fp.write("# t\tn/s\te/w\tu/d\n")
-
-        for i in range(0, len(gm_data[0])):
-            bbp_fp.write("%e\t%f\t%f\t%f\n" %
-                         (ts, float(gm_data[0][i]),
-                          float(gm_data[1][i]), float(gm_data[2][i])))
-            ts += dt
+        bbp_fp.write(bbp_formatter.format_samples("%e\t%f\t%f\t%f\n",
+                                                  data.T))
         bbp_fp.flush()
         bbp_fp.close()
 
@@ -84,29 +84,23 @@ class UCStitch(object):
         nl_filenames.append("%s/%s.000.nl1D.001" % (a_tmpdir, site))
         nl_filenames.append("%s/%s.090.nl1D.001" % (a_tmpdir, site))
         nl_filenames.append("%s/%s.ver.nl1D.001" % (a_tmpdir, site))
-        nl_fp = []
-        for nl_filename in nl_filenames:
-            nl_fp.append(open(nl_filename, 'w'))
-        line = bbp_data[0]
-        while line.startswith("%") or line.startswith("#"):
-            del bbp_data[0]
-            line = bbp_data[0]
-        for fp in nl_fp:
+        start_line = 0
+        while (bbp_data[start_line].startswith("%") or
+               bbp_data[start_line].startswith("#")):
+            start_line = start_line + 1
+        bbp_data = bbp_data[start_line:]
+        data = bbp_formatter.parse_samples(bbp_data, 4, bbp_file)
+
+        # nl1D requires 1 line with nt dt followed by 5 entries per line
+        num_lines, num_left = divmod(len(bbp_data), 5)
+        data_format = ("%f " * 5 + "\n") * num_lines + "%f " * num_left
+        for i, nl_filename in enumerate(nl_filenames):
+            nl_fp = open(nl_filename, 'w')
             #nt dt
-            fp.write("\t%d\t%f\n" % (len(bbp_data),
-                                     float(bbp_data[1].split()[0])))
-        count = 0
-        for line in bbp_data:
-            pieces = line.split()
-            for i in range(0, 3):
-                nl_fp[i].write("%f " % float(pieces[i+1]))
-            count += 1
-            if (count % 5) == 0:
-                for i in range(0, 3):
-                    nl_fp[i].write("\n")
-        for fp in nl_fp:
-            fp.flush()
-            fp.close()
+            nl_fp.write("\t%d\t%f\n" % (len(bbp_data), data[1][0]))
+            nl_fp.write(data_format % tuple(data[:, i + 1].tolist()))
+            nl_fp.flush()
+            nl_fp.close()
 
     def run(self):
         """
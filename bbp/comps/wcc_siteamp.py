@@ -38,7 +38,7 @@ class WccSiteamp(object):
         self.log = None
 
     def process_separate_seismograms(self, site, sta_base, vs30,
-                                     a_indir, a_tmpdir):
+                                     a_indir, a_tmpdir, logfile):
         """
         Runs the site response module for separate low and high
         frequency seismograms
@@ -74,7 +74,7 @@ class WccSiteamp(object):
                           (os.path.join(install.A_GP_BIN_DIR, "wcc2bbp"),
                            nsfile, ewfile, udfile) +
                           "wcc2bbp=0 < %s >> %s 2>&1" %
-                          (bbpfile, self.log))
+                          (bbpfile, logfile))
             bband_utils.runprog(progstring, abort_on_error=True,
                                 print_cmd=False)
 
@@ -96,7 +96,7 @@ class WccSiteamp(object):
                 cmd = ("%s diff=1 " %
                        (os.path.join(install.A_GP_BIN_DIR, "integ_diff")) +
                        "filein=%s fileout=%s >> %s 2>&1" %
-                       (filein, fileout, self.log))
+                       (filein, fileout, logfile))
                 bband_utils.runprog(cmd, abort_on_error=True,
                                     print_cmd=False)
 
@@ -111,7 +111,7 @@ class WccSiteamp(object):
                                             "wcc_getpeak")) +
                               "%s/temp_%s.acc.hf.%s > %s 2>> %s" %
                               (a_tmpdir, sta_base, compo,
-                               pga_filename, self.log))
+                               pga_filename, logfile))
                 # wcc_getpeak returns 33 even when it succeeds
                 bband_utils.runprog(progstring, print_cmd=False)
                 pga_file = open(pga_filename, "r")
@@ -159,7 +159,7 @@ class WccSiteamp(object):
                               'flowcap=%f infile=%s outfile=%s ' %
                               (flowcap, filein, fileout) +
                               "fmidbot=%s fmin=%s >> %s 2>&1" %
-                              (config.FMIDBOT, config.FMIN, self.log))
+                              (config.FMIDBOT, config.FMIN, logfile))
                 bband_utils.runprog(progstring, abort_on_error=True)
 
                 # Output becomes input
@@ -173,7 +173,7 @@ class WccSiteamp(object):
                 cmd = ("%s integ=1 " %
                        (os.path.join(install.A_GP_BIN_DIR, "integ_diff")) +
                        "filein=%s fileout=%s >> %s 2>&1" %
-                       (filein, fileout, self.log))
+                       (filein, fileout, logfile))
                 bband_utils.runprog(cmd, abort_on_error=True, print_cmd=False)
 
             # Do one time for acceleration
@@ -200,7 +200,7 @@ class WccSiteamp(object):
                           'title="%s Sim NGAH, stat=%s" ' %
                           (freq, site) +
                           'nsfile=%s ewfile=%s udfile=%s > %s 2>> %s' %
-                          (nsfile, ewfile, udfile, bbpfile, self.log))
+                          (nsfile, ewfile, udfile, bbpfile, logfile))
             bband_utils.runprog(progstring, abort_on_error=True,
                                 print_cmd=False)
 
@@ -228,13 +228,13 @@ class WccSiteamp(object):
                           'title="%s Sim NGAH, stat=%s" ' %
                           (freq, site) +
                           'nsfile=%s ewfile=%s udfile=%s > %s 2>> %s' %
-                          (nsfile, ewfile, udfile, bbpfile, self.log))
+                          (nsfile, ewfile, udfile, bbpfile, logfile))
             bband_utils.runprog(progstring, abort_on_error=True,
                                 print_cmd=False)
 
 
     def process_hybrid_seismogram(self, site, sta_base, vs30,
-                                  a_tmpdir, a_outdir):
+                                  a_tmpdir, a_outdir, logfile):
         """
         Runs the site response module for a hybrid seismogram
         """
@@ -280,7 +280,7 @@ class WccSiteamp(object):
                       "udfile=%s " % (udfile) +
                       "wcc2bbp=0 " +
                       "< %s >> %s 2>&1 " %
-                      (bbpfile, self.log))
+                      (bbpfile, logfile))
 
         bband_utils.runprog(progstring, abort_on_error=True, print_cmd=False)
 
@@ -299,7 +299,7 @@ class WccSiteamp(object):
             cmd = ("%s diff=1 " %
                    (os.path.join(install.A_GP_BIN_DIR, "integ_diff")) +
                    "filein=%s fileout=%s >> %s 2>&1" %
-                   (filein, fileout, self.log))
+                   (filein, fileout, logfile))
             bband_utils.runprog(cmd, abort_on_error=True, print_cmd=False)
 
             pga_filename = os.path.join(a_tmpdir,
@@ -310,7 +310,7 @@ class WccSiteamp(object):
             progstring = ("%s < %s > %s 2>> %s" %
                           (os.path.join(install.A_GP_BIN_DIR,
                                         "wcc_getpeak"),
-                           filein, pga_filename, self.log))
+                           filein, pga_filename, logfile))
             # wcc_getpeak returns 33 even when it succeeds
             bband_utils.runprog(progstring, print_cmd=False)
             pga_file = open(pga_filename, "r")
@@ -338,7 +338,7 @@ class WccSiteamp(object):
                           'infile=%s outfile=%s ' %
                           (filein, fileout) +
                           "fmidbot=%s fmin=%s >> %s 2>&1" %
-                          (config.FMIDBOT, config.FMIN, self.log))
+                          (config.FMIDBOT, config.FMIN, logfile))
             bband_utils.runprog(progstring, abort_on_error=True)
 
             filein = fileout
@@ -352,7 +352,7 @@ class WccSiteamp(object):
             cmd = ("%s integ=1 " %
                    (os.path.join(install.A_GP_BIN_DIR, "integ_diff")) +
                    "filein=%s fileout=%s >> %s 2>&1" %
-                   (filein, fileout, self.log))
+                   (filein, fileout, logfile))
             bband_utils.runprog(cmd, abort_on_error=True, print_cmd=False)
 
         # Create the velocity BBP file by combining the 3 vel components
@@ -373,7 +373,7 @@ class WccSiteamp(object):
                       (os.path.join(install.A_GP_BIN_DIR, "wcc2bbp")) +
                       'title="Sim NGAH, stat=%s" ' % (site) +
                       'nsfile=%s ewfile=%s udfile=%s > %s 2>> %s' %
-                      (nsfile, ewfile, udfile, bbpfile, self.log))
+                      (nsfile, ewfile, udfile, bbpfile, logfile))
         bband_utils.runprog(progstring, abort_on_error=True, print_cmd=False)
 
         # Copy output velocity file to output dir
@@ -397,12 +397,35 @@ class WccSiteamp(object):
                       (os.path.join(install.A_GP_BIN_DIR, "wcc2bbp")) +
                       'title="Sim NGAH, stat=%s" ' % (site) +
                       'nsfile=%s ewfile=%s udfile=%s > %s 2>> %s' %
-                      (nsfile, ewfile, udfile, bbpfile, self.log))
+                      (nsfile, ewfile, udfile, bbpfile, logfile))
         bband_utils.runprog(progstring, abort_on_error=True, print_cmd=False)
 
         # Copy output acceleration file to output dir
         shutil.copy2(bbpfile, a_outdir)
 
+    def process_station(self, sites, logfile, sta_base,
+                        a_indir, a_tmpdir, a_outdir):
+        """
+        Runs the site response module for a single station
+        """
+        config = self.config
+        site = sites.scode
+        vs30 = sites.vs30
+        if vs30 > config.VREF_MAX:
+            vs30 = config.VREF_MAX
+
+        # Temporary files are per station so stations can run in parallel
+        sta_base = "%s_%s" % (sta_base, site)
+
+        print("*** WccSiteamp Processing station %s..." % (site))
+
+        if self.method == "GP":
+            self.process_separate_seismograms(site, sta_base, vs30,
+                                              a_indir, a_tmpdir, logfile)
+        elif self.method == "SDSU" or self.method == "EXSIM" or self.method == "UCSB":
+            self.process_hybrid_seismogram(site, sta_base, vs30,
+                                           a_tmpdir, a_outdir, logfile)
+
     def run(self):
         """
         Run the GP WccSiteamp 2014 module
@@ -412,7 +435,6 @@ class WccSiteamp(object):
         self.install = InstallCfg.getInstance()
         install = self.install
         self.config = WccSiteampCfg()
-        config = self.config
 
         sim_id = self.sim_id
         sta_base = os.path.basename(os.path.splitext(self.r_stations)[0])
@@ -437,20 +459,9 @@ class WccSiteamp(object):
         slo = StationList(a_statfile)
         site_list = slo.getStationList()
 
-        for sites in site_list:
-            site = sites.scode
-            vs30 = sites.vs30
-            if vs30 > config.VREF_MAX:
-                vs30 = config.VREF_MAX
-
-            print("*** WccSiteamp Processing station %s..." % (site))
-
-            if self.method == "GP":
-                self.process_separate_seismograms(site, sta_base, vs30,
-                                                  a_indir, a_tmpdir)
-            elif self.method == "SDSU" or self.method == "EXSIM" or self.method == "UCSB":
-                self.process_hybrid_seismogram(site, sta_base, vs30,
-                                               a_tmpdir, a_outdir)
+        bband_utils.run_stations(self.process_station, site_list,
+                                 args=(sta_base, a_indir, a_tmpdir, a_outdir),
+                                 jobs=install.num_jobs, logfile=self.log)
 
         print("GP Site Response Completed".center(80, '-'))
 
@@ -35,7 +35,13 @@ from test_gp_gof import TestGPGof
 from test_sdsu_mogof import TestSDSUMOGof
 from test_anderson_gof import TestAndersonGof
 from test_rzz2015 import TestRZZ2015
+from test_rd50_store import TestRD50Store
+from test_pynga_utils import TestPyngaUtils
+from test_fas import TestFAS
 from test_as16 import TestAS16
+from test_stage_cache import TestStageCache
+from test_seis_cache import TestSeisCache
+from test_srf_reader import TestSRFReader
 
 class Logger(object):
     def __init__(self, filename):
@@ -58,6 +64,9 @@ TS = unittest.TestSuite()
 TS.addTests(CoreTestSuite())
 TS.addTest(unittest.makeSuite(TestVm2vm))
 TS.addTest(unittest.makeSuite(TestCC))
+TS.addTest(unittest.makeSuite(TestStageCache))
+TS.addTest(unittest.makeSuite(TestSeisCache))
+TS.addTest(unittest.makeSuite(TestSRFReader))
 
 # Add Graves & Pitarka tests
 TS.addTest(unittest.makeSuite(TestGenslip))
@@ -91,6 +100,9 @@ TS.addTest(unittest.makeSuite(TestGPGof))
 TS.addTest(unittest.makeSuite(TestSDSUMOGof))
 TS.addTest(unittest.makeSuite(TestAndersonGof))
 TS.addTest(unittest.makeSuite(TestRZZ2015))
+TS.addTest(unittest.makeSuite(TestRD50Store))
+TS.addTest(unittest.makeSuite(TestPyngaUtils))
+TS.addTest(unittest.makeSuite(TestFAS))
 TS.addTest(unittest.makeSuite(TestAS16))
 
 # Done, run the tests
@@ -63,6 +63,29 @@ class TestArias(unittest.TestCase):
             # Only check if we have the same number of lines
             self.assertTrue(len(lines) == len(rlines))
 
+    def test_arias_duration_multi(self):
+        """
+        Make sure processing several records together gives the same
+        results as processing them one at a time
+        """
+        in_file = os.path.join(self.install.A_TEST_REF_DIR, "arias",
+                               "inputs", "NGA_no_1063_RRS228.AT2")
+        out_file = os.path.join(self.a_outdir, "NGA_no_1063_RRS228.AT2.AD.bbp")
+        out_files = [os.path.join(self.a_outdir,
+                                  "NGA_no_1063_RRS228.AT2.AD.%d.bbp" % (idx))
+                     for idx in range(3)]
+
+        self.assertEqual(arias_duration.ad_from_acc(in_file, out_file), 0)
+        self.assertEqual(arias_duration.ad_from_acc_multi([in_file] * 3,
+                                                          out_files), 0)
+        res_file = open(out_file, 'r')
+        lines = res_file.read()
+        res_file.close()
+        for multi_file in out_files:
+            res_file = open(multi_file, 'r')
+            self.assertEqual(res_file.read(), lines)
+            res_file.close()
+
 if __name__ == "__main__":
     SUITE = unittest.TestLoader().loadTestsFromTestCase(TestArias)
     unittest.TextTestRunner(verbosity=2).run(SUITE)
@@ -10,11 +10,39 @@ from __future__ import division, print_function
 
 # Import Python modules
 import os
+import sys
+import json
+import time
+import shutil
+import tempfile
 import unittest
+import numpy as np
 
 # Import Broadband modules
+import timeline
 import bband_utils
 
+def square_station(item, logfile, fail_item=None, exit_item=None):
+    """
+    Station function used to test run_stations
+    """
+    if item == fail_item:
+        raise ValueError("Station %d failed" % (item))
+    if item == exit_item:
+        sys.exit(1)
+    log_fp = open(logfile, 'a')
+    log_fp.write("station %d\n" % (item))
+    log_fp.close()
+    return item * item
+
+def random_station(item, logfile):
+    """
+    Station function returning a random number, slow enough for all
+    workers to get a station
+    """
+    time.sleep(0.05)
+    return np.random.random()
+
 class TestBBandUtils(unittest.TestCase):
     """
     Acceptance Test for bband_utils
@@ -54,6 +82,91 @@ class TestBBandUtils(unittest.TestCase):
         if res == 0:
             self.fail("Sub process should returned non-zero and it didn't.")
 
+    def test_run_stations(self):
+        """
+        Test run_stations keeps the station order for results and logs
+        """
+        tmpdir = tempfile.mkdtemp()
+        try:
+            for jobs in [1, 4]:
+                logfile = os.path.join(tmpdir, "jobs_%d.log" % (jobs))
+                results = bband_utils.run_stations(square_station, range(10),
+                                                   jobs=jobs, logfile=logfile)
+                self.assertEqual(results, [item * item for item in range(10)])
+                log_fp = open(logfile, 'r')
+                self.assertEqual(log_fp.read(),
+                                 "".join(["station %d\n" % (item)
+                                          for item in range(10)]))
+                log_fp.close()
+                # Station log files should be gone
+                self.assertEqual(os.listdir(tmpdir).count("jobs_%d.log.0" %
+                                                          (jobs)), 0)
+
+            logfile = os.path.join(tmpdir, "fail.log")
+            self.assertRaises(bband_utils.ProcessingError,
+                              bband_utils.run_stations, square_station,
+                              range(10), args=(3,), jobs=4, logfile=logfile)
+            # Stations exiting must not leave the pool waiting
+            self.assertRaises(bband_utils.ProcessingError,
+                              bband_utils.run_stations, square_station,
+                              range(10), args=(None, 5), jobs=4,
+                              logfile=logfile)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_run_stations_random(self):
+        """
+        Test workers do not share the random numbers of the parent
+        """
+        np.random.seed(1)
+        results = bband_utils.run_stations(random_station, range(8), jobs=4)
+        self.assertEqual(len(set(results)), len(results))
+
+    def test_timeline(self):
+        """
+        Test that modules, stations and programs are recorded in the
+        performance timeline
+        """
+        tmpdir = tempfile.mkdtemp()
+        timeline_file = os.path.join(tmpdir, "timeline.jsonl")
+        timeline.enable(timeline_file)
+        try:
+            with timeline.Timer("module", "TestModule"):
+                bband_utils.runprog("sleep 0.1", False)
+                for jobs in [1, 2]:
+                    bband_utils.run_stations(square_station, range(3),
+                                             jobs=jobs,
+                                             logfile=os.path.join(tmpdir,
+                                                                  "st.log"))
+        finally:
+            timeline.disable()
+        # Nothing is recorded when disabled
+        bband_utils.runprog("true", False)
+        # Empty commands have no program name
+        self.assertEqual(timeline.program_name(" "), "")
+        self.assertEqual(bband_utils.get_command_output(""), "")
+
+        events = timeline.read_timeline(timeline_file)
+        categories = [event["category"] for event in events]
+        self.assertEqual(categories.count("module"), 1)
+        self.assertEqual(categories.count("station"), 6)
+        self.assertEqual(categories.count("subprocess"), 1)
+        for event in events:
+            if event["category"] == "subprocess":
+                self.assertEqual(event["name"], "sleep")
+                self.assertEqual(event["returncode"], 0)
+                self.assertTrue(event["wall"] >= 0.1)
+            if event["category"] == "module":
+                self.assertTrue(event["wall"] >= 0.1)
+        self.assertTrue("square_station" in timeline.summarize(events))
+
+        trace_file = os.path.join(tmpdir, "trace.json")
+        timeline.write_chrome_trace(events, trace_file)
+        trace_fp = open(trace_file, 'r')
+        self.assertEqual(len(json.load(trace_fp)["traceEvents"]), 8)
+        trace_fp.close()
+        shutil.rmtree(tmpdir)
+
 if __name__ == '__main__':
     SUITE = unittest.TestLoader().loadTestsFromTestCase(TestBBandUtils)
     unittest.TextTestRunner(verbosity=2).run(SUITE)
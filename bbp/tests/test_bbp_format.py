@@ -13,7 +13,10 @@ from __future__ import division, print_function
 
 # Import Python modules
 import os
+import time
+import filecmp
 import unittest
+import numpy as np
 
 # Import Broadband modules
 import seqnum
@@ -90,6 +93,130 @@ class TestBBPFormat(unittest.TestCase):
         # compare to amplitudes calculated by PEER
         return 0
 
+    def test_seis_store(self):
+        """
+        Test for the binary seismogram store and its exporters
+        """
+        ref_dir = os.path.join(self.install.A_TEST_REF_DIR, "ucb")
+        in_bbp_file = os.path.join(ref_dir, "station.acc.bbp")
+        store_dir = os.path.join(self.tmpdir, "seis_store")
+
+        key = bbp_formatter.bbp2store(in_bbp_file, store_dir)
+        self.assertEqual(key, "station.acc")
+        self.assertEqual(bbp_formatter.list_seis_records(store_dir), [key])
+        data, metadata = bbp_formatter.read_seis_record(store_dir, key)
+        self.assertEqual(data.shape, (4, metadata["npts"]))
+
+        # Exported PEER files must match the ones from the bbp file
+        ref_files = [os.path.join(self.outdir, "ref_peer_%s.acc" % (comp))
+                     for comp in ["n", "e", "z"]]
+        out_files = [os.path.join(self.outdir, "store_peer_%s.acc" % (comp))
+                     for comp in ["n", "e", "z"]]
+        bbp_formatter.bbp2peer(in_bbp_file, *ref_files)
+        bbp_formatter.store2peer(store_dir, key, *out_files)
+        for ref_file, out_file in zip(ref_files, out_files):
+            self.assertTrue(filecmp.cmp(ref_file, out_file, shallow=False))
+
+        # A bbp file exported from the store must read back the same data
+        out_bbp = os.path.join(self.outdir, "store.acc.bbp")
+        bbp_formatter.store2bbp(store_dir, key, out_bbp)
+        bbp_formatter.bbp2store(out_bbp, store_dir, "copy")
+        copy, _ = bbp_formatter.read_seis_record(store_dir, "copy")
+        self.assertTrue(abs(copy - data).max() <=
+                        1.0e-6 * abs(data).max())
+
+        # Only the column names are left out of the PEER headers
+        header_lines = ["# HF Sim NGAH, stat=s01\n"]
+        bbp_formatter.write_seis_record(store_dir, "hf", data, header_lines)
+        bbp_formatter.store2peer(store_dir, "hf", *out_files)
+        peer_file = open(out_files[0], 'r')
+        self.assertEqual(peer_file.readline(), header_lines[0])
+        peer_file.close()
+
+    def test_read_seismogram(self):
+        """
+        Test reading seismograms from the seismogram store
+        """
+        ref_dir = os.path.join(self.install.A_TEST_REF_DIR, "ucb")
+        in_bbp_file = os.path.join(ref_dir, "station.acc.bbp")
+        store_dir = os.path.join(self.tmpdir, "read_store")
+        ref_data = bbp_formatter.read_seismogram(in_bbp_file)
+        data = bbp_formatter.read_seismogram(in_bbp_file, store_dir)
+        self.assertTrue(np.array_equal(data, ref_data))
+
+        # Records are used instead of the text files
+        bbp_formatter.write_seis_record(store_dir, "station.acc",
+                                        2.0 * ref_data)
+        data = bbp_formatter.read_seismogram(in_bbp_file, store_dir)
+        self.assertTrue(np.array_equal(data, 2.0 * ref_data))
+
+        # But not when the text file is newer
+        new_bbp_file = os.path.join(self.outdir, "station.acc.bbp")
+        bbp_formatter.write_bbp_file(new_bbp_file, ref_data)
+        os.utime(new_bbp_file, (os.path.getmtime(in_bbp_file),
+                                time.time() + 10.0))
+        data = bbp_formatter.read_seismogram(new_bbp_file, store_dir)
+        self.assertTrue(np.allclose(data, ref_data))
+
+    def test_bulk_io(self):
+        """
+        Test the arrays returned by the converters
+        """
+        ref_dir = os.path.join(self.install.A_TEST_REF_DIR, "ucb")
+        in_bbp_file = os.path.join(ref_dir, "station.acc.bbp")
+        peer_files = [os.path.join(self.outdir, "bulk_peer_%s.acc" % (comp))
+                      for comp in ["n", "e", "z"]]
+        out_bbp_file = os.path.join(self.outdir, "bulk.acc.bbp")
+
+        header_lines, data = bbp_formatter.read_bbp_file(in_bbp_file)
+        npts, dt, acc = bbp_formatter.bbp2peer(in_bbp_file, *peer_files)
+        self.assertEqual(acc.shape, (3, npts))
+        self.assertTrue(np.allclose(acc * bband_utils.G2CMSS, data[1:]))
+        for comp, peer_file in zip(acc, peer_files):
+            (_, peer_npts,
+             peer_dt, samples) = bbp_formatter.read_peer_file(peer_file)
+            self.assertEqual(peer_npts, npts)
+            self.assertTrue(np.allclose(samples, comp))
+
+        # Converting back gives the original data and the same time
+        # axis the original per-sample loop created
+        new_data = bbp_formatter.peer2bbp(*(peer_files + [out_bbp_file]))
+        times = []
+        cur_time = 0.0
+        for _ in range(npts):
+            times.append(cur_time)
+            cur_time = cur_time + peer_dt
+        self.assertTrue(np.array_equal(new_data[0], times))
+        self.assertTrue(np.allclose(new_data[1:], data[1:]))
+        _, bbp_data = bbp_formatter.read_bbp_file(out_bbp_file)
+        self.assertTrue(np.allclose(bbp_data, new_data))
+
+    def test_add_bbp_files(self):
+        """
+        Test adding the seismograms of several bbp files
+        """
+        ref_dir = os.path.join(self.install.A_TEST_REF_DIR, "ucb")
+        in_bbp_file = os.path.join(ref_dir, "station.acc.bbp")
+        header_lines, data = bbp_formatter.read_bbp_file(in_bbp_file)
+
+        header, total = bbp_formatter.add_bbp_files([in_bbp_file] * 3)
+        self.assertEqual(header, header_lines)
+        self.assertTrue(np.array_equal(total[0], data[0]))
+        self.assertTrue(np.allclose(total[1:], 3 * data[1:]))
+
+        # Files must have the same samples
+        short_bbp_file = os.path.join(self.outdir, "short.acc.bbp")
+        bbp_formatter.write_bbp_file(short_bbp_file, data[:, :-1])
+        self.assertRaises(bband_utils.ProcessingError,
+                          bbp_formatter.add_bbp_files,
+                          [in_bbp_file, short_bbp_file])
+        slow_bbp_file = os.path.join(self.outdir, "slow.acc.bbp")
+        bbp_formatter.write_bbp_file(slow_bbp_file,
+                                     np.vstack([2 * data[0], data[1:]]))
+        self.assertRaises(bband_utils.ProcessingError,
+                          bbp_formatter.add_bbp_files,
+                          [in_bbp_file, slow_bbp_file])
+
     def test_peer2bbp(self):
         """
         Test for the peer2bbp converter
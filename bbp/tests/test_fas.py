@@ -0,0 +1,124 @@
+#! /usr/bin/env python
+"""
+Southern California Earthquake Center Broadband Platform
+Copyright 2010-2017 Southern California Earthquake Center
+
+This is the unit test for the Konno-Ohmachi smoothing in fas.py
+"""
+from __future__ import division, print_function
+
+# Import Python modules
+import unittest
+import numpy as np
+
+# Import Broadband modules
+import fas
+
+def ko98_smoothing_reference(freqs, data, delta_freq, bexp):
+    """
+    Original point-by-point implementation of fas.ko98_smoothing
+
+    # ** smoothing of a function y (equally-spaced, dx) with the "Konno-Ohmachi"
+    # ** function sin (alog10(f/fc)^exp) / alog10(f/fc)^exp) ^^4
+    # ** where fc is the frequency around which the smoothing is performed
+    # ** exp determines the exponent 10^(1/exp) is the half-width of the peak
+    # ** cf Konno & Ohmachi, 1998, BSSA 88-1, pp. 228-241
+    """
+
+    nx = len(freqs)
+    data_smooth = np.zeros(nx)
+    fratio = np.power(10., (2.5 / bexp))
+    data_smooth[0] = data[0]
+
+    for index in range(1, nx):
+        freq = freqs[index]
+        # Added check to avoid division by zero later and NaNs in the output file
+        if freq == 0.0:
+            data_smooth[index] = data[index]
+            continue
+        fc1 = freq / fratio
+        fc2 = freq * fratio
+        index1 = int(fc1 / delta_freq)
+        index2 = int((fc2 / delta_freq) + 1)
+        if index1 <= 1:
+            index1 = 0
+        if index2 >= nx:
+            index2 = nx
+        a1 = 0.0
+        a2 = 0.0
+        for j in range(index1, index2):
+            if j != index:
+                # Extra check to avoid NaNs in output file
+                if freqs[j] == 0.0:
+                    data_smooth[index] = data[index]
+                    break
+                c1 = bexp * np.log10(freqs[j] / freq)
+                c1 = np.power(np.sin(c1) / c1, 4.0)
+                a2 = a2 + c1
+                a1 = a1 + c1 * data[j]
+            else:
+                a2 = a2 + 1.0
+                a1 = a1 + data[index]
+            data_smooth[index] = a1 / a2
+
+    return data_smooth
+
+class TestFAS(unittest.TestCase):
+    """
+    Unit test for fas.py
+    """
+
+    def setUp(self):
+        prng = np.random.RandomState(1)
+        self.delta_freq = 0.05
+        self.spectra = prng.lognormal(0.0, 1.0, (3, 400))
+
+    def test_ko98_smoothing(self):
+        """
+        Compares the smoothing done with the sparse weights with the
+        original implementation
+        """
+        for bexp in [20.0, 188.5]:
+            # Spectra starting at zero frequency have windows that
+            # include it, these points are not smoothed
+            for first_freq in [0.0, self.delta_freq]:
+                freqs = (first_freq +
+                         self.delta_freq * np.arange(self.spectra.shape[1]))
+                for data in self.spectra:
+                    ref = ko98_smoothing_reference(freqs, data,
+                                                   self.delta_freq, bexp)
+                    new = fas.ko98_smoothing(freqs, data,
+                                             self.delta_freq, bexp)
+                    self.assertTrue(np.allclose(new, ref,
+                                                rtol=1.0e-14, atol=0.0))
+
+                # Several spectra at once
+                refs = [ko98_smoothing_reference(freqs, data,
+                                                 self.delta_freq, bexp)
+                        for data in self.spectra]
+                new = fas.ko98_smoothing(freqs, self.spectra,
+                                         self.delta_freq, bexp)
+                self.assertEqual(new.shape, self.spectra.shape)
+                self.assertTrue(np.allclose(new, refs,
+                                            rtol=1.0e-14, atol=0.0))
+
+    def test_ko98_weights_cache(self):
+        """
+        Checks weights are reused only for the same frequencies
+        """
+        freqs = self.delta_freq * np.arange(1, 101)
+        weights = fas.ko98_weights(freqs, self.delta_freq, 188.5)
+        self.assertTrue(fas.ko98_weights(freqs, self.delta_freq,
+                                         188.5) is weights)
+        # Windows starting after the last frequency are left empty,
+        # as in the original implementation
+        new_weights = fas.ko98_weights(2.0 * freqs, self.delta_freq, 188.5)
+        self.assertFalse(new_weights is weights)
+        ref = ko98_smoothing_reference(2.0 * freqs, self.spectra[0][:100],
+                                       self.delta_freq, 188.5)
+        self.assertTrue(np.allclose(new_weights.dot(self.spectra[0][:100]),
+                                    ref, rtol=1.0e-14, atol=0.0))
+
+if __name__ == '__main__':
+    SUITE = unittest.TestLoader().loadTestsFromTestCase(TestFAS)
+    unittest.TextTestRunner(verbosity=2).run(SUITE)
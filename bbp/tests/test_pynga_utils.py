@@ -0,0 +1,71 @@
+#! /usr/bin/env python
+"""
+Southern California Earthquake Center Broadband Platform
+Copyright 2010-2017 Southern California Earthquake Center
+
+This is the unit test for the distance functions in pynga/utils.py
+"""
+from __future__ import division, print_function
+
+# Import Python modules
+import unittest
+import numpy as np
+
+# Import Pynga and its utilities
+import pynga.utils as putils
+
+class TestPyngaUtils(unittest.TestCase):
+    """
+    Unit test for pynga/utils.py
+    """
+
+    def setUp(self):
+        prng = np.random.RandomState(1)
+        # Sites around the fault, some of them above it
+        self.site_geoms = [[-118.5 + dlon, 34.2 + dlat, 0.0]
+                           for dlon, dlat in prng.uniform(-0.8, 0.8,
+                                                          (25, 2))]
+        self.site_geoms.append([-118.5, 34.2, 0.0])
+        self.faults = []
+        for dims, mech in [((20.0, 0.1, 15.0, 0.1, 2.0), (122.0, 40.0, 105.0)),
+                           ((40.0, 0.1, 12.0, 0.1, 0.0), (310.0, 90.0, 180.0)),
+                           ((10.0, 0.1, 8.0, 0.1, 5.0), (45.0, 60.0, -90.0))]:
+            (fault_trace1, up_seis_depth, low_seis_depth, ave_dip,
+             _, _) = putils.FaultTraceGen((-118.5, 34.2), dims, mech)
+            self.faults.append((fault_trace1, up_seis_depth,
+                                low_seis_depth, ave_dip))
+        # Trace with more than one segment
+        self.faults.append(([[-118.7, 34.0, 1.0], [-118.5, 34.15, 1.0],
+                             [-118.2, 34.2, 1.0]], 1.0, 15.0, 70.0))
+
+    def test_distances(self):
+        """
+        Compares the distances for all sites at once with the ones
+        computed for each site
+        """
+        for fault in self.faults:
+            (rjb, rrup,
+             rx) = putils.DistancesToSimpleFaultSurface(self.site_geoms,
+                                                        *fault)
+            for idx, site_geom in enumerate(self.site_geoms):
+                ref = putils.DistanceToSimpleFaultSurface(site_geom, *fault)
+                self.assertTrue(np.allclose([rjb[idx], rrup[idx], rx[idx]],
+                                            ref, rtol=1.0e-10, atol=1.0e-8))
+
+    def test_empty(self):
+        """
+        Checks an empty site list returns empty distances
+        """
+        rjb, rrup, rx = putils.DistancesToSimpleFaultSurface([],
+                                                             *self.faults[0])
+        self.assertEqual((len(rjb), len(rrup), len(rx)), (0, 0, 0))
+        rjb, rrup, rx = putils.DistancesToSimpleFaultSurface([],
+                                                             *self.faults[0],
+                                                             RrupCalc=False,
+                                                             RxCalc=False)
+        self.assertEqual(len(rjb), 0)
+        self.assertTrue(rrup is None and rx is None)
+
+if __name__ == '__main__':
+    SUITE = unittest.TestLoader().loadTestsFromTestCase(TestPyngaUtils)
+    unittest.TextTestRunner(verbosity=2).run(SUITE)
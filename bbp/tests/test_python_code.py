@@ -13,6 +13,7 @@ import os
 import unittest
 
 # Import Broadband modules
+import module
 import bband_utils
 from install_cfg import InstallCfg
 
@@ -51,6 +52,18 @@ class TestPythonCode(unittest.TestCase):
         self.failIf(bband_utils.runprog(cmd, False) != 0,
                     "Python code in test directory mixes tabs and spaces!")
 
+    def test_component_registry(self):
+        """
+        Make sure every module in the registry resolves to its class
+        """
+        for name in module.COMPONENTS:
+            component_class = module.get_component_class(name)
+            self.failIf(component_class.__name__ != name,
+                        "Registry entry %s resolves to %s!" %
+                        (name, component_class.__name__))
+        self.assertRaises(bband_utils.ParameterError,
+                          module.get_component_class, "NoSuchModule")
+
 if __name__ == '__main__':
     SUITE = unittest.TestLoader().loadTestsFromTestCase(TestPythonCode)
     unittest.TextTestRunner(verbosity=2).run(SUITE)
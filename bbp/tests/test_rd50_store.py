@@ -0,0 +1,198 @@
+#! /usr/bin/env python
+"""
+Southern California Earthquake Center Broadband Platform
+Copyright 2010-2017 Southern California Earthquake Center
+
+This is the unit test for the rd50_store.py BBP module
+"""
+from __future__ import division, print_function
+
+# Import Python modules
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+# Import Broadband modules
+import bband_utils
+import rd50_store
+from install_cfg import InstallCfg
+from station_list import StationList
+
+class TestRD50Store(unittest.TestCase):
+    """
+    Unit test for rd50_store.py
+    """
+
+    def setUp(self):
+        self.install = InstallCfg.getInstance()
+        self.base_dir = tempfile.mkdtemp()
+        self.input_dir = os.path.join(self.base_dir, "outdata")
+        self.store_dir = os.path.join(self.base_dir, "rd50_store")
+        ref_dir = os.path.join(self.install.A_TEST_REF_DIR, "accept_refs")
+        self.obs_dir = os.path.join(ref_dir, "valid-northridge-GP_seis")
+        # Use the results of the other methods as our realizations
+        self.sim_dirs = [os.path.join(ref_dir, "valid-northridge-%s" %
+                                      (method))
+                         for method in ["CSM", "EXSIM", "GP", "SDSU"]]
+        slo = StationList(os.path.join(self.install.A_TEST_REF_DIR,
+                                       "accept_inputs",
+                                       "northridge_3_sta.stl"))
+        self.site_list = slo.getStationList()
+        # Leave only one station for the longer periods
+        self.site_list[0].low_freq_corner = 1.0
+        self.site_list[1].low_freq_corner = 0.5
+        self.rrups = [10.5, 22.25, 35.0]
+
+    def tearDown(self):
+        shutil.rmtree(self.base_dir)
+
+    def add_realization(self, realization, sim_dir):
+        """
+        Creates the rd50 files for realization using the ones in sim_dir
+        """
+        basedir = os.path.join(self.input_dir, realization)
+        if not os.path.exists(basedir):
+            os.makedirs(basedir)
+        open(os.path.join(basedir, "NR-%s.bias" % (realization)),
+             'w').close()
+        for site in self.site_list:
+            shutil.copy2(os.path.join(sim_dir, "%s.rd50" % (site.scode)),
+                         os.path.join(basedir, "%s.%s.rd50" %
+                                      (realization, site.scode)))
+
+    def read_sim_data(self, sim_dirs):
+        """
+        Returns the rd50 data in sim_dirs, (realization x station x
+        period x component), stations are sorted as in the store
+        """
+        stations = sorted([site.scode for site in self.site_list])
+        return np.array([[np.loadtxt(os.path.join(sim_dir, "%s.rd50" %
+                                                  (station)))[:, 1:]
+                          for station in stations]
+                         for sim_dir in sim_dirs])
+
+    def test_update(self):
+        """
+        Check only new or changed realizations are ingested
+        """
+        for idx, sim_dir in enumerate(self.sim_dirs[:3]):
+            self.add_realization("%d" % (idx), sim_dir)
+        store = rd50_store.RD50Store(self.store_dir)
+        self.assertEqual(store.update(self.input_dir), (3, 0))
+        self.assertEqual(store.event_label, "NR")
+        self.assertEqual(len(store.periods), 63)
+        means = self.read_sim_data(self.sim_dirs[:3]).mean(axis=0)
+        self.assertTrue(np.allclose(store.station_means(), means))
+
+        # Nothing to do on a new run
+        store = rd50_store.RD50Store(self.store_dir)
+        self.assertEqual(store.update(self.input_dir), (0, 0))
+
+        # New realization
+        self.add_realization("3", self.sim_dirs[3])
+        self.assertEqual(store.update(self.input_dir), (1, 0))
+        means = self.read_sim_data(self.sim_dirs).mean(axis=0)
+        self.assertTrue(np.allclose(store.station_means(), means))
+        means = self.read_sim_data([self.sim_dirs[0],
+                                    self.sim_dirs[3]]).mean(axis=0)
+        self.assertTrue(np.allclose(store.station_means(["0", "3"]), means))
+
+        # Realization run again with different results
+        self.add_realization("1", self.sim_dirs[3])
+        for site in self.site_list:
+            rd50_file = os.path.join(self.input_dir, "1",
+                                     "1.%s.rd50" % (site.scode))
+            os.utime(rd50_file, (0, 0))
+        store = rd50_store.RD50Store(self.store_dir)
+        self.assertEqual(store.update(self.input_dir), (0, 1))
+        self.assertEqual(store.realizations, ["0", "1", "2", "3"])
+        sim_dirs = [self.sim_dirs[0], self.sim_dirs[3],
+                    self.sim_dirs[2], self.sim_dirs[3]]
+        means = self.read_sim_data(sim_dirs).mean(axis=0)
+        self.assertTrue(np.allclose(store.station_means(), means))
+
+    def test_residuals(self):
+        """
+        Compare the residuals and their statistics with the ones
+        gen_resid_tbl_3comp and resid2uncer_varN compute from the
+        station means
+        """
+        for idx, sim_dir in enumerate(self.sim_dirs):
+            self.add_realization("%d" % (idx), sim_dir)
+        store, realizations = rd50_store.update_store(self.input_dir,
+                                                      self.store_dir)
+        table = rd50_store.combine_residuals(store, realizations,
+                                             self.obs_dir, self.site_list,
+                                             self.rrups)
+        resid_file = os.path.join(self.base_dir, "resid.txt")
+        table.write(resid_file)
+        table.write_stats(os.path.join(self.base_dir, "new"))
+
+        # Text files with the station means, as the old code did
+        means = store.station_means(realizations)
+        ref_file = os.path.join(self.base_dir, "ref_resid.txt")
+        logfile = os.path.join(self.base_dir, "log.txt")
+        for idx, site in enumerate(self.site_list):
+            simfile1 = os.path.join(self.base_dir, "%s.rd50" % (site.scode))
+            out_file = open(simfile1, 'w')
+            station_means = means[store.stations.index(site.scode)]
+            for period, values in zip(store.periods, station_means):
+                out_file.write("%10.4f" % (period))
+                for value in values:
+                    out_file.write(" %10.5e" % (value))
+                out_file.write("\n")
+            out_file.close()
+            cmd = ("%s/gen_resid_tbl_3comp bbp_format=1 " %
+                   (self.install.A_GP_BIN_DIR) +
+                   "datafile1=%s simfile1=%s " %
+                   (os.path.join(self.obs_dir, "%s.rd50" % (site.scode)),
+                    simfile1) +
+                   "comp1=psa5n comp2=psa5e comp3=rotd50 " +
+                   "eqname=NR mag=0.0 stat=%s lon=%.4f lat=%.4f " %
+                   (site.scode, float(site.lon), float(site.lat)) +
+                   "vs30=%d cd=%.2f " % (site.vs30, self.rrups[idx]) +
+                   "flo=%f fhi=%f " % (site.low_freq_corner,
+                                       site.high_freq_corner) +
+                   "print_header=%d >> %s 2>> %s" %
+                   (int(idx == 0), ref_file, logfile))
+            bband_utils.runprog(cmd, abort_on_error=True)
+
+        # Same table, up to the rounding of the station means
+        ref_lines = [line.split() for line in open(ref_file)]
+        new_lines = [line.split() for line in open(resid_file)]
+        self.assertEqual(len(new_lines), len(ref_lines))
+        self.assertEqual(new_lines[0], ref_lines[0])
+        for new_line, ref_line in zip(new_lines[1:], ref_lines[1:]):
+            self.assertEqual(new_line[:13], ref_line[:13])
+            self.assertTrue(np.allclose(np.float64(new_line[13:]),
+                                        np.float64(ref_line[13:]),
+                                        rtol=0.0, atol=1.0e-4))
+
+        for comp in rd50_store.RESID_COMPS:
+            fileroot = os.path.join(self.base_dir, "ref-%s" % (comp))
+            cmd = ("%s/resid2uncer_varN " % (self.install.A_GP_BIN_DIR) +
+                   "residfile=%s fileroot=%s " % (ref_file, fileroot) +
+                   "comp=%s nstat=%d nper=63 " % (comp,
+                                                  len(self.site_list)) +
+                   " >> %s 2>&1" % (logfile))
+            bband_utils.runprog(cmd, abort_on_error=True)
+            for stat in ["bias", "sigma", "sigma0", "m90", "p90"]:
+                ref_data = np.loadtxt("%s.%s" % (fileroot, stat))
+                new_data = np.loadtxt(os.path.join(self.base_dir,
+                                                   "new-%s.%s" %
+                                                   (comp, stat)))
+                self.assertTrue(np.array_equal(new_data[:, 0],
+                                               ref_data[:, 0]))
+                self.assertTrue(np.allclose(new_data[:, 1], ref_data[:, 1],
+                                            rtol=0.0, atol=1.0e-4))
+
+        # Statistics need at least two stations
+        new_data = np.loadtxt(os.path.join(self.base_dir, "new-rotd50.bias"))
+        self.assertTrue(np.all(new_data[new_data[:, 0] > 2.0, 1] == 0.0))
+        self.assertTrue(np.all(new_data[new_data[:, 0] < 1.0, 1] != 0.0))
+
+if __name__ == '__main__':
+    SUITE = unittest.TestLoader().loadTestsFromTestCase(TestRD50Store)
+    unittest.TextTestRunner(verbosity=2).run(SUITE)
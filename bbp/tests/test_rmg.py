@@ -10,7 +10,12 @@ from __future__ import division, print_function
 
 # Import Python modules
 import os
+import math
+import shutil
+import cmath
+import warnings
 import unittest
+import numpy as np
 
 # Import Broadband modules
 import seqnum
@@ -18,8 +23,122 @@ import bband_utils
 import cmp_bbp
 from install_cfg import InstallCfg
 from rmg_cfg import RMGCfg
+import rmg as rmg_module
 from rmg import RMG
 
+def svf_etinti_reference(tau_s, tau_r, dt, nt):
+    """
+    Original implementation of RMG.svf_etinti, evaluating the
+    complex terms one sample at a time with cmath
+    """
+    t = np.linspace(0, (nt-1)*dt, nt)
+
+    if tau_r < tau_s:
+        raise ValueError("Tau_r should be larger than Tau_s")
+
+    # U_tot (final slip) is one here
+    K = 2.0 / (math.pi * tau_r * tau_s**2)
+
+    # Ignore the divide by zero error
+    with np.errstate(divide='ignore'):
+        C1 = ((t / 2.0 + 1.0 / 4 * tau_r) *
+              np.sqrt(np.array((t * (tau_r - t)), dtype=complex)) +
+              (t * tau_r - tau_r ** 2) *
+              np.arcsin(np.sqrt(np.array((t / tau_r)), dtype=complex)) -
+              [3.0 / 4 * tau_r ** 2 * y for y in
+               [cmath.atan(x) for x in np.sqrt(np.array(((tau_r - t) / t),
+                                                        dtype=complex))]])
+
+    C2 = 3.0 / 8 * math.pi * tau_r ** 2
+
+    C3 = ((tau_s - t - 1.0 / 2 * tau_r) *
+          np.sqrt(np.array(((t - tau_s) * (tau_r - t + tau_s)),
+                           dtype=complex)) +
+          tau_r * (2.0 * tau_r - 2 * t + 2 * tau_s) *
+          np.arcsin(np.sqrt(np.array(((t - tau_s) / tau_r),
+                                     dtype=complex))) +
+          [3.0 / 2 * tau_r ** 2 * y for y in
+           [cmath.atan(x) for x in np.sqrt(np.array((tau_r - t + tau_s) /
+                                                    (t - tau_s),
+                                                    dtype=complex))]])
+
+    C4 = ((-tau_s + 1.0 / 2.0 * t + 1.0 / 4.0 * tau_r) *
+          np.sqrt(np.array(((t - 2 * tau_s) * (tau_r - t + 2 * tau_s)),
+                           dtype=complex)) +
+          tau_r * (-tau_r + t - 2 * tau_s) *
+          np.arcsin(np.sqrt(np.array(((t - 2 * tau_s) / tau_r),
+                                     dtype=complex))) -
+          [3.0 / 4.0 * tau_r ** 2 * y for y in
+           [cmath.atan(x) for x in np.sqrt(np.array((tau_r - t + 2*tau_s) /
+                                                    (t - 2 * tau_s),
+                                                    dtype=complex))]])
+
+    C5 = math.pi / 2.0 * tau_r * (t - tau_r)
+
+    C6 = math.pi / 2.0 * tau_r * (2.0 * tau_s - t + tau_r)
+
+    # Filters ComplexWarning when typecasting array to float
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        if tau_r > 2 * tau_s:
+            svf = (np.array(((C1 + C2) *
+                             [x1 and x2 for x1, x2 in zip(t >= 0,
+                                                          t < tau_s)]),
+                            dtype=float) +
+                   (np.array(((C1 - C2 + C3) *
+                              [x1 and x2 for x1, x2 in zip(t >= tau_s,
+                                                           t < 2*tau_s)]),
+                             dtype=float)) +
+                   (np.array(((C1 + C3 + C4) *
+                              [x1 and x2 for x1, x2 in zip(t >= 2*tau_s,
+                                                           t < tau_r)]),
+                             dtype=float)) +
+                   (np.array(((C5 + C3 + C4) *
+                              [x1 and x2 for x1, x2 in zip(t >= tau_r,
+                                                           t < tau_r +
+                                                           tau_s)]),
+                             dtype=float)) +
+                   (np.array(((C4 + C6) *
+                              [x1 and x2 for x1, x2 in zip(t >= (tau_r +
+                                                                 tau_s),
+                                                           t < (tau_r+2 *
+                                                                tau_s))]),
+                             dtype=float)))# +
+#                   (np.array(((0) *
+#                              [x1 for x1 in t>=(tau_r+2*tau_s)]),
+#                             dtype=float)))
+        else:
+            svf = (np.array(((C1 + C2) *
+                             [x1 and x2 for x1, x2 in zip(t >= 0,
+                                                          t < tau_s)]),
+                            dtype=float) +
+                   (np.array(((C1 - C2 + C3) *
+                              [x1 and x2 for x1, x2 in zip(t >= tau_s,
+                                                           t < tau_r)]),
+                             dtype=float)) +
+                   (np.array(((C5 + C3 - C2) *
+                              [x1 and x2 for x1, x2 in zip(t >= tau_r,
+                                                           t < 2*tau_s)]),
+                             dtype=float)) +
+                   (np.array(((C5 + C3 + C4) *
+                              [x1 and x2 for x1, x2 in zip(t >= 2*tau_s,
+                                                           t < tau_r +
+                                                           tau_s)]),
+                             dtype=float)) +
+                   (np.array(((C4 + C6) *
+                              [x1 and x2 for x1, x2 in zip(t >= (tau_r +
+                                                                 tau_s),
+                                                           t < (tau_r+2 *
+                                                                tau_s))]),
+                             dtype=float)))# +
+#                   (np.array(((0) *
+#                              [x1 for x1 in t>=(tau_r+2*tau_s)]),
+#                             dtype=float)))
+
+    svf = np.dot(K, svf)
+
+    return svf, t
+
 class TestRMG(unittest.TestCase):
     """
     Unit Test for rmg.py
@@ -68,6 +187,87 @@ class TestRMG(unittest.TestCase):
         self.failIf(not cmp_bbp.cmp_srf(a_ref_file, a_newfile,
                                         tolerance=0.0011) == 0, errmsg)
 
+    def test_gen_dist_cache(self):
+        """
+        Checks that the cached Cholesky factor and the batch mode
+        reproduce the distributions of a regular gen_dist call
+        """
+        rmg = RMG(None, self.srcfile, self.outsrf, None, sim_id=self.sim_id)
+        rmg.config = RMGCfg(a_srcname=os.path.join(self.install.A_IN_DATA_DIR,
+                                                   str(self.sim_id),
+                                                   self.srcfile))
+        rmg.gen_stats_inp()
+        rmg.gen_src()
+        rmg.gen_stats()
+        rmg.cache_dir = os.path.join(self.install.A_TMP_DATA_DIR,
+                                     str(self.sim_id), "rmg_cache")
+        self.addCleanup(shutil.rmtree, rmg.cache_dir, True)
+
+        np.random.seed(1)
+        ref = rmg.gen_dist()[0]
+        self.failIf(len(os.listdir(rmg.cache_dir)) != 1,
+                    "Cholesky factor not found in cache!")
+        np.random.seed(1)
+        batch = rmg.gen_dist(3)
+        self.failIf(len(batch) != 3, "Wrong number of realizations!")
+        for key in ref:
+            self.failIf(not np.array_equal(ref[key], batch[0][key]),
+                        "Cached factor changed %s!" % (key))
+            self.failIf(np.array_equal(batch[0][key], batch[1][key]),
+                        "Realizations are not independent!")
+
+    def test_fm(self):
+        """
+        Compares the heap-based fast-marching solver against the
+        original implementation
+        """
+        prng = np.random.RandomState(1)
+        dxyz = (0.2, 0.2)
+        for nz, nx in [(10, 20), (15, 40), (24, 24)]:
+            speed = prng.uniform(1.0, 6.0, (nz, nx))
+            source = [nx * dxyz[0] / 3.0, nz * dxyz[1] / 2.0]
+            (ref_t, ref_flag) = RMG.fm_reference(speed, source, dxyz)
+            (new_t, new_flag) = RMG.fm(speed, source, dxyz)
+            self.failIf(not np.array_equal(ref_t, new_t),
+                        "Rupture times differ for %dx%d grid" % (nz, nx))
+            self.failIf(ref_flag != new_flag,
+                        "Error flags differ for %dx%d grid" % (nz, nx))
+
+    def test_svf(self):
+        """
+        Compares the SVFs generated for all subfaults at once with
+        the ones from the original implementation
+        """
+        prng = np.random.RandomState(1)
+        dt = 0.1
+        rist = prng.uniform(0.1, 5.0, (6, 9))
+        # Clipped rise times repeat
+        rist[rist < 0.5] = 0.5
+        rmg = RMG(None, self.srcfile, self.outsrf, None, sim_id=self.sim_id)
+        (svf_nt, svf, _) = rmg.gen_svfs(rist, dt, "etinti", (0.5, 5.0))
+        self.failIf(len(rmg.svf_cache) != 1,
+                    "Only the clipped rise time should be kept!")
+        # The kept SVF is reused by the next calls
+        (new_nt, new_svf, _) = rmg.gen_svfs(rist, dt, "etinti", (0.5, 5.0))
+        self.failIf(not np.array_equal(new_nt, svf_nt) or
+                    not np.array_equal(new_svf, svf),
+                    "SVFs differ when reusing the clipped ones!")
+        for k in range(rist.shape[0]):
+            for i in range(rist.shape[1]):
+                nt = int(np.ceil((rist[k][i] + 0.5) / dt))
+                tau_s = rmg_module.par_t_acc / 1.3
+                tau_r = rist[k][i] - 2.0 * tau_s
+                if tau_r <= tau_s:
+                    tau_r = tau_s * 1.01
+                (ref_svf, _) = svf_etinti_reference(tau_s, tau_r, dt, nt)
+                self.failIf(svf_nt[k][i] != nt,
+                            "Number of samples differ for %d, %d" % (k, i))
+                self.failIf(not np.allclose(svf[k][i][:nt], ref_svf,
+                                            rtol=1e-10, atol=1e-10),
+                            "SVFs differ for %d, %d" % (k, i))
+                self.failIf(np.any(svf[k][i][nt:]),
+                            "SVF not padded with zeros for %d, %d" % (k, i))
+
 if __name__ == '__main__':
     SUITE = unittest.TestLoader().loadTestsFromTestCase(TestRMG)
     unittest.TextTestRunner(verbosity=2).run(SUITE)
@@ -15,6 +15,7 @@ import unittest
 
 # Import Broadband modules
 import rotd50
+import rotd_calc
 import seqnum
 import bband_utils
 import install_cfg
@@ -71,6 +72,29 @@ class TestRotD50(unittest.TestCase):
         rotd50_obj = rotd50.RotD50(r_station_list, sim_id)
         rotd50_obj.run()
 
+    def test_rotd_calc(self):
+        """
+        Compares the rotd_calc engine against the Fortran rotd100 output
+        """
+        ref_dir = os.path.join(self.install.A_TEST_REF_DIR, "ucb")
+        for peer_file in ["station.peer_e.acc", "station.peer_n.acc"]:
+            cmd = "cp %s %s" % (os.path.join(ref_dir, peer_file),
+                                os.path.join(self.tmpdir, peer_file))
+            bband_utils.runprog(cmd)
+
+        results = rotd_calc.do_rotd(self.tmpdir, "station.peer_e.acc",
+                                    "station.peer_n.acc", "station.rd100",
+                                    with_rotd100=True)
+        diff = rotd_calc.compare_rotd_files(os.path.join(ref_dir,
+                                                         "station.rd100"),
+                                            os.path.join(self.tmpdir,
+                                                         "station.rd100"))
+        self.assertTrue(diff < 0.001,
+                        "RotD100 differs from reference by %f" % (diff))
+        for rotd50_val, rotd100_val in zip(results["rotd50"],
+                                           results["rotd100"]):
+            self.assertTrue(rotd50_val <= rotd100_val)
+
 if __name__ == "__main__":
     SUITE = unittest.TestLoader().loadTestsFromTestCase(TestRotD50)
     unittest.TextTestRunner(verbosity=2).run(SUITE)
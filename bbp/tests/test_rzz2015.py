@@ -10,9 +10,12 @@ from __future__ import division, print_function
 
 # Import Python modules
 import os
+import math
 import unittest
+import numpy as np
 
 # Import Broadband modules
+import rzz2015
 import cmp_bbp
 import seqnum
 import bband_utils
@@ -101,6 +104,57 @@ class TestRZZ2015(unittest.TestCase):
                                              sep=",") != 0,
                     "RZZ2015 Summary file does not match reference file!")
 
+    def test_sim_f_batch(self):
+        """
+        Check that the batch simulations match the one-at-a-time ones
+        """
+        rzz_obj = RZZ2015(self.stations, self.eventname, sim_id=self.sim_id)
+        prng = np.random.RandomState(1)
+        batch = rzz_obj.sim_f(10.0, 5.0, 0.3, 200, 0.02,
+                              num_sims=4, prng=prng)[0]
+        prng = np.random.RandomState(1)
+        for sim in batch:
+            single = rzz_obj.sim_f(10.0, 5.0, 0.3, 200, 0.02, prng=prng)[0]
+            self.assertTrue(np.allclose(sim, single),
+                            "Batch simulation does not match!")
+        self.assertTrue(np.array_equal(rzz_obj.nmax_pmin(batch, 200)[0],
+                                       rzz_obj.nmax_pmin(batch[0], 200)),
+                        "Batch peak count does not match!")
+
+    def test_sim_f_filter(self):
+        """
+        Check the filter built a few columns at a time against the
+        original loop over the impulse times
+        """
+        w0, wn, zeta, n, deltat = 10.0, 5.0, 0.3, 200, 0.02
+        t = np.linspace(0, deltat * (n-1), n)
+        u = np.random.RandomState(1).normal(0, size=n)
+        ref = np.zeros(n)
+        C = np.zeros(n)
+        for j in range(0, n):
+            omega = w0 - (w0 - wn) * t[j] / t[n-1]
+            omegaD = omega * math.sqrt(1 - zeta**2)
+            for i in range(j, n):
+                hf = (omega / math.sqrt(1 - zeta**2) *
+                      math.exp(-zeta * omega * (t[i] - t[j])) *
+                      math.sin(omegaD * (t[i] - t[j])))
+                C[i] = C[i] + hf ** 2
+                ref[i] = ref[i] + hf * u[j]
+        C = C ** 0.5
+        C[0] = 0.1
+        ref = ref / C
+
+        rzz_obj = RZZ2015(self.stations, self.eventname, sim_id=self.sim_id)
+        filter_columns = rzz2015.RZZ_FILTER_COLUMNS
+        rzz2015.RZZ_FILTER_COLUMNS = 64
+        try:
+            sim = rzz_obj.sim_f(w0, wn, zeta, n, deltat,
+                                prng=np.random.RandomState(1))[0]
+        finally:
+            rzz2015.RZZ_FILTER_COLUMNS = filter_columns
+        self.assertTrue(np.allclose(sim, ref, rtol=1e-10, atol=1e-12),
+                        "Simulation does not match the original filter!")
+
 if __name__ == '__main__':
     SUITE = unittest.TestLoader().loadTestsFromTestCase(TestRZZ2015)
     unittest.TextTestRunner(verbosity=2).run(SUITE)
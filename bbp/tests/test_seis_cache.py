@@ -0,0 +1,96 @@
+#! /usr/bin/env python
+"""
+Southern California Earthquake Center Broadband Platform
+Copyright 2010-2016 Southern California Earthquake Center
+
+This is the unit test for the seis_cache.py BBP module
+"""
+from __future__ import division, print_function
+
+# Import Python modules
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+# Import Broadband modules
+import bband_utils
+import seis_cache
+
+class TestSeisCache(unittest.TestCase):
+    """
+    Unit test for seis_cache.py
+    """
+
+    def setUp(self):
+        self.base_dir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.base_dir, "seis_cache")
+        self.bbp_file = os.path.join(self.base_dir, "STA.bbp")
+        self.write_file(self.bbp_file,
+                        ["# Station: STA\n",
+                         "%  comment\n",
+                         "0.0 1.0 2.0 3.0\n",
+                         "\n",
+                         "0.1 4.0 5.0 6.0 # note\n",
+                         "0.2 7.0 8.0 9.0\n"])
+
+    def tearDown(self):
+        seis_cache.disable()
+        shutil.rmtree(self.base_dir)
+
+    @staticmethod
+    def write_file(filename, lines):
+        """
+        Writes lines to filename
+        """
+        out_file = open(filename, 'w')
+        out_file.write("".join(lines))
+        out_file.close()
+
+    def test_parse(self):
+        """
+        Check comments, blank lines and skipped lines are ignored
+        """
+        data = seis_cache.read_columns(self.bbp_file)
+        self.assertEqual(data.shape, (4, 3))
+        self.assertEqual(data[0].tolist(), [0.0, 0.1, 0.2])
+        self.assertEqual(data[3].tolist(), [3.0, 6.0, 9.0])
+        data = seis_cache.read_columns(self.bbp_file, skip_lines=3)
+        self.assertEqual(data[1].tolist(), [4.0, 7.0])
+
+        self.write_file(self.bbp_file, ["0.0 1.0 2.0 3.0\n", "0.1 4.0\n"])
+        self.assertRaises(bband_utils.ProcessingError,
+                          seis_cache.read_columns, self.bbp_file)
+
+    def test_cache(self):
+        """
+        Check parsed files are reused until they change
+        """
+        seis_cache.enable(self.cache_dir)
+        data = seis_cache.read_columns(self.bbp_file)
+        self.assertEqual(len(os.listdir(self.cache_dir)), 1)
+        # Changing the returned array does not change the cache
+        data[1][0] = -1.0
+        data = seis_cache.read_columns(self.bbp_file)
+        self.assertEqual(data[1][0], 1.0)
+
+        # Sidecar is used by other processes, with nothing in memory
+        seis_cache.disable()
+        seis_cache.enable(self.cache_dir)
+        sidecar = os.path.join(self.cache_dir,
+                               os.listdir(self.cache_dir)[0])
+        sidecar_mtime = os.path.getmtime(sidecar)
+        self.assertTrue(np.array_equal(seis_cache.read_columns(self.bbp_file,
+                                                               skip_lines=3),
+                                       data[:, 1:]))
+        self.assertEqual(os.path.getmtime(sidecar), sidecar_mtime)
+
+        # A new version of the file is parsed again
+        self.write_file(self.bbp_file, ["0.0 1.5 2.5 3.5 4.5\n"])
+        data = seis_cache.read_columns(self.bbp_file)
+        self.assertEqual(data[:, 0].tolist(), [0.0, 1.5, 2.5, 3.5, 4.5])
+
+if __name__ == '__main__':
+    SUITE = unittest.TestLoader().loadTestsFromTestCase(TestSeisCache)
+    unittest.TextTestRunner(verbosity=2).run(SUITE)
@@ -0,0 +1,111 @@
+#! /usr/bin/env python
+"""
+Southern California Earthquake Center Broadband Platform
+Copyright 2010-2016 Southern California Earthquake Center
+
+This is the unit test for the srf_reader.py BBP module
+"""
+from __future__ import division, print_function
+
+# Import Python modules
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+# Import Broadband modules
+import bband_utils
+import srf_reader
+from install_cfg import InstallCfg
+
+class TestSRFReader(unittest.TestCase):
+    """
+    Unit test for srf_reader.py
+    """
+
+    def setUp(self):
+        self.install = InstallCfg()
+        self.base_dir = tempfile.mkdtemp()
+        self.srf_file = os.path.join(self.install.A_TEST_REF_DIR,
+                                     "gp", "m5.89-0.20x0.20_s2379646.srf")
+
+    def tearDown(self):
+        srf_reader.disable()
+        shutil.rmtree(self.base_dir)
+
+    def write_srf(self, lines):
+        """
+        Writes lines to an SRF file in the temporary directory and
+        returns its path
+        """
+        srf_file = os.path.join(self.base_dir, "test.srf")
+        out_file = open(srf_file, 'w')
+        out_file.write("".join(lines))
+        out_file.close()
+        return srf_file
+
+    def test_version1(self):
+        """
+        Reads a version 1 file with two planes and slip rates on
+        several lines
+        """
+        srf_file = self.write_srf(["1.0\n",
+                                   "PLANE 2\n",
+                                   " -118.0 34.0 1 1 1.0 1.0\n",
+                                   " 280 30 1.0 0.0 0.5\n",
+                                   " -118.1 34.1 1 1 1.0 1.0\n",
+                                   " 290 40 1.0 0.0 0.5\n",
+                                   "POINTS 1\n",
+                                   " -118.0 34.0 1.5 280 30 1.0e10 0.5 0.1\n",
+                                   " 90 20.0 8 0.0 0 5.0 2\n",
+                                   " 0.0 1.0 2.0 3.0 4.0 5.0\n",
+                                   " 6.0 7.0\n",
+                                   " 8.0 9.0\n",
+                                   "POINTS 1\n",
+                                   " -118.1 34.1 0.5 290 40 1.0e10 0.2 0.1\n",
+                                   " 45 10.0 1 0.0 0 0.0 0\n",
+                                   " 1.5\n"])
+        srf = srf_reader.read_srf(srf_file)
+        self.assertEqual(srf.version, 1.0)
+        self.assertEqual(srf.plane("dip").tolist(), [30.0, 40.0])
+        self.assertEqual(srf.num_points(), 2)
+        self.assertEqual(srf.column("dep").tolist(), [1.5, 0.5])
+        self.assertTrue(np.all(np.isnan(srf.column("vs"))))
+        self.assertEqual(srf.column("slip3").tolist(), [5.0, 0.0])
+        self.assertEqual(srf.slip_rate(0).tolist(), list(range(8)))
+        self.assertEqual(srf.slip_rate(0, 1).size, 0)
+        self.assertEqual(srf.slip_rate(0, 2).tolist(), [8.0, 9.0])
+        self.assertEqual(srf.slip_rate(1).tolist(), [1.5])
+
+        # Missing slip rate values
+        srf_file = self.write_srf(open(srf_file).readlines()[:-1])
+        self.assertRaises(bband_utils.ProcessingError,
+                          srf_reader.read_srf, srf_file)
+
+    def test_cache(self):
+        """
+        Checks that the cached arrays match the ones from parsing the
+        SRF file
+        """
+        ref = srf_reader.read_srf(self.srf_file)
+        self.assertEqual(ref.version, 2.0)
+        self.assertEqual(ref.num_points(), 2500)
+        self.assertEqual(ref.slip_rate(0).tolist(), [0.0, 50.8264])
+
+        cache_dir = os.path.join(self.base_dir, "srf_cache")
+        srf_reader.enable(cache_dir)
+        srf_reader.read_srf(self.srf_file)
+        self.assertEqual(len(os.listdir(cache_dir)), 1)
+        # Load the cache entry, not the copy in memory
+        srf_reader.disable()
+        srf_reader.enable(cache_dir)
+        srf = srf_reader.read_srf(self.srf_file)
+        self.assertTrue(isinstance(srf.sr, np.memmap))
+        for name in ["planes", "points", "sr_offsets", "sr"]:
+            self.assertTrue(np.array_equal(getattr(ref, name),
+                                           getattr(srf, name)))
+
+if __name__ == '__main__':
+    SUITE = unittest.TestLoader().loadTestsFromTestCase(TestSRFReader)
+    unittest.TextTestRunner(verbosity=2).run(SUITE)
@@ -0,0 +1,156 @@
+#! /usr/bin/env python
+"""
+Southern California Earthquake Center Broadband Platform
+Copyright 2010-2016 Southern California Earthquake Center
+
+This is the unit test for the stage_cache.py BBP module
+"""
+from __future__ import division, print_function
+
+# Import Python modules
+import os
+import shutil
+import tempfile
+import unittest
+
+# Import Broadband modules
+from module import Module
+from stage_cache import StageCache
+
+class TestStageCache(unittest.TestCase):
+    """
+    Unit test for stage_cache.py
+    """
+
+    def setUp(self):
+        self.base_dir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.base_dir, "cache")
+        self.src_file = os.path.join(self.base_dir, "event.src")
+        src_file = open(self.src_file, 'w')
+        src_file.write("MAGNITUDE = 6.7\n")
+        src_file.close()
+
+        self.module = Module()
+        self.module.setName("Genslip")
+        self.module.addStageFile(self.src_file)
+        self.module.addArgs(["/some/path/vmod.txt", "event.src", 4.5])
+        self.module.addKeywordArg("vmodel_name", "LABasin500")
+
+    def tearDown(self):
+        shutil.rmtree(self.base_dir)
+
+    def get_cache(self, sim_id):
+        """
+        Creates the run directories for sim_id and returns the cache
+        """
+        run_dirs = {}
+        for area in ["indata", "tmpdata", "outdata", "logs"]:
+            run_dirs[area] = os.path.join(self.base_dir, area, str(sim_id))
+            os.makedirs(run_dirs[area])
+        return StageCache(self.cache_dir, sim_id, run_dirs, "test")
+
+    def test_keys(self):
+        """
+        Check that keys change with the module arguments and inputs
+        """
+        cache = self.get_cache(1001)
+        key = cache.get_key(self.module)
+        # sim_id does not change the key
+        self.module.addKeywordArg("sim_id", 1001)
+        self.assertEqual(key, cache.get_key(self.module))
+        # Upstream modules do
+        self.assertNotEqual(key, cache.get_key(self.module, "abc"))
+        self.module.addKeywordArg("vmodel_name", "NR")
+        self.assertNotEqual(key, cache.get_key(self.module))
+        self.module.addKeywordArg("vmodel_name", "LABasin500")
+        self.assertEqual(key, cache.get_key(self.module))
+        # And so do the staged files
+        src_file = open(self.src_file, 'a')
+        src_file.write("RAKE = 90\n")
+        src_file.close()
+        self.assertNotEqual(key, cache.get_key(self.module))
+
+    def test_store_restore(self):
+        """
+        Stores the outputs of a module and restores them for a
+        different simulation
+        """
+        cache = self.get_cache(1001)
+        key = cache.get_key(self.module)
+        self.assertFalse(cache.lookup(key))
+
+        old_file = os.path.join(cache.run_dirs["tmpdata"], "old.txt")
+        open(old_file, 'w').write("not an output\n")
+        before = cache.snapshot()
+        out_dir = os.path.join(cache.run_dirs["outdata"], "gof_1001")
+        os.makedirs(out_dir)
+        open(os.path.join(out_dir, "1001.STA.acc.bbp"), 'w').write("1 2 3\n")
+        open(os.path.join(out_dir, "psa_1001.5.txt"), 'w').write("1001.5\n")
+        open(os.path.join(cache.run_dirs["outdata"],
+                          "index-1001.html"),
+             'w').write("Results for simulation 1001\n"
+                        "<a href=\"gof_1001/1001.STA.acc.bbp\">\n")
+        open(os.path.join(cache.run_dirs["logs"],
+                          "1001.genslip.log"), 'w').write("done\n")
+        self.assertEqual(cache.store(key, "Genslip", before), 4)
+        self.assertTrue(cache.lookup(key))
+
+        new_cache = self.get_cache(2002)
+        self.assertEqual(new_cache.get_key(self.module), key)
+        self.assertTrue(new_cache.lookup(key))
+        self.assertEqual(new_cache.restore(key), 4)
+        restored = os.path.join(new_cache.run_dirs["outdata"], "gof_2002",
+                                "2002.STA.acc.bbp")
+        self.assertEqual(open(restored).read(), "1 2 3\n")
+        # Decimal numbers are not simulation ids
+        restored = os.path.join(new_cache.run_dirs["outdata"], "gof_2002",
+                                "psa_1001.5.txt")
+        self.assertEqual(open(restored).read(), "1001.5\n")
+        # The simulation id in text files is replaced too
+        restored = os.path.join(new_cache.run_dirs["outdata"],
+                                "index-2002.html")
+        self.assertEqual(open(restored).read(),
+                         "Results for simulation 2002\n"
+                         "<a href=\"gof_2002/2002.STA.acc.bbp\">\n")
+        self.assertTrue(os.path.exists(os.path.join(new_cache.run_dirs["logs"],
+                                                    "2002.genslip.log")))
+        self.assertFalse(os.path.exists(os.path.join(new_cache.run_dirs["tmpdata"],
+                                                     "old.txt")))
+
+        # Binary files with the simulation id cannot be changed, the
+        # entry is only used by the same simulation id
+        self.module.addKeywordArg("vmodel_name", "NR")
+        key = cache.get_key(self.module)
+        before = cache.snapshot()
+        open(os.path.join(cache.run_dirs["tmpdata"], "1001.srf.npy"),
+             'wb').write(b"\0\0 1001 \0")
+        self.assertEqual(cache.store(key, "Genslip", before), 1)
+        self.assertTrue(cache.lookup(key))
+        self.assertFalse(new_cache.lookup(key))
+        self.assertEqual(cache.restore(key), 1)
+
+    def test_short_sim_id(self):
+        """
+        Entries stored by short simulation ids are only restored for
+        the same simulation id
+        """
+        cache = self.get_cache(1)
+        key = cache.get_key(self.module)
+        before = cache.snapshot()
+        open(os.path.join(cache.run_dirs["outdata"], "psa_1.txt"),
+             'w').write("nsta 1\n")
+        self.assertEqual(cache.store(key, "Genslip", before), 1)
+        self.assertTrue(cache.lookup(key))
+        self.assertFalse(self.get_cache(2).lookup(key))
+        self.assertFalse(self.get_cache(1001).lookup(key))
+
+        # Same simulation id, in a new tree
+        shutil.rmtree(os.path.join(self.base_dir, "outdata"))
+        os.makedirs(os.path.join(self.base_dir, "outdata", "1"))
+        self.assertEqual(cache.restore(key), 1)
+        restored = os.path.join(cache.run_dirs["outdata"], "psa_1.txt")
+        self.assertEqual(open(restored).read(), "nsta 1\n")
+
+if __name__ == '__main__':
+    SUITE = unittest.TestLoader().loadTestsFromTestCase(TestStageCache)
+    unittest.TextTestRunner(verbosity=2).run(SUITE)
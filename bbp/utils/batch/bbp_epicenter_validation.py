@@ -169,8 +169,8 @@ def write_pbs(install, numsim, simdir, xmldir, email, prefix):
     pbsfile.write("\n")
     pbsfile.write("cd $HOME\n")
     pbsfile.write("\n")
-    pbsfile.write("python $BBP_DIR/utils/batch/run_parallel.py $BBP_DIR/utils/batch/setup_bbp_epicenter_env.sh %s $PBS_NODEFILE 1\n" %
-                  (bfn))
+    pbsfile.write("python $BBP_DIR/utils/batch/run_parallel.py --journal %s.journal --launch-delay 0 $BBP_DIR/utils/batch/setup_bbp_epicenter_env.sh %s $PBS_NODEFILE 1\n" %
+                  (bfn, bfn))
     pbsfile.write("\n")
     pbsfile.write('echo "Processing end"\n')
     pbsfile.write("date\n")
@@ -19,6 +19,7 @@ import tempfile
 
 # Import Broadband modules
 import bband_utils
+import bbp_formatter
 from install_cfg import InstallCfg
 from station_list import StationList
 
@@ -28,6 +29,9 @@ import plot_rotd50
 from plot_seis import PlotSeis
 from rotd50 import RotD50
 
+# Format of each sample line in the merged bbp files
+BBP_LINE_FORMAT = "%5.7f   %5.9e   %5.9e    %5.9e\n"
+
 def post_process(station_list, src_files,
                  merged_outdir,
                  realization, scenario):
@@ -98,100 +102,72 @@ def plot_srf_file(merged_indir, merged_tmpdir, merged_outdir,
     # Restore directory
     os.chdir(old_cwd)
 
-def add_bbp_seismograms(input_files, output_file):
-    """                                                                     
-    Add all input files and write output_file with the combined data        
+def add_bbp_seismograms(input_files, output_file,
+                        store_dir=None, units="cm/s/s"):
+    """
+    Add all input files and write output_file with the combined data,
+    also saving it in the seismogram store in store_dir if one is given
+    """
+    header_lines, data = bbp_formatter.add_bbp_files(input_files)
+    header_lines = ["%s\n" % (line.strip()) for line in header_lines]
+
+    # Write output file
+    bbp_formatter.write_bbp_file(output_file, data, header_lines,
+                                 BBP_LINE_FORMAT)
+    if store_dir is not None:
+        key = os.path.basename(output_file)[:-len(".bbp")]
+        bbp_formatter.write_seis_record(store_dir, key, data,
+                                        header_lines, units)
+
+def merge_station(station, _, input_sims, merged_outdir,
+                  realization, store_dir):
     """
-    # Start empty
-    headers = []
-    times = []
-    ns_comp = []
-    ew_comp = []
-    ud_comp = []
-
-    # Read first file
-    input_file = input_files[0]
-    input_files = input_files[1:]
-    i_file = open(input_file, 'r')
-    for line in i_file:
-        line = line.strip()
-        # Empty lines
-        if not line:
-            continue
-        if line.startswith('#') or line.startswith('%'):
-            headers.append(line)
-            continue
-        pieces = line.split()
-        pieces = [float(piece) for piece in pieces]
-        times.append(pieces[0])
-        ns_comp.append(pieces[1])
-        ew_comp.append(pieces[2])
-        ud_comp.append(pieces[3])
-    i_file.close()
-
-    # Now add other files
-    for input_file in input_files:
-        index = 0
-        i_file = open(input_file, 'r')
-        for line in i_file:
-            line = line.strip()
-            # Empty lines
-            if not line:
-                continue
-            if line.startswith('#') or line.startswith('%'):
-                continue
-            pieces = line.split()
-            pieces = [float(piece) for piece in pieces]
-            if index > len(times):
-                print("[ERROR]: File size mismatch!")
-                sys.exit(1)
-            ns_comp[index] = ns_comp[index] + pieces[1]
-            ew_comp[index] = ew_comp[index] + pieces[2]
-            ud_comp[index] = ud_comp[index] + pieces[3]
-            index = index + 1
-        i_file.close()
-
-    # Finally write output file
-    o_file = open(output_file, 'w')
-    for header_line in headers:
-        o_file.write("%s\n" % (header_line))
-    for time, ns_val, ew_val, ud_val in zip(times, ns_comp,
-                                            ew_comp, ud_comp):
-        o_file.write("%5.7f   %5.9e   %5.9e    %5.9e\n" %
-                     (time, ns_val, ew_val, ud_val))
-    o_file.close()
+    Adds the velocity and acceleration seismograms of station from
+    all input simulations
+    """
+    print("==> Merging station: %s" % (station.scode))
+    # Merge both velocity and acceleration
+    for file_type, units in [('vel', "cm/s"), ('acc', "cm/s/s")]:
+        input_files = []
+        for input_sim in input_sims:
+            input_dir = os.path.join(input_sim, "Sims",
+                                     "outdata", realization)
+            input_file = os.path.join(input_dir,
+                                      "%s.%s.%s.bbp" %
+                                      (realization,
+                                       station.scode,
+                                       file_type))
+            input_files.append(input_file)
+        output_file = os.path.join(merged_outdir,
+                                   "%s.%s.%s.bbp" %
+                                   (realization,
+                                    station.scode,
+                                    file_type))
+        add_bbp_seismograms(input_files, output_file, store_dir, units)
 
 def merge_seismograms(input_sims, station_list,
-                      merged_outdir, realization):
+                      merged_outdir, realization,
+                      jobs=1, binary=False):
     """
-    Adds seismograms from multiple simulations, creating a set              
-    of merged seismograms
+    Adds seismograms from multiple simulations, creating a set
+    of merged seismograms. Stations are merged by up to jobs
+    processes, and if binary is set the merged seismograms are also
+    saved in a binary seismogram store in merged_outdir
     """
     # Load station list
     slo = StationList(station_list)
     site_list = slo.getStationList()
 
+    if binary:
+        store_dir = os.path.join(merged_outdir, "seis_store")
+    else:
+        store_dir = None
+
     # Merge each station
-    for station in site_list:
-        print("==> Merging station: %s" % (station.scode))
-        # Merge both velocity and acceleration
-        for file_type in ['vel', 'acc']:
-            input_files = []
-            for input_sim in input_sims:
-                input_dir = os.path.join(input_sim, "Sims",
-                                         "outdata", realization)
-                input_file = os.path.join(input_dir,
-                                          "%s.%s.%s.bbp" %
-                                          (realization,
-                                           station.scode,
-                                           file_type))
-                input_files.append(input_file)
-                output_file = os.path.join(merged_outdir,
-                                           "%s.%s.%s.bbp" %
-                                           (realization,
-                                            station.scode,
-                                            file_type))
-                add_bbp_seismograms(input_files, output_file)
+    bband_utils.run_stations(merge_station, site_list,
+                             args=(input_sims, merged_outdir,
+                                   realization, store_dir),
+                             jobs=jobs)
 
 def copy_indata_files(input_sims, merged_indir,
                       merged_tmpdir, realization):
@@ -250,6 +226,12 @@ def main():
                         help="Merged simulation directory")
     parser.add_argument("--scenario", dest="scenario",
                         help="scenario name")
+    parser.add_argument("-j", "--jobs", dest="jobs", type=int, default=1,
+                        help="number of stations to merge in parallel")
+    parser.add_argument("--binary", dest="binary", action="store_true",
+                        default=False,
+                        help="also save the merged seismograms in "
+                        "a binary seismogram store")
     parser.add_argument('input_segments', nargs='*',
                         help="top-level directories for all segments")
 
@@ -266,7 +248,12 @@ def main():
         print("[ERROR]: Please provide a scenario name!")
         sys.exit(-1)
     scenario = args.scenario
-    
+
+    # Number of parallel jobs
+    if args.jobs < 1:
+        print("[ERROR]: Number of jobs must be a positive integer!")
+        sys.exit(-1)
+
     # Check for the simulation directory
     merged_simdir = args.merged_simdir
     if merged_simdir is None:
@@ -350,7 +337,7 @@ def main():
         # Merge seismograms
         merge_seismograms(input_sims, station_list,
                           merged_realization_outdir,
-                          realization)
+                          realization, args.jobs, args.binary)
         # Plot combined SRF plot
         plot_srf_file(merged_realization_indir,
                       merged_realization_tmpdir,
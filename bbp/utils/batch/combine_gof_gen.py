@@ -3,10 +3,10 @@
 Python version of Ronnie Kamai's Matlab scripts to generate a combined
 bias plot. It collects information from the rd50 files for each
 realization, groups the results by station (averaging) and then
-generates a residuals file using the rd50 files from the recorded
-data. This single residuals file uses the same resid2uncer_varN
-program used in single bias plots to generate data for the combined
-plot.
+computes the residuals using the rd50 files from the recorded
+data. The bias and sigma for the combined plot are computed from
+these residuals in the same way as the resid2uncer_varN program used
+in single bias plots.
 
 $Id: combine_gof_gen.py 1437 2015-02-20 17:18:04Z fsilva $
 """
@@ -15,7 +15,6 @@ $Id: combine_gof_gen.py 1437 2015-02-20 17:18:04Z fsilva $
 import os
 import sys
 import glob
-import numpy
 import shutil
 import optparse
 import tempfile
@@ -23,8 +22,8 @@ import tempfile
 # Import Broadband modules
 import bband_utils
 from PlotGOF import PlotGoF
-from gp_gof_cfg import GPGofCfg
 from station_list import StationList
+from rd50_store import update_store, combine_residuals
 
 # Import Pynga and its utilities
 import pynga.utils as putils
@@ -33,36 +32,17 @@ import pynga.utils as putils
 # Functions
 # --------------------------------------------------------------------------
 
-def summarize_rotd50(tmpdir, outdir, combined_resid_file,
+def summarize_rotd50(tmpdir, outdir, resid_table,
                      comp_label, num_stations, num_realization,
                      codebase):
     """
     This function summarizes all rotd50 data and creates the combined
     rotd50 GOF plot
     """
-    config = GPGofCfg()
-
-    # Figure out where out binaries are
-    if "BBP_DIR" in os.environ:
-        install_root = os.path.normpath(os.environ["BBP_DIR"])
-    else:
-        raise bband_utils.ProcessingError("BBP_DIR is not set!")
-    gp_bin_dir = os.path.join(install_root, "src", "gp", "bin")
-
-    logfile = os.path.join(tmpdir, "log.txt")
-
-    for comp in config.COMPS_PSA5:
-        # Build paths and check lengths
-        fileroot = os.path.join(tmpdir, "%s-%s-combined-rd50-%s" %
-                                (codebase, comp_label, comp))
-        bband_utils.check_path_lengths([combined_resid_file, fileroot],
-                                       bband_utils.GP_MAX_FILENAME)
-
-        cmd = ("%s/resid2uncer_varN " % (gp_bin_dir) + 
-               "residfile=%s fileroot=%s " % (combined_resid_file, fileroot) +
-               "comp=%s nstat=%d nper=63 " % (comp, num_stations) +
-               " >> %s 2>&1" % (logfile))
-        bband_utils.runprog(cmd, abort_on_error=True)
+    # Bias, sigma and confidence limits for each component
+    fileroot = os.path.join(tmpdir, "%s-%s-combined-rd50" %
+                            (codebase, comp_label))
+    resid_table.write_stats(fileroot)
 
     plottitle = ("Combined GOF Plot for %s\n%d Realizations\n%s Method" %
                  (comp_label, num_realization, codebase.upper()))
@@ -73,103 +53,13 @@ def summarize_rotd50(tmpdir, outdir, combined_resid_file,
 
     print "Stations used: %s" % (num_stations)
 
-def combine_station_data(station, input_dir, temp_dir):
-    """
-    This function combines data for a given station across multiple
-    realizations, writting a single output file in temp_dir
-    """
-    data = {}
-    # Get realizations
-    realizations = sorted(os.listdir(input_dir))
-    for realization in realizations:
-        basedir = os.path.join(input_dir, realization)
-        data_file = glob.glob("%s%s%s.%s.rd50" % (basedir, os.sep,
-                                                  realization,
-                                                  station))
-        if len(data_file) != 1:
-            raise bband_utils.ProcessingError("Data for station %s " %
-                                              (station) +
-                                              "not found for "
-                                              "realization %s!" %
-                                              (realization))
-        data_file = data_file[0]
-        in_data = open(data_file, 'r')
-        for line in in_data:
-            line = line.strip()
-            # Skip comments
-            if line.startswith("#"):
-                continue
-            pieces = line.split()
-            pieces = [float(piece) for piece in pieces]
-            key = pieces[0]
-            pieces = pieces[1:]
-            if not key in data:
-                # Key is new to dictionary
-                empty_set = [[] for _ in pieces]
-                data[key] = empty_set
-            for idx, value in enumerate(pieces):
-                data[key][idx].append(value)
-        in_data.close()
-
-    # Now, write the output file
-    out_file = open((os.path.join(temp_dir, "%s.rd50" % (station))), 'w')
-    keys = sorted(data.keys())
-    for key in keys:
-        out_file.write("%10.4f" % (key))
-        for comp in data[key]:
-            out_file.write(" %10.5e" % (numpy.mean(comp)))
-        out_file.write("\n")
-        
-def combine_realizations_data(input_dir, temp_dir):
-    """
-    This function creates a single file averaging the rd50 files for
-    each of the stations across all realizations
-    """
-    # Get realizations
-    realizations = sorted(os.listdir(input_dir))
-    one_realization = realizations[0]
-    basedir = os.path.join(input_dir, one_realization)
-    # Figure out what our stations are
-    rd50_files = glob.glob("%s%s%s.*.rd50" % (basedir,
-                                              os.sep,
-                                              one_realization))
-    rd50_files = [os.path.basename(each_file) for each_file in rd50_files]
-    stations = [station.split(".")[1] for station in rd50_files]
-    # Capture event_label
-    bias_file = glob.glob("%s%s*.bias" % (basedir, os.sep))
-    if len(bias_file) < 1:
-        raise bband_utils.ProcessingError("Cannot find event label!")
-    bias_file = bias_file[0]
-    # Let's capture the event label
-    event_label = os.path.basename(bias_file).split("-")[0]
-
-    # Now walk through all realizations and combine stations data
-    for station in stations:
-        print "working on station: %s" % (station)
-        combine_station_data(station, input_dir, temp_dir)
-
-    return event_label, len(realizations), len(stations)
-
-def create_resid_data_file(comp_label, input_indir, input_obsdir,
-                           combined_file, temp_dir):
+def create_resid_table(store, realizations, input_indir, input_obsdir):
     """
-    This function creates a file containing the combined residuals
-    from the simulation data from all stations
+    This function computes the combined residuals of the simulation
+    data in the rd50 store for all stations
     """
-    # Copy header for first file, set logfile
-    copy_header = 1
-    logfile = os.path.join(temp_dir, "log.txt")
-
-    # Figure out where out binaries are
-    if "BBP_DIR" in os.environ:
-        install_root = os.path.normpath(os.environ["BBP_DIR"])
-    else:
-        raise bband_utils.ProcessingError("BBP_DIR is not set!")
-    gp_bin_dir = os.path.join(install_root, "src", "gp", "bin")
-
     # Get realizations
-    realizations = sorted(os.listdir(input_indir))
-    one_realization = realizations[0]
+    one_realization = sorted(os.listdir(input_indir))[0]
     basedir = os.path.join(input_indir, one_realization)
 
     # Get the station list
@@ -190,57 +80,34 @@ def create_resid_data_file(comp_label, input_indir, input_obsdir,
     src_keys = bband_utils.parse_src_file(a_srcfile)
 
     # Get the obsdir
-    realizations = sorted(os.listdir(input_obsdir))
-    one_realization = realizations[0]
+    one_realization = sorted(os.listdir(input_obsdir))[0]
     basedir = os.path.join(input_obsdir, one_realization)
     obs_dir = glob.glob("%s%sobs_seis*" % (basedir, os.sep))
     if len(obs_dir) != 1:
         raise bband_utils.ProcessingError("Cannot get observation dir!")
     obs_dir = obs_dir[0]
 
-    # Go through all stations
-    for site in site_list:
-        slon = float(site.lon)
-        slat = float(site.lat)
-        stat = site.scode
-
-        # Calculate Rrup
-        origin = (src_keys['lon_top_center'],
-                  src_keys['lat_top_center'])
-        dims = (src_keys['fault_length'], src_keys['dlen'],
-                src_keys['fault_width'], src_keys['dwid'],
-                src_keys['depth_to_top'])
-        mech = (src_keys['strike'], src_keys['dip'],
-                src_keys['rake'])
-
-        site_geom = [float(site.lon), float(site.lat), 0.0]
-        (fault_trace1, up_seis_depth,
-         low_seis_depth, ave_dip,
-         dummy1, dummy2) = putils.FaultTraceGen(origin, dims, mech)
-        _, rrup, _ = putils.DistanceToSimpleFaultSurface(site_geom,
-                                                         fault_trace1,
-                                                         up_seis_depth,
-                                                         low_seis_depth,
-                                                         ave_dip)
-
-        simfile1 = os.path.join(temp_dir, "%s.rd50" % (stat))
-        datafile1 = os.path.join(obs_dir, "%s.rd50" % (stat))
-
-        cmd = ("%s/gen_resid_tbl_3comp bbp_format=1 " % (gp_bin_dir) +
-               "datafile1=%s simfile1=%s " % (datafile1, simfile1) + 
-               "comp1=psa5n comp2=psa5e comp3=rotd50 " +
-               "eqname=%s mag=0.0 stat=%s lon=%.4f lat=%.4f " %
-               (comp_label, stat, slon, slat) +
-               "vs30=%d cd=%.2f " % (site.vs30, rrup) +
-               "flo=%f fhi=%f " % (site.low_freq_corner,
-                                   site.high_freq_corner) +
-               "print_header=%d >> %s 2>> %s" %
-               (copy_header, combined_file, logfile))
-        bband_utils.runprog(cmd, abort_on_error=True)
-
-        if copy_header == 1:
-            copy_header = 0
-
+    # Calculate Rrup for all stations
+    origin = (src_keys['lon_top_center'],
+              src_keys['lat_top_center'])
+    dims = (src_keys['fault_length'], src_keys['dlen'],
+            src_keys['fault_width'], src_keys['dwid'],
+            src_keys['depth_to_top'])
+    mech = (src_keys['strike'], src_keys['dip'],
+            src_keys['rake'])
+    (fault_trace1, up_seis_depth,
+     low_seis_depth, ave_dip,
+     dummy1, dummy2) = putils.FaultTraceGen(origin, dims, mech)
+    site_geoms = [[float(site.lon), float(site.lat), 0.0]
+                  for site in site_list]
+    _, rrups, _ = putils.DistancesToSimpleFaultSurface(site_geoms,
+                                                       fault_trace1,
+                                                       up_seis_depth,
+                                                       low_seis_depth,
+                                                       ave_dip)
+
+    return combine_residuals(store, realizations, obs_dir,
+                             site_list, rrups)
 
 # --------------------------------------------------------------------------
 # Main
@@ -253,6 +120,9 @@ PARSER.add_option("-o", "--output_dir", dest="output_dir",
                   help="Output file")
 PARSER.add_option("-c", "--codebase", dest="codebase",
                   help="Method used for the simulation")
+PARSER.add_option("-s", "--store-dir", dest="store_dir",
+                  help="Directory keeping the rd50 data of all realizations "
+                  "read so far (default: Sims/rd50_store)")
 (OPTIONS, ARGS) = PARSER.parse_args()
 
 
@@ -278,26 +148,26 @@ else:
 if OPTIONS.codebase is None:
     PARSER.error("Please specify codebase!")
 
+if OPTIONS.store_dir is None:
+    STORE_DIR = os.path.join(TOP_INPUT_DIR, "Sims", "rd50_store")
+else:
+    STORE_DIR = OPTIONS.store_dir
+
 # Create temp dir
 TMPDIR = tempfile.mkdtemp(prefix="bbp-")
-COMBINED_FILE = os.path.join(TMPDIR,
-                             "bbp-rd50-resid-combined.txt")
 
 # Combine realizations' data
-(COMP_LABEL,
- NUM_REALIZATIONS,
- NUM_STAT) = combine_realizations_data(INPUT_OUTDIR,
-                                       TMPDIR)
+STORE, REALIZATIONS = update_store(INPUT_OUTDIR, STORE_DIR)
 
-# Create data files with both gmpe and simulation data
-create_resid_data_file(COMP_LABEL, INPUT_INDIR, INPUT_OUTDIR,
-                       COMBINED_FILE, TMPDIR)
+# Compute residuals with both observed and simulation data
+RESID_TABLE = create_resid_table(STORE, REALIZATIONS,
+                                 INPUT_INDIR, INPUT_OUTDIR)
 
 summarize_rotd50(TMPDIR, OUTPUT_DIR,
-                 COMBINED_FILE,
-                 COMP_LABEL,
-                 NUM_STAT,
-                 NUM_REALIZATIONS,
+                 RESID_TABLE,
+                 STORE.event_label,
+                 len(RESID_TABLE.site_list),
+                 len(REALIZATIONS),
                  OPTIONS.codebase)
 
 print "All Done!"
@@ -61,9 +61,9 @@ def parse_src_file(a_srcfile):
 
     return src_keys
 
-def calculate_gmpe(src_keys, station, output_file, rrups, gmpe_group_name):
+def calculate_gmpe(src_keys, site_list, output_files, rrups, gmpe_group_name):
     """
-    Calculate the GMPE results for a given station.
+    Calculate the GMPE results for all stations in site_list.
     """
     gmpe_group = gmpe_config.GMPES[gmpe_group_name]
     origin = (src_keys['lon_top_center'], src_keys['lat_top_center'])
@@ -72,62 +72,60 @@ def calculate_gmpe(src_keys, station, output_file, rrups, gmpe_group_name):
             src_keys['depth_to_top'])
     mech = (src_keys['strike'], src_keys['dip'], src_keys['rake'])
 
-    # Station location
-    site_geom = [float(station.lon), float(station.lat), 0.0]
     (fault_trace1, upper_seis_depth,
      lower_seis_depth, ave_dip,
      dummy1, dummy2) = putils.FaultTraceGen(origin, dims, mech)
-    rjb, rrup, rx = putils.DistanceToSimpleFaultSurface(site_geom,
-                                                        fault_trace1,
-                                                        upper_seis_depth,
-                                                        lower_seis_depth,
-                                                        ave_dip)
 
-    print "station: %s, Rrup: %f" % (station.scode, rrup)
-    rrups.append(rrup)
+    # Station distances
+    site_geoms = [[float(station.lon), float(station.lat), 0.0]
+                  for station in site_list]
+    (rjbs, station_rrups,
+     rxs) = putils.DistancesToSimpleFaultSurface(site_geoms,
+                                                 fault_trace1,
+                                                 upper_seis_depth,
+                                                 lower_seis_depth,
+                                                 ave_dip)
+    for station, rrup in zip(site_list, station_rrups):
+        print "station: %s, Rrup: %f" % (station.scode, rrup)
+    rrups.extend(station_rrups)
 
     vs30 = 1000
     z10 = None # Let PyNGA calculate it
     z25 = None # Let PyNGA calculate it
 
-    # Compute PSA for this stations
-    station_median = []
-    for period in gmpe_group["periods"]:
-        period_medians = []
-        for nga_model in gmpe_group["models"]:
-            median = gmpe_config.calculate_gmpe(gmpe_group_name,
-                                                nga_model,
-                                                src_keys['magnitude'],
-                                                rjb, vs30,
-                                                period,
-                                                rake=src_keys['rake'],
-                                                dip=src_keys['dip'],
-                                                W=src_keys['fault_width'],
-                                                Ztor=src_keys['depth_to_top'],
-                                                Rrup=rrup, Rx=rx,
-                                                Z10=z10, Z25=z25)
-            period_medians.append(median)
-        station_median.append((period, period_medians))
+    # Compute PSA for all stations
+    medians, _ = gmpe_config.calculate_gmpe_batch(gmpe_group_name,
+                                                  src_keys['magnitude'],
+                                                  rjbs, vs30,
+                                                  gmpe_group["periods"],
+                                                  rake=src_keys['rake'],
+                                                  dip=src_keys['dip'],
+                                                  W=src_keys['fault_width'],
+                                                  Ztor=src_keys['depth_to_top'],
+                                                  Rrup=station_rrups,
+                                                  Rx=rxs,
+                                                  Z10=z10, Z25=z25)
 
     # Create label
     file_label = ""
     for nga_model in gmpe_group["models"]:
         file_label = "%s %s" % (file_label, nga_model)
-    # Output data to file
-    outfile = open(output_file, 'w')
-    outfile.write("#station: %s\n" % (station.scode))
-    outfile.write("#period%s\n" % (file_label))
-    for item in station_median:
-        period = item[0]
-        vals = item[1]
-        out_str = "%.4f" % (period)
-        for method in vals:
-            out_str = out_str + "\t%.6f" % (method)
-        outfile.write("%s\n" % (out_str))
-    outfile.close()
-
-    # Return list
-    return station_median
+    # Output data to files
+    for station, output_file, station_medians in zip(site_list,
+                                                     output_files,
+                                                     medians):
+        outfile = open(output_file, 'w')
+        outfile.write("#station: %s\n" % (station.scode))
+        outfile.write("#period%s\n" % (file_label))
+        for period, vals in zip(gmpe_group["periods"], station_medians):
+            out_str = "%.4f" % (period)
+            for method in vals:
+                out_str = out_str + "\t%.6f" % (method)
+            outfile.write("%s\n" % (out_str))
+        outfile.close()
+
+    # Return array
+    return medians
 
 def create_gmpe_data_file(indata_dir, tmpdir,
                           gmpe_file, gmpe_label_file,
@@ -157,9 +155,9 @@ def create_gmpe_data_file(indata_dir, tmpdir,
 
     # Write ri50 files
     rrups = []
-    for site in site_list:
-        output_file = os.path.join(tmpdir, "%s.ri50" % (site.scode))
-        calculate_gmpe(src_keys, site, output_file, rrups, gmpe_group_name)
+    output_files = [os.path.join(tmpdir, "%s.ri50" % (site.scode))
+                    for site in site_list]
+    calculate_gmpe(src_keys, site_list, output_files, rrups, gmpe_group_name)
     mean_rrup = numpy.mean(rrups)
 
     # Get periods
@@ -1,37 +1,153 @@
 #!/usr/bin/env python
+"""
+Southern California Earthquake Center Broadband Platform
+Copyright 2010-2017 Southern California Earthquake Center
+
+Runs a list of commands on the cores of one or more compute nodes.
+Nodes are handed out as soon as a command exits, failed commands can
+be retried, and an optional journal records finished commands so an
+interrupted batch can be resumed
+"""
 
 import sys
 import os
 import time
+import json
+import errno
 import socket
+import optparse
 import subprocess
 
+def read_nodelist(nodefile, numcores):
+    """
+    Returns a list with one entry per available core, nodefile is
+    either 'localhost' or a file with one node name per line
+    """
+    hostname = socket.gethostname()
+
+    nodelist = []
+    if (nodefile == 'localhost'):
+        for i in xrange(0, numcores):
+            nodelist.append(hostname)
+    else:
+        ip = open(nodefile)
+        lines = ip.read().splitlines()
+        ip.close()
+        for line in lines:
+            if ((line != hostname) and (line != '')):
+                for i in xrange(0, numcores):
+                    nodelist.append(line)
+            elif (line == hostname):
+                for i in xrange(0, numcores):
+                    nodelist.append(hostname)
+
+    return nodelist
+
+class TaskJournal:
+    """
+    Append-only record of finished commands, one JSON entry per line
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        # Commands that completed successfully
+        self.done = set()
+        # Last recorded runtime of each command (in seconds)
+        self.runtimes = {}
+        if self.filename is not None and os.path.exists(self.filename):
+            ip = open(self.filename)
+            for line in ip:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # Partial line from an interrupted run
+                    continue
+                self.runtimes[entry["cmd"]] = entry["runtime"]
+                if entry["status"] == 0:
+                    self.done.add(entry["cmd"])
+            ip.close()
+
+    def record(self, cmd, node, status, attempt, runtime):
+        """
+        Adds an entry for a finished command, making sure it reaches
+        the disk before the command is considered complete
+        """
+        self.runtimes[cmd] = runtime
+        if status == 0:
+            self.done.add(cmd)
+        if self.filename is None:
+            return
+        op = open(self.filename, 'a')
+        op.write("%s\n" % (json.dumps({"cmd": cmd, "node": node,
+                                       "status": status,
+                                       "attempt": attempt,
+                                       "runtime": runtime,
+                                       "time": time.time()})))
+        op.flush()
+        os.fsync(op.fileno())
+        op.close()
+
+    def order(self, cmdlist):
+        """
+        Returns the commands in cmdlist that have not completed yet,
+        longest first according to the recorded runtimes. Commands
+        without a recorded runtime are assumed to take the average
+        """
+        pending = [c for c in cmdlist if c not in self.done]
+        known = [self.runtimes[c] for c in pending if c in self.runtimes]
+        if len(known) == 0:
+            return pending
+        average = sum(known) / len(known)
+        # Stable sort keeps the original order for equal estimates
+        return sorted(pending, key=lambda c: -self.runtimes.get(c, average))
+
 class RunParallel:
 
     def __init__(self, envscript):
         self.envscript = envscript
         return
 
-        
-    def runMultiSSH(self, nodefile, numcores, cmdlist):
-        hostname = socket.gethostname()
+    def build_command(self, node, cmd, local):
+        """
+        Returns the shell command that runs cmd on node
+        """
+        if local:
+            return "/bin/sh -c \'. %s;%s\'" % (self.envscript, cmd)
+        # Make sure we set TMPDIR and PBS_JOBID
+        if not "TMPDIR" in os.environ:
+            os.environ["TMPDIR"] = ("/tmp/%s" %
+                                    (os.environ["PBS_JOBID"]))
+        return "/usr/bin/ssh %s \"/bin/sh -c \'TMPDIR=%s;PBS_JOBID=%s;source %s;%s\'\"" % (node, os.environ["TMPDIR"], os.environ["PBS_JOBID"], self.envscript, cmd)
 
-        # Read in nodefile
-        nodelist = []
-        if (nodefile == 'localhost'):
-            for i in xrange(0, numcores):
-                nodelist.append(hostname)
-        else:
-            ip = open(nodefile)
-            lines = ip.read().splitlines()
-            ip.close()
-            for line in lines:
-                if ((line != hostname) and (line != '')):
-                    for i in xrange(0, numcores):
-                        nodelist.append(line)
-                elif (line == hostname):
-                    for i in xrange(0, numcores):
-                        nodelist.append(hostname)
+    def wait_any(self):
+        """
+        Blocks until any child process exits, returns its pid and
+        exit code
+        """
+        while True:
+            try:
+                pid, status = os.wait()
+            except OSError, e:
+                if e.errno == errno.EINTR:
+                    continue
+                raise
+            if os.WIFSIGNALED(status):
+                return pid, -os.WTERMSIG(status)
+            if os.WIFEXITED(status):
+                return pid, os.WEXITSTATUS(status)
+
+    def runMultiSSH(self, nodefile, numcores, cmdlist, journal=None,
+                    retries=0, launch_delay=1.0):
+        """
+        Runs all commands in cmdlist using numcores cores on each
+        node in nodefile. Commands already completed according to the
+        journal file are skipped, failed commands are run again up to
+        retries times. launch_delay is the minimum time between
+        starting two commands (sim ids default to the time in seconds).
+        Returns 0 if all commands succeeded, 1 otherwise
+        """
+        nodelist = read_nodelist(nodefile, numcores)
+        local = (nodefile == 'localhost')
 
         if (len(nodelist) == 0):
             print "No compute nodes available"
@@ -39,59 +155,90 @@ class RunParallel:
         else:
             print "Running on %s cores" % (len(nodelist))
 
-        # Execute each station's xml file
-        proclist = []
-        for c in cmdlist:
-            while (len(nodelist) == 0):
-                # Free up some nodes
-                newproc = []
-                for proc in proclist:
-                    if (proc[0].poll() != None):
-                        if (proc[0].wait() != 0):
-                            print "Process on node %s failed" % (proc[1])
-                            return(1)
-                        else:
-                            nodelist.append(proc[1])
-                    else:
-                        newproc.append(proc)
-                        
-                time.sleep(5)
-                proclist = newproc
-
-            # Allocate next available node
-            node = nodelist.pop()
-            # Make sure we set TMPDIR and PBS_JOBID
-            if not "TMPDIR" in os.environ:
-                os.environ["TMPDIR"] = ("/tmp/%s" %
-                                        (os.environ["PBS_JOBID"]))
-            cmd = "/usr/bin/ssh %s \"/bin/sh -c \'TMPDIR=%s;PBS_JOBID=%s;source %s;%s\'\"" % (node, os.environ["TMPDIR"], os.environ["PBS_JOBID"], self.envscript, c)
-            print "Running on %s: %s" % (node, cmd)   
-            proclist.append([subprocess.Popen(cmd,shell=True), node])
-            # Ensure unique simids
-            time.sleep(5)
-            
-        # Wait for all child processes to finish
-        if (len(proclist) > 0):
-            for proc in proclist:
-                proc[0].wait()
-            
+        task_journal = TaskJournal(journal)
+        queue = task_journal.order(cmdlist)
+        if len(queue) < len(cmdlist):
+            print "Skipping %d completed commands" % (len(cmdlist) - len(queue))
+        attempts = {}
+        failed = []
+        running = {}
+        last_launch = None
+        batch_start = time.time()
+
+        while (len(queue) > 0 or len(running) > 0):
+            # Start commands on all free cores
+            while (len(queue) > 0 and len(nodelist) > 0):
+                if last_launch is not None:
+                    wait = launch_delay - (time.time() - last_launch)
+                    if wait > 0:
+                        time.sleep(wait)
+                c = queue.pop(0)
+                node = nodelist.pop()
+                attempts[c] = attempts.get(c, 0) + 1
+                cmd = self.build_command(node, c, local)
+                print "Running on %s: %s" % (node, cmd)
+                proc = subprocess.Popen(cmd, shell=True)
+                last_launch = time.time()
+                running[proc.pid] = [proc, node, c, last_launch]
+
+            # Wait for the next command to finish
+            pid, status = self.wait_any()
+            if pid not in running:
+                continue
+            proc, node, c, start = running.pop(pid)
+            # We already reaped the child, let Popen know
+            proc.returncode = status
+            runtime = time.time() - start
+            nodelist.append(node)
+            task_journal.record(c, node, status, attempts[c], runtime)
+            if status == 0:
+                print "Completed on %s in %.1f s: %s" % (node, runtime, c)
+            elif attempts[c] <= retries:
+                print "Process on node %s failed (%d), retrying: %s" % (node, status, c)
+                queue.insert(0, c)
+            else:
+                print "Process on node %s failed (%d): %s" % (node, status, c)
+                failed.append(c)
+
+        print "Batch completed in %.1f s, %d commands failed" % (time.time() - batch_start, len(failed))
+        for c in failed:
+            print "Failed: %s" % (c)
+        if (len(failed) > 0):
+            return(1)
         return(0)
 
 
 if __name__ == '__main__':
 
-    envscript = sys.argv[1]
-    cmdfile = sys.argv[2]
-    nodefile = sys.argv[3]
-    numcores = int(sys.argv[4])
+    parser = optparse.OptionParser(usage="%prog [options] envscript "
+                                   "cmdfile nodefile numcores")
+    parser.add_option("--journal", dest="journal",
+                      help="file recording completed commands, commands "
+                      "found there are skipped when resuming a batch")
+    parser.add_option("--retries", dest="retries", type="int", default=0,
+                      help="number of times a failed command is retried")
+    parser.add_option("--launch-delay", dest="launch_delay", type="float",
+                      default=1.0, help="minimum time between starting "
+                      "two commands (seconds)")
+    (options, args) = parser.parse_args()
+    if len(args) != 4:
+        parser.error("Need envscript, cmdfile, nodefile and numcores")
+
+    envscript = args[0]
+    cmdfile = args[1]
+    nodefile = args[2]
+    numcores = int(args[3])
 
     # Read in command list
     ip = open(cmdfile)
-    cmdlist = ip.read().splitlines()
+    cmdlist = [c for c in ip.read().splitlines() if c != '']
     ip.close()
 
     # Run the commands
     runobj = RunParallel(envscript)
-    runobj.runMultiSSH(nodefile, numcores, cmdlist)
-    
-    sys.exit(0)
+    rc = runobj.runMultiSSH(nodefile, numcores, cmdlist,
+                            journal=options.journal,
+                            retries=options.retries,
+                            launch_delay=options.launch_delay)
+
+    sys.exit(rc)
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+"""
+Southern California Earthquake Center Broadband Platform
+Copyright 2010-2016 Southern California Earthquake Center
+
+Benchmark comparing the heap-based RMG fast-marching solver against
+the original dictionary-based implementation
+"""
+from __future__ import division, print_function
+
+# Import Python modules
+import sys
+import time
+import argparse
+import numpy as np
+
+# Import Broadband modules
+from rmg import RMG
+
+def time_solver(solver, speed, source, dxyz, repeats):
+    """
+    Returns the best wall time out of repeats runs of solver, along
+    with the solver's output
+    """
+    best = None
+    for _ in range(repeats):
+        t1 = time.time()
+        result = solver(speed, source, dxyz)
+        t2 = time.time()
+        if best is None or (t2 - t1) < best:
+            best = t2 - t1
+    return best, result
+
+def main():
+    """
+    Runs both solvers over a range of fault grid sizes
+    """
+    parser = argparse.ArgumentParser(description="Benchmarks the RMG "
+                                     "fast-marching rupture time solver.")
+    parser.add_argument("--sizes", dest="sizes", default="20,40,80,160",
+                        help="comma-separated list of along-strike grid "
+                        "sizes, down-dip size is half of it")
+    parser.add_argument("--repeats", dest="repeats", type=int, default=3,
+                        help="number of repetitions for each solver")
+    parser.add_argument("--max-reference", dest="max_reference", type=int,
+                        default=20000,
+                        help="skip the reference solver above this "
+                        "number of grid points")
+    parser.add_argument("--seed", dest="seed", type=int, default=1)
+    args = parser.parse_args()
+
+    dxyz = (0.2, 0.2)
+    prng = np.random.RandomState(args.seed)
+    failed = False
+
+    print("%8s %10s %12s %12s %9s %s" % ("nz x nx", "points", "reference",
+                                         "heap", "speedup", "match"))
+    for nx in [int(val) for val in args.sizes.split(",")]:
+        nz = max(nx // 2, 5)
+        speed = prng.uniform(1.0, 6.0, (nz, nx))
+        source = [nx * dxyz[0] / 2.0, nz * dxyz[1] / 2.0]
+
+        t_heap, (t_dist, e_flag) = time_solver(RMG.fm, speed, source,
+                                               dxyz, args.repeats)
+        if nx * nz > args.max_reference:
+            print("%8s %10d %12s %12.4f %9s %s" %
+                  ("%dx%d" % (nz, nx), nx * nz, "-", t_heap, "-", "-"))
+            continue
+        t_ref, (r_dist, r_flag) = time_solver(RMG.fm_reference, speed,
+                                              source, dxyz, 1)
+        match = np.array_equal(t_dist, r_dist) and e_flag == r_flag
+        failed = failed or not match
+        print("%8s %10d %12.4f %12.4f %9.1f %s" %
+              ("%dx%d" % (nz, nx), nx * nz, t_ref, t_heap,
+               t_ref / t_heap, match))
+
+    if failed:
+        print("[ERROR]: Solvers do not produce identical rupture times!")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
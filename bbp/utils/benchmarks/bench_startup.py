@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+"""
+Southern California Earthquake Center Broadband Platform
+Copyright 2010-2016 Southern California Earthquake Center
+
+Benchmark measuring the Python start-up cost of a Broadband process,
+comparing the lazy component registry in module.py against importing
+every Broadband module up front
+"""
+from __future__ import division, print_function
+
+# Import Python modules
+import os
+import sys
+import time
+import argparse
+import subprocess
+
+# Import Broadband modules
+import module
+
+def time_command(cmd, comps_dir, repeats):
+    """
+    Runs cmd repeats times from comps_dir and returns the best wall
+    time, or None if the command fails
+    """
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join([comps_dir,
+                                         env.get("PYTHONPATH", "")])
+    devnull = open(os.devnull, 'w')
+    best = None
+    for _ in range(repeats):
+        t1 = time.time()
+        retcode = subprocess.call(cmd, cwd=comps_dir, env=env,
+                                  stdout=devnull, stderr=devnull)
+        t2 = time.time()
+        if retcode != 0:
+            devnull.close()
+            return None
+        if best is None or (t2 - t1) < best:
+            best = t2 - t1
+    devnull.close()
+    return best
+
+def main():
+    """
+    Times interpreter start-up, the lazy registry, and eager imports
+    """
+    parser = argparse.ArgumentParser(description="Benchmarks the start-up "
+                                     "time of Broadband processes.")
+    parser.add_argument("--repeats", dest="repeats", type=int, default=5,
+                        help="number of repetitions for each command")
+    parser.add_argument("--python", dest="python", default=sys.executable,
+                        help="Python interpreter used to run the tests")
+    parser.add_argument("--modules", dest="modules",
+                        default="RotD50,FAS,AndersonGOF",
+                        help="comma-separated list of Broadband modules "
+                        "a typical short workflow instantiates")
+    args = parser.parse_args()
+
+    comps_dir = os.path.dirname(os.path.abspath(module.__file__))
+    names = [name.strip() for name in args.modules.split(",")]
+    workflow_imports = "; ".join(["module.get_component_class('%s')" %
+                                  (name) for name in names])
+    eager_imports = "; ".join(["import %s" % (mod_name) for mod_name
+                               in sorted(set(module.COMPONENTS.values()))])
+    tests = [("interpreter", "pass"),
+             ("registry only", "import module"),
+             ("workflow modules",
+              "import module; %s" % (workflow_imports)),
+             ("all modules (eager)", eager_imports)]
+
+    print("%-22s %10s" % ("test", "best (s)"))
+    for label, code in tests:
+        best = time_command([args.python, "-c", code], comps_dir,
+                            args.repeats)
+        if best is None:
+            print("%-22s %10s" % (label, "failed"))
+            continue
+        print("%-22s %10.4f" % (label, best))
+
+if __name__ == '__main__':
+    main()
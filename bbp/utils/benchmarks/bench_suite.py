@@ -0,0 +1,484 @@
+#!/usr/bin/env python
+"""
+Southern California Earthquake Center Broadband Platform
+Copyright 2010-2016 Southern California Earthquake Center
+
+Performance regression suite for the Broadband hot routines. Each case
+times a routine on fixed inputs from the unit test reference data,
+reports throughput and peak memory, and keeps a checksum of its results
+so optimizations can be shown to be faster without changing them.
+Results can be saved as a baseline and later runs compared against it
+"""
+from __future__ import division, print_function
+
+# Import Python modules
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+import argparse
+import platform
+import resource
+import tempfile
+import subprocess
+import numpy as np
+
+# Import Broadband modules
+import timeline
+from station_list import StationList
+
+# Change this when the cases change in a way that makes old
+# baselines meaningless
+BENCH_SUITE_VERSION = 1
+# Short routines are called repeatedly until a timing sample takes at
+# least this long (in seconds), so timer resolution does not dominate
+MIN_SAMPLE_TIME = 0.2
+
+# --------------------------------------------------------------------------
+# Helpers
+# --------------------------------------------------------------------------
+
+def array_checksum(values):
+    """
+    Returns a float summarizing the finite values in values
+    """
+    values = np.asarray(values, dtype=float)
+    return float(np.sum(np.abs(values[np.isfinite(values)])))
+
+def data_checksum(data):
+    """
+    Returns the sha1 digest of data as a hex string
+    """
+    return hashlib.sha1(data).hexdigest()
+
+def file_checksum(filename):
+    """
+    Returns the sha1 digest of the contents of filename
+    """
+    in_file = open(filename, 'rb')
+    checksum = data_checksum(in_file.read())
+    in_file.close()
+    return checksum
+
+def copy_files(src_dir, dst_dir, names):
+    """
+    Copies files from src_dir to dst_dir, names is a list of
+    (source name, destination name) pairs
+    """
+    if not os.path.exists(dst_dir):
+        os.makedirs(dst_dir)
+    for src_name, dst_name in names:
+        shutil.copy2(os.path.join(src_dir, src_name),
+                     os.path.join(dst_dir, dst_name))
+
+# --------------------------------------------------------------------------
+# Benchmark cases
+# --------------------------------------------------------------------------
+#
+# Each case takes the reference data and a scratch directory and
+# returns the number of work units and a function running the
+# routine once. The function returns a list of checksums (floats or
+# strings) describing its results
+#
+
+def setup_rotd(ref_dir, work_dir):
+    """
+    RotD50 and RotD100 of the ucb reference record
+    """
+    import rotd_calc
+
+    acc_e, dt = rotd_calc.read_peer_acc(os.path.join(ref_dir, "ucb",
+                                                     "station.peer_e.acc"))
+    acc_n, _ = rotd_calc.read_peer_acc(os.path.join(ref_dir, "ucb",
+                                                    "station.peer_n.acc"))
+    def run():
+        results = rotd_calc.calc_rotd(acc_e, acc_n, dt)
+        return [array_checksum(results["rotd50"]),
+                array_checksum(results["rotd100"])]
+    return 1, run
+
+def setup_fas(ref_dir, work_dir):
+    """
+    Konno-Ohmachi smoothing of the EAS of the ucb reference record
+    """
+    import fas
+
+    data = np.loadtxt(os.path.join(ref_dir, "ucb", "station.acc.bbp"),
+                      comments='#')
+    dt = data[1, 0] - data[0, 0]
+    spectra = np.abs(np.fft.rfft(data[:, 1:3].T, axis=-1)) * dt
+    freqs = np.fft.rfftfreq(data.shape[0], dt)
+    eas = np.sqrt(0.5 * (spectra[0] ** 2 + spectra[1] ** 2))
+    def run():
+        # Time the weight matrix too, as the first station would
+        fas.KO98_WEIGHTS_CACHE.clear()
+        smoothed = fas.ko98_smoothing(freqs, eas, freqs[1] - freqs[0], 188.5)
+        return [array_checksum(smoothed)]
+    return 1, run
+
+def setup_arias(ref_dir, work_dir):
+    """
+    Arias intensity and durations of the arias reference record
+    """
+    import arias_duration
+
+    acc, dt = arias_duration.read_peer_acc(os.path.join(ref_dir, "arias",
+                                                        "inputs",
+                                                        "NGA_no_1063_"
+                                                        "RRS228.AT2"))
+    acc = acc[np.newaxis, :]
+    def run():
+        results = arias_duration.calculate_arias(acc, dt)
+        return [array_checksum(result) for result in results]
+    return 1, run
+
+def setup_anderson_gof(ref_dir, work_dir):
+    """
+    Anderson GoF scores (and plots) for all stations in the
+    anderson_gof reference data
+    """
+    from anderson_gof import AndersonGOF
+
+    sim_id = 1
+    gof_dir = os.path.join(ref_dir, "anderson_gof")
+    site_list = StationList(os.path.join(gof_dir,
+                                         "nr_v13_3_1.stl")).getStationList()
+    sims_dir = os.path.join(work_dir, "sims")
+    out_dir = os.path.join(work_dir, "out")
+    os.makedirs(out_dir)
+    names = []
+    for site in site_list:
+        for ext in ["acc.bbp", "rd50"]:
+            names.append(("%s.%s" % (site.scode, ext),
+                          "%d.%s.%s" % (sim_id, site.scode, ext)))
+    copy_files(os.path.join(gof_dir, "syn_seis"), sims_dir, names)
+    obs_dir = os.path.join(gof_dir, "obs_seis")
+    gof_obj = AndersonGOF("nr_v13_3_1.stl", "NR", sim_id=sim_id)
+    def run():
+        checksums = []
+        for irec in range(len(site_list)):
+            scores, total, _ = gof_obj.process_station(irec, None, site_list,
+                                                       sims_dir, obs_dir,
+                                                       out_dir)
+            checksums.append(array_checksum(scores))
+            checksums.append(array_checksum([total]))
+        return checksums
+    return len(site_list), run
+
+def setup_rzz2015(ref_dir, work_dir):
+    """
+    RZZ2015 metrics (and plots) for all stations in the rzz2015
+    reference data, with a fixed seed for the damping simulations
+    """
+    from rzz2015 import RZZ2015
+
+    sim_id = 1
+    rzz_dir = os.path.join(ref_dir, "rzz2015")
+    site_list = StationList(os.path.join(rzz_dir,
+                                         "nr_v13_3_1.stl")).getStationList()
+    sims_dir = os.path.join(work_dir, "sims")
+    out_dir = os.path.join(work_dir, "out")
+    os.makedirs(out_dir)
+    copy_files(os.path.join(rzz_dir, "syn_seis"), sims_dir,
+               [("%s.acc.bbp" % (site.scode),
+                 "%d.%s.acc.bbp" % (sim_id, site.scode))
+                for site in site_list])
+    obs_dir = os.path.join(rzz_dir, "obs_seis")
+    rzz_obj = RZZ2015("nr_v13_3_1.stl", "NR", sim_id=sim_id, seed=1)
+    def run():
+        lines = []
+        for site in site_list:
+            lines.extend(rzz_obj.process_station(site, None, obs_dir,
+                                                 sims_dir, out_dir))
+        return [data_checksum("".join(lines).encode())]
+    return len(site_list), run
+
+def setup_gmpe(ref_dir, work_dir):
+    """
+    NGA-West2 medians for all stations in the as16 reference data
+    """
+    import bband_utils
+    from calculate_gmpe import CalculateGMPE
+
+    as16_dir = os.path.join(ref_dir, "as16")
+    site_list = StationList(os.path.join(as16_dir,
+                                         "nr_v13_3_1.stl")).getStationList()
+    gmpe_obj = CalculateGMPE("nr_v13_3_1.stl", "nr_v14_02_1.src", "NR",
+                             False, "NGA-West2")
+    gmpe_obj.src_keys = bband_utils.parse_src_file(os.path.join(as16_dir,
+                                                                "nr_v14_02_1."
+                                                                "src"))
+    output_files = [os.path.join(work_dir, "%s.gmpe" % (site.scode))
+                    for site in site_list]
+    def run():
+        medians = gmpe_obj.calculate_gmpe(site_list, output_files)
+        return [array_checksum(medians)]
+    return len(site_list), run
+
+def setup_rmg_fm(ref_dir, work_dir):
+    """
+    RMG fast-marching rupture times on a fixed 60x120 speed grid
+    """
+    from rmg import RMG
+
+    dxyz = (0.2, 0.2)
+    prng = np.random.RandomState(1)
+    speed = prng.uniform(1.0, 6.0, (60, 120))
+    source = [120 * dxyz[0] / 3.0, 60 * dxyz[1] / 2.0]
+    def run():
+        times, e_flag = RMG.fm(speed, source, dxyz)
+        return [array_checksum(times), float(e_flag)]
+    return speed.size, run
+
+def setup_bbp_formatter(ref_dir, work_dir):
+    """
+    Conversion of the ucb reference record to PEER files and back
+    """
+    import bbp_formatter
+
+    in_bbp_file = os.path.join(ref_dir, "ucb", "station.acc.bbp")
+    peer_files = [os.path.join(work_dir, "station.peer_%s.acc" % (comp))
+                  for comp in ["n", "e", "z"]]
+    out_bbp_file = os.path.join(work_dir, "station.out.bbp")
+    def run():
+        bbp_formatter.bbp2peer(in_bbp_file, *peer_files)
+        bbp_formatter.peer2bbp(*(peer_files + [out_bbp_file]))
+        return [file_checksum(filename)
+                for filename in peer_files + [out_bbp_file]]
+    return 1, run
+
+# Name, unit of work and setup function of each case
+CASES = [("rotd", "records", setup_rotd),
+         ("fas", "spectra", setup_fas),
+         ("arias", "records", setup_arias),
+         ("anderson_gof", "stations", setup_anderson_gof),
+         ("rzz2015", "stations", setup_rzz2015),
+         ("gmpe", "stations", setup_gmpe),
+         ("rmg_fm", "points", setup_rmg_fm),
+         ("bbp_formatter", "records", setup_bbp_formatter)]
+
+# --------------------------------------------------------------------------
+# Running and comparing
+# --------------------------------------------------------------------------
+
+def run_case(name, ref_dir, repeats):
+    """
+    Runs case name repeats times in this process, using the reference
+    data in ref_dir. Returns a dictionary with its timings, peak memory
+    and checksums
+    """
+    setup = dict([(case[0], case[2]) for case in CASES])[name]
+    unit = dict([(case[0], case[1]) for case in CASES])[name]
+    work_dir = tempfile.mkdtemp(prefix="bbp-bench-")
+    try:
+        units, func = setup(ref_dir, work_dir)
+        # Calibrate the number of calls per sample, this also warms
+        # up any caches the routine fills on its first call
+        number = 1
+        while True:
+            t1 = time.time()
+            for _ in range(number):
+                checksums = func()
+            if time.time() - t1 >= MIN_SAMPLE_TIME or number >= 10000:
+                break
+            number = number * 10
+        times = []
+        for _ in range(repeats):
+            t1 = time.time()
+            for _ in range(number):
+                checksums = func()
+            times.append((time.time() - t1) / number)
+    finally:
+        shutil.rmtree(work_dir)
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    best = min(times)
+
+    return {"best": best,
+            "median": float(np.median(times)),
+            "repeats": repeats,
+            "number": number,
+            "units": units,
+            "unit": unit,
+            "throughput": units / best if best > 0 else None,
+            "peak_mb": timeline.maxrss_kb(usage) / 1024.0,
+            "checksums": checksums}
+
+def run_case_process(name, ref_dir, repeats, python, verbose):
+    """
+    Runs case name in a new process, so its peak memory is not
+    affected by the other cases. Returns its results, or None if the
+    case fails
+    """
+    out_fd, out_file = tempfile.mkstemp(prefix="bbp-bench-", suffix=".json")
+    os.close(out_fd)
+    cmd = [python, os.path.abspath(__file__), "--case", name,
+           "--ref-dir", ref_dir, "--repeats", str(repeats),
+           "--case-output", out_file]
+    if verbose:
+        retcode = subprocess.call(cmd)
+    else:
+        devnull = open(os.devnull, 'w')
+        retcode = subprocess.call(cmd, stdout=devnull, stderr=devnull)
+        devnull.close()
+    results = None
+    if retcode == 0:
+        in_file = open(out_file, 'r')
+        results = json.load(in_file)
+        in_file.close()
+    os.remove(out_file)
+    return results
+
+def checksums_match(old, new, rtol):
+    """
+    Returns True if the checksum lists old and new are the same,
+    floats are compared with relative tolerance rtol
+    """
+    if old is None or new is None or len(old) != len(new):
+        return False
+    for old_val, new_val in zip(old, new):
+        if isinstance(old_val, float) and isinstance(new_val, float):
+            if not np.isclose(old_val, new_val, rtol=rtol, atol=0.0):
+                return False
+        elif old_val != new_val:
+            return False
+    return True
+
+def compare(name, results, baseline, threshold, rtol):
+    """
+    Returns a list of problems found comparing results for case name
+    against the baseline results for the same case
+    """
+    problems = []
+    if results["best"] > baseline["best"] * (1.0 + threshold):
+        problems.append("%s: %.1f%% slower than baseline" %
+                        (name, (results["best"] / baseline["best"] - 1.0) *
+                         100.0))
+    if results["peak_mb"] > baseline["peak_mb"] * (1.0 + threshold):
+        problems.append("%s: peak memory %.1f MB, baseline %.1f MB" %
+                        (name, results["peak_mb"], baseline["peak_mb"]))
+    if not checksums_match(baseline["checksums"], results["checksums"],
+                           rtol):
+        problems.append("%s: results differ from baseline" % (name))
+    return problems
+
+def main():
+    """
+    Runs the selected cases, compares them against the baseline and
+    optionally saves a new one
+    """
+    names = [case[0] for case in CASES]
+    comps_dir = os.path.dirname(os.path.abspath(timeline.__file__))
+    parser = argparse.ArgumentParser(description="Runs the Broadband "
+                                     "performance regression suite.")
+    parser.add_argument("--cases", dest="cases", default=",".join(names),
+                        help="comma-separated list of cases to run "
+                        "(default: all of %s)" % (",".join(names)))
+    parser.add_argument("--ref-dir", dest="ref_dir",
+                        default=os.path.join(os.path.dirname(comps_dir),
+                                             "tests", "ref_data"),
+                        help="unit test reference data directory")
+    parser.add_argument("--repeats", dest="repeats", type=int, default=3,
+                        help="number of repetitions for each case")
+    parser.add_argument("--baseline", dest="baseline",
+                        help="JSON file with baseline results to "
+                        "compare against")
+    parser.add_argument("--save", dest="save",
+                        help="save the results as a baseline in this file")
+    parser.add_argument("--threshold", dest="threshold", type=float,
+                        default=0.10,
+                        help="relative slowdown or memory growth "
+                        "reported as a regression (default: 0.10)")
+    parser.add_argument("--rtol", dest="rtol", type=float, default=1e-6,
+                        help="relative tolerance for numeric checksums")
+    parser.add_argument("--python", dest="python", default=sys.executable,
+                        help="Python interpreter used to run the cases")
+    parser.add_argument("--verbose", action="store_true", dest="verbose",
+                        help="show the output of the benchmarked routines")
+    parser.add_argument("--case", dest="case", help=argparse.SUPPRESS)
+    parser.add_argument("--case-output", dest="case_output",
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.case is not None:
+        # Running a single case for the parent process
+        results = run_case(args.case, args.ref_dir, args.repeats)
+        out_file = open(args.case_output, 'w')
+        json.dump(results, out_file)
+        out_file.close()
+        return
+
+    selected = [name.strip() for name in args.cases.split(",")]
+    for name in selected:
+        if name not in names:
+            parser.error("Unknown case: %s" % (name))
+    if args.repeats < 1:
+        parser.error("Number of repeats must be a positive integer.")
+
+    baseline = {}
+    if args.baseline is not None:
+        in_file = open(args.baseline, 'r')
+        baseline_data = json.load(in_file)
+        in_file.close()
+        if baseline_data.get("version") != BENCH_SUITE_VERSION:
+            parser.error("Baseline was created by a different suite version")
+        baseline = baseline_data["cases"]
+        if (baseline_data["python"] != platform.python_version() or
+            baseline_data["numpy"] != np.__version__ or
+            baseline_data["host"] != platform.node()):
+            print("[WARNING]: Baseline was recorded on %s with Python %s "
+                  "and NumPy %s" % (baseline_data["host"],
+                                    baseline_data["python"],
+                                    baseline_data["numpy"]))
+
+    print("%-14s %10s %10s %16s %10s %9s %s" %
+          ("case", "best (s)", "median (s)", "throughput", "peak (MB)",
+           "vs base", "results"))
+    all_results = {}
+    problems = []
+    for name in selected:
+        results = run_case_process(name, args.ref_dir, args.repeats,
+                                   args.python, args.verbose)
+        if results is None:
+            print("%-14s failed, run with --verbose for details" % (name))
+            problems.append("%s: failed" % (name))
+            continue
+        all_results[name] = results
+        speedup = "-"
+        status = "-"
+        if name in baseline:
+            speedup = "%.2fx" % (baseline[name]["best"] / results["best"])
+            case_problems = compare(name, results, baseline[name],
+                                    args.threshold, args.rtol)
+            problems.extend(case_problems)
+            if checksums_match(baseline[name]["checksums"],
+                               results["checksums"], args.rtol):
+                status = "same"
+            else:
+                status = "CHANGED"
+        print("%-14s %10.4f %10.4f %16s %10.1f %9s %s" %
+              (name, results["best"], results["median"],
+               "%.2f %s/s" % (results["throughput"], results["unit"]),
+               results["peak_mb"], speedup, status))
+
+    if args.save is not None:
+        out_file = open(args.save, 'w')
+        json.dump({"version": BENCH_SUITE_VERSION,
+                   "python": platform.python_version(),
+                   "numpy": np.__version__,
+                   "host": platform.node(),
+                   "time": time.time(),
+                   "cases": all_results}, out_file, indent=1,
+                  sort_keys=True)
+        out_file.close()
+        print("Baseline saved to %s" % (args.save))
+
+    if problems:
+        print()
+        for problem in problems:
+            print("[REGRESSION]: %s" % (problem))
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -3,143 +3,284 @@
 This script calculates md5sums for all the Green's functions and
 compares against the expected values.  The path to the green's
 functions is set up by install_cfg.py.
+
+Each data directory has a single manifest (checksums.md5, in md5sum
+format) with the checksums of all its files. Directories with the old
+layout (a checksums directory with one .md5 file per data file) are
+still verified. Files are hashed in-process by a pool of workers, and
+the checksums are cached by (inode, size, mtime), so files that did
+not change since the last check are not read again.
 $Id: md5sum_check.py 1644 2016-04-19 18:54:19Z fsilva $
 """
 
 # Import Python modules
 import os
 import sys
-import subprocess
+import json
+import shutil
+import hashlib
+import optparse
 
 # Import Broadband modules
 from install_cfg import InstallCfg
 import bband_utils
 
-def check_md5s_in_dir(md5_dir, data_dir):
+# Manifest with the md5sums of all files in a data directory
+MANIFEST_FILE = "checksums.md5"
+# Old layout, with one .md5 file for each data file
+MD5_DIR = "checksums"
+# Cache of computed md5sums, in the user's data directory
+CACHE_FILE = "checksums_cache.json"
+# Block size used when reading files
+HASH_BLOCK_SIZE = 4 * 1024 * 1024
+
+def md5_file(filename, _):
     """
-    This function checks the stored md5 sums stored in md5_dir and
-    compares them with the files present in data_dir
+    Returns the md5sum of filename, or None if it cannot be read
     """
-    return_code = 0
-    print "Entering directory %s" % (data_dir)
-    for entry in os.listdir(md5_dir):
-        # Make sure we have an absolute path
-        a_entry = os.path.join(md5_dir, entry)
-        if os.path.isdir(a_entry) and entry[0] != '.':
-            # Skip hidden dirs
-            return_code += check_md5s_in_dir(a_entry,
-                                             os.path.join(data_dir, entry))
-        elif a_entry.endswith(".md5"):
-            # It's a valid md5 file, cut off .md5 extension
-            r_gf_filename = entry[0:len(entry) - 4]
-            a_gf_filename = os.path.join(data_dir, r_gf_filename)
-            try:
-                if sys.platform == "linux2":
-                    # We are running on linux
-                    proc = subprocess.Popen(["md5sum", a_gf_filename],
-                                            stdout=subprocess.PIPE)
-                    calculated_md5 = proc.communicate()[0].split()[0]
-                elif sys.platform == "darwin":
-                    # This is a Mac OS X computer
-                    proc = subprocess.Popen(["md5", a_gf_filename],
-                                            stdout=subprocess.PIPE)
-                    calculated_md5 = proc.communicate()[0].split()[3]
-                else:
-                    print "Unknow platform %s!" % (sys.platform)
-                    sys.exit(1)
-            except IndexError:
-                print "Error calculating md5sum of file %s" % (a_gf_filename)
-                sys.exit(1)
+    digest = hashlib.md5()
+    try:
+        in_file = open(filename, 'rb')
+        try:
+            while True:
+                block = in_file.read(HASH_BLOCK_SIZE)
+                if not block:
+                    break
+                digest.update(block)
+        finally:
+            in_file.close()
+    except IOError:
+        return None
+    return digest.hexdigest()
+
+def file_stamp(filename):
+    """
+    Returns the (inode, size, mtime) stamp used to find files that
+    did not change since their md5sum was cached
+    """
+    stat = os.stat(filename)
+    return [stat.st_ino, stat.st_size, stat.st_mtime]
+
+def load_cache(cache_file):
+    """
+    Returns the cached md5sums, indexed by absolute path
+    """
+    if cache_file is None or not os.path.exists(cache_file):
+        return {}
+    try:
+        in_file = open(cache_file, 'r')
+        cache = json.load(in_file)
+        in_file.close()
+    except (IOError, ValueError):
+        # Unreadable cache, start over
+        return {}
+    return cache
+
+def save_cache(cache_file, cache):
+    """
+    Saves the cached md5sums, writing to a temporary file first so
+    other processes never read a partial cache
+    """
+    if cache_file is None:
+        return
+    bband_utils.mkdirs([os.path.dirname(cache_file)], print_cmd=False)
+    tmp_file = "%s.%d.tmp" % (cache_file, os.getpid())
+    out_file = open(tmp_file, 'w')
+    json.dump(cache, out_file)
+    out_file.close()
+    os.rename(tmp_file, cache_file)
+
+def compute_md5s(filenames, cache, jobs):
+    """
+    Returns a dictionary with the md5sums of filenames (None for files
+    that cannot be read). Only files not found in cache with the same
+    stamp are hashed, using up to jobs processes, and cache is updated
+    with their md5sums
+    """
+    md5s = {}
+    to_hash = []
+    stamps = []
+    for filename in filenames:
+        try:
+            stamp = file_stamp(filename)
+        except OSError:
+            md5s[filename] = None
+            continue
+        entry = cache.get(filename)
+        if entry is not None and entry[:3] == stamp:
+            md5s[filename] = entry[3]
+        else:
+            to_hash.append(filename)
+            stamps.append(stamp)
+
+    results = bband_utils.run_stations(md5_file, to_hash, jobs=jobs)
+    for filename, stamp, md5 in zip(to_hash, stamps, results):
+        md5s[filename] = md5
+        if md5 is not None:
+            cache[filename] = stamp + [md5]
+
+    return md5s
+
+def read_manifest(manifest_file):
+    """
+    Returns a list with the relative path and md5sum of each file in
+    manifest_file
+    """
+    entries = []
+    in_file = open(manifest_file, 'r')
+    for line in in_file:
+        pieces = line.rstrip("\n").split(None, 1)
+        if len(pieces) != 2:
+            continue
+        entries.append((pieces[1], pieces[0]))
+    in_file.close()
+    return entries
+
+def read_md5_dir(md5_dir):
+    """
+    Returns a list with the relative path and md5sum of each file
+    that has a .md5 file in md5_dir (old checksums layout)
+    """
+    entries = []
+    for root, dirs, files in os.walk(md5_dir):
+        # Skip hidden dirs
+        dirs[:] = [entry for entry in dirs if entry[0] != '.']
+        for entry in files:
+            if not entry.endswith(".md5"):
+                continue
+            a_entry = os.path.join(root, entry)
             saved_fp = open(a_entry, 'r')
             stored_md5 = saved_fp.readline().split()[0]
             saved_fp.close()
-            if calculated_md5 != stored_md5:
-                print ("Error: calculated md5sum %s " % (calculated_md5) +
-                       "doesn't agree with expected md5sum %s for file %s.\n" %
-                       (stored_md5, a_gf_filename))
-                return_code += 1
+            # Cut off .md5 extension
+            entries.append((os.path.relpath(a_entry, md5_dir)[:-4],
+                            stored_md5))
+    return entries
+
+def check_md5s(data_dir, cache, jobs=1):
+    """
+    This function checks the md5sums stored for data_dir, in its
+    manifest or in its checksums directory, against the files present
+    in data_dir. Returns the number of files that do not agree
+    """
+    manifest_file = os.path.join(data_dir, MANIFEST_FILE)
+    md5_dir = os.path.join(data_dir, MD5_DIR)
+    if os.path.exists(manifest_file):
+        entries = read_manifest(manifest_file)
+    elif os.path.exists(md5_dir):
+        entries = read_md5_dir(md5_dir)
+    else:
+        return 0
+
+    print "Checking directory %s" % (data_dir)
+    filenames = [os.path.join(data_dir, r_filename)
+                 for r_filename, _ in entries]
+    md5s = compute_md5s(filenames, cache, jobs)
+
+    return_code = 0
+    for a_filename, (_, stored_md5) in zip(filenames, entries):
+        calculated_md5 = md5s[a_filename]
+        if calculated_md5 is None:
+            print "Error calculating md5sum of file %s" % (a_filename)
+            return_code += 1
+        elif calculated_md5 != stored_md5:
+            print ("Error: calculated md5sum %s " % (calculated_md5) +
+                   "doesn't agree with expected md5sum %s for file %s.\n" %
+                   (stored_md5, a_filename))
+            return_code += 1
     return return_code
 
-def generate_md5s(data_dir, md5_dir, top_level=False):
+def generate_md5s(data_dir, cache, jobs=1):
     """
     This function generates md5 checksums for the files stored in
-    data_dir, and stores the results in md5_dir.
+    data_dir, and stores the results in its manifest
     """
+    print "Generating checksums for directory %s" % (data_dir)
+    manifest_file = os.path.join(data_dir, MANIFEST_FILE)
+    filenames = []
+    for root, dirs, files in os.walk(data_dir):
+        # Skip hidden dirs and the old top-level checksums directory
+        dirs[:] = [entry for entry in dirs if entry[0] != '.' and
+                   not (root == data_dir and entry == MD5_DIR)]
+        for entry in files:
+            a_entry = os.path.join(root, entry)
+            if a_entry != manifest_file:
+                filenames.append(a_entry)
+    filenames.sort()
+    md5s = compute_md5s(filenames, cache, jobs)
 
-    print "Entering directory %s\n" % data_dir
-    # Make sure md5_dir exists
-    bband_utils.mkdirs([md5_dir], print_cmd=False)
+    # Now, write all md5sums to the manifest
+    md5_out = open(manifest_file, 'w')
+    for a_entry in filenames:
+        if md5s[a_entry] is None:
+            print "Error calculating md5sum of file %s" % (a_entry)
+            sys.exit(1)
+        md5_out.write("%s  %s\n" % (md5s[a_entry],
+                                    os.path.relpath(a_entry, data_dir)))
+    md5_out.close()
 
-    for entry in os.listdir(data_dir):
-        # Skip top-level checksums directory
-        if top_level and entry == "checksums":
-            continue
-        a_entry = os.path.join(data_dir, entry)
-        if os.path.isdir(a_entry) and entry[0] != '.': #skip hidden dirs
-            generate_md5s(a_entry, os.path.join(md5_dir, entry))
-        else:
-            md5_filename = os.path.join(md5_dir, "%s.md5" % (entry))
-            filename = os.path.basename(entry)
-            if sys.platform == "linux2":
-                # We are running on linux
-                md5sum = subprocess.Popen(["md5sum", a_entry],
-                                          stdout=subprocess.PIPE)
-                computed_sum = md5sum.communicate()[0].split()[0]
-            elif sys.platform == "darwin":
-                # This is a Mac OS X computer
-                md5sum = subprocess.Popen(["md5", a_entry],
-                                          stdout=subprocess.PIPE)
-                computed_sum = md5sum.communicate()[0].split()[3]
-            else:
-                print "Unknow platform %s!" % (sys.platform)
-                sys.exit(1)
-            # Now, write md5sum to file
-            md5_out = open(md5_filename, 'w')
-            md5_out.write("%s %s\n" % (computed_sum, filename))
-            md5_out.close()
+def remove_md5s(data_dir):
+    """
+    Removes the manifest and the old checksums directory of data_dir
+    """
+    manifest_file = os.path.join(data_dir, MANIFEST_FILE)
+    md5_dir = os.path.join(data_dir, MD5_DIR)
+    if os.path.exists(manifest_file):
+        os.remove(manifest_file)
+    if os.path.exists(md5_dir):
+        shutil.rmtree(md5_dir)
 
 #-------------------------------------------------------------------------------
 # Main program starts here
 #-------------------------------------------------------------------------------
+PARSER = optparse.OptionParser()
+PARSER.add_option("-g", action="store_true", dest="generate",
+                  help="Generate md5sums instead")
+PARSER.add_option("-d", action="store_true", dest="delete",
+                  help="Delete md5sums")
+PARSER.add_option("-j", "--jobs", dest="jobs", type="int", default=1,
+                  help="Number of files to hash in parallel")
+PARSER.add_option("--no-cache", action="store_false", dest="use_cache",
+                  default=True,
+                  help="Hash all files, ignoring the cached md5sums")
+(OPTIONS, ARGS) = PARSER.parse_args()
+if OPTIONS.jobs < 1:
+    PARSER.error("Number of jobs must be a positive integer.")
+
 CFG = InstallCfg()
+DATA_DIRS = []
+for CHECK_DIR in [CFG.A_GF_DIR, CFG.A_VAL_DIR]:
+    for DIRECTORY in bband_utils.list_subdirs(CHECK_DIR):
+        DATA_DIRS.append(os.path.abspath(os.path.join(CHECK_DIR, DIRECTORY)))
+
+if OPTIONS.delete:
+    # Delete md5sums
+    for DATA_DIR in DATA_DIRS:
+        remove_md5s(DATA_DIR)
+    # All done!
+    sys.exit(0)
 
-if len(sys.argv) == 2:
-    if sys.argv[1] == '-g':
-        # Generate md5sums instead
-        for CHECK_DIR in [CFG.A_GF_DIR, CFG.A_VAL_DIR]:
-            SUB_DIRS = bband_utils.list_subdirs(CHECK_DIR)
-            for DIRECTORY in SUB_DIRS:
-                BASE_DIR = os.path.join(CHECK_DIR, DIRECTORY)
-                MD5_DIR = os.path.join(CHECK_DIR, DIRECTORY, "checksums")
-                # First, remove checksums directory if it already exists
-                if os.path.exists(MD5_DIR):
-                    os.system("rm -rf %s" % (MD5_DIR))                    
-                generate_md5s(BASE_DIR, MD5_DIR, True)
-        # All done!
-        sys.exit(0)
-
-    if sys.argv[1] == '-d':
-        # Delete md5sums
-        for CHECK_DIR in [CFG.A_GF_DIR, CFG.A_VAL_DIR]:
-            SUB_DIRS = bband_utils.list_subdirs(CHECK_DIR)
-            for DIRECTORY in SUB_DIRS:
-                BASE_DIR = os.path.join(CHECK_DIR, DIRECTORY)
-                MD5_DIR = os.path.join(CHECK_DIR, DIRECTORY, "checksums")
-                # First, remove checksums directory if it already exists
-                if os.path.exists(MD5_DIR):
-                    os.system("rm -rf %s" % (MD5_DIR))                    
-        # All done!
-        sys.exit(0)
+if OPTIONS.use_cache:
+    CACHE = os.path.join(CFG.A_DATA_ROOT, CACHE_FILE)
+else:
+    CACHE = None
+MD5_CACHE = load_cache(CACHE)
+
+if OPTIONS.generate:
+    # Generate md5sums instead
+    for DATA_DIR in DATA_DIRS:
+        # First, remove existing checksums
+        remove_md5s(DATA_DIR)
+        generate_md5s(DATA_DIR, MD5_CACHE, OPTIONS.jobs)
+        save_cache(CACHE, MD5_CACHE)
+    # All done!
+    sys.exit(0)
 
 print "Starting verifying checksums..."
 STATUS = 0
-for CHECK_DIR in [CFG.A_GF_DIR, CFG.A_VAL_DIR]:
-    SUB_DIRS = bband_utils.list_subdirs(CHECK_DIR)
-    for DIRECTORY in SUB_DIRS:
-        BASE_DIR = os.path.join(CHECK_DIR, DIRECTORY)
-        MD5_DIR = os.path.join(CHECK_DIR, DIRECTORY, "checksums")
-        if os.path.exists(MD5_DIR):
-            STATUS += check_md5s_in_dir(MD5_DIR, BASE_DIR)
+for DATA_DIR in DATA_DIRS:
+    STATUS += check_md5s(DATA_DIR, MD5_CACHE, OPTIONS.jobs)
+    save_cache(CACHE, MD5_CACHE)
 
 if STATUS == 0:
     print "All checksums agree!"
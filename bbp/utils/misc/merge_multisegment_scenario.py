@@ -17,6 +17,7 @@ import argparse
 # Import Broadband modules
 import seqnum
 import bband_utils
+import bbp_formatter
 from install_cfg import InstallCfg
 from station_list import StationList
 
@@ -26,6 +27,9 @@ import plot_rotd50
 from plot_seis import PlotSeis
 from rotd50 import RotD50
 
+# Format of each sample line in the merged bbp files
+BBP_LINE_FORMAT = "%5.7f   %5.9e   %5.9e    %5.9e\n"
+
 class MergeScenario(object):
     """
     Implements merging a number of individual simulations into a combined
@@ -48,6 +52,7 @@ class MergeScenario(object):
         self.src_files = []
         self.srf_files = []
         self.scenario = None
+        self.binary = False
 
     def parse_arguments(self):
         """
@@ -61,6 +66,12 @@ class MergeScenario(object):
                             help="sim_id for merged simulation")
         parser.add_argument("--scenario", dest="scenario",
                             help="scenario name")
+        parser.add_argument("-j", "--jobs", dest="jobs", type=int, default=1,
+                            help="number of stations to merge in parallel")
+        parser.add_argument("--binary", dest="binary", action="store_true",
+                            default=False,
+                            help="also save the merged seismograms in "
+                            "a binary seismogram store")
         parser.add_argument('input_sims', nargs='*')
         args = parser.parse_args()
 
@@ -84,6 +95,13 @@ class MergeScenario(object):
 
         self.scenario = args.scenario
 
+        # Parallel jobs and binary output
+        if args.jobs < 1:
+            print("[ERROR]: Number of jobs must be a positive integer!")
+            sys.exit(-1)
+        self.install.set_num_jobs(args.jobs)
+        self.binary = args.binary
+
     def create_merged_dirs(self):
         """
         Creates the directory struction for the merged simulation
@@ -145,68 +163,53 @@ class MergeScenario(object):
             correction_file = correction_file[0]
             shutil.copy2(correction_file, self.a_indir)
 
-    def add_bbp_seismograms(self, input_files, output_file):
+    def add_bbp_seismograms(self, input_files, output_file,
+                            store_dir=None, units="cm/s/s"):
         """
-        Add all input files and write output_file with the combined data
+        Add all input files and write output_file with the combined
+        data, also saving it in the seismogram store in store_dir if
+        one is given
         """
-        # Start empty
-        headers = []
-        times = []
-        ns_comp = []
-        ew_comp = []
-        ud_comp = []
-
-        # Read first file
-        input_file = input_files[0]
-        input_files = input_files[1:]
-        i_file = open(input_file, 'r')
-        for line in i_file:
-            line = line.strip()
-            # Empty lines
-            if not line:
-                continue
-            if line.startswith('#') or line.startswith('%'):
-                headers.append(line)
-                continue
-            pieces = line.split()
-            pieces = [float(piece) for piece in pieces]
-            times.append(pieces[0])
-            ns_comp.append(pieces[1])
-            ew_comp.append(pieces[2])
-            ud_comp.append(pieces[3])
-        i_file.close()
-
-        # Now add other files
-        for input_file in input_files:
-            index = 0
-            i_file = open(input_file, 'r')
-            for line in i_file:
-                line = line.strip()
-                # Empty lines
-                if not line:
-                    continue
-                if line.startswith('#') or line.startswith('%'):
-                    continue
-                pieces = line.split()
-                pieces = [float(piece) for piece in pieces]
-                if index > len(times):
-                    print("[ERROR]: File size mismatch!")
-                    sys.exit(1)
-                ns_comp[index] = ns_comp[index] + pieces[1]
-                ew_comp[index] = ew_comp[index] + pieces[2]
-                ud_comp[index] = ud_comp[index] + pieces[3]
-                index = index + 1
-            i_file.close()
-
-        # Finally write output file
-        o_file = open(output_file, 'w')
-        for header_line in headers:
-            o_file.write("%s\n" % (header_line))
-        for time, ns_val, ew_val, ud_val in zip(times, ns_comp,
-                                                ew_comp, ud_comp):
-            o_file.write("%5.7f   %5.9e   %5.9e    %5.9e\n" %
-                         (time, ns_val, ew_val, ud_val))
-        o_file.close()
+        header_lines, data = bbp_formatter.add_bbp_files(input_files)
+        header_lines = ["%s\n" % (line.strip()) for line in header_lines]
+
+        # Write output file
+        bbp_formatter.write_bbp_file(output_file, data, header_lines,
+                                     BBP_LINE_FORMAT)
+        if store_dir is not None:
+            key = os.path.basename(output_file)[:-len(".bbp")]
+            bbp_formatter.write_seis_record(store_dir, key, data,
+                                            header_lines, units)
+
+    def merge_station(self, station, _):
+        """
+        Adds the velocity and acceleration seismograms of station
+        from all input simulations
+        """
+        print("==> Merging station: %s" % (station.scode))
+        if self.binary:
+            store_dir = os.path.join(self.a_outdir, "seis_store")
+        else:
+            store_dir = None
+        # Merge both velocity and acceleration
+        for file_type, units in [('vel', "cm/s"), ('acc', "cm/s/s")]:
+            input_files = []
+            for sim_id in self.input_sims:
+                input_dir = os.path.join(self.install.A_OUT_DATA_DIR,
+                                         str(sim_id))
+                input_file = os.path.join(input_dir,
+                                          "%s.%s.%s.bbp" %
+                                          (str(sim_id),
+                                           station.scode,
+                                           file_type))
+                input_files.append(input_file)
+            output_file = os.path.join(self.a_outdir,
+                                       "%s.%s.%s.bbp" %
+                                       (str(self.output_sim_id),
+                                        station.scode,
+                                        file_type))
+            self.add_bbp_seismograms(input_files, output_file,
+                                     store_dir, units)
 
     def merge_seismograms(self):
         """
@@ -218,26 +221,8 @@ class MergeScenario(object):
         site_list = slo.getStationList()
 
         # Merge each station
-        for station in site_list:
-            print("==> Merging station: %s" % (station.scode))
-            # Merge both velocity and acceleration
-            for file_type in ['vel', 'acc']:
-                input_files = []
-                for sim_id in self.input_sims:
-                    input_dir = os.path.join(self.install.A_OUT_DATA_DIR,
-                                             str(sim_id))
-                    input_file = os.path.join(input_dir,
-                                              "%s.%s.%s.bbp" %
-                                              (str(sim_id),
-                                               station.scode,
-                                               file_type))
-                    input_files.append(input_file)
-                output_file = os.path.join(self.a_outdir,
-                                           "%s.%s.%s.bbp" %
-                                           (str(self.output_sim_id),
-                                            station.scode,
-                                            file_type))
-                self.add_bbp_seismograms(input_files, output_file)
+        bband_utils.run_stations(self.merge_station, site_list,
+                                 jobs=self.install.num_jobs)
 
     def plot_srf(self):
         """